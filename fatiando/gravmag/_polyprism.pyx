@@ -0,0 +1,595 @@
+#cython: embedsignature=True
+"""
+Cython implementation of the gravity and magnetic fields of polygonal prisms.
+
+The model is passed as a structure of arrays: a (V, 2) array with the x and y
+coordinates of the vertices of all prisms (one prism after the other), an
+array with the index of the first vertex of each prism (plus the total number
+of vertices at the end), a (N, 2) array with the top and bottom ``[z1, z2]`` of
+each prism and arrays with the physical property of each prism. The loops over
+prisms, edges and computation points run in C with the GIL released. The
+computation points are split among OpenMP threads (this module must be
+compiled with OpenMP support for this to have any effect).
+
+The formulas are the same as the ones in fatiando.gravmag.polyprism (Plouff,
+1976), including the small dummy values that avoid divisions by zero.
+"""
+import numpy
+
+from libc.math cimport log, atan2, sqrt
+# Import Cython definitions for numpy
+cimport numpy
+cimport cython
+from cython.parallel cimport prange
+
+DTYPE = numpy.float
+ctypedef numpy.float_t DTYPE_T
+
+# Signature of the kernel functions that are evaluated on each prism edge:
+# (X1, Y1, X2, Y2, Z1, Z2) are the coordinates of the two vertices of the edge
+# and of the top and bottom relative to the computation point.
+ctypedef double (*edge_func)(double, double, double, double, double,
+                             double) nogil
+
+# Avoids zero division and log(0) errors
+DEF DUMMY = 1e-10
+
+
+@cython.cdivision(True)
+cdef inline double edgez(double X1, double Y1, double X2, double Y2,
+                         double Z1, double Z2) nogil:
+    cdef:
+        double p, p_sqr, Qk1, Qk2, Ak1, Ak2, R1k1, R1k2, R2k1, R2k2
+        double Bk1, Bk2, E1k1, E1k2, E2k1, E2k2, Ck1, Ck2, Z1_sqr, Z2_sqr
+        double kernel
+    Z1_sqr = Z1**2
+    Z2_sqr = Z2**2
+    p = X1*Y2 - X2*Y1
+    p_sqr = p**2
+    Qk1 = (Y2 - Y1)*Y1 + (X2 - X1)*X1
+    Qk2 = (Y2 - Y1)*Y2 + (X2 - X1)*X2
+    Ak1 = X1**2 + Y1**2
+    Ak2 = X2**2 + Y2**2
+    R1k1 = sqrt(Ak1 + Z1_sqr)
+    R1k2 = sqrt(Ak2 + Z1_sqr)
+    R2k1 = sqrt(Ak1 + Z2_sqr)
+    R2k2 = sqrt(Ak2 + Z2_sqr)
+    Ak1 = sqrt(Ak1)
+    Ak2 = sqrt(Ak2)
+    Bk1 = sqrt(Qk1**2 + p_sqr)
+    Bk2 = sqrt(Qk2**2 + p_sqr)
+    E1k1 = R1k1*Bk1
+    E1k2 = R1k2*Bk2
+    E2k1 = R2k1*Bk1
+    E2k2 = R2k2*Bk2
+    kernel = (Z2 - Z1)*(atan2(Qk2, p) - atan2(Qk1, p))
+    kernel += Z2*(atan2(Z2*Qk1, R2k1*p) - atan2(Z2*Qk2, R2k2*p))
+    kernel += Z1*(atan2(Z1*Qk2, R1k2*p) - atan2(Z1*Qk1, R1k1*p))
+    Ck1 = Qk1*Ak1
+    Ck2 = Qk2*Ak2
+    kernel += 0.5*p*Ak1/(Bk1 + DUMMY)*log(
+        (E1k1 - Ck1)*(E2k1 + Ck1)/((E1k1 + Ck1)*(E2k1 - Ck1) + DUMMY) +
+        DUMMY)
+    kernel += 0.5*p*(Ak2/(Bk2 + DUMMY))*log(
+        (E2k2 - Ck2)*(E1k2 + Ck2)/((E2k2 + Ck2)*(E1k2 - Ck2) + DUMMY) +
+        DUMMY)
+    return kernel
+
+
+@cython.cdivision(True)
+cdef inline double edgexx(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, n, g, dist, p, d1, d2, vert1_sqr, vert2_sqr
+        double R11, R12, R21, R22, atan_diff_d1, atan_diff_d2, tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    n = deltax/deltay
+    g = X1 - Y1*n
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    p = (X1*Y2 - X2*Y1)/dist + DUMMY
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    atan_diff_d2 = atan2(Z2*d2, p*R22) - atan2(Z1*d2, p*R21)
+    atan_diff_d1 = atan2(Z2*d1, p*R12) - atan2(Z1*d1, p*R11)
+    tmp = g*Y2*atan_diff_d2/(p*d2) + n*p*atan_diff_d2/(d2)
+    tmp -= g*Y1*atan_diff_d1/(p*d1) + n*p*atan_diff_d1/(d1)
+    tmp += n*log(
+        (Z2 + R12)*(Z1 + R21)/((Z1 + R11)*(Z2 + R22) + DUMMY) + DUMMY)
+    tmp *= -1/(1 + n*n)
+    return tmp
+
+
+@cython.cdivision(True)
+cdef inline double edgexy(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, n, g, g_sqr, dist, p, d1, d2
+        double vert1_sqr, vert2_sqr, R11, R12, R21, R22
+        double atan_diff_d1, atan_diff_d2, tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    n = deltax/deltay
+    g = X1 - Y1*n
+    g_sqr = g*g
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    p = (X1*Y2 - X2*Y1)/dist + DUMMY
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    atan_diff_d2 = atan2(Z2*d2, p*R22) - atan2(Z1*d2, p*R21)
+    atan_diff_d1 = atan2(Z2*d1, p*R12) - atan2(Z1*d1, p*R11)
+    tmp = (g_sqr + g*n*Y2)*atan_diff_d2/(p*d2) - p*atan_diff_d2/d2
+    tmp -= (g_sqr + g*n*Y1)*atan_diff_d1/(p*d1) - p*atan_diff_d1/d1
+    tmp += log(
+        (Z2 + R22)*(Z1 + R11)/((Z1 + R21)*(Z2 + R12) + DUMMY) + DUMMY)
+    tmp *= 1/(1 + n*n)
+    return tmp
+
+
+@cython.cdivision(True)
+cdef inline double edgexz(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, n, n_sqr_p1, g, ng, dist, d1, d2
+        double vert1_sqr, vert2_sqr, R11, R12, R21, R22
+        double log_r11, log_r12, log_r21, log_r22, log_diff_d1, log_diff_d2
+        double tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    n = deltax/deltay
+    n_sqr_p1 = n*n + 1
+    g = X1 - Y1*n
+    ng = n*g
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    log_r22 = log((R22 - d2)/(R22 + d2) + DUMMY)
+    log_r21 = log((R21 - d2)/(R21 + d2) + DUMMY)
+    log_r12 = log((R12 - d1)/(R12 + d1) + DUMMY)
+    log_r11 = log((R11 - d1)/(R11 + d1) + DUMMY)
+    log_diff_d1 = (0.5/d1)*(log_r12 - log_r11)
+    log_diff_d2 = (0.5/d2)*(log_r22 - log_r21)
+    tmp = (Y2*n_sqr_p1 + ng)*log_diff_d2
+    tmp -= (Y1*n_sqr_p1 + ng)*log_diff_d1
+    tmp *= -1/n_sqr_p1
+    return tmp
+
+
+@cython.cdivision(True)
+cdef inline double edgeyy(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, m, c, dist, p, d1, d2, vert1_sqr, vert2_sqr
+        double R11, R12, R21, R22, atan_diff_d1, atan_diff_d2, tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    m = deltay/deltax
+    c = Y1 - X1*m
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    p = (X1*Y2 - X2*Y1)/dist + DUMMY
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    atan_diff_d2 = atan2(Z2*d2, p*R22) - atan2(Z1*d2, p*R21)
+    atan_diff_d1 = atan2(Z2*d1, p*R12) - atan2(Z1*d1, p*R11)
+    tmp = c*X2*atan_diff_d2/(p*d2) + m*p*atan_diff_d2/d2
+    tmp -= c*X1*atan_diff_d1/(p*d1) + m*p*atan_diff_d1/d1
+    tmp += m*log(
+        (Z2 + R12)*(Z1 + R21)/((Z2 + R22)*(Z1 + R11)) + DUMMY)
+    tmp *= 1/(1 + m*m)
+    return tmp
+
+
+@cython.cdivision(True)
+cdef inline double edgeyz(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, m, m_sqr_p1, c, cm, dist, d1, d2
+        double vert1_sqr, vert2_sqr, R11, R12, R21, R22
+        double log_r11, log_r12, log_r21, log_r22, tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    m = deltay/deltax
+    m_sqr_p1 = m*m + 1
+    c = Y1 - X1*m
+    cm = c*m
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    log_r11 = log((R11 - d1)/(R11 + d1) + DUMMY)
+    log_r12 = log((R12 - d1)/(R12 + d1) + DUMMY)
+    log_r21 = log((R21 - d2)/(R21 + d2) + DUMMY)
+    log_r22 = log((R22 - d2)/(R22 + d2) + DUMMY)
+    tmp = (X2*m_sqr_p1 + cm)*(0.5/d2)*(log_r22 - log_r21)
+    tmp -= (X1*m_sqr_p1 + cm)*(0.5/d1)*(log_r12 - log_r11)
+    tmp *= 1/m_sqr_p1
+    return tmp
+
+
+@cython.cdivision(True)
+cdef inline double edgezz(double X1, double Y1, double X2, double Y2,
+                          double Z1, double Z2) nogil:
+    cdef:
+        double deltax, deltay, dist, p, d1, d2, vert1_sqr, vert2_sqr
+        double R11, R12, R21, R22
+    deltax = X2 - X1
+    deltay = Y2 - Y1
+    # dist is only used in divisions. Add DUMMY to avoid zero division if the
+    # two vertices coincide.
+    dist = sqrt(deltax*deltax + deltay*deltay) + DUMMY
+    p = (X1*Y2 - X2*Y1)/dist
+    d1 = (deltax*X1 + deltay*Y1)/dist
+    d2 = (deltax*X2 + deltay*Y2)/dist
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    return (atan2(Z2*d2, p*R22) - atan2(Z1*d2, p*R21) -
+            atan2(Z2*d1, p*R12) + atan2(Z1*d1, p*R11))
+
+
+@cython.cdivision(True)
+cdef inline void edge_tensor(double X1, double Y1, double X2, double Y2,
+                             double Z1, double Z2, double *res) nogil:
+    """
+    Add the 6 second derivative kernels of an edge to res (xx, xy, xz, yy, yz,
+    zz).
+
+    The geometric terms, arc-tangents and logarithms that are common to the
+    edgexx, ..., edgezz kernels are computed only once. This costs about the
+    same as a single kernel. The only differences from the individual kernels
+    are that zz uses the arc-tangents of the other kernels (which include the
+    dummy values) and yy the logarithm of xx (which has a dummy value in the
+    denominator). The results differ only by round-off.
+    """
+    cdef:
+        double deltax, deltay, dist, p, d1, d2, vert1_sqr, vert2_sqr
+        double R11, R12, R21, R22, atan_diff_d1, atan_diff_d2
+        double log_xx, log_xy, log_diff_d1, log_diff_d2
+        double n, n_sqr_p1, g, m, m_sqr_p1, c, tmp
+    deltax = X2 - X1 + DUMMY
+    deltay = Y2 - Y1 + DUMMY
+    dist = sqrt(deltax*deltax + deltay*deltay)
+    p = (X1*Y2 - X2*Y1)/dist + DUMMY
+    d1 = (deltax*X1 + deltay*Y1)/dist + DUMMY
+    d2 = (deltax*X2 + deltay*Y2)/dist + DUMMY
+    vert1_sqr = X1*X1 + Y1*Y1
+    vert2_sqr = X2*X2 + Y2*Y2
+    R11 = sqrt(vert1_sqr + Z1*Z1)
+    R12 = sqrt(vert1_sqr + Z2*Z2)
+    R21 = sqrt(vert2_sqr + Z1*Z1)
+    R22 = sqrt(vert2_sqr + Z2*Z2)
+    atan_diff_d2 = atan2(Z2*d2, p*R22) - atan2(Z1*d2, p*R21)
+    atan_diff_d1 = atan2(Z2*d1, p*R12) - atan2(Z1*d1, p*R11)
+    log_xx = log(
+        (Z2 + R12)*(Z1 + R21)/((Z1 + R11)*(Z2 + R22) + DUMMY) + DUMMY)
+    log_xy = log(
+        (Z2 + R22)*(Z1 + R11)/((Z1 + R21)*(Z2 + R12) + DUMMY) + DUMMY)
+    log_diff_d1 = (0.5/d1)*(log((R12 - d1)/(R12 + d1) + DUMMY) -
+                            log((R11 - d1)/(R11 + d1) + DUMMY))
+    log_diff_d2 = (0.5/d2)*(log((R22 - d2)/(R22 + d2) + DUMMY) -
+                            log((R21 - d2)/(R21 + d2) + DUMMY))
+    # The x kernels use the inverse slope of the edge and the y kernels the
+    # slope
+    n = deltax/deltay
+    n_sqr_p1 = n*n + 1
+    g = X1 - Y1*n
+    m = deltay/deltax
+    m_sqr_p1 = m*m + 1
+    c = Y1 - X1*m
+    # xx
+    tmp = g*Y2*atan_diff_d2/(p*d2) + n*p*atan_diff_d2/d2
+    tmp -= g*Y1*atan_diff_d1/(p*d1) + n*p*atan_diff_d1/d1
+    tmp += n*log_xx
+    res[0] += -tmp/n_sqr_p1
+    # xy
+    tmp = (g*g + g*n*Y2)*atan_diff_d2/(p*d2) - p*atan_diff_d2/d2
+    tmp -= (g*g + g*n*Y1)*atan_diff_d1/(p*d1) - p*atan_diff_d1/d1
+    tmp += log_xy
+    res[1] += tmp/n_sqr_p1
+    # xz
+    tmp = (Y2*n_sqr_p1 + n*g)*log_diff_d2
+    tmp -= (Y1*n_sqr_p1 + n*g)*log_diff_d1
+    res[2] += -tmp/n_sqr_p1
+    # yy
+    tmp = c*X2*atan_diff_d2/(p*d2) + m*p*atan_diff_d2/d2
+    tmp -= c*X1*atan_diff_d1/(p*d1) + m*p*atan_diff_d1/d1
+    tmp += m*log_xx
+    res[3] += tmp/m_sqr_p1
+    # yz
+    tmp = (X2*m_sqr_p1 + c*m)*log_diff_d2
+    tmp -= (X1*m_sqr_p1 + c*m)*log_diff_d1
+    res[4] += tmp/m_sqr_p1
+    # zz
+    res[5] += atan_diff_d2 - atan_diff_d1
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline double edges(edge_func kernel, const double[:, ::1] vertices,
+                         const Py_ssize_t[:] offsets,
+                         const double[:, ::1] z, Py_ssize_t m,
+                         double xp, double yp, double zp) nogil:
+    """
+    Sum the kernel evaluated on the edges of prism m.
+    """
+    cdef:
+        Py_ssize_t k, first, last
+        double X1, Y1, X2, Y2, Z1, Z2, res
+    first, last = offsets[m], offsets[m + 1]
+    Z1 = z[m, 0] - zp
+    Z2 = z[m, 1] - zp
+    res = 0
+    for k in range(first, last):
+        X1 = vertices[k, 0] - xp
+        Y1 = vertices[k, 1] - yp
+        # The last edge closes the polygon
+        if k + 1 == last:
+            X2 = vertices[first, 0] - xp
+            Y2 = vertices[first, 1] - yp
+        else:
+            X2 = vertices[k + 1, 0] - xp
+            Y2 = vertices[k + 1, 1] - yp
+        res += kernel(X1, Y1, X2, Y2, Z1, Z2)
+    return res
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline void tensor_edges(const double[:, ::1] vertices,
+                              const Py_ssize_t[:] offsets,
+                              const double[:, ::1] z, Py_ssize_t m,
+                              double xp, double yp, double zp,
+                              double *res) nogil:
+    """
+    Sum the 6 second derivative kernels over the edges of prism m in a single
+    pass (see edge_tensor).
+
+    Puts xx, xy, xz, yy, yz, zz in res.
+    """
+    cdef:
+        Py_ssize_t k, first, last
+        unsigned int i
+        double X1, Y1, X2, Y2, Z1, Z2
+    first, last = offsets[m], offsets[m + 1]
+    Z1 = z[m, 0] - zp
+    Z2 = z[m, 1] - zp
+    for i in range(6):
+        res[i] = 0
+    for k in range(first, last):
+        X1 = vertices[k, 0] - xp
+        Y1 = vertices[k, 1] - yp
+        # The last edge closes the polygon
+        if k + 1 == last:
+            X2 = vertices[first, 0] - xp
+            Y2 = vertices[first, 1] - yp
+        else:
+            X2 = vertices[k + 1, 0] - xp
+            Y2 = vertices[k + 1, 1] - yp
+        edge_tensor(X1, Y1, X2, Y2, Z1, Z2, res)
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline double magnetic_kernel(const double[:, ::1] vertices,
+                                   const Py_ssize_t[:] offsets,
+                                   const double[:, ::1] z, Py_ssize_t m,
+                                   double mx, double my, double mz,
+                                   double fx, double fy, double fz,
+                                   double xp, double yp, double zp) nogil:
+    """
+    The projection of the magnetic induction of prism m on the direction
+    (fx, fy, fz) (without any constants).
+
+    If more than one of the second derivative kernels contributes to the
+    result, computes all of them in a single pass over the edges (which costs
+    about the same as a single kernel). Otherwise, evaluates only the one that
+    is needed.
+    """
+    cdef:
+        double cxx, cxy, cxz, cyy, cyz, czz, res
+        double kernels[6]
+    # Coefficients of each kernel in f.(T m), T the kernel tensor
+    cxx = fx*mx
+    cxy = fx*my + fy*mx
+    cxz = fx*mz + fz*mx
+    cyy = fy*my
+    cyz = fy*mz + fz*my
+    czz = fz*mz
+    if (cxx != 0) + (cxy != 0) + (cxz != 0) + (cyy != 0) + (cyz != 0) + \
+            (czz != 0) > 1:
+        tensor_edges(vertices, offsets, z, m, xp, yp, zp, kernels)
+        return (cxx*kernels[0] + cxy*kernels[1] + cxz*kernels[2]
+                + cyy*kernels[3] + cyz*kernels[4] + czz*kernels[5])
+    res = 0
+    if cxx != 0:
+        res += cxx*edges(edgexx, vertices, offsets, z, m, xp, yp, zp)
+    if cxy != 0:
+        res += cxy*edges(edgexy, vertices, offsets, z, m, xp, yp, zp)
+    if cxz != 0:
+        res += cxz*edges(edgexz, vertices, offsets, z, m, xp, yp, zp)
+    if cyy != 0:
+        res += cyy*edges(edgeyy, vertices, offsets, z, m, xp, yp, zp)
+    if cyz != 0:
+        res += cyz*edges(edgeyz, vertices, offsets, z, m, xp, yp, zp)
+    if czz != 0:
+        res += czz*edges(edgezz, vertices, offsets, z, m, xp, yp, zp)
+    return res
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline void gravity(edge_func kernel, const double[:] xp,
+                         const double[:] yp, const double[:] zp,
+                         const double[:, ::1] vertices,
+                         const Py_ssize_t[:] offsets,
+                         const double[:, ::1] z, const double[:] density,
+                         int threads, double[:] res) nogil:
+    """
+    Add the effect of all prisms to res (without any constants).
+
+    The computation points are split among *threads* OpenMP threads.
+    """
+    cdef Py_ssize_t l, m
+    for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+        for m in range(z.shape[0]):
+            if density[m] == 0:
+                continue
+            res[l] += density[m]*edges(kernel, vertices, offsets, z, m,
+                                       xp[l], yp[l], zp[l])
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline void magnetic(const double[:] xp, const double[:] yp,
+                          const double[:] zp, const double[:, ::1] vertices,
+                          const Py_ssize_t[:] offsets,
+                          const double[:, ::1] z, const double[:, ::1] mag,
+                          double fx, double fy, double fz, int threads,
+                          double[:] res) nogil:
+    """
+    Add the projection of the magnetic induction of all prisms on the
+    direction (fx, fy, fz) to res (without any constants).
+
+    The computation points are split among *threads* OpenMP threads.
+    """
+    cdef Py_ssize_t l, m
+    for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+        for m in range(z.shape[0]):
+            res[l] += magnetic_kernel(vertices, offsets, z, m, mag[m, 0],
+                                      mag[m, 1], mag[m, 2], fx, fy, fz,
+                                      xp[l], yp[l], zp[l])
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline void tensor_point(const double[:, ::1] vertices,
+                              const Py_ssize_t[:] offsets,
+                              const double[:, ::1] z,
+                              const double[:] density,
+                              double xp, double yp, double zp,
+                              double[:, ::1] res, Py_ssize_t l) nogil:
+    """
+    Add the gravity gradient tensor of all prisms on point l to res[:, l].
+    """
+    cdef:
+        Py_ssize_t m
+        unsigned int c
+        double kernels[6]
+    for m in range(z.shape[0]):
+        if density[m] == 0:
+            continue
+        tensor_edges(vertices, offsets, z, m, xp, yp, zp, kernels)
+        for c in range(6):
+            res[c, l] += density[m]*kernels[c]
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def tensor(const double[:] xp not None, const double[:] yp not None,
+           const double[:] zp not None,
+           const double[:, ::1] vertices not None,
+           const Py_ssize_t[:] offsets not None,
+           const double[:, ::1] z not None,
+           const double[:] density not None, int threads,
+           double[:, ::1] res not None):
+    """
+    Add gxx, gxy, gxz, gyy, gyz, gzz of all prisms to the rows of res (shape
+    (6, N), without any constants).
+    """
+    cdef Py_ssize_t l
+    with nogil:
+        # The kernels of each point are kept in tensor_point so that every
+        # thread has its own
+        for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+            tensor_point(vertices, offsets, z, density, xp[l], yp[l], zp[l],
+                         res, l)
+
+
+cdef int select_kernel(str field, edge_func *kernel) except -1:
+    """
+    Set the edge kernel function for a gravity field.
+    """
+    if field == 'gz':
+        kernel[0] = edgez
+    elif field == 'gxx':
+        kernel[0] = edgexx
+    elif field == 'gxy':
+        kernel[0] = edgexy
+    elif field == 'gxz':
+        kernel[0] = edgexz
+    elif field == 'gyy':
+        kernel[0] = edgeyy
+    elif field == 'gyz':
+        kernel[0] = edgeyz
+    elif field == 'gzz':
+        kernel[0] = edgezz
+    else:
+        raise ValueError("Invalid gravity field '{}'".format(field))
+    return 0
+
+
+def gravity_field(str field, const double[:] xp not None,
+                  const double[:] yp not None, const double[:] zp not None,
+                  const double[:, ::1] vertices not None,
+                  const Py_ssize_t[:] offsets not None,
+                  const double[:, ::1] z not None,
+                  const double[:] density not None, int threads,
+                  double[:] res not None):
+    """
+    Add the gravity field (gz or a gradient component) of all prisms to res
+    (without any constants).
+    """
+    cdef edge_func kernel
+    select_kernel(field, &kernel)
+    with nogil:
+        gravity(kernel, xp, yp, zp, vertices, offsets, z, density, threads,
+                res)
+
+
+def magnetic_field(const double[:] xp not None, const double[:] yp not None,
+                   const double[:] zp not None,
+                   const double[:, ::1] vertices not None,
+                   const Py_ssize_t[:] offsets not None,
+                   const double[:, ::1] z not None,
+                   const double[:, ::1] mag not None,
+                   double fx, double fy, double fz, int threads,
+                   double[:] res not None):
+    """
+    Add the projection of the magnetic induction of all prisms on the
+    direction (fx, fy, fz) to res (without any constants).
+    """
+    with nogil:
+        magnetic(xp, yp, zp, vertices, offsets, z, mag, fx, fy, fz, threads,
+                 res)
@@ -2,6 +2,18 @@
 """
 Cython implementation of the gravity and magnetic fields of right rectangular
 prisms.
+
+The model is passed as a structure of arrays: a (N, 6) array with the
+boundaries ``[x1, x2, y1, y2, z1, z2]`` of each prism and arrays with the
+physical property of each prism. The loops over prisms and computation points
+run in C with the GIL released. The computation points are split among OpenMP
+threads (this module must be compiled with OpenMP support for this to have any
+effect).
+
+If a ratio > 0 is given, prisms that are farther than ratio times their
+diagonal from a computation point are replaced by a point mass (or point
+dipole) at their center. This avoids the logarithms and arc-tangents of the
+8 corners for the far away prisms.
 """
 import numpy
 
@@ -9,10 +21,28 @@ from libc.math cimport log, atan2, sqrt
 # Import Cython definitions for numpy
 cimport numpy
 cimport cython
+from cython.parallel cimport prange
 
 DTYPE = numpy.float
 ctypedef numpy.float_t DTYPE_T
 
+# Signature of the kernel functions that are evaluated on each prism corner
+ctypedef double (*kernel_func)(double, double, double, double) nogil
+
+# Signature of the point mass kernels used for prisms far from the point
+ctypedef double (*point_func)(double, double, double, double) nogil
+
+# The sensitivity matrices can be single or double precision
+ctypedef fused real:
+    float
+    double
+
+# Which singularity correction to use when summing over the corners
+DEF NO_SHIFT = 0
+DEF SHIFT_XY = 1
+DEF SHIFT_XZ = 2
+DEF SHIFT_YZ = 3
+
 cdef inline double safe_atan2(double y, double x) nogil:
     cdef double res
     if y == 0:
@@ -67,413 +97,628 @@ cdef inline double kernelyz(double x, double y, double z, double r) nogil:
 cdef inline double kernelzz(double x, double y, double z, double r) nogil:
     return -safe_atan2(x*y, z*r)
 
+# Fields of a point mass at (x, y, z) relative to the computation point and at
+# a distance r (without the volume). Same conventions as the kernels above.
+cdef inline double pointpot(double x, double y, double z, double r) nogil:
+    return 1/r
+
+cdef inline double pointx(double x, double y, double z, double r) nogil:
+    return x/r**3
+
+cdef inline double pointy(double x, double y, double z, double r) nogil:
+    return y/r**3
+
+cdef inline double pointz(double x, double y, double z, double r) nogil:
+    return z/r**3
+
+cdef inline double pointxx(double x, double y, double z, double r) nogil:
+    return (3*x**2 - r**2)/r**5
+
+cdef inline double pointxy(double x, double y, double z, double r) nogil:
+    return 3*x*y/r**5
+
+cdef inline double pointxz(double x, double y, double z, double r) nogil:
+    return 3*x*z/r**5
+
+cdef inline double pointyy(double x, double y, double z, double r) nogil:
+    return (3*y**2 - r**2)/r**5
+
+cdef inline double pointyz(double x, double y, double z, double r) nogil:
+    return 3*y*z/r**5
+
+cdef inline double pointzz(double x, double y, double z, double r) nogil:
+    return (3*z**2 - r**2)/r**5
+
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double mx, double my, double mz, double fx, double fy, double fz,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, v1, v2, v3, v4, v5, v6, bx, by, bz, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    v1 = kernelxx(dx, dy, dz, r)
-                    v2 = kernelxy(dx, dy, dz, r)
-                    v3 = kernelxz(dx, dy, dz, r)
-                    v4 = kernelyy(dx, dy, dz, r)
-                    v5 = kernelyz(dx, dy, dz, r)
-                    v6 = kernelzz(dx, dy, dz, r)
-                    bx = (v1*mx + v2*my + v3*mz)
-                    by = (v2*mx + v4*my + v5*mz)
-                    bz = (v3*mx + v5*my + v6*mz)
-                    kernel = fx*bx + fy*by + fz*bz
-                    res[l] += ((-1.)**(i + j + k))*kernel
+cdef inline bint far_field(const double[:, ::1] bounds, Py_ssize_t m,
+                           double xp, double yp, double zp, double ratio,
+                           double *center) nogil:
+    """
+    Check if the computation point is farther than ratio times the diagonal of
+    prism m from its center.
+
+    If it is, puts the position of the center relative to the point, the
+    distance, and the volume of the prism in center (x, y, z, r, volume).
+    Always false if ratio is 0.
+    """
+    cdef double sx, sy, sz, dx, dy, dz, r2
+    if ratio <= 0:
+        return False
+    sx = bounds[m, 1] - bounds[m, 0]
+    sy = bounds[m, 3] - bounds[m, 2]
+    sz = bounds[m, 5] - bounds[m, 4]
+    dx = 0.5*(bounds[m, 0] + bounds[m, 1]) - xp
+    dy = 0.5*(bounds[m, 2] + bounds[m, 3]) - yp
+    dz = 0.5*(bounds[m, 4] + bounds[m, 5]) - zp
+    r2 = dx**2 + dy**2 + dz**2
+    if r2 <= ratio**2*(sx**2 + sy**2 + sz**2):
+        return False
+    center[0], center[1], center[2] = dx, dy, dz
+    center[3] = sqrt(r2)
+    center[4] = sx*sy*sz
+    return True
+
+cdef inline double distance(int shift, double dx, double dy, double dz,
+                            double sx, double sy, double sz) nogil:
+    """
+    The distance from the computation point to a prism corner.
+
+    shift moves the computation point slightly when it is aligned with the
+    corners of the prism, avoiding the singularities of the gxy, gxz, and gyz
+    kernels. sx, sy, sz are the dimensions of the prism.
+    """
+    if shift == SHIFT_XY and dx == 0 and dy == 0 and dz < 0:
+        return sqrt((0.00001*sx)**2 + (0.00001*sy)**2 + dz**2)
+    elif shift == SHIFT_XZ and dx == 0 and dz == 0 and dy < 0:
+        return sqrt((0.00001*sx)**2 + (0.00001*sz)**2 + dy**2)
+    elif shift == SHIFT_YZ and dy == 0 and dz == 0 and dx < 0:
+        return sqrt((0.00001*sy)**2 + (0.00001*sz)**2 + dx**2)
+    return sqrt(dx**2 + dy**2 + dz**2)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def bx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double mx, double my, double mz,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, v1, v2, v3, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    v1 = kernelxx(dx, dy, dz, r)
-                    v2 = kernelxy(dx, dy, dz, r)
-                    v3 = kernelxz(dx, dy, dz, r)
-                    kernel = (v1*mx + v2*my + v3*mz)
-                    res[l] += ((-1.)**(i + j + k))*kernel
+cdef inline double corners(kernel_func kernel, int shift,
+                           const double[:, ::1] bounds, Py_ssize_t m,
+                           double xp, double yp, double zp) nogil:
+    """
+    Sum the kernel evaluated on the 8 corners of prism m (the integration
+    limits).
+    """
+    cdef:
+        unsigned int i, j, k
+        double x[2]
+        double y[2]
+        double z[2]
+        double res, sign, r, dx, dy, dz
+    x[0], x[1] = bounds[m, 1], bounds[m, 0]
+    y[0], y[1] = bounds[m, 3], bounds[m, 2]
+    z[0], z[1] = bounds[m, 5], bounds[m, 4]
+    res = 0
+    for k in range(2):
+        dz = z[k] - zp
+        for j in range(2):
+            dy = y[j] - yp
+            for i in range(2):
+                dx = x[i] - xp
+                r = distance(shift, dx, dy, dz, x[0] - x[1], y[0] - y[1],
+                             z[0] - z[1])
+                if (i + j + k) % 2 == 0:
+                    sign = 1
+                else:
+                    sign = -1
+                res += sign*kernel(dx, dy, dz, r)
+    return res
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def by(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double mx, double my, double mz,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, v2, v4, v5, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    v2 = kernelxy(dx, dy, dz, r)
-                    v4 = kernelyy(dx, dy, dz, r)
-                    v5 = kernelyz(dx, dy, dz, r)
-                    kernel = (v2*mx + v4*my + v5*mz)
-                    res[l] += ((-1.)**(i + j + k))*kernel
+cdef inline double prism_field(kernel_func kernel, point_func point,
+                               int shift, double ratio,
+                               const double[:, ::1] bounds, Py_ssize_t m,
+                               double xp, double yp, double zp) nogil:
+    """
+    The field of prism m using the corners or, if the point is far enough
+    (see far_field), the point mass kernel.
+    """
+    cdef double center[5]
+    if far_field(bounds, m, xp, yp, zp, ratio, center):
+        return center[4]*point(center[0], center[1], center[2], center[3])
+    return corners(kernel, shift, bounds, m, xp, yp, zp)
+
+cdef inline void point_tensor(const double *center, double *res) nogil:
+    """
+    The 6 second derivative kernels of a point mass (see far_field).
+
+    Puts xx, xy, xz, yy, yz, zz in res.
+    """
+    cdef double x, y, z, r, scale
+    x, y, z, r = center[0], center[1], center[2], center[3]
+    scale = center[4]/r**5
+    res[0] = scale*(3*x**2 - r**2)
+    res[1] = scale*3*x*y
+    res[2] = scale*3*x*z
+    res[3] = scale*(3*y**2 - r**2)
+    res[4] = scale*3*y*z
+    res[5] = scale*(3*z**2 - r**2)
+
+cdef inline void point_vector(const double *center, double *res) nogil:
+    """
+    The x, y, and z gravity kernels of a point mass (see far_field).
+    """
+    cdef double scale = center[4]/center[3]**3
+    res[0] = scale*center[0]
+    res[1] = scale*center[1]
+    res[2] = scale*center[2]
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def bz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double mx, double my, double mz,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, v3, v5, v6, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    v3 = kernelxz(dx, dy, dz, r)
-                    v5 = kernelyz(dx, dy, dz, r)
-                    v6 = kernelzz(dx, dy, dz, r)
-                    kernel = (v3*mx + v5*my + v6*mz)
-                    res[l] += ((-1.)**(i + j + k))*kernel
+cdef inline void tensor_corners(const double[:, ::1] bounds, Py_ssize_t m,
+                                double xp, double yp, double zp, bint shift,
+                                double *res) nogil:
+    """
+    Sum the 6 second derivative kernels over the 8 corners of prism m,
+    computing the distance to each corner only once.
+
+    Puts xx, xy, xz, yy, yz, zz in res. If shift is true, avoids the
+    singularities of xy, xz, and yz (like the SHIFT_* options of corners).
+    """
+    cdef:
+        unsigned int i, j, k, c
+        double x[2]
+        double y[2]
+        double z[2]
+        double sign, r, dx, dy, dz, sx, sy, sz
+    x[0], x[1] = bounds[m, 1], bounds[m, 0]
+    y[0], y[1] = bounds[m, 3], bounds[m, 2]
+    z[0], z[1] = bounds[m, 5], bounds[m, 4]
+    sx, sy, sz = x[0] - x[1], y[0] - y[1], z[0] - z[1]
+    for c in range(6):
+        res[c] = 0
+    for k in range(2):
+        dz = z[k] - zp
+        for j in range(2):
+            dy = y[j] - yp
+            for i in range(2):
+                dx = x[i] - xp
+                if (i + j + k) % 2 == 0:
+                    sign = 1
+                else:
+                    sign = -1
+                r = sqrt(dx**2 + dy**2 + dz**2)
+                res[0] += sign*kernelxx(dx, dy, dz, r)
+                res[3] += sign*kernelyy(dx, dy, dz, r)
+                res[5] += sign*kernelzz(dx, dy, dz, r)
+                if shift:
+                    res[1] += sign*kernelxy(
+                        dx, dy, dz, distance(SHIFT_XY, dx, dy, dz, sx, sy, sz))
+                    res[2] += sign*kernelxz(
+                        dx, dy, dz, distance(SHIFT_XZ, dx, dy, dz, sx, sy, sz))
+                    res[4] += sign*kernelyz(
+                        dx, dy, dz, distance(SHIFT_YZ, dx, dy, dz, sx, sy, sz))
+                else:
+                    res[1] += sign*kernelxy(dx, dy, dz, r)
+                    res[2] += sign*kernelxz(dx, dy, dz, r)
+                    res[4] += sign*kernelyz(dx, dy, dz, r)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double density,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelx(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline void vector_corners(const double[:, ::1] bounds, Py_ssize_t m,
+                                double xp, double yp, double zp,
+                                double *res) nogil:
+    """
+    Sum the x, y, and z gravity kernels over the 8 corners of prism m,
+    computing the distance, logarithms and arc-tangents only once.
+
+    Puts x, y, z in res.
+    """
+    cdef:
+        unsigned int i, j, k, c
+        double x[2]
+        double y[2]
+        double z[2]
+        double sign, r, dx, dy, dz, logx, logy, logz, atanx, atany, atanz
+    x[0], x[1] = bounds[m, 1], bounds[m, 0]
+    y[0], y[1] = bounds[m, 3], bounds[m, 2]
+    z[0], z[1] = bounds[m, 5], bounds[m, 4]
+    for c in range(3):
+        res[c] = 0
+    for k in range(2):
+        dz = z[k] - zp
+        for j in range(2):
+            dy = y[j] - yp
+            for i in range(2):
+                dx = x[i] - xp
+                if (i + j + k) % 2 == 0:
+                    sign = 1
+                else:
+                    sign = -1
+                r = sqrt(dx**2 + dy**2 + dz**2)
+                logx = safe_log(dx + r)
+                logy = safe_log(dy + r)
+                logz = safe_log(dz + r)
+                atanx = safe_atan2(dz*dy, dx*r)
+                atany = safe_atan2(dx*dz, dy*r)
+                atanz = safe_atan2(dx*dy, dz*r)
+                # Same as kernelx, kernely, and kernelz
+                res[0] -= sign*(dy*logz + dz*logy - dx*atanx)
+                res[1] -= sign*(dz*logx + dx*logz - dy*atany)
+                res[2] -= sign*(dx*logy + dy*logx - dz*atanz)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double density,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernely(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline double magnetic_kernel(const double[:, ::1] bounds, Py_ssize_t m,
+                                   double mx, double my, double mz,
+                                   double fx, double fy, double fz,
+                                   double xp, double yp, double zp,
+                                   double ratio) nogil:
+    """
+    The projection of the magnetic induction of prism m on the direction
+    (fx, fy, fz) (without any constants).
+
+    Only evaluates the second derivative kernels that contribute to the
+    result, so bx, by, and bz cost 3 kernels instead of 6. If most kernels are
+    needed (the total field), computes all of them in a single pass. Uses a
+    point dipole if the point is far enough (see far_field).
+    """
+    cdef:
+        double cxx, cxy, cxz, cyy, cyz, czz, res
+        double kernels[6]
+        double center[5]
+    # Coefficients of each kernel in f.(T m), T the kernel tensor
+    cxx = fx*mx
+    cxy = fx*my + fy*mx
+    cxz = fx*mz + fz*mx
+    cyy = fy*my
+    cyz = fy*mz + fz*my
+    czz = fz*mz
+    if far_field(bounds, m, xp, yp, zp, ratio, center):
+        point_tensor(center, kernels)
+        return (cxx*kernels[0] + cxy*kernels[1] + cxz*kernels[2]
+                + cyy*kernels[3] + cyz*kernels[4] + czz*kernels[5])
+    if (cxx != 0) + (cxy != 0) + (cxz != 0) + (cyy != 0) + (cyz != 0) + \
+            (czz != 0) > 3:
+        tensor_corners(bounds, m, xp, yp, zp, False, kernels)
+        return (cxx*kernels[0] + cxy*kernels[1] + cxz*kernels[2]
+                + cyy*kernels[3] + cyz*kernels[4] + czz*kernels[5])
+    res = 0
+    if cxx != 0:
+        res += cxx*corners(kernelxx, NO_SHIFT, bounds, m, xp, yp, zp)
+    if cxy != 0:
+        res += cxy*corners(kernelxy, NO_SHIFT, bounds, m, xp, yp, zp)
+    if cxz != 0:
+        res += cxz*corners(kernelxz, NO_SHIFT, bounds, m, xp, yp, zp)
+    if cyy != 0:
+        res += cyy*corners(kernelyy, NO_SHIFT, bounds, m, xp, yp, zp)
+    if cyz != 0:
+        res += cyz*corners(kernelyz, NO_SHIFT, bounds, m, xp, yp, zp)
+    if czz != 0:
+        res += czz*corners(kernelzz, NO_SHIFT, bounds, m, xp, yp, zp)
+    return res
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-       double x1, double x2, double y1, double y2, double z1, double z2,
-       double density,
-       numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelz(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline void gravity(kernel_func kernel, point_func point, int shift,
+                         const double[:] xp, const double[:] yp,
+                         const double[:] zp, const double[:, ::1] bounds,
+                         const double[:] density, int threads, double ratio,
+                         double[:] res) nogil:
+    """
+    Add the effect of all prisms to res (without any constants).
+
+    The computation points are split among *threads* OpenMP threads.
+    """
+    cdef Py_ssize_t l, m
+    for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+        for m in range(bounds.shape[0]):
+            if density[m] == 0:
+                continue
+            res[l] += density[m]*prism_field(kernel, point, shift, ratio,
+                                             bounds, m, xp[l], yp[l], zp[l])
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelxx(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline void magnetic(const double[:] xp, const double[:] yp,
+                          const double[:] zp, const double[:, ::1] bounds,
+                          const double[:, ::1] mag,
+                          double fx, double fy, double fz, int threads,
+                          double ratio, double[:] res) nogil:
+    """
+    Add the projection of the magnetic induction of all prisms on the
+    direction (fx, fy, fz) to res (without any constants).
+
+    The computation points are split among *threads* OpenMP threads.
+    """
+    cdef Py_ssize_t l, m
+    for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+        for m in range(bounds.shape[0]):
+            res[l] += magnetic_kernel(bounds, m, mag[m, 0], mag[m, 1],
+                                      mag[m, 2], fx, fy, fz,
+                                      xp[l], yp[l], zp[l], ratio)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz, tmp1, tmp2
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    if dx == 0 and dy == 0 and dz < 0:
-                        tmp1 = 0.00001*(x2 - x1)
-                        tmp2 = 0.00001*(y2 - y1)
-                        r = sqrt(tmp1**2 + tmp2**2 + dz**2)
-                    else:
-                        r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelxy(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline void tensor_point(const double[:, ::1] bounds,
+                              const double[:] density,
+                              double xp, double yp, double zp, double ratio,
+                              double[:, ::1] res, Py_ssize_t l) nogil:
+    """
+    Add the gravity gradient tensor of all prisms on point l to res[:, l].
+    """
+    cdef:
+        Py_ssize_t m
+        unsigned int c
+        double kernels[6]
+        double center[5]
+    for m in range(bounds.shape[0]):
+        if density[m] == 0:
+            continue
+        if far_field(bounds, m, xp, yp, zp, ratio, center):
+            point_tensor(center, kernels)
+        else:
+            tensor_corners(bounds, m, xp, yp, zp, True, kernels)
+        for c in range(6):
+            res[c, l] += density[m]*kernels[c]
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz, tmp1, tmp2
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    if dx == 0 and dz == 0 and dy < 0:
-                        tmp1 = 0.00001*(x2 - x1)
-                        tmp2 = 0.00001*(z2 - z1)
-                        r = sqrt(tmp1**2 + tmp2**2 + dy**2)
-                    else:
-                        r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelxz(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+cdef inline void vector_point(const double[:, ::1] bounds,
+                              const double[:] density,
+                              double xp, double yp, double zp, double ratio,
+                              double[:, ::1] res, Py_ssize_t l) nogil:
+    """
+    Add the gravity vector of all prisms on point l to res[:, l].
+    """
+    cdef:
+        Py_ssize_t m
+        unsigned int c
+        double kernels[3]
+        double center[5]
+    for m in range(bounds.shape[0]):
+        if density[m] == 0:
+            continue
+        if far_field(bounds, m, xp, yp, zp, ratio, center):
+            point_vector(center, kernels)
+        else:
+            vector_corners(bounds, m, xp, yp, zp, kernels)
+        for c in range(3):
+            res[c, l] += density[m]*kernels[c]
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelyy(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+def tensor(const double[:] xp not None, const double[:] yp not None,
+           const double[:] zp not None,
+           const double[:, ::1] bounds not None,
+           const double[:] density not None, int threads, double ratio,
+           double[:, ::1] res not None):
+    """
+    Put gxx, gxy, gxz, gyy, gyz, gzz in the rows of res (shape (6, N)).
+    """
+    cdef Py_ssize_t l
+    with nogil:
+        for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+            tensor_point(bounds, density, xp[l], yp[l], zp[l], ratio, res,
+                         l)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz, tmp1, tmp2
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    if dy == 0 and dz == 0 and dx < 0:
-                        tmp1 = 0.00001*(y2 - y1)
-                        tmp2 = 0.00001*(z2 - z1)
-                        r = sqrt(tmp1**2 + tmp2**2 + dx**2)
-                    else:
-                        r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelyz(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+def gravity_vector(const double[:] xp not None, const double[:] yp not None,
+                   const double[:] zp not None,
+                   const double[:, ::1] bounds not None,
+                   const double[:] density not None, int threads,
+                   double ratio, double[:, ::1] res not None):
+    """
+    Put gx, gy, gz in the rows of res (shape (3, N)).
+    """
+    cdef Py_ssize_t l
+    with nogil:
+        for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+            vector_point(bounds, density, xp[l], yp[l], zp[l], ratio, res,
+                         l)
+
+cdef int select_kernel(str field, kernel_func *kernel, point_func *point,
+                      int *shift) except -1:
+    """
+    Set the kernel function, point mass kernel, and singularity correction for
+    a gravity field.
+    """
+    shift[0] = NO_SHIFT
+    if field == 'potential':
+        kernel[0] = kernelpot
+        point[0] = pointpot
+    elif field == 'gx':
+        kernel[0] = kernelx
+        point[0] = pointx
+    elif field == 'gy':
+        kernel[0] = kernely
+        point[0] = pointy
+    elif field == 'gz':
+        kernel[0] = kernelz
+        point[0] = pointz
+    elif field == 'gxx':
+        kernel[0] = kernelxx
+        point[0] = pointxx
+    elif field == 'gxy':
+        kernel[0] = kernelxy
+        point[0] = pointxy
+        shift[0] = SHIFT_XY
+    elif field == 'gxz':
+        kernel[0] = kernelxz
+        point[0] = pointxz
+        shift[0] = SHIFT_XZ
+    elif field == 'gyy':
+        kernel[0] = kernelyy
+        point[0] = pointyy
+    elif field == 'gyz':
+        kernel[0] = kernelyz
+        point[0] = pointyz
+        shift[0] = SHIFT_YZ
+    elif field == 'gzz':
+        kernel[0] = kernelzz
+        point[0] = pointzz
+    else:
+        raise ValueError("Invalid gravity field '{}'".format(field))
+    return 0
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-        double x1, double x2, double y1, double y2, double z1, double z2,
-        double density,
-        numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelzz(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+def gravity_sensitivity(str field, const double[:] xp not None,
+                        const double[:] yp not None,
+                        const double[:] zp not None,
+                        const double[:, ::1] bounds not None,
+                        const double[:] scale not None, int threads,
+                        double ratio, real[:, ::1] jac not None):
+    """
+    Put the effect of each prism with unit density in the columns of jac
+    (shape (N, M), without any constants).
+
+    Prisms with zero scale get a column of zeros.
+    """
+    cdef:
+        Py_ssize_t l, m
+        kernel_func kernel
+        point_func point
+        int shift
+    select_kernel(field, &kernel, &point, &shift)
+    with nogil:
+        for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+            for m in range(bounds.shape[0]):
+                if scale[m] == 0:
+                    jac[l, m] = 0
+                else:
+                    jac[l, m] = scale[m]*prism_field(kernel, point, shift,
+                                                     ratio, bounds, m,
+                                                     xp[l], yp[l], zp[l])
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
-              numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-              numpy.ndarray[DTYPE_T, ndim=1] zp not None,
-              double x1, double x2, double y1, double y2, double z1, double z2,
-              double density,
-              numpy.ndarray[DTYPE_T, ndim=1] res not None):
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] x, y, z
-    cdef DTYPE_T kernel, r, dx, dy, dz
-    size = len(xp)
-    x = numpy.array([x2, x1], dtype=DTYPE)
-    y = numpy.array([y2, y1], dtype=DTYPE)
-    z = numpy.array([z2, z1], dtype=DTYPE)
-    for l in range(size):
-        # Evaluate the integration limits
-        for k in range(2):
-            dz = z[k] - zp[l]
-            for j in range(2):
-                dy = y[j] - yp[l]
-                for i in range(2):
-                    dx = x[i] - xp[l]
-                    r = sqrt(dx**2 + dy**2 + dz**2)
-                    kernel = kernelpot(dx, dy, dz, r)
-                    res[l] += ((-1.)**(i + j + k))*kernel*density
+def magnetic_sensitivity(const double[:] xp not None,
+                         const double[:] yp not None,
+                         const double[:] zp not None,
+                         const double[:, ::1] bounds not None,
+                         const double[:, ::1] mag not None,
+                         double fx, double fy, double fz, int threads,
+                         double ratio, real[:, ::1] jac not None):
+    """
+    Put the projection on (fx, fy, fz) of the magnetic induction of each prism
+    in the columns of jac (shape (N, M), without any constants).
+
+    Each row of mag is the magnetization vector of a prism (usually a unit
+    vector). Prisms with zero magnetization get a column of zeros.
+    """
+    cdef Py_ssize_t l, m
+    with nogil:
+        for l in prange(xp.shape[0], num_threads=threads, schedule='static'):
+            for m in range(bounds.shape[0]):
+                jac[l, m] = magnetic_kernel(bounds, m, mag[m, 0], mag[m, 1],
+                                            mag[m, 2], fx, fy, fz,
+                                            xp[l], yp[l], zp[l], ratio)
+
+def tf(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:, ::1] mag not None,
+       double fx, double fy, double fz, int threads, double ratio,
+       double[:] res not None):
+    with nogil:
+        magnetic(xp, yp, zp, bounds, mag, fx, fy, fz, threads, ratio, res)
+
+def bx(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:, ::1] mag not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        magnetic(xp, yp, zp, bounds, mag, 1, 0, 0, threads, ratio, res)
+
+def by(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:, ::1] mag not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        magnetic(xp, yp, zp, bounds, mag, 0, 1, 0, threads, ratio, res)
+
+def bz(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:, ::1] mag not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        magnetic(xp, yp, zp, bounds, mag, 0, 0, 1, threads, ratio, res)
+
+def potential(const double[:] xp not None, const double[:] yp not None,
+              const double[:] zp not None,
+              const double[:, ::1] bounds not None,
+              const double[:] density not None, int threads, double ratio,
+              double[:] res not None):
+    with nogil:
+        gravity(kernelpot, pointpot, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gx(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:] density not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelx, pointx, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gy(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:] density not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernely, pointy, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gz(const double[:] xp not None, const double[:] yp not None,
+       const double[:] zp not None,
+       const double[:, ::1] bounds not None, const double[:] density not None,
+       int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelz, pointz, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gxx(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelxx, pointxx, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gxy(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelxy, pointxy, SHIFT_XY, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gxz(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelxz, pointxz, SHIFT_XZ, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gyy(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelyy, pointyy, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gyz(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelyz, pointyz, SHIFT_YZ, xp, yp, zp, bounds, density,
+                threads, ratio, res)
+
+def gzz(const double[:] xp not None, const double[:] yp not None,
+        const double[:] zp not None,
+        const double[:, ::1] bounds not None, const double[:] density not None,
+        int threads, double ratio, double[:] res not None):
+    with nogil:
+        gravity(kernelzz, pointzz, NO_SHIFT, xp, yp, zp, bounds, density,
+                threads, ratio, res)
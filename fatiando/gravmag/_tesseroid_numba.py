@@ -1,24 +1,30 @@
 """
 A numba implementation of the tesseroid gravity effects.
 
-These functions compute the effect of a single tesseroid. They are used by
-fatiando.gravmag.tesseroid as a backend and are not meant to be used directly.
+These functions compute the effect of a tesseroid model given as arrays of
+bounds and densities. They are used by fatiando.gravmag.tesseroid as a backend
+and are not meant to be used directly.
 
 A few doctests for the numba code::
 
 >>> import numpy as np
->>> stack = np.empty((6, 6))
+>>> stack = np.empty((6, 7))
 >>> stktop = -1
->>> stktop = split(0, 4, 3, 6, 11, 5, 2, 1, 3, stack, stktop)
+>>> stktop = split(0, 4, 3, 6, 11, 5, 1, 2, 1, 3, stack, stktop)
 >>> stktop
 5
 >>> stack
-array([[  0.,   2.,   3.,   6.,   7.,   5.],
-       [  0.,   2.,   3.,   6.,   9.,   7.],
-       [  0.,   2.,   3.,   6.,  11.,   9.],
-       [  2.,   4.,   3.,   6.,   7.,   5.],
-       [  2.,   4.,   3.,   6.,   9.,   7.],
-       [  2.,   4.,   3.,   6.,  11.,   9.]])
+array([[  0.,   2.,   3.,   6.,   7.,   5.,   1.],
+       [  0.,   2.,   3.,   6.,   9.,   7.,   1.],
+       [  0.,   2.,   3.,   6.,  11.,   9.,   1.],
+       [  2.,   4.,   3.,   6.,   7.,   5.,   1.],
+       [  2.,   4.,   3.,   6.,   9.,   7.,   1.],
+       [  2.,   4.,   3.,   6.,  11.,   9.,   1.]])
+>>> bigger = grow(stack, 8)
+>>> bigger.shape
+(12, 7)
+>>> np.all(bigger[:6] == stack)
+True
 
 """
 from __future__ import division, absolute_import
@@ -28,61 +34,209 @@ import numpy as np
 from ..constants import MEAN_EARTH_RADIUS
 
 
-nodes = np.array([-0.577350269189625731058868041146,
-                  0.577350269189625731058868041146])
-
-
-def engine_factory(kernel):
+def integrator_factory(kernel):
+    """
+    Make a function that integrates the kernel of a single tesseroid on a
+    single point using the adaptive discretization.
+
+    The function adds the integral (without the density) to the *values*
+    array and returns the number of times a tesseroid was too small to divide
+    and the stack. The stack is replaced by a larger copy if the subdivision
+    doesn't fit in it. Each row of the stack has the bounds of a tesseroid
+    and its depth in the subdivision tree.
+
+    The *stats* array accumulates the number of kernel evaluations (one per
+    GLQ node of each integrated tesseroid), the number of splits and the
+    maximum depth (in this order).
+    """
+    @numba.jit(nopython=True)
+    def integrate(lon, coslat, sinlat, radius, bounds, ratio, nodes, weights,
+                  stack, lonc, sinlatc, coslatc, rc, values, stats):
+        "Integrate the kernel of a single tesseroid on a single point"
+        error_code = 0
+        for i in range(6):
+            stack[0, i] = bounds[i]
+        stack[0, 6] = 0
+        stktop = 0
+        while stktop >= 0:
+            w, e, s, n, top, bottom, depth = stack[stktop, :]
+            stktop -= 1
+            distance, Llon, Llat, Lr = distance_size(
+                lon, coslat, sinlat, radius, w, e, s, n, top, bottom)
+            nlon, nlat, nr, new_cells, err = divisions(
+                distance, Llon, Llat, Lr, ratio)
+            error_code += err
+            if new_cells > 1:
+                if new_cells + (stktop + 1) > stack.shape[0]:
+                    stack = grow(stack, new_cells + stktop + 1)
+                stktop = split(w, e, s, n, top, bottom, depth + 1, nlon, nlat,
+                               nr, stack, stktop)
+                stats[1] += 1
+            else:
+                scale = scale_nodes(w, e, s, n, top, bottom, nodes, lonc,
+                                    sinlatc, coslatc, rc)
+                kernel(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc,
+                       rc, weights, scale, values)
+                stats[0] += lonc.size*sinlatc.size*rc.size
+                if depth > stats[2]:
+                    stats[2] = int(depth)
+        return error_code, stack
+    return integrate
+
+
+def engine_factory(kernel, parallel=False):
     """
     Make the engine functions for each specific field by passing in the
     appropriate kernel.
+
+    The engines add the effect of all tesseroids in *bounds* on all
+    computation points to *result*, an array with one row per point and one
+    column per field component calculated by the kernel. The statistics of
+    the subdivision are accumulated in *stats* (see ``integrator_factory``).
+    They return the number of tesseroids that were too small to divide and the
+    stack (which may have grown).
+
+    If *parallel* is True, the engine splits the computation points among
+    threads (using numba's ``prange``) and allocates the stack and GLQ buffers
+    for each point inside the loop, so each thread uses its own. Otherwise,
+    the buffers must be passed in and are reused.
     """
-    @numba.jit(nopython=True)
-    def engine(lon, sinlat, coslat, radius, bounds, density, ratio,
-               stack, lonc, sinlatc, coslatc, rc, result):
+    integrate = integrator_factory(kernel)
+
+    if parallel:
+        @numba.jit(nopython=True, parallel=True)
+        def engine(lon, sinlat, coslat, radius, bounds, density, ratio,
+                   nodes, weights, stack, result, stats):
+            error_code = 0
+            point_stats = np.zeros((result.shape[0], stats.size),
+                                   dtype=stats.dtype)
+            for l in numba.prange(result.shape[0]):
+                local_stack = np.empty_like(stack)
+                lonc = np.empty(nodes[0].size)
+                sinlatc = np.empty(nodes[1].size)
+                coslatc = np.empty(nodes[1].size)
+                rc = np.empty(nodes[2].size)
+                values = np.empty(result.shape[1])
+                for t in range(density.size):
+                    values[:] = 0
+                    err, local_stack = integrate(
+                        lon[l], coslat[l], sinlat[l], radius[l], bounds[t],
+                        ratio, nodes, weights, local_stack, lonc, sinlatc,
+                        coslatc, rc, values, point_stats[l])
+                    for c in range(values.size):
+                        result[l, c] += density[t]*values[c]
+                    error_code += err
+            reduce_stats(point_stats, stats)
+            return error_code, stack
+    else:
+        @numba.jit(nopython=True)
+        def engine(lon, sinlat, coslat, radius, bounds, density, ratio,
+                   nodes, weights, stack, lonc, sinlatc, coslatc, rc, result,
+                   stats):
+            error_code = 0
+            values = np.empty(result.shape[1])
+            for t in range(density.size):
+                for l in range(result.shape[0]):
+                    values[:] = 0
+                    err, stack = integrate(
+                        lon[l], coslat[l], sinlat[l], radius[l], bounds[t],
+                        ratio, nodes, weights, stack, lonc, sinlatc, coslatc,
+                        rc, values, stats)
+                    for c in range(values.size):
+                        result[l, c] += density[t]*values[c]
+                    error_code += err
+            return error_code, stack
+    return engine
+
+
+def sensitivity_factory(kernel, parallel=False):
+    """
+    Make the functions that fill the sensitivity matrix of a specific field.
+
+    Element ``[l, t]`` of the matrix is the integral of the kernel of the tth
+    tesseroid in *bounds* on the lth computation point (the effect of the
+    tesseroid with unit density). The functions return the number of
+    tesseroids that were too small to divide and accumulate the statistics of
+    the subdivision in *stats*.
+
+    If *parallel* is True, the computation points are split among threads
+    (using numba's ``prange``). The buffers are allocated for each point with
+    the same size as *stack*.
+    """
+    integrate = integrator_factory(kernel)
+
+    @numba.jit(nopython=True, parallel=parallel)
+    def fill(lon, sinlat, coslat, radius, bounds, ratio, nodes, weights,
+             stack, out, stats):
         error_code = 0
-        for l in range(result.size):
-            for i in range(6):
-                stack[0, i] = bounds[i]
-            stktop = 0
-            while stktop >= 0:
-                w, e, s, n, top, bottom = stack[stktop, :]
-                stktop -= 1
-                distance, Llon, Llat, Lr = distance_size(
-                    lon[l], coslat[l], sinlat[l], radius[l], w, e, s, n, top,
-                    bottom)
-                nlon, nlat, nr, new_cells, err = divisions(
-                    distance, Llon, Llat, Lr, ratio)
+        point_stats = np.zeros((out.shape[0], stats.size), dtype=stats.dtype)
+        for l in numba.prange(out.shape[0]):
+            local_stack = np.empty_like(stack)
+            lonc = np.empty(nodes[0].size)
+            sinlatc = np.empty(nodes[1].size)
+            coslatc = np.empty(nodes[1].size)
+            rc = np.empty(nodes[2].size)
+            values = np.empty(1)
+            for t in range(out.shape[1]):
+                values[0] = 0
+                err, local_stack = integrate(
+                    lon[l], coslat[l], sinlat[l], radius[l], bounds[t],
+                    ratio, nodes, weights, local_stack, lonc, sinlatc,
+                    coslatc, rc, values, point_stats[l])
+                out[l, t] = values[0]
                 error_code += err
-                if new_cells > 1:
-                    if new_cells + (stktop + 1) > stack.shape[0]:
-                        raise OverflowError
-                    stktop = split(w, e, s, n, top, bottom, nlon, nlat, nr,
-                                   stack, stktop)
-                else:
-                    scale = scale_nodes(w, e, s, n, top, bottom, nodes, lonc,
-                                        sinlatc, coslatc, rc)
-                    result[l] += density*scale*kernel(
-                        lon[l], coslat[l], sinlat[l], radius[l], lonc, sinlatc,
-                        coslatc, rc)
+        reduce_stats(point_stats, stats)
         return error_code
-    return engine
+    return fill
+
+
+@numba.jit(nopython=True)
+def reduce_stats(point_stats, stats):
+    """
+    Add the statistics of each computation point to *stats*.
+
+    The counts are summed and the maximum depth is the largest of all points.
+    """
+    for l in range(point_stats.shape[0]):
+        stats[0] += point_stats[l, 0]
+        stats[1] += point_stats[l, 1]
+        if point_stats[l, 2] > stats[2]:
+            stats[2] = point_stats[l, 2]
+
+
+@numba.jit(nopython=True)
+def grow(stack, size):
+    """
+    Make a copy of the stack with room for at least *size* tesseroids.
+
+    Doubles the size of the stack so that it only grows a few times.
+    """
+    new = np.empty((max(2*stack.shape[0], size), stack.shape[1]))
+    new[:stack.shape[0], :] = stack
+    return new
 
 
 @numba.jit(nopython=True)
 def scale_nodes(w, e, s, n, top, bottom, nodes, lonc, sinlatc, coslatc, rc):
-    "Put the GLQ nodes in the integration limit"
+    """
+    Put the GLQ nodes in the integration limits.
+
+    *nodes* is a tuple with the nodes in longitude, latitude and radius.
+    """
     d2r = np.pi/180
     dlon = d2r*(e - w)
     dlat = d2r*(n - s)
     dr = top - bottom
+    nodes_lon, nodes_lat, nodes_r = nodes
     # Scale the GLQ nodes to the integration limits
-    for i in range(len(nodes)):
-        lonc[i] = 0.5*dlon*nodes[i] + d2r*0.5*(e + w)
-        latc = 0.5*dlat*nodes[i] + d2r*0.5*(n + s)
-        sinlatc[i] = np.sin(latc)
-        coslatc[i] = np.cos(latc)
-        rc[i] = (0.5*dr*nodes[i] +
+    for i in range(nodes_lon.size):
+        lonc[i] = 0.5*dlon*nodes_lon[i] + d2r*0.5*(e + w)
+    for j in range(nodes_lat.size):
+        latc = 0.5*dlat*nodes_lat[j] + d2r*0.5*(n + s)
+        sinlatc[j] = np.sin(latc)
+        coslatc[j] = np.cos(latc)
+    for k in range(nodes_r.size):
+        rc[k] = (0.5*dr*nodes_r[k] +
                  0.5*(top + bottom) + MEAN_EARTH_RADIUS)
     scale = dlon*dlat*dr*0.125
     return scale
@@ -109,9 +263,11 @@ def distance_size(lon, coslat, sinlat, radius, w, e, s, n, top, bottom):
 
 
 @numba.jit(nopython=True)
-def split(w, e, s, n, top, bottom, nlon, nlat, nr, stack, stktop):
+def split(w, e, s, n, top, bottom, depth, nlon, nlat, nr, stack, stktop):
     """
     Divide the region into smaller parts and add them to the stack.
+
+    The parts are at *depth* in the subdivision tree.
     """
     dlon = (e - w)/nlon
     dlat = (n - s)/nlat
@@ -126,6 +282,7 @@ def split(w, e, s, n, top, bottom, nlon, nlat, nr, stack, stktop):
                 stack[stktop, 3] = s + (j + 1)*dlat
                 stack[stktop, 4] = bottom + (k + 1)*dr
                 stack[stktop, 5] = bottom + k*dr
+                stack[stktop, 6] = depth
     return stktop
 
 
@@ -155,174 +312,232 @@ def divisions(distance, Llon, Llat, Lr, ratio):
 
 
 @numba.jit(nopython=True)
-def kernelV(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelV(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+            scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 l_sqr = r_sqr + rc[k]**2 - 2*radius*rc[k]*cospsi
-                kappa = (rc[k]**2)*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*(rc[k]**2)*coslatc[j]
                 result += kappa/np.sqrt(l_sqr)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelx(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelx(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+            scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 l_sqr = r_sqr + rc[k]**2 - 2*radius*rc[k]*cospsi
-                kappa = (rc[k]**2)*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*(rc[k]**2)*coslatc[j]
                 result += kappa*rc[k]*kphi/(l_sqr**1.5)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernely(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernely(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+            scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
         sinlon = np.sin(lonc[i] - lon)
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 l_sqr = r_sqr + rc[k]**2 - 2*radius*rc[k]*cospsi
-                kappa = (rc[k]**2)*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*(rc[k]**2)*coslatc[j]
                 result += kappa*(rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+            scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 l_sqr = r_sqr + rc[k]**2 - 2*radius*rc[k]*cospsi
-                kappa = (rc[k]**2)*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*(rc[k]**2)*coslatc[j]
                 result += kappa*(rc[k]*cospsi - radius)/(l_sqr**1.5)
     # Multiply by -1 so that z is pointing down for gz and the gravity anomaly
     # doesn't look inverted (ie, negative for positive density)
-    result *= -1
-    return result
+    values[0] -= scale*result
 
 
 @numba.jit(nopython=True)
-def kernelxx(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelxx(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 l_sqr = r_sqr + rc[k]**2 - 2*radius*rc[k]*cospsi
-                kappa = (rc[k]**2)*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*(rc[k]**2)*coslatc[j]
                 result += kappa*(3*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelxy(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelxy(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lonc[i] - lon)
         sinlon = np.sin(lonc[i] - lon)
-        for j in range(2):
+        for j in range(sinlatc.size):
             kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 rc_sqr = rc[k]**2
                 l_sqr = r_sqr + rc_sqr - 2*radius*rc[k]*cospsi
-                kappa = rc_sqr*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
                 result += kappa*3*rc_sqr*kphi*coslatc[j]*sinlon/(l_sqr**2.5)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelxz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelxz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 rc_sqr = rc[k]**2
                 l_5 = (r_sqr + rc_sqr - 2*radius*rc[k]*cospsi)**2.5
-                kappa = rc_sqr*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
                 result += kappa*3*rc[k]*kphi*(rc[k]*cospsi - radius)/l_5
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelyy(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelyy(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lonc[i] - lon)
         sinlon = np.sin(lonc[i] - lon)
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 rc_sqr = rc[k]**2
                 l_sqr = r_sqr + rc_sqr - 2*radius*rc[k]*cospsi
-                kappa = rc_sqr*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
                 deltay = rc[k]*coslatc[j]*sinlon
                 result += kappa*(3*(deltay**2) - l_sqr)/(l_sqr**2.5)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelyz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelyz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lonc[i] - lon)
         sinlon = np.sin(lonc[i] - lon)
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 rc_sqr = rc[k]**2
                 l_sqr = r_sqr + rc_sqr - 2*radius*rc[k]*cospsi
-                kappa = rc_sqr*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
                 deltay = rc[k]*coslatc[j]*sinlon
                 deltaz = rc[k]*cospsi - radius
                 result += kappa*3.*deltay*deltaz/(l_sqr**2.5)
-    return result
+    values[0] += scale*result
 
 
 @numba.jit(nopython=True)
-def kernelzz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc):
+def kernelzz(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc, weights,
+             scale, values):
+    wlon, wlat, wr = weights
     r_sqr = radius**2
     result = 0
-    for i in range(2):
+    for i in range(lonc.size):
         coslon = np.cos(lon - lonc[i])
-        for j in range(2):
+        for j in range(sinlatc.size):
             cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in range(2):
+            for k in range(rc.size):
                 rc_sqr = rc[k]**2
                 l_sqr = r_sqr + rc_sqr - 2*radius*rc[k]*cospsi
                 l_5 = l_sqr**2.5
-                kappa = rc_sqr*coslatc[j]
+                kappa = wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
                 deltaz = rc[k]*cospsi - radius
                 result += kappa*(3*deltaz**2 - l_sqr)/l_5
-    return result
+    values[0] += scale*result
+
+
+@numba.jit(nopython=True)
+def kernel_all(lon, coslat, sinlat, radius, lonc, sinlatc, coslatc, rc,
+               weights, scale, values):
+    """
+    Calculate all components of the gravity vector and gradient tensor at once.
+
+    Adds gx, gy, gz, gxx, gxy, gxz, gyy, gyz, gzz (in this order) to *values*.
+    The distances and trigonometric functions are computed only once for
+    each GLQ node.
+    """
+    wlon, wlat, wr = weights
+    r_sqr = radius**2
+    for i in range(lonc.size):
+        coslon = np.cos(lon - lonc[i])
+        sinlon = np.sin(lonc[i] - lon)
+        for j in range(sinlatc.size):
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(rc.size):
+                rc_sqr = rc[k]**2
+                l_sqr = r_sqr + rc_sqr - 2*radius*rc[k]*cospsi
+                l_3 = l_sqr*np.sqrt(l_sqr)
+                l_5 = l_3*l_sqr
+                kappa = scale*wlon[i]*wlat[j]*wr[k]*rc_sqr*coslatc[j]
+                deltax = rc[k]*kphi
+                deltay = rc[k]*coslatc[j]*sinlon
+                deltaz = rc[k]*cospsi - radius
+                values[0] += kappa*deltax/l_3
+                values[1] += kappa*deltay/l_3
+                # z is pointing down for gz (see kernelz)
+                values[2] -= kappa*deltaz/l_3
+                values[3] += kappa*(3*deltax**2 - l_sqr)/l_5
+                values[4] += kappa*3*deltax*deltay/l_5
+                values[5] += kappa*3*deltax*deltaz/l_5
+                values[6] += kappa*(3*deltay**2 - l_sqr)/l_5
+                values[7] += kappa*3*deltay*deltaz/l_5
+                values[8] += kappa*(3*deltaz**2 - l_sqr)/l_5
 
 
 # Use the factory to make the functions for specific fields. These are the ones
@@ -337,3 +552,40 @@ gyy = engine_factory(kernelyy)
 gyz = engine_factory(kernelyz)
 gzz = engine_factory(kernelzz)
 potential = engine_factory(kernelV)
+components = engine_factory(kernel_all)
+# The parallel versions of the engines
+parallel = dict(
+    gx=engine_factory(kernelx, parallel=True),
+    gy=engine_factory(kernely, parallel=True),
+    gz=engine_factory(kernelz, parallel=True),
+    gxx=engine_factory(kernelxx, parallel=True),
+    gxy=engine_factory(kernelxy, parallel=True),
+    gxz=engine_factory(kernelxz, parallel=True),
+    gyy=engine_factory(kernelyy, parallel=True),
+    gyz=engine_factory(kernelyz, parallel=True),
+    gzz=engine_factory(kernelzz, parallel=True),
+    potential=engine_factory(kernelV, parallel=True),
+    components=engine_factory(kernel_all, parallel=True))
+# The functions that fill the sensitivity matrix of each field
+sensitivity = dict(
+    gx=sensitivity_factory(kernelx),
+    gy=sensitivity_factory(kernely),
+    gz=sensitivity_factory(kernelz),
+    gxx=sensitivity_factory(kernelxx),
+    gxy=sensitivity_factory(kernelxy),
+    gxz=sensitivity_factory(kernelxz),
+    gyy=sensitivity_factory(kernelyy),
+    gyz=sensitivity_factory(kernelyz),
+    gzz=sensitivity_factory(kernelzz),
+    potential=sensitivity_factory(kernelV))
+parallel_sensitivity = dict(
+    gx=sensitivity_factory(kernelx, parallel=True),
+    gy=sensitivity_factory(kernely, parallel=True),
+    gz=sensitivity_factory(kernelz, parallel=True),
+    gxx=sensitivity_factory(kernelxx, parallel=True),
+    gxy=sensitivity_factory(kernelxy, parallel=True),
+    gxz=sensitivity_factory(kernelxz, parallel=True),
+    gyy=sensitivity_factory(kernelyy, parallel=True),
+    gyz=sensitivity_factory(kernelyz, parallel=True),
+    gzz=sensitivity_factory(kernelzz, parallel=True),
+    potential=sensitivity_factory(kernelV, parallel=True))
@@ -0,0 +1,267 @@
+"""
+A numba implementation of the Barnes-Hut tree code for point sources.
+
+These functions build the tree and evaluate the fields of point sources with
+it. They are used by fatiando.gravmag.treecode and are not meant to be used
+directly.
+
+Every field is a derivative of the potential of unit point sources. The
+kernel of a first derivative is ``w.d/r**3`` and of a second derivative is
+``sum(W*T)`` (T is the tensor of second derivatives of 1/r), where d is the
+position of the source relative to the computation point. The weights *w* and
+*W* are stored in a (nsets, 3, 3) array (first derivatives only use the first
+row). Each set of weights has its own set of charges, so that dipoles with
+varying directions can be represented as 3 sets of scalar charges.
+
+A few doctests for the numba code::
+
+>>> import numpy as np
+>>> points = np.array([[0., 0, 0], [1, 0, 0], [5, 1, 0], [6, 1, 1]])
+>>> order, start, end, children, center, size = build(points, 1)
+>>> order.tolist()
+[0, 1, 2, 3]
+>>> start.tolist()
+[0, 0, 2, 0, 1, 2, 3]
+>>> end.tolist()
+[4, 2, 4, 1, 2, 3, 4]
+>>> children.tolist()
+[[1, 2], [3, 4], [5, 6], [-1, -1], [-1, -1], [-1, -1], [-1, -1]]
+>>> center[0].tolist(), size[1]
+([3.0, 0.5, 0.5], 1.0)
+
+"""
+from __future__ import division, absolute_import
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True)
+def build(points, leaf_size):
+    """
+    Build a binary tree by splitting the points in half along the largest
+    dimension of their bounding box until there are at most *leaf_size*
+    points in a node.
+
+    The children of a node always have larger indices than their parent.
+
+    Returns:
+
+    * [order, start, end, children, center, size]
+        The indices that sort the points by node, the range of the sorted
+        points in each node, the indices of the 2 children of each node (-1
+        for leaves), the center and the diagonal of the bounding box of each
+        node.
+
+    """
+    npoints = points.shape[0]
+    order = np.arange(npoints)
+    maxnodes = 2*npoints + 1
+    start = np.empty(maxnodes, dtype=np.int64)
+    end = np.empty(maxnodes, dtype=np.int64)
+    children = -np.ones((maxnodes, 2), dtype=np.int64)
+    center = np.empty((maxnodes, 3))
+    size = np.empty(maxnodes)
+    if npoints == 0:
+        # A tree without nodes (there is no bounding box to split)
+        return (order, start[:0], end[:0], children[:0], center[:0],
+                size[:0])
+    # Nodes waiting to be filled: (node index, start, end)
+    stack = np.empty((maxnodes, 3), dtype=np.int64)
+    stack[0, 0], stack[0, 1], stack[0, 2] = 0, 0, npoints
+    stktop = 0
+    nnodes = 1
+    lower = np.empty(3)
+    upper = np.empty(3)
+    while stktop >= 0:
+        node, i1, i2 = stack[stktop, 0], stack[stktop, 1], stack[stktop, 2]
+        stktop -= 1
+        start[node], end[node] = i1, i2
+        for c in range(3):
+            lower[c] = points[order[i1], c]
+            upper[c] = points[order[i1], c]
+        for i in range(i1 + 1, i2):
+            for c in range(3):
+                value = points[order[i], c]
+                if value < lower[c]:
+                    lower[c] = value
+                if value > upper[c]:
+                    upper[c] = value
+        axis = 0
+        for c in range(3):
+            center[node, c] = 0.5*(lower[c] + upper[c])
+            if upper[c] - lower[c] > upper[axis] - lower[axis]:
+                axis = c
+        size[node] = np.sqrt((upper[0] - lower[0])**2 +
+                             (upper[1] - lower[1])**2 +
+                             (upper[2] - lower[2])**2)
+        if i2 - i1 <= leaf_size or size[node] == 0:
+            continue
+        segment = order[i1:i2]
+        order[i1:i2] = segment[np.argsort(points[segment, axis])]
+        middle = i1 + (i2 - i1)//2
+        # Push the right child first so that the left one is split first
+        children[node, 0], children[node, 1] = nnodes, nnodes + 1
+        nnodes += 2
+        stktop += 1
+        stack[stktop, 0], stack[stktop, 1] = children[node, 1], middle
+        stack[stktop, 2] = i2
+        stktop += 1
+        stack[stktop, 0], stack[stktop, 1] = children[node, 0], i1
+        stack[stktop, 2] = middle
+    return (order, start[:nnodes], end[:nnodes], children[:nnodes],
+            center[:nnodes], size[:nnodes])
+
+
+@numba.jit(nopython=True)
+def moments(points, charges, start, end, children, center):
+    """
+    Calculate the total charge and the dipole moment (about the center) of
+    every node for each set of charges.
+
+    *points* and *charges* must be sorted by node (using the order returned by
+    :func:`build`). Children are visited before their parents.
+
+    Returns:
+
+    * [charge, dipole]
+        Arrays with shapes (nsets, nnodes) and (nsets, nnodes, 3).
+
+    """
+    nsets = charges.shape[0]
+    nnodes = start.shape[0]
+    charge = np.zeros((nsets, nnodes))
+    dipole = np.zeros((nsets, nnodes, 3))
+    for node in range(nnodes - 1, -1, -1):
+        for s in range(nsets):
+            if children[node, 0] < 0:
+                for i in range(start[node], end[node]):
+                    charge[s, node] += charges[s, i]
+                    for c in range(3):
+                        dipole[s, node, c] += charges[s, i]*(
+                            points[i, c] - center[node, c])
+            else:
+                for child in children[node]:
+                    charge[s, node] += charge[s, child]
+                    for c in range(3):
+                        dipole[s, node, c] += dipole[s, child, c] + \
+                            charge[s, child]*(center[child, c] -
+                                              center[node, c])
+    return charge, dipole
+
+
+@numba.jit(nopython=True)
+def kernel(order, weights, dx, dy, dz, r):
+    """
+    The kernel of a unit point source at (dx, dy, dz) relative to the
+    computation point.
+    """
+    if order == 1:
+        return (weights[0, 0]*dx + weights[0, 1]*dy + weights[0, 2]*dz)/r**3
+    d = (dx, dy, dz)
+    res = 0.
+    trace = 0.
+    for a in range(3):
+        trace += weights[a, a]
+        for b in range(3):
+            res += weights[a, b]*d[a]*d[b]
+    return (3*res - trace*r**2)/r**5
+
+
+@numba.jit(nopython=True)
+def kernel_gradient(order, weights, dx, dy, dz, r, grad):
+    """
+    Put the gradient of the kernel with respect to the position of the source
+    in grad.
+    """
+    d = (dx, dy, dz)
+    if order == 1:
+        wd = weights[0, 0]*dx + weights[0, 1]*dy + weights[0, 2]*dz
+        for c in range(3):
+            grad[c] = weights[0, c]/r**3 - 3*wd*d[c]/r**5
+        return
+    dwd = 0.
+    trace = 0.
+    for a in range(3):
+        trace += weights[a, a]
+        for b in range(3):
+            dwd += weights[a, b]*d[a]*d[b]
+    for c in range(3):
+        # (W + W^T).d because the third derivatives of 1/r are symmetric
+        wd = 0.
+        for a in range(3):
+            wd += (weights[c, a] + weights[a, c])*d[a]
+        grad[c] = -15*dwd*d[c]/r**7 + 3*(wd + trace*d[c])/r**5
+
+
+@numba.jit(nopython=True)
+def evaluate_point(xp, yp, zp, order, weights, points, charges, start, end,
+                   children, center, size, charge, dipole, theta, stack,
+                   grad):
+    """
+    Evaluate the field of all sources on a single point by traversing the
+    tree.
+
+    Nodes that are farther than size/theta from the point are replaced by
+    their charge and dipole moment. The sources in leaves that are too close
+    are summed directly. Sources on top of the computation point are ignored.
+    """
+    nsets = charges.shape[0]
+    res = 0.
+    stack[0] = 0
+    stktop = 0
+    while stktop >= 0:
+        node = stack[stktop]
+        stktop -= 1
+        dx = center[node, 0] - xp
+        dy = center[node, 1] - yp
+        dz = center[node, 2] - zp
+        r = np.sqrt(dx**2 + dy**2 + dz**2)
+        if r*theta > size[node]:
+            for s in range(nsets):
+                kernel_gradient(order, weights[s], dx, dy, dz, r, grad)
+                res += (charge[s, node]*kernel(order, weights[s], dx, dy, dz,
+                                               r) +
+                        dipole[s, node, 0]*grad[0] +
+                        dipole[s, node, 1]*grad[1] +
+                        dipole[s, node, 2]*grad[2])
+        elif children[node, 0] < 0:
+            for i in range(start[node], end[node]):
+                dx = points[i, 0] - xp
+                dy = points[i, 1] - yp
+                dz = points[i, 2] - zp
+                r = np.sqrt(dx**2 + dy**2 + dz**2)
+                if r == 0:
+                    continue
+                for s in range(nsets):
+                    res += charges[s, i]*kernel(order, weights[s], dx, dy, dz,
+                                                r)
+        else:
+            stack[stktop + 1] = children[node, 1]
+            stack[stktop + 2] = children[node, 0]
+            stktop += 2
+    return res
+
+
+@numba.jit(nopython=True, parallel=True)
+def evaluate(xp, yp, zp, order, weights, points, charges, start, end,
+             children, center, size, theta, result):
+    """
+    Evaluate the field of all sources on every computation point.
+
+    The computation points are split among threads (using numba's
+    ``prange``). *points* and *charges* must be sorted by node.
+    """
+    charge, dipole = moments(points, charges, start, end, children, center)
+    # The tree is balanced so it has at most log2(nnodes) levels and the stack
+    # never holds more than 1 node per level (plus the 2 children pushed)
+    depth = 1
+    while 2**depth < start.shape[0]:
+        depth += 1
+    stack_size = depth + 3
+    for l in numba.prange(result.shape[0]):
+        stack = np.empty(stack_size, dtype=np.int64)
+        grad = np.empty(3)
+        result[l] = evaluate_point(xp[l], yp[l], zp[l], order, weights,
+                                   points, charges, start, end, children,
+                                   center, size, charge, dipole, theta,
+                                   stack, grad)
@@ -19,7 +19,7 @@ More complex parametrizations are:
 
 """
 from __future__ import division, absolute_import
-from future.builtins import super, range
+from future.builtins import super
 import numpy as np
 
 from ..inversion.misfit import Misfit
@@ -51,7 +51,8 @@ class PolygonalBasinGravity(Misfit):
     :class:`~fatiando.inversion.regularization.TotalVariation1D`.
 
     The forward modeling is done using :mod:`~fatiando.gravmag.talwani`.
-    Derivatives are calculated using a 2-point finite difference approximation.
+    Derivatives are calculated analytically using
+    :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`.
 
     .. tip::
 
@@ -191,14 +192,11 @@ class PolygonalBasinGravity(Misfit):
         """
         Calculate the Jacobian (sensitivity) matrix for a parameter vector.
         """
-        verts = self.p2vertices(p)
-        delta = np.array([0, 1])
-        jac = np.empty((self.ndata, self.nparams))
-        for i in range(self.nparams):
-            diff = Polygon([verts[i + 2], verts[i + 1] - delta,
-                            verts[i], verts[i + 1] + delta], self.props)
-            jac[:, i] = talwani.gz(self.x, self.z, [diff])/(2*delta[1])
-        return jac
+        poly = Polygon(self.p2vertices(p), self.props)
+        # The parameters are the z coordinates of all but the first and last
+        # vertices
+        dx, dz = talwani.gz_vertex_derivatives(self.x, self.z, poly)
+        return dz[:, 1:-1]
 
     def fmt_estimate(self, p):
         """
@@ -240,7 +238,8 @@ class Triangular(Misfit):
     The inversion will estimate the (x, z) coordinates of the unknown vertex.
 
     The forward modeling is done using :mod:`~fatiando.gravmag.talwani`.
-    Derivatives are calculated using a 2-point finite difference approximation.
+    Derivatives are calculated analytically using
+    :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`.
 
     .. tip::
 
@@ -265,8 +264,6 @@ class Triangular(Misfit):
 
     * density : float
         Density contrast of the basin
-    * delta : float
-        Interval used to calculate the approximate derivatives
 
     .. note::
 
@@ -333,19 +330,10 @@ class Triangular(Misfit):
         Calculate the Jacobian (sensitivity) matrix for a given parameter
         vector.
         """
-        delta = 1.
-        props = {'density': self.density}
-        xp, zp = self.x, self.z
-        verts = self.verts
-        x, z = p
-        jac = np.transpose([
-            (talwani.gz(xp, zp, [Polygon(verts + [[x + delta, z]], props)]) -
-             talwani.gz(xp, zp, [Polygon(verts + [[x - delta, z]], props)])
-             ) / (2. * delta),
-            (talwani.gz(xp, zp, [Polygon(verts + [[x, z + delta]], props)]) -
-             talwani.gz(xp, zp, [Polygon(verts + [[x, z - delta]], props)])
-             ) / (2. * delta)])
-        return jac
+        polygon = Polygon(self.verts + [p], {'density': self.density})
+        # The parameters are the x and z coordinates of the last vertex
+        dx, dz = talwani.gz_vertex_derivatives(self.x, self.z, polygon)
+        return np.transpose([dx[:, 2], dz[:, 2]])
 
     def fmt_estimate(self, p):
         """
@@ -373,7 +361,8 @@ class Trapezoidal(Misfit):
     The inversion will then estimate the z coordinates of the unknown vertices.
 
     The forward modeling is done using :mod:`~fatiando.gravmag.talwani`.
-    Derivatives are calculated using a 2-point finite difference approximation.
+    Derivatives are calculated analytically using
+    :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`.
 
     .. tip::
 
@@ -399,8 +388,6 @@ class Trapezoidal(Misfit):
 
     * density : float
         Density contrast of the basin
-    * delta : float
-        Interval used to calculate the approximate derivatives
 
     .. note::
 
@@ -467,19 +454,11 @@ class Trapezoidal(Misfit):
 
     def jacobian(self, p):
         z1, z2 = p
-        x1, x2 = self.x1, self.x2
-        x, z = self.x, self.z
-        props = self.props
-        verts = self.verts
-        delta = 1.
-        jac = np.empty((self.ndata, self.nparams), dtype=np.float)
-        z1p = [Polygon(verts + [[x1, z1 + delta], [x2, z2]], props)]
-        z1m = [Polygon(verts + [[x1, z1 - delta], [x2, z2]], props)]
-        jac[:, 0] = (talwani.gz(x, z, z1p) - talwani.gz(x, z, z1m))/(2*delta)
-        z2p = [Polygon(verts + [[x1, z1], [x2, z2 + delta]], props)]
-        z2m = [Polygon(verts + [[x1, z1], [x2, z2 - delta]], props)]
-        jac[:, 1] = (talwani.gz(x, z, z2p) - talwani.gz(x, z, z2m))/(2*delta)
-        return jac
+        polygon = Polygon(self.verts + [[self.x1, z1], [self.x2, z2]],
+                          self.props)
+        # The parameters are the z coordinates of the last 2 vertices
+        dx, dz = talwani.gz_vertex_derivatives(self.x, self.z, polygon)
+        return dz[:, 2:]
 
     def fmt_estimate(self, p):
         """
@@ -12,7 +12,9 @@ the layer. Use :mod:`fatiando.gravmag.sphere` for forward modeling.
   :class:`~fatiando.gravmag.eqlayer.EQLTotalField`: The classic (space domain)
   equivalent layer as formulated in Li and Oldenburg (2010) or
   Oliveira Jr. et al (2012).
-  Doesn't have wavelet compression or other tweaks.
+  Can optionally compress the sensitivity matrix into low-rank blocks (see
+  :mod:`fatiando.inversion.hmatrix`) or replace it by the tree code of
+  :mod:`fatiando.gravmag.treecode` (for layers with millions of sources).
 * :class:`~fatiando.gravmag.eqlayer.PELGravity` and
   :class:`~fatiando.gravmag.eqlayer.PELTotalField`: The polynomial equivalent
   layer of Oliveira Jr. et al (2012). A fast and memory efficient algorithm.
@@ -36,8 +38,12 @@ import numpy
 import scipy.sparse
 
 from . import sphere as kernel
+from .treecode import TreeMatrix
 from ..utils import dircos, safe_dot
+from ..constants import G, CM, T2NT, SI2MGAL, SI2EOTVOS
 from ..inversion import Misfit, Smoothness
+from ..inversion.hmatrix import HMatrix
+from ..mesher import PointGrid
 
 
 class EQLBase(Misfit):
@@ -45,12 +51,44 @@ class EQLBase(Misfit):
     Base class for the classic equivalent layer.
     """
 
-    def __init__(self, x, y, z, data, grid):
+    def __init__(self, x, y, z, data, grid, compress=None, theta=None):
         super().__init__(data=data, nparams=len(grid), islinear=True)
+        if compress is not None and theta is not None:
+            raise ValueError("Can't use both compress and theta")
         self.x = x
         self.y = y
         self.z = z
         self.grid = grid
+        self.compress = compress
+        self.theta = theta
+
+    def jacobian(self, p):
+        """
+        Calculate the Jacobian matrix for a given parameter vector.
+
+        If the ``compress`` tolerance was given, returns a
+        :class:`~fatiando.inversion.hmatrix.HMatrix`. If ``theta`` was given,
+        returns a :class:`~fatiando.gravmag.treecode.TreeMatrix`.
+        """
+        if self.theta is not None:
+            return self._tree_matrix()
+        if self.compress is None:
+            return self._jacobian_block(numpy.arange(self.ndata),
+                                        numpy.arange(self.nparams))
+        grid = self.grid
+        return HMatrix(self._jacobian_block,
+                       numpy.transpose([self.x, self.y, self.z]),
+                       numpy.transpose([grid.x, grid.y, grid.z]),
+                       tol=self.compress)
+
+    def jacobian_rows(self, p, rows):
+        """
+        Calculate the rows of the Jacobian matrix in a slice.
+
+        Used by :meth:`~fatiando.inversion.misfit.Misfit.store_jacobian` to
+        fill the file on disk one block of rows at a time.
+        """
+        return self._jacobian_block(rows, numpy.arange(self.nparams))
 
     def predicted(self, p):
         """
@@ -90,25 +128,45 @@ class EQLGravity(EQLBase):
         Which gravitational field is the data. Options are: ``'gz'`` (gravity
         anomaly), ``'gxx'``, ``'gxy'``, ..., ``'gzz'`` (gravity gradient
         tensor). Defaults to ``'gz'``.
+    * compress : float or None
+        If not None, the sensitivity matrix is compressed into low-rank blocks
+        for the sources that are far from the data (a
+        :class:`~fatiando.inversion.hmatrix.HMatrix`) with this relative
+        accuracy. Use the ``'cgls'`` optimization method with it (e.g.,
+        ``eql.config('cgls').fit()``).
+    * theta : float or None
+        If not None, the products with the sensitivity matrix are calculated
+        with the tree code (a :class:`~fatiando.gravmag.treecode.TreeMatrix`)
+        with this accuracy parameter. The matrix is never formed. Use the
+        ``'cgls'`` optimization method with it. Can't be used with
+        *compress*.
 
     """
 
-    def __init__(self, x, y, z, data, grid, field='gz'):
-        super().__init__(x, y, z, data, grid)
+    def __init__(self, x, y, z, data, grid, field='gz', compress=None,
+                 theta=None):
+        super().__init__(x, y, z, data, grid, compress, theta)
         self.field = field
 
-    def jacobian(self, p):
+    def _tree_matrix(self):
         """
-        Calculate the Jacobian matrix for a given parameter vector.
+        Make the Jacobian matrix that uses the tree code.
         """
-        x = self.x
-        y = self.y
-        z = self.z
-        func = getattr(kernel, self.field)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=numpy.float)
-        for i, c in enumerate(self.grid):
-            jac[:, i] = func(x, y, z, [c], dens=1.)
-        return jac
+        grid = self.grid
+        return TreeMatrix(self.field,
+                          numpy.transpose([self.x, self.y, self.z]),
+                          numpy.transpose([grid.x, grid.y, grid.z]),
+                          volume=4*numpy.pi*grid.radius**3/3,
+                          theta=self.theta)
+
+    def _jacobian_block(self, rows, cols):
+        """
+        Calculate the rows and columns of the Jacobian matrix given.
+        """
+        x = self.x[rows]
+        y = self.y[rows]
+        z = self.z[rows]
+        return _gravity_kernels(self.field, x, y, z, self.grid, cols)
 
 
 class EQLTotalField(EQLBase):
@@ -133,28 +191,48 @@ class EQLTotalField(EQLBase):
         there is remanent magnetization and the total magnetization of the
         layer if different from the induced magnetization.
         If there is only induced magnetization, use None
+    * compress : float or None
+        If not None, the sensitivity matrix is compressed into low-rank blocks
+        for the sources that are far from the data (a
+        :class:`~fatiando.inversion.hmatrix.HMatrix`) with this relative
+        accuracy. Use the ``'cgls'`` optimization method with it (e.g.,
+        ``eql.config('cgls').fit()``).
+    * theta : float or None
+        If not None, the products with the sensitivity matrix are calculated
+        with the tree code (a :class:`~fatiando.gravmag.treecode.TreeMatrix`)
+        with this accuracy parameter. The matrix is never formed. Use the
+        ``'cgls'`` optimization method with it. Can't be used with
+        *compress*.
 
     """
 
-    def __init__(self, x, y, z, data, inc, dec, grid, sinc=None, sdec=None):
-        super().__init__(x, y, z, data, grid)
+    def __init__(self, x, y, z, data, inc, dec, grid, sinc=None, sdec=None,
+                 compress=None, theta=None):
+        super().__init__(x, y, z, data, grid, compress, theta)
         self.inc, self.dec = inc, dec
         self.sinc = sinc if sinc is not None else inc
         self.sdec = sdec if sdec is not None else dec
 
-    def jacobian(self, p):
+    def _tree_matrix(self):
         """
-        Calculate the Jacobian matrix for a given parameter vector.
+        Make the Jacobian matrix that uses the tree code.
+        """
+        grid = self.grid
+        return TreeMatrix('tf', numpy.transpose([self.x, self.y, self.z]),
+                          numpy.transpose([grid.x, grid.y, grid.z]),
+                          volume=4*numpy.pi*grid.radius**3/3, inc=self.inc,
+                          dec=self.dec, sinc=self.sinc, sdec=self.sdec,
+                          theta=self.theta)
+
+    def _jacobian_block(self, rows, cols):
+        """
+        Calculate the rows and columns of the Jacobian matrix given.
         """
-        x = self.x
-        y = self.y
-        z = self.z
-        inc, dec = self.inc, self.dec
+        x = self.x[rows]
+        y = self.y[rows]
+        z = self.z[rows]
         mag = dircos(self.sinc, self.sdec)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        for i, c in enumerate(self.grid):
-            jac[:, i] = kernel.tf(x, y, z, [c], inc, dec, pmag=mag)
-        return jac
+        return _tf_kernels(x, y, z, self.grid, self.inc, self.dec, mag, cols)
 
 
 class PELBase(EQLBase):
@@ -214,6 +292,55 @@ class PELBase(EQLBase):
         return estimate.ravel()
 
 
+def _grid_arrays(grid, cols):
+    """
+    The coordinates and volumes of the sources in the layer (only the ones in
+    *cols* if it's not None).
+
+    Slices the arrays of a PointGrid instead of creating a Sphere for each
+    point. The layer can also be a list of spheres.
+    """
+    if cols is None:
+        cols = slice(None)
+    if isinstance(grid, PointGrid):
+        x, y, z = grid.x[cols], grid.y[cols], grid.z[cols]
+        volume = numpy.full(x.size, 4*numpy.pi*grid.radius**3/3)
+        return x, y, z, volume
+    x, y, z, volume = kernel._kernel_arrays(grid)
+    return x[cols], y[cols], z[cols], volume[cols]
+
+
+def _gravity_kernels(field, x, y, z, grid, cols=None):
+    """
+    The sensitivity of a gravitational field to the densities of the sources
+    in the layer (or only the ones in *cols*) as a (len(x), number of
+    sources) matrix.
+    """
+    if field == 'gz':
+        return G*SI2MGAL*kernel._kernel_gradient(
+            x, y, z, *_grid_arrays(grid, cols))[2]
+    if field not in ['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']:
+        raise ValueError("Invalid field '{}'".format(field))
+    return G*SI2EOTVOS*kernel._kernel_tensor(
+        x, y, z, *_grid_arrays(grid, cols), components=[field[1:]])[0]
+
+
+def _tf_kernels(x, y, z, grid, inc, dec, mag, cols=None):
+    """
+    The sensitivity of the total field anomaly to the magnetization
+    intensities of the sources in the layer (or only the ones in *cols*) as
+    a (len(x), number of sources) matrix. *mag* is the unit vector of the
+    magnetization.
+    """
+    fx, fy, fz = dircos(inc, dec)
+    mx, my, mz = mag
+    # The tensor is symmetric so the off-diagonal terms appear twice
+    weights = [fx*mx, fx*my + fy*mx, fx*mz + fz*mx, fy*my, fy*mz + fz*my,
+               fz*mz]
+    kernels = kernel._kernel_tensor(x, y, z, *_grid_arrays(grid, cols))
+    return CM*T2NT*numpy.tensordot(weights, kernels, axes=1)
+
+
 def _bkmatrix(grid, degree):
     """
     Make the Bk polynomial coefficient matrix for a given PointGrid.
@@ -325,18 +452,21 @@ class PELGravity(PELBase):
         """
         Calculate the Jacobian matrix for a given parameter vector.
         """
-        x = self.x
-        y = self.y
-        z = self.z
-        func = getattr(kernel, self.field)
+        return self.jacobian_rows(p, slice(None))
+
+    def jacobian_rows(self, p, rows):
+        """
+        Calculate the rows of the Jacobian matrix in a slice.
+        """
+        x = self.x[rows]
+        y = self.y[rows]
+        z = self.z[rows]
         grids = self.grid.split(self.windows)
         pergrid = ncoeffs(self.degree)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        gk = numpy.empty((self.ndata, grids[0].size), dtype=float)
+        jac = numpy.empty((x.size, self.nparams), dtype=float)
         for i, grid in enumerate(grids):
             bk = _bkmatrix(grid, self.degree)
-            for k, c in enumerate(grid):
-                gk[:, k] = func(x, y, z, [c], dens=1.)
+            gk = _gravity_kernels(self.field, x, y, z, grid)
             jac[:, i*pergrid:(i + 1)*pergrid] = safe_dot(gk, bk)
         return jac
 
@@ -382,19 +512,22 @@ class PELTotalField(PELBase):
         """
         Calculate the Jacobian matrix for a given parameter vector.
         """
-        x = self.x
-        y = self.y
-        z = self.z
-        inc, dec = self.inc, self.dec
+        return self.jacobian_rows(p, slice(None))
+
+    def jacobian_rows(self, p, rows):
+        """
+        Calculate the rows of the Jacobian matrix in a slice.
+        """
+        x = self.x[rows]
+        y = self.y[rows]
+        z = self.z[rows]
         mag = dircos(self.sinc, self.sdec)
         grids = self.grid.split(self.windows)
         pergrid = ncoeffs(self.degree)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        gk = numpy.empty((self.ndata, grids[0].size), dtype=float)
+        jac = numpy.empty((x.size, self.nparams), dtype=float)
         for i, grid in enumerate(grids):
             bk = _bkmatrix(grid, self.degree)
-            for k, c in enumerate(grid):
-                gk[:, k] = kernel.tf(x, y, z, [c], inc, dec, pmag=mag)
+            gk = _tf_kernels(x, y, z, grid, self.inc, self.dec, mag)
             jac[:, i*pergrid:(i + 1)*pergrid] = safe_dot(gk, bk)
         return jac
 
@@ -75,7 +75,7 @@ import numpy
 from fatiando.gravmag import prism as prism_engine
 from fatiando.gravmag import tesseroid as tesseroid_engine
 from fatiando import utils
-from fatiando.mesher import Prism, Tesseroid
+from fatiando.mesher import Prism, Tesseroid, OctreePrismMesh
 
 
 def loadseeds(fname):
@@ -168,7 +168,8 @@ def sow(locations, mesh):
             ]
 
     * mesh : :class:`fatiando.mesher.PrismMesh`
-        The mesh that will be used in the inversion.
+        The mesh that will be used in the inversion. Can also be a
+        :class:`fatiando.mesher.OctreePrismMesh`.
 
     Returns:
 
@@ -197,6 +198,11 @@ def _find_index(point, mesh):
     """
     Find the index of the cell that has point inside it.
     """
+    if isinstance(mesh, OctreePrismMesh):
+        seed = mesh.find(point)
+        if seed is not None and mesh[seed] is not None:
+            return seed
+        return None
     x1, x2, y1, y2, z1, z2 = mesh.bounds
     nz, ny, nx = mesh.shape
     xs = mesh.get_xs()
@@ -241,7 +247,9 @@ def harvest(data, seeds, mesh, compactness, threshold, report=False,
 
     * mesh : :class:`fatiando.mesher.PrismMesh`
         The mesh used in the inversion. Will estimate the physical property
-        distribution on this mesh
+        distribution on this mesh. Can also be a
+        :class:`fatiando.mesher.OctreePrismMesh` to use small cells only where
+        they are needed.
 
     * compactness : float
         The compactness regularing parameter (i.e., how much should the
@@ -359,7 +367,10 @@ def iharvest(data, seeds, mesh, compactness, threshold, restrict):
     totalgoal = _shapefunc(data, predicted)
     totalmisfit = _misfitfunc(data, predicted)
     regularizer = 0.
-    # Weight the regularizing function by the mean extent of the mesh
+    # Weight the regularizing function by the mean extent of the mesh. For an
+    # OctreePrismMesh this is the unrefined shape on purpose: _distance
+    # measures distances in units of the unrefined cells, so refining the
+    # mesh doesn't change the weight given to the regularizing function.
     mu = compactness*1/(sum(mesh.shape)/3)
     yield [estimate, predicted, None, neighbors, totalgoal, totalmisfit,
            regularizer]
@@ -505,7 +516,14 @@ def _distance(n, m, mesh):
 def _index2ijk(index, mesh):
     """
     Transform the index of a cell in mesh to a 3-dimensional (i,j,k) index.
+
+    For an :class:`~fatiando.mesher.OctreePrismMesh`, returns the position of
+    the center of the cell in units of the unrefined cells.
     """
+    if isinstance(mesh, OctreePrismMesh):
+        i, j, k, level = mesh.ijk(index)
+        size = 0.5**level
+        return (i + 0.5)*size, (j + 0.5)*size, (k + 0.5)*size
     nz, ny, nx = mesh.shape
     k = index//(nx*ny)
     j = (index - k*(nx*ny))//nx
@@ -539,6 +557,11 @@ def _is_neighbor(index, props, neighborhood):
 
 def _neighbor_indexes(n, mesh, restrict):
     """Find the indexes of the neighbors of n"""
+    if isinstance(mesh, OctreePrismMesh):
+        neighbors = mesh.neighbors(n)
+        directions = ['above', 'below', 'north', 'south', 'east', 'west']
+        return [i for d in directions if d not in restrict
+                for i in neighbors[d] if mesh[i] is not None]
     nz, ny, nx = mesh.shape
     indexes = []
     if 'above' not in restrict:
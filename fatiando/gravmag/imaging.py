@@ -113,9 +113,8 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     weights = numpy.abs(depths) ** power / (2 * G * numpy.sqrt(numpy.pi))
     density = []
     for l in range(nlayers):
-        sensibility_T = numpy.array(
-            [pot_prism.gz(x, y, z, [p], dens=1) for p in mesh.get_layer(l)])
-        density.extend(scale * weights[l] * numpy.dot(sensibility_T, gz))
+        sensibility = pot_prism.sensitivity('gz', x, y, z, mesh.get_layer(l))
+        density.extend(scale * weights[l] * numpy.dot(sensibility.T, gz))
     mesh.addprop('density', numpy.array(density))
     return mesh
 
@@ -146,29 +146,16 @@ class DipoleMagDir(Misfit):
         return safe_dot(self.jacobian(p), p)
 
     def jacobian(self, p):
-        x = self.x
-        y = self.y
-        z = self.z
         dipoles = [mesher.Sphere(xp, yp, zp, 1.) for xp, yp, zp in
                    self.points]
+        # All second derivatives of all dipoles calculated in a single pass
+        gxx, gxy, gxz, gyy, gyz, gzz = sphere.kernel_tensor(
+            self.x, self.y, self.z, dipoles)*self.cte*G*SI2EOTVOS
+        fx, fy, fz = self.F_versor
         jac = np.empty((self.ndata, self.nparams), dtype=np.float)
-        for i, dipole in enumerate(dipoles):
-            k = 3*i
-            derivative_gxx = sphere.gxx(x, y, z, [dipole], dens=self.cte)
-            derivative_gxy = sphere.gxy(x, y, z, [dipole], dens=self.cte)
-            derivative_gxz = sphere.gxz(x, y, z, [dipole], dens=self.cte)
-            derivative_gyy = sphere.gyy(x, y, z, [dipole], dens=self.cte)
-            derivative_gyz = sphere.gyz(x, y, z, [dipole], dens=self.cte)
-            derivative_gzz = sphere.gzz(x, y, z, [dipole], dens=self.cte)
-            jac[:, k] = T2NT * ((self.F_versor[0] * derivative_gxx) +
-                                (self.F_versor[1] * derivative_gxy) +
-                                (self.F_versor[2] * derivative_gxz))
-            jac[:, k + 1] = T2NT * ((self.F_versor[0] * derivative_gxy) +
-                                    (self.F_versor[1] * derivative_gyy) +
-                                    (self.F_versor[2] * derivative_gyz))
-            jac[:, k + 2] = T2NT * ((self.F_versor[0] * derivative_gxz) +
-                                    (self.F_versor[1] * derivative_gyz) +
-                                    (self.F_versor[2] * derivative_gzz))
+        jac[:, 0::3] = T2NT*(fx*gxx + fy*gxy + fz*gxz)
+        jac[:, 1::3] = T2NT*(fx*gxy + fy*gyy + fz*gyz)
+        jac[:, 2::3] = T2NT*(fx*gxz + fy*gyz + fz*gzz)
         return jac
 
     def fmt_estimate(self, p):
@@ -1,14 +1,27 @@
 """
 The potential fields of a homogeneous 3D prism with polygonal cross-section.
+
+The loops over prisms, edges and computation points run in compiled code
+(using the formulas of Plouff, 1976). All functions take a ``threads``
+argument that splits the computation points among OpenMP threads (use
+``threads=None`` to use all CPU cores).
+
+The magnetic fields and :func:`~fatiando.gravmag.polyprism.tensor` compute
+all second derivatives of the kernel in a single pass over the edges of the
+prisms, which costs about the same as a single component.
 """
 from __future__ import division, absolute_import
-from future.builtins import range
 
 import numpy as np
 
 from .. import utils
 from ..constants import SI2MGAL, SI2EOTVOS, G, CM, T2NT
 from .._our_duecredit import due, Doi
+from .prism import _threads
+try:
+    from . import _polyprism
+except ImportError:
+    _polyprism = None
 
 
 due.cite(Doi("10.1190/1.1440645"),
@@ -16,7 +29,7 @@ due.cite(Doi("10.1190/1.1440645"),
          path='fatiando.gravmag.polyprism')
 
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, threads=1):
     r"""
     The total-field magnetic anomaly of polygonal prisms.
 
@@ -41,6 +54,9 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
         A magnetization vector. If not None, will use this value instead of the
         ``'magnetization'`` property of the prisms. Use this, e.g., for
         sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -54,36 +70,12 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    # Calculate the 3 components of the unit vector in the direction of the
     # regional field
     fx, fy, fz = utils.dircos(inc, dec)
-    res = 0
-    for prism in prisms:
-        if prism is None:
-            continue
-        if 'magnetization' not in prism.props and pmag is None:
-            continue
-        if pmag is None:
-            mx, my, mz = prism.props['magnetization']
-        else:
-            mx, my, mz = pmag
-        v1 = kernelxx(xp, yp, zp, prism)
-        v2 = kernelxy(xp, yp, zp, prism)
-        v3 = kernelxz(xp, yp, zp, prism)
-        v4 = kernelyy(xp, yp, zp, prism)
-        v5 = kernelyz(xp, yp, zp, prism)
-        v6 = kernelzz(xp, yp, zp, prism)
-        bx = v1*mx + v2*my + v3*mz
-        by = v2*mx + v4*my + v5*mz
-        bz = v3*mx + v5*my + v6*mz
-        res += fx*bx + fy*by + fz*bz
-    res *= CM * T2NT
-    return res
-
-
-def bx(xp, yp, zp, prisms):
+    return _magnetic(xp, yp, zp, prisms, fx, fy, fz, pmag, threads)
+
+
+def bx(xp, yp, zp, prisms, threads=1):
     """
     x component of magnetic induction of a polygonal prism.
 
@@ -97,6 +89,9 @@ def bx(xp, yp, zp, prisms):
         The model used to calculate the total field anomaly.
         Prisms without the physical property ``'magnetization'`` will
         be ignored. The ``'magnetization'`` must be a vector.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -110,23 +105,10 @@ def bx(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or ('magnetization' not in prism.props):
-            continue
-        # Get the magnetization vector components
-        mx, my, mz = prism.props['magnetization']
-        v1 = kernelxx(xp, yp, zp, prism)
-        v2 = kernelxy(xp, yp, zp, prism)
-        v3 = kernelxz(xp, yp, zp, prism)
-        res += v1*mx + v2*my + v3*mz
-    res *= CM * T2NT
-    return res
-
-
-def by(xp, yp, zp, prisms):
+    return _magnetic(xp, yp, zp, prisms, 1, 0, 0, None, threads)
+
+
+def by(xp, yp, zp, prisms, threads=1):
     """
     y component of magnetic induction of a polygonal prism.
 
@@ -140,6 +122,9 @@ def by(xp, yp, zp, prisms):
         The model used to calculate the total field anomaly.
         Prisms without the physical property ``'magnetization'`` will
         be ignored. The ``'magnetization'`` must be a vector.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -153,23 +138,10 @@ def by(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or ('magnetization' not in prism.props):
-            continue
-        # Get the magnetization vector components
-        mx, my, mz = prism.props['magnetization']
-        v2 = kernelxy(xp, yp, zp, prism)
-        v4 = kernelyy(xp, yp, zp, prism)
-        v5 = kernelyz(xp, yp, zp, prism)
-        res += v2*mx + v4*my + v5*mz
-    res *= CM * T2NT
-    return res
-
-
-def bz(xp, yp, zp, prisms):
+    return _magnetic(xp, yp, zp, prisms, 0, 1, 0, None, threads)
+
+
+def bz(xp, yp, zp, prisms, threads=1):
     """
     z component of magnetic induction of a polygonal prism.
 
@@ -183,6 +155,9 @@ def bz(xp, yp, zp, prisms):
         The model used to calculate the total field anomaly.
         Prisms without the physical property ``'magnetization'`` will
         be ignored. The ``'magnetization'`` must be a vector.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -196,23 +171,10 @@ def bz(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or ('magnetization' not in prism.props):
-            continue
-        # Get the magnetization vector components
-        mx, my, mz = prism.props['magnetization']
-        v3 = kernelxz(xp, yp, zp, prism)
-        v5 = kernelyz(xp, yp, zp, prism)
-        v6 = kernelzz(xp, yp, zp, prism)
-        res += v3*mx + v5*my + v6*mz
-    res *= CM * T2NT
-    return res
-
-
-def gz(xp, yp, zp, prisms):
+    return _magnetic(xp, yp, zp, prisms, 0, 0, 1, None, threads)
+
+
+def gz(xp, yp, zp, prisms, threads=1):
     r"""
     z component of gravitational acceleration of a polygonal prism.
 
@@ -229,6 +191,9 @@ def gz(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -242,73 +207,10 @@ def gz(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        x, y = prism.x, prism.y
-        z1, z2 = prism.z1, prism.z2
-        density = prism.props['density']
-        nverts = prism.nverts
-        # Calculate the effect of the prism
-        Z1 = z1 - zp
-        Z2 = z2 - zp
-        Z1_sqr = Z1**2
-        Z2_sqr = Z2**2
-        kernel = 0
-        for k in range(nverts):
-            Xk1 = x[k] - xp
-            Yk1 = y[k] - yp
-            Xk2 = x[(k + 1) % nverts] - xp
-            Yk2 = y[(k + 1) % nverts] - yp
-            p = Xk1*Yk2 - Xk2*Yk1
-            p_sqr = p**2
-            Qk1 = (Yk2 - Yk1)*Yk1 + (Xk2 - Xk1)*Xk1
-            Qk2 = (Yk2 - Yk1)*Yk2 + (Xk2 - Xk1)*Xk2
-            Ak1 = Xk1**2 + Yk1**2
-            Ak2 = Xk2**2 + Yk2**2
-            R1k1 = np.sqrt(Ak1 + Z1_sqr)
-            R1k2 = np.sqrt(Ak2 + Z1_sqr)
-            R2k1 = np.sqrt(Ak1 + Z2_sqr)
-            R2k2 = np.sqrt(Ak2 + Z2_sqr)
-            Ak1 = np.sqrt(Ak1)
-            Ak2 = np.sqrt(Ak2)
-            Bk1 = np.sqrt(Qk1**2 + p_sqr)
-            Bk2 = np.sqrt(Qk2**2 + p_sqr)
-            E1k1 = R1k1*Bk1
-            E1k2 = R1k2*Bk2
-            E2k1 = R2k1*Bk1
-            E2k2 = R2k2*Bk2
-            # Simplifying these arctans with, e.g., (Z2 - Z1)*arctan2(Qk2*p -
-            # Qk1*p, p*p + Qk2*Qk1) doesn't work because of the restrictions
-            # regarding the angles for that identity. The regression tests
-            # fail for some points by a large amount.
-            kernel += (Z2 - Z1)*(np.arctan2(Qk2, p) - np.arctan2(Qk1, p))
-            kernel += Z2*(np.arctan2(Z2*Qk1, R2k1*p) -
-                          np.arctan2(Z2*Qk2, R2k2*p))
-            kernel += Z1*(np.arctan2(Z1*Qk2, R1k2*p) -
-                          np.arctan2(Z1*Qk1, R1k1*p))
-            Ck1 = Qk1*Ak1
-            Ck2 = Qk2*Ak2
-            # dummy helps prevent zero division and log(0) errors (that's why I
-            # need to add it twice)
-            # Simplifying these two logs with a single one is not worth it
-            # because it would introduce two pow operations.
-            kernel += 0.5*p*Ak1/(Bk1 + dummy)*np.log(
-                (E1k1 - Ck1)*(E2k1 + Ck1)/((E1k1 + Ck1)*(E2k1 - Ck1) + dummy) +
-                dummy)
-            kernel += 0.5*p*(Ak2/(Bk2 + dummy))*np.log(
-                (E2k2 - Ck2)*(E1k2 + Ck2)/((E2k2 + Ck2)*(E1k2 - Ck2) + dummy) +
-                dummy)
-        res += kernel*density
-    res *= G*SI2MGAL
-    return res
-
-
-def gxx(xp, yp, zp, prisms):
+    return _gravity('gz', xp, yp, zp, prisms, threads)
+
+
+def gxx(xp, yp, zp, prisms, threads=1):
     r"""
     xx component of the gravity gradient tensor of a polygonal prism.
 
@@ -325,6 +227,9 @@ def gxx(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -338,19 +243,10 @@ def gxx(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelxx(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gxx', xp, yp, zp, prisms, threads)
 
 
-def gxy(xp, yp, zp, prisms):
+def gxy(xp, yp, zp, prisms, threads=1):
     r"""
     xy component of the gravity gradient tensor of a polygonal prism.
 
@@ -367,6 +263,9 @@ def gxy(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -380,19 +279,10 @@ def gxy(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelxy(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gxy', xp, yp, zp, prisms, threads)
 
 
-def gxz(xp, yp, zp, prisms):
+def gxz(xp, yp, zp, prisms, threads=1):
     r"""
     xz component of the gravity gradient tensor of a polygonal prism.
 
@@ -409,6 +299,9 @@ def gxz(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -422,19 +315,10 @@ def gxz(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelxz(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gxz', xp, yp, zp, prisms, threads)
 
 
-def gyy(xp, yp, zp, prisms):
+def gyy(xp, yp, zp, prisms, threads=1):
     r"""
     yy component of the gravity gradient tensor of a polygonal prism.
 
@@ -451,6 +335,9 @@ def gyy(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -464,19 +351,10 @@ def gyy(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelyy(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gyy', xp, yp, zp, prisms, threads)
 
 
-def gyz(xp, yp, zp, prisms):
+def gyz(xp, yp, zp, prisms, threads=1):
     r"""
     yz component of the gravity gradient tensor of a polygonal prism.
 
@@ -493,6 +371,9 @@ def gyz(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -506,19 +387,10 @@ def gyz(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelyz(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gyz', xp, yp, zp, prisms, threads)
 
 
-def gzz(xp, yp, zp, prisms):
+def gzz(xp, yp, zp, prisms, threads=1):
     r"""
     zz component of the gravity gradient tensor of a polygonal prism.
 
@@ -535,6 +407,9 @@ def gzz(xp, yp, zp, prisms):
         The model used to calculate the field.
         Prisms must have the physical property ``'density'`` will be
         ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -548,19 +423,64 @@ def gzz(xp, yp, zp, prisms):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = 0
-    for prism in prisms:
-        if prism is None or 'density' not in prism.props:
-            continue
-        density = prism.props['density']
-        res += kernelzz(xp, yp, zp, prism)*density
-    res *= G * SI2EOTVOS
-    return res
+    return _gravity('gzz', xp, yp, zp, prisms, threads)
+
+
+def tensor(xp, yp, zp, prisms, threads=1):
+    """
+    Calculates the 6 components of the gravity gradient tensor at once.
+
+    Faster than calling :func:`~fatiando.gravmag.polyprism.gxx`, etc,
+    separately because the terms that are common to the 6 components are
+    computed only once for each edge of the prisms. The results are the same
+    as the individual functions (up to round-off).
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms without the physical property ``'density'`` will be
+        ignored.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+
+    Returns:
 
+    * gxx, gxy, gxz, gyy, gyz, gzz : arrays
+        The components calculated on xp, yp, zp
 
-def kernelxx(xp, yp, zp, prism):
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import PolygonalPrism
+        >>> model = [PolygonalPrism([[0, 0], [100, 0], [0, 200]], 10, 100,
+        ...                         {'density': 1000})]
+        >>> xp, yp, zp = np.array([10., 50.]), np.zeros(2), np.zeros(2)
+        >>> components = tensor(xp, yp, zp, model)
+        >>> len(components)
+        6
+        >>> np.allclose(components[1], gxy(xp, yp, zp, model))
+        True
+
+    """
+    xp, yp, zp = _coordinates(xp, yp, zp)
+    vertices, offsets, z, density = _model_arrays(prisms, 'density')
+    res = np.zeros((6, xp.size), dtype=np.float)
+    _polyprism.tensor(xp.ravel(), yp.ravel(), zp.ravel(), vertices, offsets,
+                      z, density, _threads(threads), res)
+    res *= G*SI2EOTVOS
+    return [r.reshape(xp.shape) for r in res]
+
+
+def kernelxx(xp, yp, zp, prism, threads=1):
     r"""
     The xx second-derivative of the kernel function :math:`\phi`.
 
@@ -590,6 +510,9 @@ def kernelxx(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -603,50 +526,10 @@ def kernelxx(xp, yp, zp, prism):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1 + dummy
-        deltay = Y2 - Y1 + dummy
-        n = deltax/deltay
-        g = X1 - Y1*n
-        dist = np.sqrt(deltax*deltax + deltay*deltay)
-        cross = X1*Y2 - X2*Y1
-        p = cross/dist + dummy
-        d1 = (deltax*X1 + deltay*Y1)/dist + dummy
-        d2 = (deltax*X2 + deltay*Y2)/dist + dummy
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        atan_diff_d2 = np.arctan2(Z2*d2, p*R22) - np.arctan2(Z1*d2, p*R21)
-        atan_diff_d1 = np.arctan2(Z2*d1, p*R12) - np.arctan2(Z1*d1, p*R11)
-        tmp = g*Y2*atan_diff_d2/(p*d2) + n*p*atan_diff_d2/(d2)
-        tmp -= g*Y1*atan_diff_d1/(p*d1) + n*p*atan_diff_d1/(d1)
-        tmp += n*np.log(
-            (Z2 + R12)*(Z1 + R21)/((Z1 + R11)*(Z2 + R22) + dummy) + dummy)
-        tmp *= -1/(1 + n*n)
-        kernel += tmp
-    return kernel
-
-
-def kernelxy(xp, yp, zp, prism):
+    return _kernel('gxx', xp, yp, zp, prism, threads)
+
+
+def kernelxy(xp, yp, zp, prism, threads=1):
     r"""
     The xy second-derivative of the kernel function :math:`\phi`.
 
@@ -676,6 +559,9 @@ def kernelxy(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -689,51 +575,10 @@ def kernelxy(xp, yp, zp, prism):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1 + dummy
-        deltay = Y2 - Y1 + dummy
-        n = deltax/deltay
-        g = X1 - Y1*n
-        g_sqr = g*g
-        dist = np.sqrt(deltax*deltax + deltay*deltay)
-        cross = X1*Y2 - X2*Y1
-        p = cross/dist + dummy
-        d1 = (deltax*X1 + deltay*Y1)/dist + dummy
-        d2 = (deltax*X2 + deltay*Y2)/dist + dummy
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        atan_diff_d2 = np.arctan2(Z2*d2, p*R22) - np.arctan2(Z1*d2, p*R21)
-        atan_diff_d1 = np.arctan2(Z2*d1, p*R12) - np.arctan2(Z1*d1, p*R11)
-        tmp = (g_sqr + g*n*Y2)*atan_diff_d2/(p*d2) - p*atan_diff_d2/d2
-        tmp -= (g_sqr + g*n*Y1)*atan_diff_d1/(p*d1) - p*atan_diff_d1/d1
-        tmp += np.log(
-            (Z2 + R22)*(Z1 + R11)/((Z1 + R21)*(Z2 + R12) + dummy) + dummy)
-        tmp *= 1/(1 + n*n)
-        kernel += tmp
-    return kernel
-
-
-def kernelxz(xp, yp, zp, prism):
+    return _kernel('gxy', xp, yp, zp, prism, threads)
+
+
+def kernelxz(xp, yp, zp, prism, threads=1):
     r"""
     The xz second-derivative of the kernel function :math:`\phi`.
 
@@ -763,6 +608,9 @@ def kernelxz(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -776,54 +624,10 @@ def kernelxz(xp, yp, zp, prism):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1 + dummy
-        deltay = Y2 - Y1 + dummy
-        n = deltax/deltay
-        n_sqr_p1 = n*n + 1
-        g = X1 - Y1*n
-        ng = n*g
-        dist = np.sqrt(deltax*deltax + deltay*deltay)
-        d1 = (deltax*X1 + deltay*Y1)/dist + dummy
-        d2 = (deltax*X2 + deltay*Y2)/dist + dummy
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        # Collapsing these logs decreases the precision too much leading to a
-        # larger difference with the prism code.
-        log_r22 = np.log((R22 - d2)/(R22 + d2) + dummy)
-        log_r21 = np.log((R21 - d2)/(R21 + d2) + dummy)
-        log_r12 = np.log((R12 - d1)/(R12 + d1) + dummy)
-        log_r11 = np.log((R11 - d1)/(R11 + d1) + dummy)
-        log_diff_d1 = (0.5/d1)*(log_r12 - log_r11)
-        log_diff_d2 = (0.5/d2)*(log_r22 - log_r21)
-        tmp = (Y2*n_sqr_p1 + ng)*log_diff_d2
-        tmp -= (Y1*n_sqr_p1 + ng)*log_diff_d1
-        tmp *= -1/n_sqr_p1
-        kernel += tmp
-    return kernel
-
-
-def kernelyy(xp, yp, zp, prism):
+    return _kernel('gxz', xp, yp, zp, prism, threads)
+
+
+def kernelyy(xp, yp, zp, prism, threads=1):
     r"""
     The yy second-derivative of the kernel function :math:`\phi`.
 
@@ -853,6 +657,9 @@ def kernelyy(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -866,50 +673,10 @@ def kernelyy(xp, yp, zp, prism):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1 + dummy
-        deltay = Y2 - Y1 + dummy
-        m = deltay/deltax
-        c = Y1 - X1*m
-        dist = np.sqrt(deltax*deltax + deltay*deltay)
-        cross = X1*Y2 - X2*Y1
-        p = cross/dist + dummy
-        d1 = (deltax*X1 + deltay*Y1)/dist + dummy
-        d2 = (deltax*X2 + deltay*Y2)/dist + dummy
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        atan_diff_d2 = np.arctan2(Z2*d2, p*R22) - np.arctan2(Z1*d2, p*R21)
-        atan_diff_d1 = np.arctan2(Z2*d1, p*R12) - np.arctan2(Z1*d1, p*R11)
-        tmp = c*X2*atan_diff_d2/(p*d2) + m*p*atan_diff_d2/d2
-        tmp -= c*X1*atan_diff_d1/(p*d1) + m*p*atan_diff_d1/d1
-        tmp += m*np.log(
-            (Z2 + R12)*(Z1 + R21)/((Z2 + R22)*(Z1 + R11)) + dummy)
-        tmp *= 1/(1 + m*m)
-        kernel += tmp
-    return kernel
-
-
-def kernelyz(xp, yp, zp, prism):
+    return _kernel('gyy', xp, yp, zp, prism, threads)
+
+
+def kernelyz(xp, yp, zp, prism, threads=1):
     r"""
     The yz second-derivative of the kernel function :math:`\phi`.
 
@@ -939,6 +706,9 @@ def kernelyz(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -952,51 +722,10 @@ def kernelyz(xp, yp, zp, prism):
     doi:10.1190/1.1440645.
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1 + dummy
-        deltay = Y2 - Y1 + dummy
-        m = deltay/deltax
-        m_sqr_p1 = m*m + 1
-        c = Y1 - X1*m
-        cm = c*m
-        dist = np.sqrt(deltax*deltax + deltay*deltay)
-        d1 = (deltax*X1 + deltay*Y1)/dist + dummy
-        d2 = (deltax*X2 + deltay*Y2)/dist + dummy
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        # Same remark about collapsing logs as kernelxz
-        log_r11 = np.log((R11 - d1)/(R11 + d1) + dummy)
-        log_r12 = np.log((R12 - d1)/(R12 + d1) + dummy)
-        log_r21 = np.log((R21 - d2)/(R21 + d2) + dummy)
-        log_r22 = np.log((R22 - d2)/(R22 + d2) + dummy)
-        tmp = (X2*m_sqr_p1 + cm)*(0.5/d2)*(log_r22 - log_r21)
-        tmp -= (X1*m_sqr_p1 + cm)*(0.5/d1)*(log_r12 - log_r11)
-        tmp *= 1/m_sqr_p1
-        kernel += tmp
-    return kernel
-
-
-def kernelzz(xp, yp, zp, prism):
+    return _kernel('gyz', xp, yp, zp, prism, threads)
+
+
+def kernelzz(xp, yp, zp, prism, threads=1):
     r"""
     The zz second-derivative of the kernel function :math:`\phi`.
 
@@ -1026,6 +755,9 @@ def kernelzz(xp, yp, zp, prism):
     * prisms : object of :class:`fatiando.mesher.PolygonalPrism`
         The model used as the integration domain :math:`\Omega` of the kernel
         function.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -1038,39 +770,92 @@ def kernelzz(xp, yp, zp, prism):
     applications to magnetic terrain corrections, Geophysics, 41(4), 727-741,
     doi:10.1190/1.1440645.
 
+    """
+    return _kernel('gzz', xp, yp, zp, prism, threads)
+
+
+def _gravity(field, xp, yp, zp, prisms, threads):
+    """
+    Calculate a gravity field of the prisms that have a ``'density'``.
+    """
+    xp, yp, zp = _coordinates(xp, yp, zp)
+    vertices, offsets, z, density = _model_arrays(prisms, 'density')
+    res = np.zeros(xp.size, dtype=np.float)
+    _polyprism.gravity_field(field, xp.ravel(), yp.ravel(), zp.ravel(),
+                             vertices, offsets, z, density, _threads(threads),
+                             res)
+    if field == 'gz':
+        res *= G*SI2MGAL
+    else:
+        res *= G*SI2EOTVOS
+    return res.reshape(xp.shape)
+
+
+def _kernel(field, xp, yp, zp, prism, threads):
+    """
+    Calculate a second derivative kernel of a single prism (without any
+    constants).
+    """
+    xp, yp, zp = _coordinates(xp, yp, zp)
+    vertices, offsets, z, density = _model_arrays([prism], 'density', 1)
+    res = np.zeros(xp.size, dtype=np.float)
+    _polyprism.gravity_field(field, xp.ravel(), yp.ravel(), zp.ravel(),
+                             vertices, offsets, z, density, _threads(threads),
+                             res)
+    return res.reshape(xp.shape)
+
+
+def _magnetic(xp, yp, zp, prisms, fx, fy, fz, pmag, threads):
+    """
+    Calculate the projection of the magnetic induction of the prisms on the
+    direction (fx, fy, fz).
+
+    If *pmag* is None, uses the ``'magnetization'`` of the prisms and ignores
+    the ones that don't have it.
+    """
+    xp, yp, zp = _coordinates(xp, yp, zp)
+    vertices, offsets, z, mag = _model_arrays(prisms, 'magnetization', pmag)
+    res = np.zeros(xp.size, dtype=np.float)
+    _polyprism.magnetic_field(xp.ravel(), yp.ravel(), zp.ravel(), vertices,
+                              offsets, z, mag.reshape((-1, 3)), fx, fy, fz,
+                              _threads(threads), res)
+    res *= CM*T2NT
+    return res.reshape(xp.shape)
+
+
+def _coordinates(xp, yp, zp):
+    """
+    Check the shapes of the computation points and convert them to float
+    arrays.
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    dummy = 1e-10
-    x, y = prism.x, prism.y
-    z1, z2 = prism.z1, prism.z2
-    nverts = prism.nverts
-    # Calculate the effect of the prism
-    Z1 = z1 - zp
-    Z2 = z2 - zp
-    Z1_sqr = Z1*Z1
-    Z2_sqr = Z2*Z2
-    kernel = 0
-    for k in range(nverts):
-        X1 = x[k] - xp
-        Y1 = y[k] - yp
-        X2 = x[(k + 1) % nverts] - xp
-        Y2 = y[(k + 1) % nverts] - yp
-        deltax = X2 - X1
-        deltay = Y2 - Y1
-        # dist is only used in divisions. Add dummy to avoid zero division
-        # errors if the two vertices coincide.
-        dist = np.sqrt(deltax*deltax + deltay*deltay) + dummy
-        cross = X1*Y2 - X2*Y1
-        p = cross/dist
-        d1 = (deltax*X1 + deltay*Y1)/dist
-        d2 = (deltax*X2 + deltay*Y2)/dist
-        vert1_sqr = X1*X1 + Y1*Y1
-        vert2_sqr = X2*X2 + Y2*Y2
-        R11 = np.sqrt(vert1_sqr + Z1_sqr)
-        R12 = np.sqrt(vert1_sqr + Z2_sqr)
-        R21 = np.sqrt(vert2_sqr + Z1_sqr)
-        R22 = np.sqrt(vert2_sqr + Z2_sqr)
-        kernel += (np.arctan2(Z2*d2, p*R22) - np.arctan2(Z1*d2, p*R21) -
-                   np.arctan2(Z2*d1, p*R12) + np.arctan2(Z1*d1, p*R11))
-    return kernel
+    return [np.ascontiguousarray(i, dtype=np.float) for i in [xp, yp, zp]]
+
+
+def _model_arrays(prisms, prop, value=None):
+    """
+    Get the vertices, the index of the first vertex of each prism, the top and
+    bottom, and a physical property of the prisms as the arrays used by
+    _polyprism.
+
+    Skips None and prisms without the physical property *prop*. If *value* is
+    not None, uses it as the physical property of all prisms.
+    """
+    model = [p for p in prisms
+             if p is not None and (value is not None or prop in p.props)]
+    nverts = [p.nverts for p in model]
+    offsets = np.zeros(len(model) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum(nverts)
+    vertices = np.empty((offsets[-1], 2), dtype=np.float)
+    z = np.empty((len(model), 2), dtype=np.float)
+    for i, p in enumerate(model):
+        vertices[offsets[i]:offsets[i + 1], 0] = p.x
+        vertices[offsets[i]:offsets[i + 1], 1] = p.y
+        z[i] = p.z1, p.z2
+    if value is None:
+        props = [p.props[prop] for p in model]
+    else:
+        props = [value for p in model]
+    props = np.array(props, dtype=np.float)
+    return vertices, offsets, z, props
@@ -24,6 +24,14 @@ The gravitational fields are calculated using the formula of Nagy et al.
 * :func:`~fatiando.gravmag.prism.gyz`
 * :func:`~fatiando.gravmag.prism.gzz`
 
+To calculate all components of the gravity vector or of the gravity gradient
+tensor at once, use the functions below. They are faster than calling the
+functions for each component separately because the terms shared by the
+components are computed only once:
+
+* :func:`~fatiando.gravmag.prism.gravity_vector`
+* :func:`~fatiando.gravmag.prism.tensor`
+
 .. warning::
 
     The gxy, gxz, and gyz components have singularities when the computation
@@ -43,6 +51,44 @@ Bhattacharyya, 1964) and x, y, z components of the magnetic induction:
 * :func:`~fatiando.gravmag.prism.by`
 * :func:`~fatiando.gravmag.prism.bz`
 
+**Models as arrays**
+
+The functions above take a list of :class:`~fatiando.mesher.Prism` (or a
+:class:`~fatiando.mesher.PrismMesh`). They are thin wrappers around the
+functions below, which take the model as a structure of arrays: a (N, 6) array
+with the boundaries of the prisms and an array with the physical property of
+each prism. The loops over prisms and computation points run in compiled code,
+so use these directly for models with many prisms:
+
+* :func:`~fatiando.gravmag.prism.gravity`
+* :func:`~fatiando.gravmag.prism.magnetic`
+
+**Sensitivity matrices**
+
+The sensitivity (Jacobian) matrix of a model is the effect of each prism with
+unit physical property on each data point. It is needed by the inversion and
+imaging methods and can be filled in a single compiled and parallel pass by:
+
+* :func:`~fatiando.gravmag.prism.sensitivity`
+
+All of these functions take a ``threads`` argument that splits the
+computation points among OpenMP threads (use ``threads=None`` to use all CPU
+cores). Threads share the model and the output array, so there is no copying
+or pickling involved.
+
+**Far field approximation**
+
+Far away from a prism, its field is almost the same as that of a point mass
+(or point dipole) at its center, which is several times faster to compute.
+The forward modeling and sensitivity functions also take a ``ratio``
+argument: prisms farther than *ratio* times their diagonal from a computation
+point are replaced by a point source. The default (``ratio=0``) always uses
+the exact formulas. Other values must be > 0.5 (otherwise the computation
+point can be inside the prism). The error introduced decays with the square of
+*ratio* and is bounded by:
+
+* :func:`~fatiando.gravmag.prism.far_field_error`
+
 **Auxiliary Functions**
 
 Calculates the second derivatives of the function
@@ -84,18 +130,40 @@ doi: 10.1007/s001900000116.
 ----
 """
 from __future__ import division, absolute_import
+import multiprocessing
 
 import numpy
 
 from .. import utils
+from ..inversion.hmatrix import HMatrix
+from ..mesher import PrismMesh
 from ..constants import G, SI2EOTVOS, CM, T2NT, SI2MGAL
 try:
     from . import _prism
 except ImportError:
     _prism = None
 
-
-def potential(xp, yp, zp, prisms, dens=None):
+# The constants that convert the output of _prism to the conventional units
+GRAVITY_FIELDS = {'potential': G,
+                  'gx': G*SI2MGAL,
+                  'gy': G*SI2MGAL,
+                  'gz': G*SI2MGAL,
+                  'gxx': G*SI2EOTVOS,
+                  'gxy': G*SI2EOTVOS,
+                  'gxz': G*SI2EOTVOS,
+                  'gyy': G*SI2EOTVOS,
+                  'gyz': G*SI2EOTVOS,
+                  'gzz': G*SI2EOTVOS}
+MAGNETIC_FIELDS = {'tf': CM*T2NT,
+                   'bx': CM*T2NT,
+                   'by': CM*T2NT,
+                   'bz': CM*T2NT}
+# Groups of fields that are calculated in a single pass over the prisms
+COMBINED_FIELDS = {'tensor': ['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz'],
+                   'gravity_vector': ['gx', 'gy', 'gz']}
+
+
+def potential(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the gravitational potential.
 
@@ -117,6 +185,15 @@ def potential(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -126,24 +203,12 @@ def potential(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.potential(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('potential', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gx(xp, yp, zp, prisms, dens=None):
+def gx(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -165,6 +230,15 @@ def gx(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -174,24 +248,12 @@ def gx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gx(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2MGAL
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gx', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gy(xp, yp, zp, prisms, dens=None):
+def gy(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -213,6 +275,15 @@ def gy(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -222,24 +293,12 @@ def gy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gy(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2MGAL
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gy', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gz(xp, yp, zp, prisms, dens=None):
+def gz(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -261,6 +320,15 @@ def gz(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -270,24 +338,12 @@ def gz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gz(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2MGAL
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gz', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gxx(xp, yp, zp, prisms, dens=None):
+def gxx(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -309,6 +365,15 @@ def gxx(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -318,24 +383,12 @@ def gxx(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gxx(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gxx', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gxy(xp, yp, zp, prisms, dens=None):
+def gxy(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -365,6 +418,15 @@ def gxy(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -374,24 +436,12 @@ def gxy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gxy(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gxy', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gxz(xp, yp, zp, prisms, dens=None):
+def gxz(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -421,6 +471,15 @@ def gxz(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -430,24 +489,12 @@ def gxz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gxz(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gxz', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gyy(xp, yp, zp, prisms, dens=None):
+def gyy(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -469,6 +516,15 @@ def gyy(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -478,24 +534,12 @@ def gyy(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gyy(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gyy', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gyz(xp, yp, zp, prisms, dens=None):
+def gyz(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -525,6 +569,15 @@ def gyz(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -534,24 +587,12 @@ def gyz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gyz(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gyz', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def gzz(xp, yp, zp, prisms, dens=None):
+def gzz(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -573,6 +614,15 @@ def gzz(xp, yp, zp, prisms, dens=None):
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -582,24 +632,124 @@ def gzz(xp, yp, zp, prisms, dens=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.gzz(xp, yp, zp, x1, x2, y1, y2, z1, z2, density, res)
-    res *= G * SI2EOTVOS
-    return res
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gzz', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
 
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
+def gravity_vector(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
+    """
+    Calculates the 3 components of the gravity acceleration at once.
+
+    Faster than calling :func:`~fatiando.gravmag.prism.gx`,
+    :func:`~fatiando.gravmag.prism.gy`, and :func:`~fatiando.gravmag.prism.gz`
+    separately because the distances to the prism corners and the logarithms
+    and arc-tangents of the kernels are computed only once.
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have
+        this property will be ignored in the computations. Elements of *prisms*
+        that are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
+
+    Returns:
+
+    * gx, gy, gz : arrays
+        The components calculated on xp, yp, zp
+
+    """
+    if xp.shape != yp.shape or xp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('gravity_vector', xp, yp, zp, bounds, density,
+                   threads=threads, ratio=ratio)
+
+
+def tensor(xp, yp, zp, prisms, dens=None, threads=1, ratio=0):
+    """
+    Calculates the 6 components of the gravity gradient tensor at once.
+
+    Faster than calling :func:`~fatiando.gravmag.prism.gxx`, etc, separately
+    because the distances to the prism corners are computed only once. The
+    results are the same as the individual functions (including the
+    treatment of the singularities of gxy, gxz, and gyz).
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have
+        this property will be ignored in the computations. Elements of *prisms*
+        that are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
+
+    Returns:
+
+    * gxx, gxy, gxz, gyy, gyz, gzz : arrays
+        The components calculated on xp, yp, zp
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import Prism
+        >>> model = [Prism(-100, 100, -100, 100, 100, 200, {'density': 1000})]
+        >>> xp, yp, zp = np.array([10., 50.]), np.zeros(2), np.zeros(2)
+        >>> components = tensor(xp, yp, zp, model)
+        >>> len(components)
+        6
+        >>> np.allclose(components[5], gzz(xp, yp, zp, model))
+        True
+
+    """
+    if xp.shape != yp.shape or xp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    bounds, density = _density_arrays(prisms, dens)
+    return gravity('tensor', xp, yp, zp, bounds, density, threads=threads,
+                   ratio=ratio)
+
+
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, threads=1, ratio=0):
     """
     Calculate the total-field magnetic anomaly of prisms.
 
@@ -624,6 +774,15 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
         A magnetization vector. If not None, will use this value instead of the
         ``'magnetization'`` property of the prisms. Use this, e.g., for
         sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point dipole at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -633,36 +792,13 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    # Calculate the 3 components of the unit vector in the direction of the
-    # regional field
-    fx, fy, fz = utils.dircos(inc, dec)
-    if pmag is not None:
-        if isinstance(pmag, float) or isinstance(pmag, int):
-            mx, my, mz = pmag * fx, pmag * fy, pmag * fz
-        else:
-            mx, my, mz = pmag
-    for prism in prisms:
-        if (prism is None or
-                ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            mag = prism.props['magnetization']
-            if isinstance(mag, float) or isinstance(mag, int):
-                mx, my, mz = mag * fx, mag * fy, mag * fz
-            else:
-                mx, my, mz = mag
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.tf(xp, yp, zp, x1, x2, y1, y2, z1, z2, mx, my, mz, fx, fy, fz,
-                  res)
-    res *= CM * T2NT
-    return res
+    bounds, mag = _magnetization_arrays(prisms, pmag,
+                                        direction=utils.dircos(inc, dec))
+    return magnetic('tf', xp, yp, zp, bounds, mag, inc, dec,
+                    threads=threads, ratio=ratio)
 
 
-def bx(xp, yp, zp, prisms, pmag=None):
+def bx(xp, yp, zp, prisms, pmag=None, threads=1, ratio=0):
     """
     Calculates the x component of the magnetic induction produced by
     rectangular prisms.
@@ -681,6 +817,15 @@ def bx(xp, yp, zp, prisms, pmag=None):
         A magnetization vector. If not None, will use this value instead of the
         ``'magnetization'`` property of the prisms. Use this, e.g., for
         sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point dipole at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -690,25 +835,12 @@ def bx(xp, yp, zp, prisms, pmag=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    if pmag is not None:
-        mx, my, mz = pmag
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if (prism is None or
-                ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            mx, my, mz = prism.props['magnetization']
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.bx(xp, yp, zp, x1, x2, y1, y2, z1, z2, mx, my, mz, res)
-    res *= CM * T2NT
-    return res
+    bounds, mag = _magnetization_arrays(prisms, pmag)
+    return magnetic('bx', xp, yp, zp, bounds, mag, threads=threads,
+                    ratio=ratio)
 
 
-def by(xp, yp, zp, prisms, pmag=None):
+def by(xp, yp, zp, prisms, pmag=None, threads=1, ratio=0):
     """
     Calculates the y component of the magnetic induction produced by
     rectangular prisms.
@@ -727,6 +859,15 @@ def by(xp, yp, zp, prisms, pmag=None):
         A magnetization vector. If not None, will use this value instead of the
         ``'magnetization'`` property of the prisms. Use this, e.g., for
         sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point dipole at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -736,25 +877,12 @@ def by(xp, yp, zp, prisms, pmag=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    if pmag is not None:
-        mx, my, mz = pmag
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if (prism is None or
-                ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            mx, my, mz = prism.props['magnetization']
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.by(xp, yp, zp, x1, x2, y1, y2, z1, z2, mx, my, mz, res)
-    res *= CM * T2NT
-    return res
+    bounds, mag = _magnetization_arrays(prisms, pmag)
+    return magnetic('by', xp, yp, zp, bounds, mag, threads=threads,
+                    ratio=ratio)
 
 
-def bz(xp, yp, zp, prisms, pmag=None):
+def bz(xp, yp, zp, prisms, pmag=None, threads=1, ratio=0):
     """
     Calculates the z component of the magnetic induction produced by
     rectangular prisms.
@@ -773,6 +901,15 @@ def bz(xp, yp, zp, prisms, pmag=None):
         A magnetization vector. If not None, will use this value instead of the
         ``'magnetization'`` property of the prisms. Use this, e.g., for
         sensitivity matrix building.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point dipole at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
 
     Returns:
 
@@ -782,25 +919,387 @@ def bz(xp, yp, zp, prisms, pmag=None):
     """
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    if pmag is not None:
-        mx, my, mz = pmag
-    size = len(xp)
-    res = numpy.zeros(size, dtype=numpy.float)
-    for prism in prisms:
-        if (prism is None or
-                ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            mx, my, mz = prism.props['magnetization']
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        _prism.bz(xp, yp, zp, x1, x2, y1, y2, z1, z2, mx, my, mz, res)
-    res *= CM * T2NT
+    bounds, mag = _magnetization_arrays(prisms, pmag)
+    return magnetic('bz', xp, yp, zp, bounds, mag, threads=threads,
+                    ratio=ratio)
+
+
+def gravity(field, xp, yp, zp, bounds, density, threads=1, ratio=0):
+    """
+    Calculate a gravitational field of prisms given as arrays.
+
+    The loops over prisms and computation points run in compiled code without
+    creating a :class:`~fatiando.mesher.Prism` for each element of the model.
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!). Output is SI for the
+        potential, mGal for gx, gy, and gz, and Eotvos for the gradients.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'potential'``, ``'gx'``, ``'gy'``,
+        ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``,
+        ``'gzz'``. Use ``'tensor'`` or ``'gravity_vector'`` to calculate all
+        components at once (see :func:`~fatiando.gravmag.prism.tensor` and
+        :func:`~fatiando.gravmag.prism.gravity_vector`).
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * bounds : 2d-array
+        Array with shape (N, 6) with the boundaries ``[x1, x2, y1, y2, z1,
+        z2]`` of each of the N prisms.
+    * density : 1d-array or float
+        The density of each prism. If a float, all prisms will have this
+        density.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
+
+    Returns:
+
+    * res : array or list of arrays
+        The field calculated on xp, yp, zp. A list with one array per
+        component for ``'tensor'`` and ``'gravity_vector'``.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import Prism
+        >>> bounds = np.array([[-100, 100, -100, 100, 100, 200],
+        ...                    [300, 400, -50, 50, 50, 300]])
+        >>> density = np.array([1000, -500])
+        >>> xp = np.array([0., 350.])
+        >>> yp = np.zeros(2)
+        >>> zp = np.zeros(2)
+        >>> model = [Prism(-100, 100, -100, 100, 100, 200, {'density': 1000}),
+        ...          Prism(300, 400, -50, 50, 50, 300, {'density': -500})]
+        >>> np.allclose(gravity('gz', xp, yp, zp, bounds, density),
+        ...             gz(xp, yp, zp, model))
+        True
+
+    """
+    if field not in GRAVITY_FIELDS and field not in COMBINED_FIELDS:
+        raise ValueError("Invalid gravitational field '{}'".format(field))
+    if xp.shape != yp.shape or xp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    _check_ratio(ratio)
+    bounds = _as_bounds(bounds)
+    density = numpy.ascontiguousarray(
+        numpy.broadcast_to(density, (bounds.shape[0],)), dtype=numpy.float)
+    if field in COMBINED_FIELDS:
+        components = COMBINED_FIELDS[field]
+        res = numpy.zeros((len(components), len(xp)), dtype=numpy.float)
+        getattr(_prism, field)(xp, yp, zp, bounds, density, _threads(threads),
+                               ratio, res)
+        return [r*GRAVITY_FIELDS[c] for r, c in zip(res, components)]
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    getattr(_prism, field)(xp, yp, zp, bounds, density, _threads(threads),
+                           ratio, res)
+    res *= GRAVITY_FIELDS[field]
+    return res
+
+
+def magnetic(field, xp, yp, zp, bounds, magnetization, inc=None, dec=None,
+             threads=1, ratio=0):
+    """
+    Calculate a magnetic field of prisms given as arrays.
+
+    The loops over prisms and computation points run in compiled code without
+    creating a :class:`~fatiando.mesher.Prism` for each element of the model.
+
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> Down.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'tf'`` (total-field anomaly),
+        ``'bx'``, ``'by'``, ``'bz'``.
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * bounds : 2d-array
+        Array with shape (N, 6) with the boundaries ``[x1, x2, y1, y2, z1,
+        z2]`` of each of the N prisms.
+    * magnetization : 2d-array or [mx, my, mz]
+        Array with shape (N, 3) with the magnetization vector of each prism. If
+        a single vector, all prisms will have this magnetization.
+    * inc, dec : floats
+        The inclination and declination of the regional field (in degrees).
+        Only used (and required) for the total-field anomaly.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point dipole at their center. This is faster
+        but approximate (see :func:`~fatiando.gravmag.prism.far_field_error`
+        for the error). Use 0 to always use the exact formula. Must be 0
+        or > 0.5.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if field not in MAGNETIC_FIELDS:
+        raise ValueError("Invalid magnetic field '{}'".format(field))
+    if xp.shape != yp.shape or xp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    _check_ratio(ratio)
+    bounds = _as_bounds(bounds)
+    mag = numpy.ascontiguousarray(
+        numpy.broadcast_to(magnetization, (bounds.shape[0], 3)),
+        dtype=numpy.float)
+    res = numpy.zeros(len(xp), dtype=numpy.float)
+    if field == 'tf':
+        if inc is None or dec is None:
+            raise ValueError("inc and dec are required for the total field")
+        fx, fy, fz = utils.dircos(inc, dec)
+        _prism.tf(xp, yp, zp, bounds, mag, fx, fy, fz, _threads(threads),
+                  ratio, res)
+    else:
+        getattr(_prism, field)(xp, yp, zp, bounds, mag, _threads(threads),
+                               ratio, res)
+    res *= MAGNETIC_FIELDS[field]
     return res
 
 
-def kernelxx(xp, yp, zp, prism):
+def sensitivity(field, xp, yp, zp, mesh, inc=None, dec=None, sinc=None,
+                sdec=None, out=None, dtype=numpy.float, threads=1,
+                compress=None, ratio=0):
+    """
+    Calculate the sensitivity (Jacobian) matrix of a field for a prism model.
+
+    Element ``[i, j]`` of the matrix is the field produced on the ith
+    computation point by the jth prism with unit density (or unit
+    magnetization intensity for the magnetic fields). So the field produced by
+    the model is ``numpy.dot(sens, props)``.
+
+    The whole matrix is filled in compiled code. The computation points are
+    split among *threads* OpenMP threads.
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!). Output is in the units of
+        the field (see :func:`~fatiando.gravmag.prism.gravity` and
+        :func:`~fatiando.gravmag.prism.magnetic`) per unit of physical
+        property.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'potential'``, ``'gx'``, ``'gy'``,
+        ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``,
+        ``'gzz'``, ``'tf'``, ``'bx'``, ``'by'``, ``'bz'``.
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * mesh : list of :class:`~fatiando.mesher.Prism` or 2d-array
+        The model. Can be a :class:`~fatiando.mesher.PrismMesh`, a list of
+        prisms or an array with shape (M, 6) with the boundaries ``[x1, x2,
+        y1, y2, z1, z2]`` of each prism. Elements that are None (like masked
+        cells of a mesh) get a column of zeros.
+    * inc, dec : floats
+        The inclination and declination of the regional field (in degrees).
+        Only used for the magnetic fields (required for ``'tf'``).
+    * sinc, sdec : floats
+        The inclination and declination of the magnetization of the prisms (in
+        degrees). Only used for the magnetic fields. If not given, will use
+        *inc* and *dec* (induced magnetization).
+    * out : 2d-array or None
+        A C contiguous array with shape (N, M) and dtype float32 or float64 to
+        put the matrix in (for example, a preallocated buffer or a
+        ``numpy.memmap``). If None, a new array will be created.
+    * dtype : numpy dtype
+        The dtype of the new matrix (``numpy.float64`` or ``numpy.float32``).
+        Ignored if *out* is given. Use single precision to halve the memory
+        used by large matrices.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
+    * compress : float or None
+        If not None, return the matrix compressed into low-rank blocks for
+        the prisms that are far from the computation points (a
+        :class:`~fatiando.inversion.hmatrix.HMatrix`) with this relative
+        accuracy. The full matrix is never formed. Can't be used with *out*.
+    * ratio : float
+        Replace prisms farther than *ratio* times their diagonal from a
+        computation point by a point mass (or dipole) at their center. This
+        is faster but approximate (see
+        :func:`~fatiando.gravmag.prism.far_field_error` for the error). Use 0
+        to always use the exact formula. Must be 0 or > 0.5.
+
+    Returns:
+
+    * sens : 2d-array or :class:`~fatiando.inversion.hmatrix.HMatrix`
+        The sensitivity matrix with shape (N, M). If *out* was given, it is
+        returned.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import Prism
+        >>> model = [Prism(-100, 100, -100, 100, 100, 200),
+        ...          None,
+        ...          Prism(300, 400, -50, 50, 50, 300)]
+        >>> xp = np.array([0., 350.])
+        >>> yp = np.zeros(2)
+        >>> zp = np.zeros(2)
+        >>> sens = sensitivity('gz', xp, yp, zp, model)
+        >>> sens.shape
+        (2, 3)
+        >>> np.allclose(sens[:, 0], gz(xp, yp, zp, [model[0]], dens=1))
+        True
+        >>> np.all(sens[:, 1] == 0)
+        True
+
+    For large models, a compressed matrix takes only a fraction of the memory
+    (the more data and prisms, the larger the savings):
+
+        >>> from fatiando.mesher import PrismMesh
+        >>> from fatiando import gridder
+        >>> mesh = PrismMesh((0, 10000, 0, 10000, 0, 2000), (1, 40, 40))
+        >>> xp, yp, zp = gridder.regular((0, 10000, 0, 10000), (40, 40),
+        ...                              z=-100)
+        >>> dense = sensitivity('gz', xp, yp, zp, mesh)
+        >>> compressed = sensitivity('gz', xp, yp, zp, mesh, compress=1e-5)
+        >>> compressed.compression < 0.5
+        True
+        >>> density = np.ones(mesh.size)
+        >>> np.allclose(compressed.dot(density), dense.dot(density),
+        ...             rtol=1e-4)
+        True
+
+    """
+    if field not in GRAVITY_FIELDS and field not in MAGNETIC_FIELDS:
+        raise ValueError("Invalid field '{}'".format(field))
+    if xp.shape != yp.shape or xp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    _check_ratio(ratio)
+    bounds, scale = _mesh_arrays(mesh)
+    if compress is not None:
+        if out is not None:
+            raise ValueError("Can't use out with a compressed matrix")
+
+        def block(rows, cols):
+            return sensitivity(field, xp[rows], yp[rows], zp[rows],
+                               bounds[cols], inc=inc, dec=dec, sinc=sinc,
+                               sdec=sdec, threads=threads,
+                               ratio=ratio)*scale[cols]
+        centers = numpy.transpose([0.5*(bounds[:, 0] + bounds[:, 1]),
+                                   0.5*(bounds[:, 2] + bounds[:, 3]),
+                                   0.5*(bounds[:, 4] + bounds[:, 5])])
+        return HMatrix(block, numpy.transpose([xp, yp, zp]), centers,
+                       tol=compress, dtype=dtype)
+    shape = (len(xp), bounds.shape[0])
+    if out is None:
+        out = numpy.empty(shape, dtype=dtype)
+    if out.shape != shape:
+        raise ValueError(
+            "Invalid out with shape {}. Should be {}.".format(out.shape,
+                                                              shape))
+    if out.dtype not in (numpy.float32, numpy.float64):
+        raise ValueError(
+            "Invalid out dtype {}. Must be float32 or float64.".format(
+                out.dtype))
+    if field in GRAVITY_FIELDS:
+        _prism.gravity_sensitivity(field, xp, yp, zp, bounds, scale,
+                                   _threads(threads), ratio, out)
+        out *= GRAVITY_FIELDS[field]
+        return out
+    if sinc is None or sdec is None:
+        sinc, sdec = inc, dec
+    if sinc is None or sdec is None:
+        raise ValueError(
+            "sinc and sdec (or inc and dec) are required for magnetic fields")
+    if field == 'tf':
+        if inc is None or dec is None:
+            raise ValueError("inc and dec are required for the total field")
+        fx, fy, fz = utils.dircos(inc, dec)
+    else:
+        fx, fy, fz = [float(field == c) for c in ['bx', 'by', 'bz']]
+    mag = numpy.outer(scale, utils.dircos(sinc, sdec))
+    _prism.magnetic_sensitivity(xp, yp, zp, bounds, mag, fx, fy, fz,
+                                _threads(threads), ratio, out)
+    out *= MAGNETIC_FIELDS[field]
+    return out
+
+
+def far_field_error(field, ratio):
+    r"""
+    The relative error of the far field approximation used with *ratio*.
+
+    Prisms farther than *ratio* times their diagonal from a computation point
+    are replaced by a point mass (gravity) or a point dipole (magnetic) at
+    their center. The error of each prism is bounded by the returned value
+    times the largest value that the field of the point source can have at
+    that distance: :math:`\rho V/r` for the potential, :math:`\rho V/r^2`
+    for gravity and :math:`2 \rho V/r^3` for the gradients (or the
+    equivalent with the magnetization for the magnetic fields), where
+    :math:`V` is the volume of the prism and :math:`r` the distance to its
+    center.
+
+    The error decays with the square of *ratio* because the dipole moment of
+    a homogeneous prism about its center is zero. The leading-order term of
+    the error is multiplied by :math:`1/(1 - q^2)^2`, where :math:`q =
+    1/(2\,ratio)` is the largest ratio between the distance of a point of
+    the prism to its center and :math:`r`, to account for the higher-order
+    terms. The series of terms doesn't converge if :math:`ratio \le 0.5`
+    (the computation point can be inside the prism), so the error is
+    infinite and the forward modeling functions don't accept such ratios.
+
+    Parameters:
+
+    * field : str
+        The field (see :func:`~fatiando.gravmag.prism.gravity` and
+        :func:`~fatiando.gravmag.prism.magnetic`). Use ``'tensor'`` or
+        ``'gravity_vector'`` for all components at once.
+    * ratio : float
+        The distance/size ratio passed to the forward modeling functions.
+
+    Returns:
+
+    * error : float
+        The maximum relative error.
+
+    Examples:
+
+        >>> print('{:.5f}'.format(far_field_error('gz', 5)))
+        0.01020
+        >>> print('{:.5f}'.format(far_field_error('tf', 10)))
+        0.00503
+        >>> print(far_field_error('gz', 0.5))
+        inf
+
+    """
+    if ratio <= 0:
+        raise ValueError("Invalid ratio {}. Must be > 0.".format(ratio))
+    if field == 'potential':
+        constant = 1/12
+    elif field in ['gx', 'gy', 'gz', 'gravity_vector']:
+        constant = 1/4
+    elif (field in GRAVITY_FIELDS or field in MAGNETIC_FIELDS or
+          field == 'tensor'):
+        constant = 1/2
+    else:
+        raise ValueError("Invalid field '{}'".format(field))
+    if ratio <= 0.5:
+        return numpy.inf
+    return constant/ratio**2/(1 - 1/(4*ratio**2))**2
+
+
+def kernelxx(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the xx derivative of the function
 
@@ -818,6 +1317,9 @@ def kernelxx(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -828,14 +1330,12 @@ def kernelxx(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gxx(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gxx(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
 
 
-def kernelyy(xp, yp, zp, prism):
+def kernelyy(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the yy derivative of the function
 
@@ -853,6 +1353,9 @@ def kernelyy(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -863,14 +1366,12 @@ def kernelyy(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gyy(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gyy(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
 
 
-def kernelzz(xp, yp, zp, prism):
+def kernelzz(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the zz derivative of the function
 
@@ -888,6 +1389,9 @@ def kernelzz(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -898,14 +1402,12 @@ def kernelzz(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gzz(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gzz(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
 
 
-def kernelxy(xp, yp, zp, prism):
+def kernelxy(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the xy derivative of the function
 
@@ -923,6 +1425,9 @@ def kernelxy(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -933,14 +1438,12 @@ def kernelxy(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gxy(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gxy(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
 
 
-def kernelxz(xp, yp, zp, prism):
+def kernelxz(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the xz derivative of the function
 
@@ -958,6 +1461,9 @@ def kernelxz(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -968,14 +1474,12 @@ def kernelxz(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gxz(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gxz(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
 
 
-def kernelyz(xp, yp, zp, prism):
+def kernelyz(xp, yp, zp, prism, threads=1):
     r"""
     Calculates the yz derivative of the function
 
@@ -993,6 +1497,9 @@ def kernelyz(xp, yp, zp, prism):
         The x, y, and z coordinates of the computation points.
     * prisms : object of :class:`fatiando.mesher.Prism`
         The model used to calculate the field.
+    * threads : int or None
+        Number of threads used to split the computation points. If None,
+        will use all available CPU cores.
 
     Returns:
 
@@ -1003,8 +1510,139 @@ def kernelyz(xp, yp, zp, prism):
     if xp.shape != yp.shape or xp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
     res = numpy.zeros(len(xp), dtype=numpy.float)
-    x1, x2 = prism.x1, prism.x2
-    y1, y2 = prism.y1, prism.y2
-    z1, z2 = prism.z1, prism.z2
-    _prism.gyz(xp, yp, zp, x1, x2, y1, y2, z1, z2, 1, res)
+    bounds, density = _density_arrays([prism], 1)
+    _prism.gyz(xp, yp, zp, bounds, density, _threads(threads), 0, res)
     return res
+
+
+def _threads(threads):
+    """
+    Get the number of threads to use. None means all available CPU cores.
+    """
+    if threads is None:
+        return multiprocessing.cpu_count()
+    if threads < 1:
+        raise ValueError(
+            "Invalid number of threads {}. Must be >= 1.".format(threads))
+    return int(threads)
+
+
+def _check_ratio(ratio):
+    """
+    Check that the far field approximation is either off or converges (see
+    :func:`~fatiando.gravmag.prism.far_field_error`).
+    """
+    if 0 < ratio <= 0.5:
+        raise ValueError(
+            "Invalid ratio {}. Must be 0 or > 0.5.".format(ratio))
+
+
+def _as_bounds(bounds):
+    """
+    Convert the prism boundaries to a C contiguous (N, 6) float array.
+    """
+    bounds = numpy.ascontiguousarray(bounds, dtype=numpy.float)
+    if bounds.size == 0:
+        return bounds.reshape((0, 6))
+    if bounds.ndim != 2 or bounds.shape[1] != 6:
+        raise ValueError(
+            "Invalid prism bounds with shape {}. Should be (N, 6).".format(
+                bounds.shape))
+    return bounds
+
+
+def _density_arrays(prisms, dens=None):
+    """
+    Get the boundaries and densities of the prisms as arrays.
+
+    Prisms that are None or that don't have a ``'density'`` property are
+    ignored. If *dens* is not None, will use it as the density of all prisms.
+    The arrays of a :class:`~fatiando.mesher.PrismMesh` are used directly.
+    """
+    if isinstance(prisms, PrismMesh):
+        keep = ~prisms.mask
+        bounds = _as_bounds(prisms.cell_bounds[keep])
+        if dens is not None:
+            density = dens*numpy.ones(len(bounds), dtype=numpy.float)
+        elif 'density' in prisms.props:
+            density = numpy.asarray(prisms.props['density'],
+                                    dtype=numpy.float)[keep]
+        else:
+            return _as_bounds([]), numpy.zeros(0, dtype=numpy.float)
+        return bounds, density
+    bounds, density = [], []
+    for prism in prisms:
+        if prism is None or ('density' not in prism.props and dens is None):
+            continue
+        bounds.append(prism.get_bounds())
+        if dens is None:
+            density.append(prism.props['density'])
+        else:
+            density.append(dens)
+    return _as_bounds(bounds), numpy.array(density, dtype=numpy.float)
+
+
+def _magnetization_arrays(prisms, pmag=None, direction=None):
+    """
+    Get the boundaries and magnetization vectors of the prisms as arrays.
+
+    Prisms that are None or that don't have a ``'magnetization'`` property are
+    ignored. If *pmag* is not None, will use it as the magnetization of all
+    prisms. Scalar magnetizations are taken as being along *direction* (the
+    unit vector of the regional field). The arrays of a
+    :class:`~fatiando.mesher.PrismMesh` are used directly.
+    """
+    def _vector(mag):
+        if direction is not None and isinstance(mag, (float, int)):
+            return [mag*d for d in direction]
+        return mag
+    if isinstance(prisms, PrismMesh):
+        keep = ~prisms.mask
+        bounds = _as_bounds(prisms.cell_bounds[keep])
+        if pmag is not None:
+            mags = numpy.tile(numpy.asarray(_vector(pmag), dtype=numpy.float),
+                              (len(bounds), 1))
+        elif 'magnetization' in prisms.props:
+            mags = numpy.asarray(prisms.props['magnetization'],
+                                 dtype=numpy.float)[keep]
+            if mags.ndim == 1 and direction is not None:
+                mags = numpy.outer(mags, direction)
+        else:
+            return _as_bounds([]), numpy.zeros((0, 3), dtype=numpy.float)
+        return bounds, mags.reshape((len(bounds), 3))
+    bounds, mags = [], []
+    for prism in prisms:
+        if (prism is None or
+                ('magnetization' not in prism.props and pmag is None)):
+            continue
+        bounds.append(prism.get_bounds())
+        if pmag is None:
+            mags.append(_vector(prism.props['magnetization']))
+        else:
+            mags.append(_vector(pmag))
+    mags = numpy.array(mags, dtype=numpy.float).reshape((len(bounds), 3))
+    return _as_bounds(bounds), mags
+
+
+def _mesh_arrays(mesh):
+    """
+    Get the boundaries of all elements of a mesh as an (M, 6) array.
+
+    Also returns an array with 1 for each element and 0 for the elements that
+    are None. Arrays are taken as the boundaries of the elements.
+    """
+    if isinstance(mesh, numpy.ndarray):
+        bounds = _as_bounds(mesh)
+        return bounds, numpy.ones(bounds.shape[0], dtype=numpy.float)
+    if isinstance(mesh, PrismMesh):
+        bounds = numpy.array(mesh.cell_bounds, dtype=numpy.float)
+        bounds[mesh.mask] = 0
+        return bounds, (~mesh.mask).astype(numpy.float)
+    bounds = numpy.zeros((len(mesh), 6), dtype=numpy.float)
+    scale = numpy.zeros(len(mesh), dtype=numpy.float)
+    for i, cell in enumerate(mesh):
+        if cell is None:
+            continue
+        bounds[i] = cell.get_bounds()
+        scale[i] = 1
+    return bounds, scale
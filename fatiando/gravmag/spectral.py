@@ -0,0 +1,432 @@
+r"""
+Fast forward modeling of layered models on regular grids using the FFT.
+
+The potential fields of a layer of sources on a regular grid, observed on a
+regular grid at a constant height, are a 2D convolution of the physical
+property of the layer with the field of a single source. The functions in
+this module compute these convolutions with the Fast Fourier Transform. This
+takes the cost of the forward modeling from O(N M) (N data and M sources) to
+O((N + M) log(N + M)) for each layer.
+
+.. note:: The coordinate system of the input parameters is x -> North,
+    y -> East and z -> Down.
+
+.. note:: The observation grids follow the conventions of
+    :func:`fatiando.gridder.regular` (use it to generate them).
+
+**Prism meshes**
+
+* :func:`~fatiando.gravmag.spectral.prism_layers`: Any field of a
+  :class:`~fatiando.mesher.PrismMesh`. The field of each layer is the exact
+  convolution of its physical property with the field of one of its prisms
+  (computed with :mod:`fatiando.gravmag.prism`). The result is the same as
+  :mod:`fatiando.gravmag.prism` up to floating point errors. The observation
+  grid must have the same spacing as the cells of the mesh.
+
+**Reliefs**
+
+* :func:`~fatiando.gravmag.spectral.layer_gz`: Vertical component of gravity
+  of a layer with variable top, bottom, and density using Parker's (1973)
+  series expansion.
+* :func:`~fatiando.gravmag.spectral.relief_gz`: The same for a
+  :class:`~fatiando.mesher.PrismRelief`.
+
+**Inversion**
+
+* :func:`~fatiando.gravmag.spectral.oldenburg`: Estimate the relief of an
+  interface (e.g., the basement of a basin or the Moho) from gravity data with
+  the iterative method of Oldenburg (1974). Each iteration costs a few FFTs
+  of the padded grid.
+
+Parker's method approximates the prisms as a continuous layer sampled on the
+grid. The approximation is best away from the edges of the grid and when the
+relief is deep compared to the grid spacing. The layers are padded with zeros
+to avoid the wrap-around effects of the FFT.
+
+**References**
+
+Oldenburg, D. W. (1974), The inversion and interpretation of gravity
+anomalies, Geophysics, 39(4), 526-536, doi:10.1190/1.1440444.
+
+Parker, R. L. (1973), The Rapid Calculation of Potential Anomalies,
+Geophysical Journal International, 31(4), 447-455,
+doi:10.1111/j.1365-246X.1973.tb06513.x.
+
+----
+"""
+from __future__ import division, absolute_import
+from future.builtins import range
+import warnings
+import numpy
+
+from ..constants import G, SI2MGAL
+from ..mesher import OctreePrismMesh, PrismRelief
+from .. import gridder, utils
+from . import prism as prism_engine
+from .transform import _fftfreqs
+
+
+def prism_layers(field, x, y, z, shape, mesh, inc=None, dec=None):
+    """
+    Calculate a field of a prism mesh on a regular grid using the FFT.
+
+    The field of each layer of the mesh is computed as the 2D convolution of
+    the physical property of the layer with the field of one of its prisms.
+    The convolutions are done exactly (without wrap-around) with the FFT.
+    Masked cells are ignored.
+
+    .. note:: The observation grid must have the same spacing as the cells of
+        the mesh and all points must have the same z coordinate. The grid
+        doesn't need to be aligned with the cells of the mesh or have the
+        same size.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'potential'``, ``'gx'``, ``'gy'``,
+        ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``,
+        ``'gzz'`` (use the ``'density'`` of the mesh), ``'tf'``, ``'bx'``,
+        ``'by'``, ``'bz'`` (use the ``'magnetization'`` of the mesh).
+    * x, y, z : 1D arrays
+        The x, y, and z coordinates of the grid points.
+    * shape : tuple = (nx, ny)
+        The shape of the grid.
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The model.
+    * inc, dec : floats
+        The inclination and declination of the regional field (in degrees).
+        Required for ``'tf'`` and for scalar magnetizations (that are taken as
+        being along the regional field).
+
+    Returns:
+
+    * res : 1D array
+        The field calculated on the grid. Units are the same as in
+        :mod:`fatiando.gravmag.prism`.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import PrismMesh
+        >>> from fatiando import gridder
+        >>> mesh = PrismMesh((0, 1000, 0, 2000, 0, 800), (2, 10, 5))
+        >>> mesh.addprop('density', np.linspace(-200, 300, mesh.size))
+        >>> x, y, z = gridder.regular((-500, 1500, 0, 1800), (11, 10), z=-10)
+        >>> fast = prism_layers('gz', x, y, z, (11, 10), mesh)
+        >>> np.allclose(fast, prism_engine.gz(x, y, z, mesh))
+        True
+
+    """
+    if isinstance(mesh, OctreePrismMesh):
+        raise ValueError("Can't use the FFT on a refined OctreePrismMesh.")
+    if field not in prism_engine.GRAVITY_FIELDS and \
+            field not in prism_engine.MAGNETIC_FIELDS:
+        raise ValueError("Invalid field '{}'".format(field))
+    nz, ny, nx = mesh.shape
+    dx, dy, dz = mesh.dims
+    xo, yo, zo = _grid_coordinates(x, y, z, shape, (dx, dy))
+    nxo, nyo = shape
+    # The kernel of the convolution is the field of the first prism of the
+    # layer on a grid that covers all offsets between the data and the cells
+    fftshape = (nxo + nx - 1, nyo + ny - 1)
+    xk = xo[0] + dx*numpy.arange(-(nx - 1), nxo)
+    yk = yo[0] + dy*numpy.arange(-(ny - 1), nyo)
+    xk, yk = [i.ravel() for i in numpy.meshgrid(xk, yk, indexing='ij')]
+    zk = zo*numpy.ones_like(xk)
+    sources = _layer_sources(field, mesh, inc, dec)
+    x1, x2, y1, y2, z1, z2 = mesh.bounds
+    total = 0
+    for layer in range(nz):
+        top = z1 + layer*dz
+        bounds = numpy.array([[x1, x1 + dx, y1, y1 + dy, top, top + dz]])
+        cells = slice(layer*nx*ny, (layer + 1)*nx*ny)
+        for prop, unit in sources:
+            layerprop = prop[cells].reshape((ny, nx)).T
+            if not numpy.any(layerprop):
+                continue
+            if unit is None:
+                kernel = prism_engine.gravity(field, xk, yk, zk, bounds, 1)
+            else:
+                kernel = prism_engine.magnetic(field, xk, yk, zk, bounds,
+                                               unit, inc, dec)
+            total = total + (
+                numpy.fft.rfft2(layerprop, s=fftshape) *
+                numpy.fft.rfft2(kernel.reshape(fftshape)))
+    if numpy.isscalar(total):
+        return numpy.zeros(nxo*nyo, dtype=numpy.float)
+    res = numpy.fft.irfft2(total, s=fftshape)
+    return res[nx - 1:, ny - 1:].ravel()
+
+
+def layer_gz(x, y, z, shape, top, bottom, density, nterms=10):
+    r"""
+    Calculate the gz of a layer with variable thickness using Parker's method.
+
+    The layer is between the surfaces *top* and *bottom*, given on the same
+    regular grid as the observations (x, y). The gravity anomaly is
+    calculated in the wavenumber domain using the series expansion of Parker
+    (1973):
+
+    .. math::
+
+        F\{g_z\} = 2\pi G e^{-|k|(z_m - z)}
+        \sum\limits_{n=1}^{N} \frac{(-|k|)^{n-1}}{n!}
+        F\{\rho[(z_{bottom} - z_m)^n - (z_{top} - z_m)^n]\}
+
+    in which :math:`z_m` is the mean depth of the layer and :math:`N` is the
+    number of terms in the series.
+
+    .. note:: z is positive downward. The observations must be above the
+        layer.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        The x and y coordinates of the grid points.
+    * z : float
+        The z coordinate of the observations.
+    * shape : tuple = (nx, ny)
+        The shape of the grid.
+    * top, bottom : 1D arrays
+        The z coordinates of the top and bottom of the layer on the grid
+        points.
+    * density : float or 1D array
+        The density of the layer on each grid point.
+    * nterms : int
+        The number of terms of the series expansion.
+
+    Returns:
+
+    * gz : 1D array
+        The vertical component of gravity on the grid (in mGal).
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando import gridder
+        >>> # A wide and thin layer is close to a Bouguer plate
+        >>> x, y = gridder.regular((0, 10000, 0, 10000), (51, 51))
+        >>> top = 10*np.ones(x.size)
+        >>> gz = layer_gz(x, y, 0, (51, 51), top, top + 10, 1000)
+        >>> center = 25*51 + 25
+        >>> np.allclose(gz[center], 2*np.pi*G*SI2MGAL*10*1000, rtol=0.01)
+        True
+
+    """
+    top = numpy.asarray(top, dtype=numpy.float)
+    bottom = numpy.asarray(bottom, dtype=numpy.float)
+    if top.size != x.size or bottom.size != x.size:
+        raise ValueError("top and bottom must have the same size as x and y")
+    if numpy.any(top < z) or numpy.any(bottom < z):
+        raise ValueError("The observations must be above the layer")
+    density = density*numpy.ones_like(top)
+    padshape = tuple(2**int(numpy.ceil(numpy.log2(2*n))) for n in shape)
+    zmean = 0.5*(top.mean() + bottom.mean())
+    kx, ky = _fftfreqs(x, y, shape, padshape)
+    k = numpy.sqrt(kx**2 + ky**2)
+    top = (top - zmean).reshape(shape)
+    bottom = (bottom - zmean).reshape(shape)
+    density = density.reshape(shape)
+    series = 0
+    factor = 1
+    for n in range(1, nterms + 1):
+        # factor is (-|k|)^(n - 1)/n!
+        factor = factor/n
+        term, nps = gridder.pad_array(density*(bottom**n - top**n), padshape,
+                                      padtype='0')
+        series = series + factor*numpy.fft.fft2(term)
+        factor = -factor*k
+    gz_ft = 2*numpy.pi*G*SI2MGAL*numpy.exp(-k*(zmean - z))*series
+    gz = numpy.real(numpy.fft.ifft2(gz_ft))
+    return gridder.unpad_array(gz, nps).ravel()
+
+
+def relief_gz(relief, shape, z, nterms=10):
+    """
+    Calculate the gz of a prism relief using Parker's method.
+
+    Uses :func:`~fatiando.gravmag.spectral.layer_gz` with the top, bottom and
+    ``'density'`` of the prisms of the relief. The observations are on the
+    nodes of the relief at a constant z coordinate.
+
+    Parameters:
+
+    * relief : :class:`~fatiando.mesher.PrismRelief`
+        The model. Its nodes must be a regular grid generated by
+        :func:`fatiando.gridder.regular`.
+    * shape : tuple = (nx, ny)
+        The shape of the grid of nodes of the relief.
+    * z : float
+        The z coordinate of the observations (positive downward).
+    * nterms : int
+        The number of terms of the series expansion.
+
+    Returns:
+
+    * gz : 1D array
+        The vertical component of gravity on the nodes (in mGal).
+
+    """
+    x, y = numpy.asarray(relief.x), numpy.asarray(relief.y)
+    nodes = numpy.asarray(relief.z, dtype=numpy.float)
+    top = numpy.minimum(nodes, relief.ref)
+    bottom = numpy.maximum(nodes, relief.ref)
+    density = numpy.asarray(relief.props['density'], dtype=numpy.float)
+    return layer_gz(x, y, z, shape, top, bottom, density, nterms)
+
+
+def oldenburg(x, y, z, shape, gz, ref, density, cutoff=None, maxit=50,
+              tol=0.01, nterms=10):
+    r"""
+    Estimate the relief of an interface from gravity data (Oldenburg, 1974).
+
+    The interface undulates around the depth *ref* and has a density contrast
+    *density* (following the convention of
+    :class:`~fatiando.mesher.PrismRelief`). The relief :math:`\Delta h =
+    h - ref` is found by rearranging Parker's series:
+
+    .. math::
+
+        F\{\Delta h\} = B(|k|)\left[
+        -\frac{F\{g_z\} e^{|k|(ref - z)}}{2\pi G \rho}
+        - \sum\limits_{n=2}^{N} \frac{(-|k|)^{n-1}}{n!}
+        F\{\Delta h^n\}\right]
+
+    and iterating until the relief changes less than *tol* between
+    iterations. :math:`B(|k|)` is a low-pass filter with a cosine taper
+    that stabilizes the downward continuation of the data. The data are padded
+    with :func:`fatiando.gridder.pad_array`.
+
+    .. note:: z is positive downward. The gravity data should have the
+        regional field removed.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        The x and y coordinates of the grid points.
+    * z : float
+        The z coordinate of the observations.
+    * shape : tuple = (nx, ny)
+        The shape of the grid.
+    * gz : 1D array
+        The gravity anomaly (in mGal) on the grid.
+    * ref : float
+        The mean depth of the interface. Must be below the observations.
+    * density : float
+        The density contrast of the relief.
+    * cutoff : None or tuple = (wh, sh)
+        The wavenumbers (in rad/m) where the low-pass filter starts and ends
+        the taper. Wavenumbers above *sh* are removed. If None, will not
+        filter the data.
+    * maxit : int
+        The maximum number of iterations.
+    * tol : float
+        The root-mean-square change in the relief (in meters) between
+        iterations used to stop.
+    * nterms : int
+        The number of terms of the series expansion.
+
+    Returns:
+
+    * relief : :class:`~fatiando.mesher.PrismRelief`
+        The estimated relief (with the ``'density'`` property) on the grid
+        points.
+
+    """
+    if ref <= z:
+        raise ValueError("The interface must be below the observations")
+    x, y = numpy.asarray(x), numpy.asarray(y)
+    dx, dy = gridder.spacing((x.min(), x.max(), y.min(), y.max()), shape)
+    padded, nps = gridder.pad_array(numpy.reshape(gz, shape))
+    kx, ky = _fftfreqs(x, y, shape, padded.shape)
+    k = numpy.sqrt(kx**2 + ky**2)
+    lowpass = _lowpass(k, cutoff)
+    # The downward continuation overflows at high wavenumbers, so only
+    # calculate it where the filter doesn't remove the data
+    keep = lowpass > 0
+    continuation = numpy.zeros_like(k)
+    continuation[keep] = numpy.exp(k[keep]*(ref - z))
+    data = -numpy.fft.fft2(padded)*continuation/(
+        2*numpy.pi*G*SI2MGAL*density)
+    relief = numpy.zeros(padded.shape)
+    for iteration in range(maxit):
+        series = 0
+        factor = -k
+        for n in range(2, nterms + 1):
+            # factor is (-|k|)^(n - 1)/n!
+            factor = factor/n
+            series = series + factor*numpy.fft.fft2(relief**n)
+            factor = -factor*k
+        update = numpy.real(numpy.fft.ifft2(lowpass*(data - series)))
+        change = gridder.unpad_array(update - relief, nps)
+        relief = update
+        if numpy.sqrt(numpy.mean(change**2)) < tol:
+            break
+    else:
+        warnings.warn(
+            "Relief didn't converge after {} iterations.".format(maxit))
+    depth = ref + gridder.unpad_array(relief, nps).ravel()
+    estimate = PrismRelief(ref, (dy, dx), [x, y, depth])
+    estimate.addprop('density', density*numpy.ones(depth.size))
+    return estimate
+
+
+def _lowpass(k, cutoff):
+    """
+    Low-pass filter with a cosine taper between the wavenumbers in cutoff.
+    """
+    if cutoff is None:
+        return numpy.ones_like(k)
+    wh, sh = cutoff
+    taper = 0.5*(1 + numpy.cos(numpy.pi*(k - wh)/(sh - wh)))
+    return numpy.where(k < wh, 1, numpy.where(k > sh, 0, taper))
+
+
+def _grid_coordinates(x, y, z, shape, spacing):
+    """
+    Get the x and y coordinates of the rows and columns of a regular grid and
+    its z coordinate. Checks that the grid has the given spacing and a
+    constant z.
+    """
+    x, y, z = [numpy.asarray(i, dtype=numpy.float) for i in [x, y, z]]
+    if x.size != shape[0]*shape[1] or x.shape != y.shape or \
+            x.shape != z.shape:
+        raise ValueError("x, y, and z must be a regular grid with shape "
+                         "{}".format(shape))
+    if not numpy.allclose(z, z[0]):
+        raise ValueError("All grid points must have the same z coordinate")
+    xo = x.reshape(shape)[:, 0]
+    yo = y.reshape(shape)[0, :]
+    for coords, d, name in [(xo, spacing[0], 'x'), (yo, spacing[1], 'y')]:
+        if coords.size > 1 and not numpy.allclose(numpy.diff(coords), d):
+            raise ValueError(
+                "The grid spacing in {} must be equal to the size of the "
+                "cells ({}).".format(name, d))
+    return xo, yo, z[0]
+
+
+def _layer_sources(field, mesh, inc, dec):
+    """
+    The physical property of the cells of the mesh that produce field, with
+    zeros on the masked cells.
+
+    Returns a list of (prop, unit) pairs. For magnetic fields, there is one
+    pair per component of the magnetization with the unit vector in that
+    direction. unit is None for gravity fields.
+    """
+    keep = ~mesh.mask
+    if field in prism_engine.GRAVITY_FIELDS:
+        if 'density' not in mesh.props:
+            return []
+        density = numpy.asarray(mesh.props['density'], dtype=numpy.float)
+        return [(density*keep, None)]
+    if 'magnetization' not in mesh.props:
+        return []
+    mag = numpy.asarray(mesh.props['magnetization'], dtype=numpy.float)
+    if mag.ndim == 1:
+        if inc is None or dec is None:
+            raise ValueError(
+                "inc and dec are required for scalar magnetizations")
+        mag = numpy.outer(mag, utils.dircos(inc, dec))
+    mag = mag*keep[:, numpy.newaxis]
+    return [(mag[:, i], numpy.identity(3)[i]) for i in range(3)]
@@ -2,11 +2,13 @@ r"""
 The potential fields of a homogeneous sphere.
 """
 from __future__ import division, absolute_import
+from collections import OrderedDict
 
 import numpy as np
 
 from ..constants import SI2MGAL, G, CM, T2NT, SI2EOTVOS
 from .. import utils
+from ..mesher import PointGrid
 from .._our_duecredit import due, Doi
 
 
@@ -42,6 +44,14 @@ def _v_zz(x, y, z, r_sqr, r_5):
     return (3*z**2 - r_sqr)/r_5
 
 
+_SECOND_DERIVATIVES = OrderedDict([('xx', _v_xx), ('xy', _v_xy),
+                                   ('xz', _v_xz), ('yy', _v_yy),
+                                   ('yz', _v_yz), ('zz', _v_zz)])
+# The maximum number of elements of the (nspheres, npoints) arrays calculated
+# at a time
+_CHUNK_SIZE = 2**18
+
+
 def tf(xp, yp, zp, spheres, inc, dec, pmag=None):
     r"""
     The total-field magnetic anomaly.
@@ -97,34 +107,7 @@ def tf(xp, yp, zp, spheres, inc, dec, pmag=None):
 
     """
     fx, fy, fz = utils.dircos(inc, dec)
-    if pmag is not None:
-        pmx, pmy, pmz = pmag
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'magnetization' not in sphere.props and pmag is None:
-            continue
-        if pmag is None:
-            mx, my, mz = sphere.props['magnetization']
-        else:
-            mx, my, mz = pmx, pmy, pmz
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        # Calculating v_xx, etc to calculate B is ~2x slower than this
-        dotprod = mx*x + my*y + mz*z
-        bx = (3*dotprod*x - r_sqr*mx)/r_5
-        by = (3*dotprod*y - r_sqr*my)/r_5
-        bz = (3*dotprod*z - r_sqr*mz)/r_5
-        res += volume*(fx*bx + fy*by + fz*bz)
-    res *= CM*T2NT
-    return res
+    return _magnetic(xp, yp, zp, spheres, pmag, (fx, fy, fz))
 
 
 def bx(xp, yp, zp, spheres, pmag=None):
@@ -162,31 +145,7 @@ def bx(xp, yp, zp, spheres, pmag=None):
     Applications, Cambridge University Press.
 
     """
-    if pmag is not None:
-        pmx, pmy, pmz = pmag
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'magnetization' not in sphere.props and pmag is None:
-            continue
-        if pmag is None:
-            mx, my, mz = sphere.props['magnetization']
-        else:
-            mx, my, mz = pmx, pmy, pmz
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        # Calculating v_xx, etc to calculate B is ~1.3x slower than this
-        dotprod = mx*x + my*y + mz*z
-        res += volume*(3*dotprod*x - r_sqr*mx)/r_5
-    res *= CM * T2NT
-    return res
+    return _magnetic(xp, yp, zp, spheres, pmag, (1, 0, 0))
 
 
 def by(xp, yp, zp, spheres, pmag=None):
@@ -224,31 +183,7 @@ def by(xp, yp, zp, spheres, pmag=None):
     Applications, Cambridge University Press.
 
     """
-    if pmag is not None:
-        pmx, pmy, pmz = pmag
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'magnetization' not in sphere.props and pmag is None:
-            continue
-        if pmag is None:
-            mx, my, mz = sphere.props['magnetization']
-        else:
-            mx, my, mz = pmx, pmy, pmz
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        # Calculating v_xx, etc to calculate B is ~1.3x slower than this
-        dotprod = mx*x + my*y + mz*z
-        res += volume*(3*dotprod*y - r_sqr*my)/r_5
-    res *= CM * T2NT
-    return res
+    return _magnetic(xp, yp, zp, spheres, pmag, (0, 1, 0))
 
 
 def bz(xp, yp, zp, spheres, pmag=None):
@@ -286,31 +221,7 @@ def bz(xp, yp, zp, spheres, pmag=None):
     Applications, Cambridge University Press.
 
     """
-    if pmag is not None:
-        pmx, pmy, pmz = pmag
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'magnetization' not in sphere.props and pmag is None:
-            continue
-        if pmag is None:
-            mx, my, mz = sphere.props['magnetization']
-        else:
-            mx, my, mz = pmx, pmy, pmz
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        # Calculating v_xx, etc to calculate B is ~1.3x slower than this
-        dotprod = mx*x + my*y + mz*z
-        res += volume*(3*dotprod*z - r_sqr*mz)/r_5
-    res *= CM * T2NT
-    return res
+    return _magnetic(xp, yp, zp, spheres, pmag, (0, 0, 1))
 
 
 def gz(xp, yp, zp, spheres, dens=None):
@@ -351,26 +262,17 @@ def gz(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r = np.sqrt(x**2 + y**2 + z**2)
+    xp, yp, zp, shape = _coordinates(xp, yp, zp)
+    x, y, z, volume, density = _sphere_arrays(spheres, 'density', dens)
+    mass = density*volume
+    res = np.zeros(xp.size)
+    for s, dx, dy, dz in _relative_positions(xp, yp, zp, x, y, z):
+        r = np.sqrt(dx**2 + dy**2 + dz**2)
         # This is faster than r3 = r_sqrt**1.5
         r_cb = r*r*r
-        mass = density*4*np.pi*(sphere.radius**3)/3
-        res += mass*z/r_cb
+        res += mass[s].dot(dz/r_cb)
     res *= G*SI2MGAL
-    return res
+    return res.reshape(shape)
 
 
 def gxx(xp, yp, zp, spheres, dens=None):
@@ -412,27 +314,7 @@ def gxx(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_xx(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['xx'])[0]
 
 
 def gxy(xp, yp, zp, spheres, dens=None):
@@ -474,27 +356,7 @@ def gxy(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_xy(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['xy'])[0]
 
 
 def gxz(xp, yp, zp, spheres, dens=None):
@@ -536,27 +398,7 @@ def gxz(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_xz(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['xz'])[0]
 
 
 def gyy(xp, yp, zp, spheres, dens=None):
@@ -598,27 +440,7 @@ def gyy(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_yy(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['yy'])[0]
 
 
 def gyz(xp, yp, zp, spheres, dens=None):
@@ -660,27 +482,7 @@ def gyz(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_yz(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['yz'])[0]
 
 
 def gzz(xp, yp, zp, spheres, dens=None):
@@ -722,27 +524,51 @@ def gzz(xp, yp, zp, spheres, dens=None):
     Applications, Cambridge University Press.
 
     """
-    res = 0
-    for sphere in spheres:
-        if sphere is None:
-            continue
-        if 'density' not in sphere.props and dens is None:
-            continue
-        if dens is None:
-            density = sphere.props['density']
-        else:
-            density = dens
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        r_sqr = x**2 + y**2 + z**2
-        # This is faster than r5 = r_sqrt**2.5
-        r = np.sqrt(r_sqr)
-        r_5 = r*r*r*r*r
-        volume = 4*np.pi*(sphere.radius**3)/3
-        res += density*volume*_v_zz(x, y, z, r_sqr, r_5)
-    res *= G*SI2EOTVOS
-    return res
+    return _gradients(xp, yp, zp, spheres, dens, ['zz'])[0]
+
+
+def tensor(xp, yp, zp, spheres, dens=None):
+    r"""
+    All components of the gravity gradient tensor calculated in a single pass.
+
+    Calculating the 6 components at once is faster than calling :func:`gxx`,
+    :func:`gxy`, etc, because the distances from the spheres to the
+    computation points are only calculated once.
+
+    The coordinate system of the input parameters is x -> North, y -> East and
+    z -> Down.
+
+    All input values should be in SI and output is in Eotvos.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. The ones
+        that are ``None`` or without a density will be ignored.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+
+    Returns:
+
+    * [gxx, gxy, gxz, gyy, gyz, gzz] : list of arrays
+        The components calculated on xp, yp, zp
+
+    Examples:
+
+    >>> from fatiando.mesher import Sphere
+    >>> model = [Sphere(0, 0, 1000, 500, {'density': 1000})]
+    >>> xp, yp, zp = np.array([0., 500]), np.array([0., 0]), np.zeros(2)
+    >>> res = tensor(xp, yp, zp, model)
+    >>> all(np.allclose(r, f(xp, yp, zp, model)) for r, f in
+    ...     zip(res, [gxx, gxy, gxz, gyy, gyz, gzz]))
+    True
+
+    """
+    return _gradients(xp, yp, zp, spheres, dens,
+                      ['xx', 'xy', 'xz', 'yy', 'yz', 'zz'])
 
 
 def kernelxx(xp, yp, zp, sphere):
@@ -989,3 +815,252 @@ def kernelzz(xp, yp, zp, sphere):
     volume = 4*np.pi*(sphere.radius**3)/3
     res = volume*_v_zz(x, y, z, r_sqr, r_5)
     return res
+
+
+def kernel_gradient(xp, yp, zp, spheres):
+    r"""
+    The first derivatives of the kernel function of many spheres at once.
+
+    .. math::
+
+        \phi(x,y,z) = \frac{4}{3} \pi radius^3 \frac{1}{r}
+
+    where :math:`r = \sqrt{(x - x')^2 + (y - y')^2 + (z - z')^2}`.
+
+    Each column of the results is the kernel of one sphere, so they can be
+    used to build sensitivity matrices directly. For example, the
+    sensitivity of :func:`gz` to the densities of the spheres is
+    ``G*SI2MGAL*kernel_gradient(xp, yp, zp, spheres)[2]``.
+
+    The coordinate system of the input parameters is x -> North, y -> East and
+    z -> Down.
+
+    All input values should be in SI and output is in SI.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the function will be
+        calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere` or
+      :class:`fatiando.mesher.PointGrid`
+        The spheres. Can't contain ``None`` (raises a ``ValueError``) so
+        that the columns of the result match the spheres.
+
+    Returns:
+
+    * res : array
+        The x, y, and z derivatives in an array with shape
+        (3, len(xp), len(spheres)).
+
+    """
+    xp, yp, zp, _ = _coordinates(xp, yp, zp)
+    x, y, z, volume = _kernel_arrays(spheres)
+    return _kernel_gradient(xp, yp, zp, x, y, z, volume)
+
+
+def _kernel_gradient(xp, yp, zp, x, y, z, volume):
+    """
+    The first derivatives of the kernel function of the spheres given as
+    arrays of their centers and volumes (see :func:`kernel_gradient`).
+    """
+    res = np.empty((3, xp.size, x.size))
+    for s, dx, dy, dz in _relative_positions(xp, yp, zp, x, y, z):
+        r = np.sqrt(dx**2 + dy**2 + dz**2)
+        r_cb = r*r*r
+        for i, d in enumerate([dx, dy, dz]):
+            res[i, :, s] = (volume[s, None]*d/r_cb).T
+    return res
+
+
+def kernel_tensor(xp, yp, zp, spheres, components=None):
+    r"""
+    The second derivatives of the kernel function of many spheres at once.
+
+    .. math::
+
+        \phi(x,y,z) = \frac{4}{3} \pi radius^3 \frac{1}{r}
+
+    where :math:`r = \sqrt{(x - x')^2 + (y - y')^2 + (z - z')^2}`.
+
+    This is the same as calling :func:`kernelxx`, :func:`kernelxy`, etc, for
+    every sphere but the distances are calculated only once. Each column of
+    the results is the kernel of one sphere, so they can be used to build
+    sensitivity matrices directly (see
+    :class:`fatiando.gravmag.magdir.DipoleMagDir`).
+
+    The coordinate system of the input parameters is x -> North, y -> East and
+    z -> Down.
+
+    All input values should be in SI and output is in SI.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the function will be
+        calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere` or
+      :class:`fatiando.mesher.PointGrid`
+        The spheres. Can't contain ``None`` (raises a ``ValueError``) so
+        that the columns of the result match the spheres.
+    * components : list of str or None
+        Which derivatives to calculate (``'xx'``, ``'xy'``, etc). If None,
+        will calculate all of them.
+
+    Returns:
+
+    * res : array
+        The derivatives in an array with shape
+        (len(components), len(xp), len(spheres)). By default, the components
+        are xx, xy, xz, yy, yz, and zz.
+
+    Examples:
+
+    >>> from fatiando.mesher import Sphere
+    >>> spheres = [Sphere(0, 0, 1000, 500), Sphere(200, 100, 800, 300)]
+    >>> xp, yp, zp = np.array([0., 500, 100]), np.zeros(3), np.zeros(3)
+    >>> res = kernel_tensor(xp, yp, zp, spheres)
+    >>> res.shape
+    (6, 3, 2)
+    >>> np.allclose(res[3, :, 1], kernelyy(xp, yp, zp, spheres[1]))
+    True
+
+    """
+    xp, yp, zp, _ = _coordinates(xp, yp, zp)
+    x, y, z, volume = _kernel_arrays(spheres)
+    return _kernel_tensor(xp, yp, zp, x, y, z, volume, components)
+
+
+def _kernel_tensor(xp, yp, zp, x, y, z, volume, components=None):
+    """
+    The second derivatives of the kernel function of the spheres given as
+    arrays of their centers and volumes (see :func:`kernel_tensor`).
+    """
+    if components is None:
+        components = list(_SECOND_DERIVATIVES.keys())
+    res = np.empty((len(components), xp.size, x.size))
+    for s, dx, dy, dz in _relative_positions(xp, yp, zp, x, y, z):
+        r_sqr = dx**2 + dy**2 + dz**2
+        # This is faster than r5 = r_sqrt**2.5
+        r = np.sqrt(r_sqr)
+        r_5 = r*r*r*r*r
+        for i, c in enumerate(components):
+            v = _SECOND_DERIVATIVES[c](dx, dy, dz, r_sqr, r_5)
+            res[i, :, s] = (volume[s, None]*v).T
+    return res
+
+
+def _gradients(xp, yp, zp, spheres, dens, components):
+    """
+    Calculate the given components of the gravity gradient tensor (list of
+    'xx', 'xy', etc) sharing the distances between them.
+    """
+    xp, yp, zp, shape = _coordinates(xp, yp, zp)
+    x, y, z, volume, density = _sphere_arrays(spheres, 'density', dens)
+    mass = density*volume
+    res = [np.zeros(xp.size) for c in components]
+    for s, dx, dy, dz in _relative_positions(xp, yp, zp, x, y, z):
+        r_sqr = dx**2 + dy**2 + dz**2
+        # This is faster than r5 = r_sqrt**2.5
+        r = np.sqrt(r_sqr)
+        r_5 = r*r*r*r*r
+        for i, c in enumerate(components):
+            v = _SECOND_DERIVATIVES[c](dx, dy, dz, r_sqr, r_5)
+            res[i] += mass[s].dot(v)
+    return [G*SI2EOTVOS*r.reshape(shape) for r in res]
+
+
+def _magnetic(xp, yp, zp, spheres, pmag, direction):
+    """
+    Calculate the component of the magnetic induction along the unit vector
+    *direction*.
+    """
+    xp, yp, zp, shape = _coordinates(xp, yp, zp)
+    x, y, z, volume, mag = _sphere_arrays(spheres, 'magnetization', pmag)
+    moment = volume[:, None]*np.reshape(mag, (-1, 3))
+    fx, fy, fz = direction
+    # The projection of the moments on the direction
+    fdotm = moment.dot([fx, fy, fz])
+    res = np.zeros(xp.size)
+    for s, dx, dy, dz in _relative_positions(xp, yp, zp, x, y, z):
+        r_sqr = dx**2 + dy**2 + dz**2
+        # This is faster than r5 = r_sqrt**2.5
+        r = np.sqrt(r_sqr)
+        r_5 = r*r*r*r*r
+        mx, my, mz = moment[s, 0, None], moment[s, 1, None], moment[s, 2, None]
+        # Calculating v_xx, etc to calculate B is ~2x slower than this
+        dotprod = mx*dx + my*dy + mz*dz
+        fdotr = fx*dx + fy*dy + fz*dz
+        res += ((3*dotprod*fdotr - r_sqr*fdotm[s, None])/r_5).sum(axis=0)
+    res *= CM*T2NT
+    return res.reshape(shape)
+
+
+def _coordinates(xp, yp, zp):
+    """
+    Broadcast the computation points to the same shape and flatten them.
+
+    Returns the flat arrays and the shape of the results.
+    """
+    xp, yp, zp = np.broadcast_arrays(xp, yp, zp)
+    shape = xp.shape
+    xp, yp, zp = [np.ravel(i).astype(np.float) for i in [xp, yp, zp]]
+    return xp, yp, zp, shape
+
+
+def _relative_positions(xp, yp, zp, x, y, z):
+    """
+    Iterate over chunks of spheres giving their positions relative to the
+    computation points as (nspheres, npoints) arrays.
+
+    Yields the slice of the spheres in the chunk and the x, y, z arrays. The
+    chunks are kept under _CHUNK_SIZE elements to limit the memory used.
+    """
+    size = max(_CHUNK_SIZE//max(xp.size, 1), 1)
+    for i in range(0, x.size, size):
+        s = slice(i, i + size)
+        yield s, x[s, None] - xp, y[s, None] - yp, z[s, None] - zp
+
+
+def _kernel_arrays(spheres):
+    """
+    Get the coordinates and volumes of a list of spheres (or a PointGrid) to
+    calculate their kernels.
+
+    Unlike :func:`_sphere_arrays`, doesn't ignore spheres that are None
+    because that would shift the columns of the kernel matrices.
+    """
+    if not isinstance(spheres, PointGrid) and any(s is None for s in spheres):
+        raise ValueError("Can't calculate the kernel of a None sphere.")
+    x, y, z, volume, _ = _sphere_arrays(spheres, 'kernel', 1)
+    return x, y, z, volume
+
+
+def _sphere_arrays(spheres, prop, value):
+    """
+    Get the coordinates, volumes and values of a physical property of a list
+    of spheres (or a PointGrid).
+
+    Spheres that are None or don't have the property are ignored. If *value*
+    is not None, use it instead of the property.
+    """
+    if isinstance(spheres, PointGrid):
+        volume = np.full(spheres.size, 4*np.pi*spheres.radius**3/3)
+        if value is None:
+            value = spheres.props[prop]
+        value = np.asarray(value, dtype=np.float64)
+        if prop == 'magnetization':
+            value = np.broadcast_to(value, (spheres.size, 3))
+        else:
+            value = np.broadcast_to(value, (spheres.size,))
+        return spheres.x, spheres.y, spheres.z, volume, value
+    spheres = [s for s in spheres
+               if s is not None and (value is not None or prop in s.props)]
+    x, y, z = np.transpose([[s.x, s.y, s.z] for s in spheres]).reshape(
+        (3, -1))
+    volume = np.array([4*np.pi*s.radius**3/3 for s in spheres])
+    if value is None:
+        value = np.array([s.props[prop] for s in spheres], dtype=float)
+    else:
+        value = np.array([value for s in spheres], dtype=float)
+    return x, y, z, volume, value
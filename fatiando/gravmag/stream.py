@@ -0,0 +1,267 @@
+"""
+Forward modeling of surveys that don't fit in memory.
+
+The forward modeling functions (like :func:`fatiando.gravmag.prism.gz`)
+calculate the field on all computation points at once and allocate temporary
+arrays with the size of the survey for each element of the model. The
+functions in this module call them on fixed-size chunks of the computation
+points and write the results into an output array. The memory used depends
+only on the chunk size and the model, not on the size of the survey.
+
+* :func:`~fatiando.gravmag.stream.forward`: Calculate a field on arrays of
+  computation points chunk by chunk. The arrays and the output can be
+  ``numpy.memmap`` so that the survey never has to be loaded in memory.
+* :func:`~fatiando.gravmag.stream.iforward`: Calculate a field on each chunk
+  of computation points produced by an iterator (e.g., reading a large file
+  piece by piece) and yield the results one chunk at a time.
+
+Both receive the forward modeling function and its extra arguments, so they
+work with :mod:`~fatiando.gravmag.prism`,
+:mod:`~fatiando.gravmag.polyprism`, :mod:`~fatiando.gravmag.sphere`,
+:mod:`~fatiando.gravmag.tesseroid` (with longitude, latitude and height
+instead of x, y, z), etc. Functions that return a list of components (like
+:func:`fatiando.gravmag.prism.tensor`) produce one column per component.
+
+The chunks can be calculated in parallel by a pool of processes (the
+``njobs`` argument). Only ``njobs`` chunks are in memory at any time. The
+model is sent to the processes only once, when the pool is created. Use the
+multithreading options of the functions instead (like ``threads`` in
+:mod:`~fatiando.gravmag.prism` or ``parallel`` in
+:mod:`~fatiando.gravmag.tesseroid`) when the model is large.
+
+**Example**
+
+Calculate the gravity anomaly of a prism on a survey saved in files, writing
+the result to another file::
+
+    >>> import os
+    >>> import shutil
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from fatiando.gravmag import prism
+    >>> from fatiando.mesher import Prism
+    >>> from fatiando import gridder
+    >>> model = [Prism(-500, 500, -500, 500, 100, 600, {'density': 1000})]
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> # Make a survey file with the x and y coordinates
+    >>> fname = os.path.join(tmpdir, 'survey.npy')
+    >>> survey = np.lib.format.open_memmap(fname, mode='w+',
+    ...                                    shape=(2, 10000))
+    >>> survey[0], survey[1] = gridder.regular((-5000, 5000, -5000, 5000),
+    ...                                        (100, 100))
+    >>> del survey
+    >>> # Calculate on chunks of 1000 points with the height fixed at 100 m
+    >>> x, y = np.load(fname, mmap_mode='r')
+    >>> out = np.lib.format.open_memmap(os.path.join(tmpdir, 'gz.npy'),
+    ...                                 mode='w+', shape=(10000,))
+    >>> gz = forward(prism.gz, x, y, -100, model, out=out, chunk_size=1000)
+    >>> gz is out
+    True
+    >>> np.allclose(gz, prism.gz(x, y, -100*np.ones_like(x), model))
+    True
+    >>> del x, y, gz, out
+    >>> shutil.rmtree(tmpdir)
+
+----
+
+"""
+from __future__ import division, absolute_import
+from future.builtins import range
+import multiprocessing
+
+import numpy as np
+
+
+# The default number of computation points in each chunk
+CHUNK_SIZE = 2**16
+
+
+def forward(func, xp, yp, zp, model, args=(), kwargs=None, out=None,
+            chunk_size=CHUNK_SIZE, njobs=1):
+    """
+    Calculate a field on chunks of the computation points at a time.
+
+    Parameters:
+
+    * func : function
+        The forward modeling function, called as ``func(xp, yp, zp, model,
+        *args, **kwargs)`` on each chunk (e.g.,
+        :func:`fatiando.gravmag.prism.gz`).
+    * xp, yp, zp : 1d-arrays or floats
+        The x, y, and z coordinates of the computation points (or longitude,
+        latitude and height for tesseroids). Can be ``numpy.memmap``. Floats
+        are used for all points.
+    * model : list
+        The model passed on to *func*.
+    * args : tuple
+        Extra positional arguments of *func* (e.g., the inclination and
+        declination for the total-field anomaly).
+    * kwargs : dict or None
+        Extra keyword arguments of *func*.
+    * out : array or None
+        The array where the results are written (can be a ``numpy.memmap``).
+        Must have one row per computation point (and one column per component
+        if *func* returns a list). If None, will allocate a new array.
+    * chunk_size : int
+        The number of computation points in each chunk.
+    * njobs : int
+        The number of processes used to calculate the chunks in parallel.
+
+    Returns:
+
+    * out : array
+        The field calculated on the computation points.
+
+    """
+    sizes = [np.size(c) for c in [xp, yp, zp] if np.ndim(c) > 0]
+    if any(np.ndim(c) > 1 for c in [xp, yp, zp]):
+        raise ValueError("Computation points must be 1d-arrays or floats")
+    if len(set(sizes)) > 1:
+        raise ValueError(
+            "Coordinate arrays must have the same size. Got {}".format(sizes))
+    size = sizes[0] if sizes else 1
+    if out is not None and len(out) != size:
+        raise ValueError(
+            "out has {} rows but there are {} points".format(len(out), size))
+    if chunk_size < 1:
+        raise ValueError("Invalid chunk size {}".format(chunk_size))
+    chunks = ([_slice(c, start, start + chunk_size) for c in [xp, yp, zp]]
+              for start in range(0, size, chunk_size))
+    start = 0
+    for res in iforward(func, chunks, model, args=args, kwargs=kwargs,
+                        njobs=njobs):
+        if out is None:
+            out = np.empty((size,) + res.shape[1:], dtype=res.dtype)
+        out[start:start + len(res)] = res
+        start += len(res)
+    if out is None:
+        out = np.empty(0)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def iforward(func, points, model, args=(), kwargs=None, njobs=1):
+    """
+    Calculate a field on each chunk of computation points of an iterator.
+
+    The results are generated one chunk at a time, in the same order as the
+    chunks. Only the chunks being calculated are kept in memory.
+
+    Parameters:
+
+    * func : function
+        The forward modeling function, called as ``func(xp, yp, zp, model,
+        *args, **kwargs)`` on each chunk (e.g.,
+        :func:`fatiando.gravmag.sphere.tf`).
+    * points : iterable
+        Produces the chunks of computation points as ``[xp, yp, zp]`` arrays
+        (floats are used for all points of the chunk).
+    * model : list
+        The model passed on to *func*.
+    * args : tuple
+        Extra positional arguments of *func*.
+    * kwargs : dict or None
+        Extra keyword arguments of *func*.
+    * njobs : int
+        The number of processes used to calculate the chunks in parallel.
+
+    Yields:
+
+    * res : array
+        The field calculated on each chunk. Has one column per component if
+        *func* returns a list.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> from fatiando.gravmag import sphere
+    >>> from fatiando.mesher import Sphere
+    >>> model = [Sphere(0, 0, 1000, 500, {'density': 1000})]
+    >>> x = np.linspace(-1000, 1000, 5)
+    >>> chunks = ([x, 0, z] for z in [-100, -200])
+    >>> for z, gz in zip([-100, -200], iforward(sphere.gz, chunks, model)):
+    ...     print(np.allclose(gz, sphere.gz(x, 0*x, z + 0*x, model)))
+    True
+    True
+    >>> chunks = [[x, 0, -100], [x[:2], 0, -200]]
+    >>> for tensor in iforward(sphere.tensor, chunks, model):
+    ...     print(tensor.shape)
+    (5, 6)
+    (2, 6)
+
+    """
+    if kwargs is None:
+        kwargs = {}
+    if njobs < 1:
+        raise ValueError("Invalid number of jobs {}".format(njobs))
+    if njobs == 1:
+        for chunk in points:
+            yield _evaluate(func, chunk, model, args, kwargs)
+        return
+    pool = multiprocessing.Pool(njobs, initializer=_init_worker,
+                                initargs=(func, model, args, kwargs))
+    try:
+        batch = []
+        for chunk in points:
+            batch.append(chunk)
+            if len(batch) == njobs:
+                for res in pool.map(_worker_evaluate, batch):
+                    yield res
+                batch = []
+        if batch:
+            for res in pool.map(_worker_evaluate, batch):
+                yield res
+        pool.close()
+    finally:
+        # Also stops the processes if the generator isn't consumed
+        pool.terminate()
+        pool.join()
+
+
+def _slice(coordinate, start, stop):
+    """
+    Get the chunk [start:stop] of a coordinate array. Floats are returned as
+    they are.
+    """
+    if np.ndim(coordinate) == 0:
+        return coordinate
+    return coordinate[start:stop]
+
+
+def _evaluate(func, chunk, model, args, kwargs):
+    """
+    Run the forward modeling function on a chunk of computation points.
+
+    The coordinates are loaded into contiguous arrays of the same size.
+    Functions that return a list of components produce a 2d-array with one
+    column per component.
+    """
+    xp, yp, zp = [np.ascontiguousarray(c, dtype=np.float)
+                  for c in np.broadcast_arrays(*chunk)]
+    res = func(xp, yp, zp, model, *args, **kwargs)
+    if isinstance(res, (list, tuple)):
+        return np.transpose(res)
+    return np.asarray(res)
+
+
+# Holds the forward modeling function and its arguments in each process
+_worker = {}
+
+
+def _init_worker(func, model, args, kwargs):
+    """
+    Store the forward modeling function and model in the worker process.
+    """
+    _worker['func'] = func
+    _worker['model'] = model
+    _worker['args'] = args
+    _worker['kwargs'] = kwargs
+
+
+def _worker_evaluate(chunk):
+    """
+    Run the forward modeling on a chunk in the worker process.
+    """
+    return _evaluate(_worker['func'], chunk, _worker['model'],
+                     _worker['args'], _worker['kwargs'])
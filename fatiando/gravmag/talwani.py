@@ -11,6 +11,16 @@ Use the :func:`~fatiando.mesher.Polygon` object to create polygons.
 
 * :func:`~fatiando.gravmag.talwani.gz`
 
+The edges of all polygons are evaluated at once (as arrays), so it is better
+to pass all polygons of a model in a single call than to call ``gz`` for each
+one of them.
+
+**Derivatives**
+
+* :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`: the analytical
+  derivatives of :math:`g_z` with respect to the coordinates of the vertices
+  of a polygon. Used to build the Jacobians of :mod:`fatiando.gravmag.basin2d`.
+
 **References**
 
 Talwani, M., J. L. Worzel, and M. Landisman (1959), Rapid Gravity Computations
@@ -23,7 +33,7 @@ Fracture Zone, J. Geophys. Res., 64(1), 49-59, doi:10.1029/JZ064i001p00049.
 from __future__ import absolute_import, division
 from future.builtins import range
 import numpy
-from numpy import arctan2, pi, sin, cos, log, tan
+from numpy import arctan2, sin, cos, log, tan
 
 from fatiando.constants import G, SI2MGAL
 
@@ -59,50 +69,189 @@ def gz(xp, zp, polygons, dens=None):
     """
     if xp.shape != zp.shape:
         raise ValueError("Input arrays xp and zp must have same shape!")
-    res = numpy.zeros_like(xp)
+    x1, z1, x2, z2, density = _edges(polygons, dens)
+    xp_, zp_ = [numpy.ravel(numpy.asarray(i, dtype=numpy.float))[numpy.newaxis]
+                for i in [xp, zp]]
+    res = numpy.zeros(xp_.size, dtype=numpy.float)
+    # Evaluate a few edges at a time so that the temporary (edges x points)
+    # arrays don't get too large
+    chunk = max(1, _CHUNK_SIZE//max(xp_.size, 1))
+    for i in range(0, x1.size, chunk):
+        edges = slice(i, i + chunk)
+        xv = x1[edges, numpy.newaxis] - xp_
+        zv = z1[edges, numpy.newaxis] - zp_
+        xvp1 = x2[edges, numpy.newaxis] - xp_
+        zvp1 = z2[edges, numpy.newaxis] - zp_
+        # The kernel is singular for points on an edge (or on a vertex). Move
+        # these points 0.01 meters up, like in gz_vertex_derivatives
+        on_edge = (xv*zvp1 - zv*xvp1 == 0) & (xv*xvp1 + zv*zvp1 <= 0)
+        zv[on_edge] += 0.01
+        zvp1[on_edge] += 0.01
+        res += density[edges].dot(_edge_kernel(xv, zv, xvp1, zvp1))
+    res *= SI2MGAL*2.0*G
+    return res.reshape(numpy.shape(xp))
+
+
+def gz_vertex_derivatives(xp, zp, polygon, dens=None):
+    """
+    Calculates the derivatives of :math:`g_z` with respect to the coordinates
+    of the vertices of a polygon.
+
+    Moving a vertex only changes the shape of the polygon along its two
+    edges. So the derivatives are line integrals of the :math:`g_z` kernel
+    along these edges (weighted by the normal displacement of the edge) and
+    can be calculated analytically. This is much faster and more accurate
+    than finite differences with perturbed polygons.
+
+    .. note:: The coordinate system of the input parameters is z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal/m**!
+
+    Parameters:
+
+    * xp, zp : arrays
+        The x and z coordinates of the computation points.
+    * polygon : :func:`~fatiando.mesher.Polygon`
+        The polygon. Must have the property ``'density'`` unless *dens* is
+        given.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the polygon.
+
+        .. note:: The y coordinate of the polygon is used as z!
+
+    Returns:
+
+    * dx, dz : 2d-arrays
+        The derivatives with respect to the x and z coordinates of each
+        vertex. Both have shape (number of points, number of vertices). For
+        example, ``dz[:, 2]`` is the derivative of :math:`g_z` with respect
+        to the z coordinate of the third vertex on all computation points.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import Polygon
+        >>> poly = Polygon([[100, 0], [0, 100], [-100, 0]], {'density': 1000})
+        >>> xp, zp = np.array([-50., 0, 80]), -np.ones(3)
+        >>> dx, dz = gz_vertex_derivatives(xp, zp, poly)
+        >>> dx.shape, dz.shape
+        ((3, 3), (3, 3))
+        >>> # Compare with a finite difference approximation
+        >>> up = Polygon([[100, 0], [0, 100.1], [-100, 0]], {'density': 1000})
+        >>> down = Polygon([[100, 0], [0, 99.9], [-100, 0]], {'density': 1000})
+        >>> diff = (gz(xp, zp, [up]) - gz(xp, zp, [down]))/0.2
+        >>> np.allclose(dz[:, 1], diff)
+        True
+
+    """
+    if xp.shape != zp.shape:
+        raise ValueError("Input arrays xp and zp must have same shape!")
+    if dens is None:
+        dens = polygon.props['density']
+    x1, z1, x2, z2, _ = _edges([polygon], dens)
+    xp_, zp_ = [numpy.ravel(numpy.asarray(i, dtype=numpy.float))[numpy.newaxis]
+                for i in [xp, zp]]
+    # The position of the vertices of each edge relative to the points
+    ax = x1[:, numpy.newaxis] - xp_
+    az = z1[:, numpy.newaxis] - zp_
+    bx = x2[:, numpy.newaxis] - xp_
+    bz = z2[:, numpy.newaxis] - zp_
+    deltax = bx - ax
+    deltaz = bz - az
+    # The integrals are singular for points on an edge (or on a vertex). Move
+    # these points 0.01 meters up, like the fix used in gz
+    on_edge = (ax*bz - az*bx == 0) & (ax*bx + az*bz <= 0)
+    az[on_edge] += 0.01
+    bz[on_edge] += 0.01
+    # Along the edge, the squared distance to the point is
+    # a*t**2 + b*t + c for t in [0, 1]
+    a = deltax**2 + deltaz**2
+    b = 2*(ax*deltax + az*deltaz)
+    c = ax**2 + az**2
+    cross = ax*bz - az*bx
+    dot = ax*bx + az*bz
+    # The integrals of t**n/(a*t**2 + b*t + c) from 0 to 1. The first is the
+    # angle that the edge subtends divided by the cross product. It tends to
+    # 1/dot if the point is aligned with the edge (but not on it).
+    aligned = cross == 0
+    int0 = numpy.arctan2(cross, dot)/numpy.where(aligned, 1, cross)
+    int0[aligned] = 1/dot[aligned]
+    int1 = (numpy.log((bx**2 + bz**2)/c) - b*int0)/(2*a)
+    int2 = (1 - b*int1 - c*int0)/a
+    # Integrals of the kernel times the displacement of the edge when moving
+    # its first (1 - t) or second (t) vertex
+    first = az*int0 + (deltaz - az)*int1 - deltaz*int2
+    second = az*int1 + deltaz*int2
+    # Each vertex is the first of one edge and the second of the previous one
+    scale = SI2MGAL*2.0*G*dens
+    nverts = polygon.nverts
+    dx = numpy.empty((xp_.size, nverts), dtype=numpy.float)
+    dz = numpy.empty((xp_.size, nverts), dtype=numpy.float)
+    previous = numpy.roll(numpy.arange(nverts), 1)
+    dx[:] = (scale*(deltaz*first + (deltaz*second)[previous])).T
+    dz[:] = (-scale*(deltax*first + (deltax*second)[previous])).T
+    return dx, dz
+
+
+# Maximum number of elements of the temporary arrays in gz
+_CHUNK_SIZE = 2**18
+
+
+def _edges(polygons, dens):
+    """
+    Get the coordinates of the vertices of the edges of all polygons and the
+    density of each edge.
+
+    Skips None and polygons without a density (unless *dens* is given).
+    """
+    x1, z1, x2, z2, density = [], [], [], [], []
     for polygon in polygons:
         if polygon is None or ('density' not in polygon.props and
                                dens is None):
             continue
         if dens is None:
-            density = polygon.props['density']
+            density.append(polygon.props['density']*numpy.ones(polygon.nverts))
         else:
-            density = dens
-        x = polygon.x
-        z = polygon.y
-        nverts = polygon.nverts
-        for v in range(nverts):
-            # Change the coordinates of this vertice
-            xv = x[v] - xp
-            zv = z[v] - zp
-            # The last vertice pairs with the first one
-            if v == nverts - 1:
-                xvp1 = x[0] - xp
-                zvp1 = z[0] - zp
-            else:
-                xvp1 = x[v + 1] - xp
-                zvp1 = z[v + 1] - zp
-            # Temporary fix. The analytical conditions for these limits don't
-            # work. So if the conditions are breached, sum 0.01 meters to the
-            # coodinates and be happy
-            xv[xv == 0.] += 0.01
-            xv[xv == xvp1] += 0.01
-            zv[zv[xv == zv] == 0.] += 0.01
-            zv[zv == zvp1] += 0.01
-            zvp1[zvp1[xvp1 == zvp1] == 0.] += 0.01
-            xvp1[xvp1 == 0.] += 0.01
-            # End of fix
-            phi_v = arctan2(zvp1 - zv, xvp1 - xv)
-            ai = xvp1 + zvp1 * (xvp1 - xv) / (zv - zvp1)
-            theta_v = arctan2(zv, xv)
-            theta_vp1 = arctan2(zvp1, xvp1)
-            theta_v[theta_v < 0] += pi
-            theta_vp1[theta_vp1 < 0] += pi
-            tmp = ai * sin(phi_v) * cos(phi_v) * (
-                theta_v - theta_vp1 + tan(phi_v) * log(
-                    (cos(theta_v) * (tan(theta_v) - tan(phi_v))) /
-                    (cos(theta_vp1) * (tan(theta_vp1) - tan(phi_v)))))
-            tmp[theta_v == theta_vp1] = 0.
-            res = res + tmp * density
-    res = res * SI2MGAL * 2.0 * G
-    return res
+            density.append(dens*numpy.ones(polygon.nverts))
+        x = numpy.asarray(polygon.x, dtype=numpy.float)
+        z = numpy.asarray(polygon.y, dtype=numpy.float)
+        # The last vertex pairs with the first one
+        x1.append(x)
+        z1.append(z)
+        x2.append(numpy.roll(x, -1))
+        z2.append(numpy.roll(z, -1))
+    if not density:
+        return [numpy.empty(0) for i in range(5)]
+    return [numpy.concatenate(i) for i in [x1, z1, x2, z2, density]]
+
+
+def _edge_kernel(xv, zv, xvp1, zvp1):
+    """
+    The Talwani et al. (1959) kernel of each edge on each point.
+
+    The arguments are the coordinates of the vertices of the edges relative
+    to the points (arrays with shape (edges, points)). They are modified in
+    place.
+    """
+    # Temporary fix. The analytical conditions for these limits don't
+    # work. So if the conditions are breached, sum 0.01 meters to the
+    # coodinates and be happy
+    xv[xv == 0.] += 0.01
+    xv[xv == xvp1] += 0.01
+    zv[zv == zvp1] += 0.01
+    xvp1[xvp1 == 0.] += 0.01
+    # End of fix
+    phi_v = arctan2(zvp1 - zv, xvp1 - xv)
+    ai = xvp1 + zvp1 * (xvp1 - xv) / (zv - zvp1)
+    # The angle that the edge subtends as seen from the point (theta_v -
+    # theta_vp1 in Talwani et al. (1959)). Taking it from the cross and dot
+    # products keeps it right for edges that cross the depth of the point.
+    cross = xvp1 * zv - zvp1 * xv
+    theta = arctan2(cross, xv * xvp1 + zv * zvp1)
+    # The ratio of the distances from the point to the vertices, which is
+    # what the ratio of cos(theta)*(tan(theta) - tan(phi)) reduces to
+    ratio = numpy.sqrt((xvp1**2 + zvp1**2) / (xv**2 + zv**2))
+    tmp = ai * sin(phi_v) * cos(phi_v) * (theta + tan(phi_v) * log(ratio))
+    tmp[cross == 0] = 0.
+    return tmp
@@ -64,6 +64,10 @@ Forward modeling of gravitational fields is performed by functions:
 :func:`~fatiando.gravmag.tesseroid.gyz`,
 :func:`~fatiando.gravmag.tesseroid.gzz`
 
+To calculate all components of the gravity vector and gradient tensor on the
+same points, use :func:`~fatiando.gravmag.tesseroid.components` instead. It
+divides the tesseroids only once for all components.
+
 The fields are calculated using Gauss-Legendre Quadrature integration and the
 adaptive discretization algorithm of Uieda et al. (2016). The accuracy of the
 integration is controlled by the ``ratio`` argument. Larger values cause finer
@@ -77,6 +81,42 @@ approximately 0.1%.
     points are closer than 1 km of the tesseroids. This effect is more
     significant in the gravity gradient components.
 
+The tesseroids are divided using a stack that grows when needed, so the
+computation points can be as close to the model as necessary (at the cost of
+many more divisions). The :class:`~fatiando.gravmag.tesseroid.Engine` reports
+the number of divisions and kernel evaluations of each call.
+
+The number of GLQ nodes used in each dimension is controlled by the ``glq``
+argument. The default 2 nodes per dimension requires a fine discretization.
+Higher orders (e.g., ``glq=(4, 4, 4)``) can reach the same accuracy with a
+smaller ``ratio`` and fewer divisions, which can be faster for computation
+points close to the model.
+
+All functions can run in parallel in two ways: ``njobs`` splits the
+computation points among processes (using ``multiprocessing``) and
+``parallel=True`` splits them among threads inside a single compiled function
+(using numba), which doesn't need to copy the model to other processes.
+
+Reusing the model and processes
+-------------------------------
+
+Each call to the functions above converts the model to arrays and, if
+``njobs > 1``, starts new processes and sends them the model. To compute
+several fields or grids for the same model, use a
+:class:`~fatiando.gravmag.tesseroid.Engine` instead. It keeps the model in
+shared memory and the worker processes (and their buffers) alive between
+calls. The densities can be changed in place (e.g., in an inversion) without
+restarting the workers.
+
+Sensitivity matrix
+------------------
+
+The adaptive discretization depends only on the geometry of the model and the
+computation points. In inversions, where only the densities change, use
+:func:`~fatiando.gravmag.tesseroid.sensitivity` to integrate the tesseroids
+only once. The field of any density model is then the product of the matrix
+and the density vector.
+
 References
 ++++++++++
 
@@ -95,6 +135,7 @@ import warnings
 import numpy as np
 from . import _tesseroid_numba
 from ..constants import SI2MGAL, SI2EOTVOS, MEAN_EARTH_RADIUS, G
+from ..mesher import TesseroidMesh
 from .._our_duecredit import due, Doi, BibTeX
 
 
@@ -104,17 +145,36 @@ due.cite(Doi("10.1190/geo2015-0204.1"),
 RATIO_V = 1
 RATIO_G = 1.6
 RATIO_GG = 8
+# The initial size of the stack used to divide the tesseroids. The stack grows
+# if the subdivision doesn't fit in it.
 STACK_SIZE = 100
+# The default number of GLQ nodes in longitude, latitude and radius
+GLQ_ORDER = (2, 2, 2)
+# The fields calculated by the combined kernel (in this order)
+COMPONENTS = ['gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+# The default ratio and the constant that converts the results to the output
+# units of each field
+FIELDS = {'potential': (RATIO_V, G),
+          'gx': (RATIO_G, SI2MGAL*G),
+          'gy': (RATIO_G, SI2MGAL*G),
+          'gz': (RATIO_G, SI2MGAL*G),
+          'gxx': (RATIO_GG, SI2EOTVOS*G),
+          'gxy': (RATIO_GG, SI2EOTVOS*G),
+          'gxz': (RATIO_GG, SI2EOTVOS*G),
+          'gyy': (RATIO_GG, SI2EOTVOS*G),
+          'gyz': (RATIO_GG, SI2EOTVOS*G),
+          'gzz': (RATIO_GG, SI2EOTVOS*G),
+          'components': (RATIO_GG,
+                         np.array(3*[SI2MGAL*G] + 6*[SI2EOTVOS*G]))}
+# The model and buffers of the worker processes of Engine
+_worker = {}
 
 
 def _check_input(lon, lat, height, model, ratio, njobs, pool):
     """
-    Check if the inputs are as expected and generate the output array.
-
-    Returns:
-
-    * results : 1d-array, zero filled
+    Check if the inputs are as expected.
 
+    The output array is allocated by the callers (see ``_output``).
     """
     assert lon.shape == lat.shape == height.shape, \
         "Input coordinate arrays must have same shape"
@@ -122,8 +182,36 @@ def _check_input(lon, lat, height, model, ratio, njobs, pool):
     assert njobs > 0, "Invalid number of jobs {}. Must be > 0.".format(njobs)
     if njobs == 1:
         assert pool is None, "njobs should be number of processes in the pool"
-    result = np.zeros_like(lon)
-    return result
+
+
+def _output(field, lon):
+    """
+    Make the zero filled output array for *field*.
+
+    The array has one column per component (see COMPONENTS) if *field* is
+    ``'components'``.
+    """
+    if field == 'components':
+        return np.zeros((lon.size, len(COMPONENTS)))
+    return np.zeros_like(lon)
+
+
+def _glq(order):
+    """
+    Get the GLQ nodes and weights for the given number of nodes in longitude,
+    latitude and radius.
+
+    Returns:
+
+    * nodes, weights : tuples of 3 1d-arrays
+        The nodes (in [-1, 1]) and weights for each dimension.
+
+    """
+    assert len(order) == 3 and all(o > 0 for o in order), \
+        "Invalid GLQ order {}. Must be 3 integers > 0.".format(order)
+    nodes, weights = zip(*[np.polynomial.legendre.leggauss(o)
+                           for o in order])
+    return nodes, weights
 
 
 def _convert_coords(lon, lat, height):
@@ -172,6 +260,55 @@ def _check_tesseroid(tesseroid, dens):
     return density
 
 
+def _model_arrays(model, dens):
+    """
+    Get the bounds and densities of the valid tesseroids in the model.
+
+    Returns:
+
+    * bounds, density : 2d-array, 1d-array
+        The (M, 6) array with the bounds ``[w, e, s, n, top, bottom]`` and the
+        density of each tesseroid that should be used in the computations.
+
+    """
+    if isinstance(model, TesseroidMesh):
+        return _mesh_arrays(model, dens)
+    bounds, density = [], []
+    for tesseroid in model:
+        value = _check_tesseroid(tesseroid, dens)
+        if value is None:
+            continue
+        bounds.append(tesseroid.get_bounds())
+        density.append(value)
+    bounds = np.array(bounds, dtype='float').reshape((len(density), 6))
+    density = np.array(density, dtype='float')
+    return bounds, density
+
+
+def _mesh_arrays(mesh, dens):
+    """
+    Get the bounds and densities of the valid tesseroids of a TesseroidMesh.
+
+    Uses the arrays of the mesh instead of creating each tesseroid. All
+    tesseroids in a mesh have the same dimensions, so they are either all
+    valid or all too small.
+    """
+    empty = np.zeros((0, 6), dtype='float'), np.zeros(0, dtype='float')
+    if 'density' not in mesh.props and dens is None:
+        return empty
+    keep = ~mesh.mask
+    bounds = mesh.cell_bounds[keep]
+    if bounds.size > 0:
+        value = _check_tesseroid(mesh.celltype(*bounds[0]), 0)
+        if value is None:
+            return empty
+    if dens is not None:
+        density = dens*np.ones(len(bounds), dtype='float')
+    else:
+        density = np.asarray(mesh.props['density'], dtype='float')[keep]
+    return np.ascontiguousarray(bounds), density
+
+
 def _dispatcher(field, lon, lat, height, model, **kwargs):
     """
     Dispatch the computation of *field* to the appropriate function.
@@ -185,20 +322,25 @@ def _dispatcher(field, lon, lat, height, model, **kwargs):
     pool = kwargs.get('pool', None)
     dens = kwargs['dens']
     ratio = kwargs['ratio']
-    result = _check_input(lon, lat, height, model, ratio, njobs, pool)
+    parallel = kwargs.get('parallel', False)
+    glq = kwargs.get('glq', GLQ_ORDER)
+    _check_input(lon, lat, height, model, ratio, njobs, pool)
+    result = _output(field, lon)
+    bounds, density = _model_arrays(model, dens)
     if njobs > 1 and pool is None:
         pool = multiprocessing.Pool(njobs)
         created_pool = True
     else:
         created_pool = False
     if pool is None:
-        _forward_model([lon, lat, height, result, model, dens, ratio,
-                        field])
+        _forward_model([lon, lat, height, result, bounds, density, ratio,
+                        glq, field, parallel])
     else:
         chunks = _split_arrays(arrays=[lon, lat, height, result],
-                               extra_args=[model, dens, ratio, field],
+                               extra_args=[bounds, density, ratio, glq, field,
+                                           parallel],
                                nparts=njobs)
-        result = np.hstack(pool.map(_forward_model, chunks))
+        result = np.concatenate(pool.map(_forward_model, chunks))
     if created_pool:
         pool.close()
     return result
@@ -213,35 +355,291 @@ def _forward_model(args):
 
     Arguments should be, in order:
 
-    lon, lat, height, result, model, dens, ratio, field
+    lon, lat, height, result, bounds, density, ratio, glq, field, parallel
     """
-    lon, lat, height, result, model, dens, ratio, field = args
-    lon, sinlat, coslat, radius = _convert_coords(lon, lat, height)
-    func = getattr(_tesseroid_numba, field)
-    warning_msg = (
-        "Stopped dividing a tesseroid because it's dimensions would be " +
-        "below the minimum numerical threshold (1e-6 degrees or 1e-3 m). " +
-        "Will compute without division. Cannot guarantee the accuracy of " +
-        "the solution.")
-    # Arrays needed by the kernel. Can't allocate them inside the kernel
-    # because numba doesn't like that.
-    stack = np.empty((STACK_SIZE, 6), dtype='float')
-    lonc = np.empty(2, dtype='float')
-    sinlatc = np.empty(2, dtype='float')
-    coslatc = np.empty(2, dtype='float')
-    rc = np.empty(2)
-    for tesseroid in model:
-        density = _check_tesseroid(tesseroid, dens)
-        if density is None:
-            continue
-        bounds = np.array(tesseroid.get_bounds())
-        error = func(lon, sinlat, coslat, radius, bounds, density, ratio,
-                     stack, lonc, sinlatc, coslatc, rc, result)
-        if error != 0:
-            warnings.warn(warning_msg, RuntimeWarning)
+    (lon, lat, height, result, bounds, density, ratio, glq, field,
+     parallel) = args
+    _compute(field, lon, lat, height, bounds, density, ratio, glq,
+             _buffers(glq), result, parallel)
     return result
 
 
+def _buffers(glq=GLQ_ORDER):
+    """
+    Allocate the arrays needed by the numba engine.
+
+    Returns a list with the stack and the arrays for the GLQ nodes scaled to
+    the integration limits (lonc, sinlatc, coslatc, rc). *glq* is the number
+    of nodes in longitude, latitude and radius.
+
+    Each row of the stack has the bounds of a tesseroid and its depth in the
+    subdivision tree.
+    """
+    stack = np.empty((STACK_SIZE, 7), dtype='float')
+    lonc = np.empty(glq[0], dtype='float')
+    sinlatc = np.empty(glq[1], dtype='float')
+    coslatc = np.empty(glq[1], dtype='float')
+    rc = np.empty(glq[2], dtype='float')
+    return [stack, lonc, sinlatc, coslatc, rc]
+
+
+def _compute(field, lon, lat, height, bounds, density, ratio, glq, buffers,
+             result, parallel=False):
+    """
+    Add the effect of the tesseroids (given as arrays) to result.
+
+    The result is in SI units and without the gravitational constant. If
+    *parallel* is True, will use the multithreaded engine (which allocates its
+    own buffers). The buffers are replaced in place if they don't match the
+    GLQ order or if the stack grew, so they can be reused on the next call.
+
+    Returns:
+
+    * stats : 1d-array
+        The number of kernel evaluations, the number of splits and the
+        maximum depth of the subdivision.
+
+    """
+    lon, sinlat, coslat, radius = _convert_coords(lon, lat, height)
+    nodes, weights = _glq(glq)
+    # The numba engines take one column per field component
+    values = result.reshape((result.shape[0], -1))
+    stats = np.zeros(3, dtype='int64')
+    sizes = [b.shape[0] for b in buffers[1:]]
+    if sizes != [glq[0], glq[1], glq[1], glq[2]]:
+        buffers[:] = _buffers(glq)
+    if parallel:
+        func = _tesseroid_numba.parallel[field]
+        error, _ = func(lon, sinlat, coslat, radius, bounds, density, ratio,
+                        nodes, weights, buffers[0], values, stats)
+    else:
+        func = getattr(_tesseroid_numba, field)
+        stack, lonc, sinlatc, coslatc, rc = buffers
+        error, buffers[0] = func(lon, sinlat, coslat, radius, bounds,
+                                 density, ratio, nodes, weights, stack, lonc,
+                                 sinlatc, coslatc, rc, values, stats)
+    _check_errors(error)
+    return stats
+
+
+def _merge_stats(stats):
+    """
+    Combine the subdivision statistics of several calls to _compute into a
+    dictionary.
+    """
+    stats = np.atleast_2d(stats)
+    return {'kernel_evaluations': int(stats[:, 0].sum()),
+            'splits': int(stats[:, 1].sum()),
+            'max_depth': int(stats[:, 2].max())}
+
+
+def _check_errors(error):
+    """
+    Warn about tesseroids that were too small to divide if the error count
+    returned by the numba engines is not zero.
+    """
+    if error != 0:
+        warning_msg = (
+            "Stopped dividing a tesseroid because it's dimensions would be " +
+            "below the minimum numerical threshold (1e-6 degrees or 1e-3 " +
+            "m). Will compute without division. Cannot guarantee the " +
+            "accuracy of the solution.")
+        warnings.warn(warning_msg, RuntimeWarning)
+
+
+class Engine(object):
+    """
+    Forward model the gravitational fields of a tesseroid model many times.
+
+    Converts the model to arrays of bounds and densities only once and keeps
+    them in shared memory. If ``njobs > 1``, starts the worker processes once
+    and reuses them (and their preallocated buffers) on every call. Use this
+    to avoid the overhead of starting processes and sending the model to them
+    when calculating many fields or grids for the same model.
+
+    Call :meth:`~fatiando.gravmag.tesseroid.Engine.close` when done (or use
+    the engine in a ``with`` block) to stop the worker processes.
+
+    After each call to :meth:`~fatiando.gravmag.tesseroid.Engine.calculate`,
+    the ``stats`` attribute is a dictionary with statistics of the adaptive
+    discretization: the number of kernel evaluations, one per GLQ node of
+    each integrated tesseroid (``'kernel_evaluations'``), the number of times
+    a tesseroid was divided (``'splits'``) and the maximum depth of the
+    subdivision (``'max_depth'``).
+
+    Parameters:
+
+    * model : list of :class:`~fatiando.mesher.Tesseroid`
+        The density model. Tesseroids that are None, don't have a
+        ``'density'`` property, or are too small are ignored (see
+        :func:`~fatiando.gravmag.tesseroid.gz`).
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the tesseroids.
+    * njobs : int
+        Number of processes used to split the computation points. If
+        ``njobs=1``, will run in this process.
+    * parallel : bool
+        If True, will split the computation points among threads (see
+        :func:`~fatiando.gravmag.tesseroid.gz`).
+
+    Examples:
+
+    >>> from fatiando.mesher import TesseroidMesh
+    >>> from fatiando import gridder
+    >>> model = TesseroidMesh((0, 1, 0, 1, 0, -10000), (1, 2, 2))
+    >>> model.addprop('density', [200, 300, 400, 500])
+    >>> lon, lat, height = gridder.regular((0, 1, 0, 1), (5, 5), z=10000)
+    >>> with Engine(model, njobs=2) as engine:
+    ...     first = engine.calculate('gz', lon, lat, height)
+    ...     # Change the densities without restarting the processes
+    ...     engine.density[:] = 1000
+    ...     second = engine.calculate('gz', lon, lat, height)
+    >>> np.allclose(first, gz(lon, lat, height, model))
+    True
+    >>> np.allclose(second, gz(lon, lat, height, model, dens=1000))
+    True
+
+    """
+
+    def __init__(self, model, dens=None, njobs=1, parallel=False):
+        assert njobs > 0, \
+            "Invalid number of jobs {}. Must be > 0.".format(njobs)
+        bounds, density = _model_arrays(model, dens)
+        self.njobs = njobs
+        self.parallel = parallel
+        self.size = density.size
+        # Allocate at least one element because empty buffers are invalid
+        self._shared = [
+            multiprocessing.RawArray('d', max(1, bounds.size)),
+            multiprocessing.RawArray('d', max(1, density.size)),
+            self.size]
+        self._bounds, self._density = _shared_arrays(*self._shared)
+        self._bounds[:] = bounds
+        self._density[:] = density
+        self._buffers = _buffers()
+        self.stats = None
+        self.pool = None
+        if njobs > 1:
+            self.pool = multiprocessing.Pool(njobs, initializer=_init_worker,
+                                             initargs=self._shared)
+
+    @property
+    def density(self):
+        """
+        The densities of the tesseroids used in the computations.
+
+        This array is shared with the worker processes. Assign to it (e.g.,
+        ``engine.density[:] = new``) to change the densities.
+        """
+        return self._density
+
+    def calculate(self, field, lon, lat, height, ratio=None,
+                  glq=GLQ_ORDER):
+        """
+        Calculate a gravitational field of the model.
+
+        Parameters:
+
+        * field : str
+            The field to calculate. One of: ``'potential'``, ``'gx'``,
+            ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+            ``'gyz'``, ``'gzz'``, ``'components'`` (all components of the
+            gravity vector and gradient tensor, see
+            :func:`~fatiando.gravmag.tesseroid.components`).
+        * lon, lat, height : arrays
+            Arrays with the longitude, latitude and height coordinates of the
+            computation points.
+        * ratio : float or None
+            Will divide each tesseroid until the distance between it and the
+            computation points is < ratio*size of tesseroid. If None, will use
+            the default value for the field (the same as the corresponding
+            function of this module).
+        * glq : tuple of 3 ints
+            The number of GLQ nodes in longitude, latitude and radius.
+
+        Returns:
+
+        * res : array or list of arrays
+            The calculated field in the same units as the corresponding
+            function of this module.
+
+        """
+        assert field in FIELDS, "Invalid field '{}'".format(field)
+        default_ratio, scale = FIELDS[field]
+        if ratio is None:
+            ratio = default_ratio
+        _check_input(lon, lat, height, None, ratio, 1, None)
+        result = _output(field, lon)
+        if self.pool is None:
+            stats = _compute(field, lon, lat, height, self._bounds,
+                             self._density, ratio, glq, self._buffers, result,
+                             self.parallel)
+        else:
+            chunks = _split_arrays(arrays=[lon, lat, height],
+                                   extra_args=[ratio, glq, field,
+                                               self.parallel],
+                                   nparts=self.njobs)
+            results, stats = zip(*self.pool.map(_engine_forward, chunks))
+            result = np.concatenate(results)
+        self.stats = _merge_stats(stats)
+        result *= scale
+        if field == 'components':
+            return list(result.T)
+        return result
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _shared_arrays(bounds, density, size):
+    """
+    Make numpy arrays that use the shared memory of the model.
+    """
+    bounds = np.frombuffer(bounds, dtype='float')[:6*size].reshape((size, 6))
+    density = np.frombuffer(density, dtype='float')[:size]
+    return bounds, density
+
+
+def _init_worker(bounds, density, size):
+    """
+    Store the shared model and allocate the buffers of a worker process.
+    """
+    _worker['bounds'], _worker['density'] = _shared_arrays(bounds, density,
+                                                           size)
+    _worker['buffers'] = _buffers()
+
+
+def _engine_forward(args):
+    """
+    Calculate a field of the model of the worker process.
+
+    Arguments should be, in order:
+
+    lon, lat, height, ratio, glq, field, parallel
+
+    Returns the result and the statistics of the subdivision.
+    """
+    lon, lat, height, ratio, glq, field, parallel = args
+    result = _output(field, lon)
+    stats = _compute(field, lon, lat, height, _worker['bounds'],
+                     _worker['density'], ratio, glq, _worker['buffers'],
+                     result, parallel)
+    return result, stats
+
+
 def _split_arrays(arrays, extra_args, nparts):
     """
     Split the coordinate arrays into nparts. Add extra_args to each part.
@@ -267,7 +665,7 @@ def _split_arrays(arrays, extra_args, nparts):
 
 
 def potential(lon, lat, height, model, dens=None, ratio=RATIO_V,
-              njobs=1, pool=None):
+              njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the gravitational potential due to a tesseroid model.
 
@@ -301,6 +699,16 @@ def potential(lon, lat, height, model, dens=None, ratio=RATIO_V,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -316,13 +724,14 @@ def potential(lon, lat, height, model, dens=None, ratio=RATIO_V,
     """
     field = 'potential'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= G
     return result
 
 
 def gx(lon, lat, height, model, dens=None, ratio=RATIO_G,
-       njobs=1, pool=None):
+       njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the North component of the gravitational attraction.
 
@@ -356,6 +765,16 @@ def gx(lon, lat, height, model, dens=None, ratio=RATIO_G,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -371,13 +790,14 @@ def gx(lon, lat, height, model, dens=None, ratio=RATIO_G,
     """
     field = 'gx'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2MGAL*G
     return result
 
 
 def gy(lon, lat, height, model, dens=None, ratio=RATIO_G,
-       njobs=1, pool=None):
+       njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the East component of the gravitational attraction.
 
@@ -411,6 +831,16 @@ def gy(lon, lat, height, model, dens=None, ratio=RATIO_G,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -426,13 +856,14 @@ def gy(lon, lat, height, model, dens=None, ratio=RATIO_G,
     """
     field = 'gy'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2MGAL*G
     return result
 
 
 def gz(lon, lat, height, model, dens=None, ratio=RATIO_G,
-       njobs=1, pool=None):
+       njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the radial component of the gravitational attraction.
 
@@ -471,6 +902,16 @@ def gz(lon, lat, height, model, dens=None, ratio=RATIO_G,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -486,13 +927,14 @@ def gz(lon, lat, height, model, dens=None, ratio=RATIO_G,
     """
     field = 'gz'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2MGAL*G
     return result
 
 
 def gxx(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the xx component of the gravity gradient tensor.
 
@@ -526,6 +968,16 @@ def gxx(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -541,13 +993,14 @@ def gxx(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gxx'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
 
 
 def gxy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the xy component of the gravity gradient tensor.
 
@@ -581,6 +1034,16 @@ def gxy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -596,13 +1059,14 @@ def gxy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gxy'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
 
 
 def gxz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the xz component of the gravity gradient tensor.
 
@@ -636,6 +1100,16 @@ def gxz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -651,13 +1125,14 @@ def gxz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gxz'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
 
 
 def gyy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the yy component of the gravity gradient tensor.
 
@@ -691,6 +1166,16 @@ def gyy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -706,13 +1191,14 @@ def gyy(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gyy'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
 
 
 def gyz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the yz component of the gravity gradient tensor.
 
@@ -746,6 +1232,16 @@ def gyz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -761,13 +1257,14 @@ def gyz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gyz'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
 
 
 def gzz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
-        njobs=1, pool=None):
+        njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
     """
     Calculate the zz component of the gravity gradient tensor.
 
@@ -801,6 +1298,16 @@ def gzz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
         instead of creating a new one. You must still specify *njobs* as the
         number of processes in the pool. Use this to avoid spawning processes
         on each call to this functions, which can have significant overhead.
+    * parallel : bool
+        If True, will calculate the effect of all tesseroids in a single
+        compiled function that splits the computation points among threads.
+        Uses all cores available to numba (set the ``NUMBA_NUM_THREADS``
+        environment variable to change this) without starting new processes.
+    * glq : tuple of 3 ints
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        (divided) tesseroid in longitude, latitude and radius. Higher orders
+        are more accurate for the same *ratio*, so they can be combined with
+        a smaller *ratio* to divide the tesseroids less.
 
     Returns:
 
@@ -816,6 +1323,168 @@ def gzz(lon, lat, height, model, dens=None, ratio=RATIO_GG,
     """
     field = 'gzz'
     result = _dispatcher(field, lon, lat, height, model, dens=dens,
-                         ratio=ratio, njobs=njobs, pool=pool)
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
     result *= SI2EOTVOS*G
     return result
+
+
+def components(lon, lat, height, model, dens=None, ratio=RATIO_GG,
+               njobs=1, pool=None, parallel=False, glq=GLQ_ORDER):
+    """
+    Calculate all components of the gravitational attraction and the gravity
+    gradient tensor.
+
+    The tesseroids are divided only once for all components and the distances
+    and trigonometric functions are computed only once for each GLQ node. This
+    is faster than calling the function for each component separately.
+
+    .. note:: The same *ratio* is used for all components. The default is the
+        one used for the gravity gradient tensor, so the gravity components
+        are calculated with more accuracy (and more slowly) than by
+        :func:`~fatiando.gravmag.tesseroid.gz`.
+
+    Parameters:
+
+    See :func:`~fatiando.gravmag.tesseroid.gz`.
+
+    Returns:
+
+    * gx, gy, gz, gxx, gxy, gxz, gyy, gyz, gzz : arrays
+        The calculated components. The gravity components are in mGal and
+        the gradient components in Eotvos.
+
+    Examples:
+
+    >>> from fatiando.mesher import TesseroidMesh
+    >>> from fatiando import gridder
+    >>> model = TesseroidMesh((0, 1, 0, 1, 0, -10000), (1, 2, 2))
+    >>> model.addprop('density', [200, 300, 400, 500])
+    >>> lon, lat, height = gridder.regular((0, 1, 0, 1), (5, 5), z=10000)
+    >>> fields = components(lon, lat, height, model)
+    >>> np.allclose(fields[2], gz(lon, lat, height, model, ratio=RATIO_GG))
+    True
+    >>> np.allclose(fields[-1], gzz(lon, lat, height, model))
+    True
+
+    """
+    field = 'components'
+    result = _dispatcher(field, lon, lat, height, model, dens=dens,
+                         ratio=ratio, njobs=njobs, pool=pool,
+                         parallel=parallel, glq=glq)
+    result *= FIELDS[field][1]
+    return list(result.T)
+
+
+def sensitivity(field, lon, lat, height, model, ratio=None, out=None,
+                dtype='float64', parallel=False, glq=GLQ_ORDER):
+    """
+    Calculate the sensitivity (Jacobian) matrix of a field for a tesseroid
+    model.
+
+    Element ``[i, j]`` of the matrix is the field produced on the ith
+    computation point by the jth tesseroid with unit density. So the field
+    produced by the model is ``numpy.dot(sens, density)``. The adaptive
+    discretization is done only once for each tesseroid and point, so use
+    this instead of the forward modeling functions when calculating the
+    effect of many density models with the same geometry (e.g., in an
+    inversion).
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'potential'``, ``'gx'``, ``'gy'``,
+        ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``,
+        ``'gzz'``.
+    * lon, lat, height : arrays
+        Arrays with the longitude, latitude and height coordinates of the
+        computation points.
+    * model : list of :class:`~fatiando.mesher.Tesseroid`
+        The model. Elements that are None (like masked cells of a mesh) or are
+        too small (see :func:`~fatiando.gravmag.tesseroid.gz`) get a column of
+        zeros. The ``'density'`` property is not used.
+    * ratio : float or None
+        Will divide each tesseroid until the distance between it and the
+        computation points is < ratio*size of tesseroid. If None, will use
+        the default value for the field (the same as the corresponding
+        function of this module).
+    * out : 2d-array or None
+        An array with shape (N, M) and dtype float32 or float64 to put the
+        matrix in (for example, a preallocated buffer or a ``numpy.memmap``).
+        If None, a new array will be created.
+    * dtype : numpy dtype
+        The dtype of the new matrix. Ignored if *out* is given.
+    * parallel : bool
+        If True, will split the computation points among threads (see
+        :func:`~fatiando.gravmag.tesseroid.gz`).
+    * glq : tuple of 3 ints
+        The number of GLQ nodes in longitude, latitude and radius (see
+        :func:`~fatiando.gravmag.tesseroid.gz`).
+
+    Returns:
+
+    * sens : 2d-array
+        The sensitivity matrix with shape (N, M) in the same units as the
+        corresponding function of this module per unit density. If *out* was
+        given, it is returned.
+
+    Examples:
+
+    >>> from fatiando.mesher import TesseroidMesh
+    >>> from fatiando import gridder
+    >>> model = TesseroidMesh((0, 1, 0, 1, 0, -10000), (1, 2, 2))
+    >>> lon, lat, height = gridder.regular((0, 1, 0, 1), (5, 5), z=10000)
+    >>> sens = sensitivity('gz', lon, lat, height, model)
+    >>> sens.shape
+    (25, 4)
+    >>> density = np.array([200, 300, 400, 500])
+    >>> model.addprop('density', density)
+    >>> np.allclose(sens.dot(density), gz(lon, lat, height, model))
+    True
+
+    """
+    assert field in FIELDS and field != 'components', \
+        "Invalid field '{}'".format(field)
+    default_ratio, scale = FIELDS[field]
+    if ratio is None:
+        ratio = default_ratio
+    _check_input(lon, lat, height, None, ratio, 1, None)
+    nodes, weights = _glq(glq)
+    if isinstance(model, TesseroidMesh):
+        # Use the arrays of the mesh instead of creating each tesseroid
+        bounds = _mesh_arrays(model, 1)[0]
+        index = np.flatnonzero(~model.mask) if bounds.size else []
+    else:
+        index, bounds = [], []
+        for i, tesseroid in enumerate(model):
+            if _check_tesseroid(tesseroid, 1) is None:
+                continue
+            index.append(i)
+            bounds.append(tesseroid.get_bounds())
+        bounds = np.array(bounds, dtype='float').reshape((len(index), 6))
+    shape = (lon.size, len(model))
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    else:
+        assert out.shape == shape, \
+            "Invalid out with shape {}. Should be {}.".format(out.shape, shape)
+        out[:] = 0
+    if len(index) == len(model):
+        columns = out
+    else:
+        columns = np.empty((shape[0], len(index)), dtype=out.dtype)
+    lon, sinlat, coslat, radius = _convert_coords(lon.ravel(), lat.ravel(),
+                                                  height.ravel())
+    if parallel:
+        func = _tesseroid_numba.parallel_sensitivity[field]
+    else:
+        func = _tesseroid_numba.sensitivity[field]
+    stack = np.empty((STACK_SIZE, 7), dtype='float')
+    stats = np.zeros(3, dtype='int64')
+    error = func(lon, sinlat, coslat, radius, bounds, ratio, nodes, weights,
+                 stack, columns, stats)
+    _check_errors(error)
+    if columns is not out:
+        out[:, index] = columns
+    out *= scale
+    return out
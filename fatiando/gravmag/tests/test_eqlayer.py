@@ -4,7 +4,7 @@ import numpy as np
 from numpy.testing import assert_allclose, assert_array_almost_equal
 from ..eqlayer import EQLGravity, EQLTotalField, PELGravity, PELTotalField, \
     PELSmoothness
-from ...inversion import Damping
+from ...inversion import Damping, Smoothness2D, TotalVariation2D
 from .. import sphere, prism
 from ...mesher import PointGrid, Prism
 from ... import utils, gridder
@@ -120,6 +120,142 @@ def test_eqlgrav_prism_interp():
     assert_allclose(calc, true, rtol=0.05)
 
 
+def test_eqlgrav_jacobian_on_disk():
+    "EQLGravity gives the same result with the Jacobian stored on disk"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 300, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, (10, 10))
+    weights = np.linspace(0.5, 1.5, data.size)
+    true = (EQLGravity(x, y, z, data, layer).set_weights(weights) +
+            1e-23*Damping(layer.size)).fit().estimate_
+    old = utils.MEMMAP_BLOCK_SIZE
+    try:
+        # Force the products to be calculated in several blocks
+        utils.MEMMAP_BLOCK_SIZE = 2000
+        misfit = EQLGravity(x, y, z, data, layer).store_jacobian()
+        misfit.set_weights(weights)
+        eql = (misfit + 1e-23*Damping(layer.size)).fit()
+    finally:
+        utils.MEMMAP_BLOCK_SIZE = old
+    assert isinstance(eql[0].jacobian(None), np.memmap)
+    assert_allclose(eql.estimate_, true, rtol=1e-8)
+    assert_allclose(eql[0].predicted(), misfit.predicted(true), rtol=1e-8)
+
+
+def test_store_jacobian_in_blocks():
+    "The equivalent layers fill the Jacobian on disk a block of rows at a time"
+    class NoFullJacobian(object):
+        "Fail if the whole Jacobian is calculated in memory"
+        def jacobian(self, p):
+            raise AssertionError("Calculated the whole Jacobian")
+
+    class EQL(NoFullJacobian, EQLGravity):
+        pass
+
+    class PEL(NoFullJacobian, PELGravity):
+        pass
+
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 300, z=-100, seed=42)
+    data = np.ones_like(x)
+    layer = PointGrid(area, 200, (10, 10))
+    old = utils.MEMMAP_BLOCK_SIZE
+    try:
+        utils.MEMMAP_BLOCK_SIZE = 2000
+        for stored, true in [
+                (EQL(x, y, z, data, layer), EQLGravity(x, y, z, data, layer)),
+                (PEL(x, y, z, data, layer, (2, 2), 1),
+                 PELGravity(x, y, z, data, layer, (2, 2), 1))]:
+            jacobian = stored.store_jacobian().jacobian(None)
+            assert isinstance(jacobian, np.memmap)
+            assert_allclose(jacobian, true.jacobian(None), rtol=1e-12)
+    finally:
+        utils.MEMMAP_BLOCK_SIZE = old
+
+
+def test_eqlgrav_cgls():
+    "EQLGravity with the cgls method gives the same as the linear solver"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 300, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, (10, 10))
+    weights = np.linspace(0.5, 1.5, data.size)
+    eql = (EQLGravity(x, y, z, data, layer).set_weights(weights) +
+           1e-22*Damping(layer.size) + 1e-22*Smoothness2D(layer.shape))
+    true = eql.config('linear').fit().estimate_
+    eql.config('cgls', tol=1e-10, maxit=10000).fit()
+    assert eql.stats_['method'] == 'CGLS'
+    assert_allclose(eql.estimate_, true, rtol=1e-5, atol=1e-5*np.abs(
+        true).max())
+    # Early stopping
+    eql.config('cgls', maxit=3).fit()
+    assert eql.stats_['iterations'] == 3
+    assert len(eql.stats_['objective']) == 4
+    # Regularizations without a least-squares form can't be used
+    eql = EQLGravity(x, y, z, data, layer) + \
+        1e-22*TotalVariation2D(1e-5, layer.shape)
+    with pytest.raises(ValueError) as error:
+        eql.lsq_system()
+    assert 'TotalVariation2D' in str(error.value)
+
+
+def test_eqlgrav_compressed():
+    "EQLGravity with a compressed Jacobian matches the dense one"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 600, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, (20, 20))
+    dense = EQLGravity(x, y, z, data, layer)
+    compressed = EQLGravity(x, y, z, data, layer, compress=1e-6)
+    jac = compressed.jacobian(None)
+    assert jac.compression < 1
+    p = np.random.RandomState(0).uniform(size=layer.size)
+    assert_allclose(compressed.predicted(p), dense.predicted(p), rtol=1e-4)
+    with pytest.raises(ValueError):
+        compressed.hessian(None)
+    true = (dense + 1e-22*Damping(layer.size)).config(
+        'cgls', tol=1e-8).fit().estimate_
+    eql = (compressed + 1e-22*Damping(layer.size)).config(
+        'cgls', tol=1e-8).fit()
+    assert_allclose(eql.estimate_, true, rtol=1e-3,
+                    atol=1e-3*np.abs(true).max())
+
+
+def test_eqlayer_treecode():
+    "EQLGravity and EQLTotalField with the tree code match the dense matrix"
+    model = [Prism(-300, 300, -500, 500, 100, 600,
+                   {'density': 400,
+                    'magnetization': utils.ang2vec(2, -20, 30)})]
+    inc, dec = -30, 20
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 600, z=-100, seed=42)
+    layer = PointGrid(area, 200, (20, 20))
+    p = np.random.RandomState(0).uniform(size=layer.size)
+    gz = prism.gz(x, y, z, model)
+    tf = prism.tf(x, y, z, model, inc, dec)
+    spheres = [layer[i] for i in range(layer.size)]
+    pmag = utils.ang2vec(1, -20, 30)
+    gz_jac = np.transpose([sphere.gz(x, y, z, [s], dens=1) for s in spheres])
+    tf_jac = np.transpose([sphere.tf(x, y, z, [s], inc, dec, pmag=pmag)
+                           for s in spheres])
+    for dense, tree in [(gz_jac, EQLGravity(x, y, z, gz, layer, theta=0.3)),
+                        (tf_jac, EQLTotalField(x, y, z, tf, inc, dec, layer,
+                                               -20, 30, theta=0.3))]:
+        true = dense.dot(p)
+        assert np.abs(tree.predicted(p) - true).max() < \
+            0.01*np.abs(true).max()
+        r = np.linspace(-1, 1, x.size)
+        true = dense.T.dot(r)
+        assert np.abs(tree.jacobian(None).T.dot(r) - true).max() < \
+            0.01*np.abs(true).max()
+    with pytest.raises(ValueError):
+        EQLGravity(x, y, z, gz, layer, compress=1e-4, theta=0.5)
+
+
 def test_eqlayer_polereduce():
     "EQLTotalField can reduce data to the pole"
     # Use remanent magnetization
@@ -2,7 +2,7 @@ from __future__ import absolute_import
 from future.builtins import range
 import numpy as np
 from .. import harvester, prism
-from ...mesher import PrismMesh
+from ...mesher import PrismMesh, OctreePrismMesh
 from ... import gridder
 
 
@@ -73,3 +73,50 @@ def test_harvest_restrict():
         l3 = True
     assert l2
     assert l3
+
+
+def test_neighbor_indexes_octree():
+    "An unrefined OctreePrismMesh has the same neighbors as a PrismMesh"
+    bounds = (0, 3, 0, 4, 0, 5)
+    shape = (5, 4, 3)
+    mesh = PrismMesh(bounds, shape)
+    octree = OctreePrismMesh(bounds, shape)
+    nz, ny, nx = shape
+    restrict = ['north', 'below']
+    for n in range(mesh.size):
+        # The regular mesh misses the cell above if it's the first one
+        if n == nx*ny:
+            continue
+        for r in [[], restrict]:
+            assert (sorted(harvester._neighbor_indexes(n, mesh, r)) ==
+                    sorted(harvester._neighbor_indexes(n, octree, r)))
+    octree.refine([0])
+    assert sorted(harvester._neighbor_indexes(1, octree, [])) == \
+        [0, 3, 5, 8]
+
+
+def test_harvest_octree():
+    "harvest grows from refined cells into an unrefined neighbor"
+    bounds = (0, 4, 0, 4, 0, 4)
+    mesh = OctreePrismMesh(bounds, (4, 4, 4))
+    mesh.refine([mesh.find((1.5, 1.5, 1.5))])
+    # The body is the 8 children of the refined cell and the unrefined cell
+    # north of them
+    points = [(x, y, z) for z in [1.25, 1.75] for y in [1.25, 1.75]
+              for x in [1.25, 1.75]]
+    points.append((2.5, 1.5, 1.5))
+    body = [mesh.find(p) for p in points]
+    density = np.zeros(mesh.size)
+    density[body] = 1000
+    model = mesh.copy()
+    model.addprop('density', density)
+    xp, yp, zp = gridder.regular(bounds[:4], (10, 10), z=-1)
+    gz = prism.gz(xp, yp, zp, model)
+    seeds = harvester.sow([[1.25, 1.25, 1.25, {'density': 1000}]], mesh)
+    estimate, predicted = harvester.harvest([harvester.Gz(xp, yp, zp, gz)],
+                                            seeds, mesh, compactness=0.001,
+                                            threshold=0.0001)
+    found = [i for i in range(mesh.size) if estimate['density'][i] != 0]
+    assert sorted(found) == sorted(body)
+    assert sorted(set(mesh.level[found])) == [0, 1]
+    np.testing.assert_allclose(predicted[0], gz, rtol=1e-5)
@@ -102,3 +102,49 @@ def test_polyprism_regression(data, model):
         tolerance = 1e-8
         npt.assert_allclose(result, true, rtol=0, atol=tolerance,
                             err_msg='kernel: {}'.format(kernel))
+
+
+def test_polyprism_threads(data, model):
+    "Splitting the points among threads gives the same result"
+    inc, dec = data['inc'], data['dec']
+    x, y, z = data['x'], data['y'], data['z']
+    # None and prisms without the physical property are ignored
+    model = model + [None, PolygonalPrism([[0, 0], [1, 0], [0, 1]], 0, 1)]
+    for field in FIELDS:
+        if field == 'tf':
+            args = (x, y, z, model, inc, dec)
+        else:
+            args = (x, y, z, model)
+        serial = getattr(polyprism, field)(*args)
+        for threads in [2, None]:
+            npt.assert_allclose(getattr(polyprism, field)(*args,
+                                                          threads=threads),
+                                serial, rtol=1e-15,
+                                err_msg='field: {}'.format(field))
+    # The tensor components are calculated together for each point
+    model = model + [PolygonalPrism([[-2000, 0], [0, -3000], [1000, 1000]],
+                                    0, 800, {'density': -300})]
+    serial = polyprism.tensor(x, y, z, model)
+    for threads in [2, 8, None]:
+        parallel = polyprism.tensor(x, y, z, model, threads=threads)
+        for i in range(6):
+            npt.assert_allclose(parallel[i], serial[i], rtol=1e-15,
+                                err_msg='threads: {}'.format(threads))
+    # Works with 2D grids as well
+    shape = data['shape']
+    npt.assert_allclose(
+        polyprism.gz(x.reshape(shape), y.reshape(shape), z.reshape(shape),
+                     model),
+        polyprism.gz(x, y, z, model).reshape(shape))
+
+
+def test_polyprism_tensor(data, model):
+    "polyprism.tensor gives the same results as the individual components"
+    x, y, z = data['x'], data['y'], data['z']
+    components = polyprism.tensor(x, y, z, model)
+    assert len(components) == 6
+    for field, result in zip('gxx gxy gxz gyy gyz gzz'.split(), components):
+        true = getattr(polyprism, field)(x, y, z, model)
+        npt.assert_allclose(result, true, rtol=0,
+                            atol=1e-10*np.abs(true).max(),
+                            err_msg='field: {}'.format(field))
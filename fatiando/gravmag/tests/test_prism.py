@@ -3,7 +3,7 @@ import numpy as np
 from numpy.testing import assert_array_almost_equal as assert_almost
 from pytest import raises
 
-from ...mesher import Prism
+from ...mesher import Prism, PrismMesh, OctreePrismMesh
 from .. import _prism_numpy, prism
 from ... import utils, gridder
 
@@ -361,3 +361,279 @@ def test_around():
                   'Failed gzz, east and gyy')
     assert_almost(west, prism.gyy(xp, yp, zp, model), 10,
                   'Failed gzz, west and gyy')
+
+
+def test_arrays_vs_prisms():
+    "gravmag.prism gravity and magnetic with arrays match the list of prisms"
+    inc, dec = 35, -20
+    model = [Prism(-300, -100, -100, 100, 0, 200,
+                   {'density': 2000,
+                    'magnetization': utils.ang2vec(5, 25, -10)}),
+             Prism(100, 300, -100, 100, 0, 400,
+                   {'density': -1000,
+                    'magnetization': utils.ang2vec(-2, inc, dec)})]
+    bounds = np.array([p.get_bounds() for p in model])
+    density = np.array([p.props['density'] for p in model])
+    mag = np.array([p.props['magnetization'] for p in model])
+    x, y, z = gridder.regular([-500, 500, -500, 500], (21, 21), z=-10)
+    for f in ['potential', 'gx', 'gy', 'gz',
+              'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']:
+        assert_almost(prism.gravity(f, x, y, z, bounds, density),
+                      getattr(prism, f)(x, y, z, model), 10,
+                      'Field = %s' % (f))
+    for f in ['bx', 'by', 'bz']:
+        assert_almost(prism.magnetic(f, x, y, z, bounds, mag),
+                      getattr(prism, f)(x, y, z, model), 10,
+                      'Field = %s' % (f))
+    assert_almost(prism.magnetic('tf', x, y, z, bounds, mag, inc, dec),
+                  prism.tf(x, y, z, model, inc, dec), 10)
+    raises(ValueError, prism.gravity, 'tf', x, y, z, bounds, density)
+    raises(ValueError, prism.magnetic, 'gz', x, y, z, bounds, mag)
+    raises(ValueError, prism.magnetic, 'tf', x, y, z, bounds, mag)
+    raises(ValueError, prism.gravity, 'gz', x, y, z, bounds[:, :4], density)
+
+
+def test_mesh_arrays_vs_prisms():
+    "gravmag.prism uses the arrays of a PrismMesh with the same results"
+    inc, dec = 35, -20
+    mesh = PrismMesh((-500, 500, -400, 400, 0, 600), (3, 4, 5))
+    mesh.addprop('density', np.linspace(-1000, 1000, mesh.size))
+    mesh.addprop('magnetization', np.linspace(-2, 3, mesh.size))
+    mesh.mask = [0, 7, 23, 59]
+    prisms = [p for p in mesh]
+    assert sum(p is None for p in prisms) == 4
+    x, y, z = gridder.regular([-800, 800, -800, 800], (11, 11), z=-10)
+    for f in ['potential', 'gx', 'gy', 'gz',
+              'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']:
+        assert_almost(getattr(prism, f)(x, y, z, mesh),
+                      getattr(prism, f)(x, y, z, prisms), 10,
+                      'Field = %s' % (f))
+        assert_almost(getattr(prism, f)(x, y, z, mesh, dens=10),
+                      getattr(prism, f)(x, y, z, prisms, dens=10), 10,
+                      'Field = %s' % (f))
+    assert_almost(prism.tf(x, y, z, mesh, inc, dec),
+                  prism.tf(x, y, z, prisms, inc, dec), 10)
+    pmag = utils.ang2vec(2, 10, 15)
+    for f in ['bx', 'by', 'bz']:
+        assert_almost(getattr(prism, f)(x, y, z, mesh, pmag=pmag),
+                      getattr(prism, f)(x, y, z, prisms, pmag=pmag), 10,
+                      'Field = %s' % (f))
+    assert_almost(prism.sensitivity('gz', x, y, z, mesh),
+                  prism.sensitivity('gz', x, y, z, prisms), 10)
+
+
+def test_octree_vs_prism_mesh():
+    "gravmag.prism gives the same result for a refined OctreePrismMesh"
+    bounds = (-500, 500, -400, 400, 0, 600)
+    mesh = PrismMesh(bounds, (3, 4, 5))
+    mesh.addprop('density', np.linspace(-1000, 1000, mesh.size))
+    octree = OctreePrismMesh(bounds, (3, 4, 5), maxlevel=2)
+    octree.addprop('density', np.linspace(-1000, 1000, octree.size))
+    octree.refine_depth(200, 2)
+    octree.refine([octree.size - 1])
+    assert octree.size > mesh.size
+    x, y, z = gridder.regular([-800, 800, -800, 800], (11, 11), z=-10)
+    for f in ['potential', 'gz', 'gzz']:
+        assert_almost(getattr(prism, f)(x, y, z, octree),
+                      getattr(prism, f)(x, y, z, mesh), 5,
+                      'Field = %s' % (f))
+        assert_almost(getattr(prism, f)(x, y, z, octree),
+                      getattr(prism, f)(x, y, z, list(octree)), 10,
+                      'Field = %s' % (f))
+
+
+def test_threads():
+    "gravmag.prism gives the same result running on many threads"
+    inc, dec = -30, 50
+    model = [Prism(-300, -100, -100, 100, 0, 200,
+                   {'density': 2000,
+                    'magnetization': utils.ang2vec(5, 25, -10)}),
+             Prism(100, 300, -100, 100, 0, 400,
+                   {'density': -1000,
+                    'magnetization': utils.ang2vec(-2, inc, dec)})]
+    x, y, z = gridder.regular([-500, 500, -500, 500], (31, 31), z=-10)
+    for f in ['potential', 'gx', 'gy', 'gz',
+              'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'bx', 'by', 'bz']:
+        serial = getattr(prism, f)(x, y, z, model)
+        for threads in [2, 3, None]:
+            parallel = getattr(prism, f)(x, y, z, model, threads=threads)
+            assert_almost(serial, parallel, 10, 'Field = %s' % (f))
+    assert_almost(prism.tf(x, y, z, model, inc, dec),
+                  prism.tf(x, y, z, model, inc, dec, threads=4), 10)
+    raises(ValueError, prism.gz, x, y, z, model, threads=0)
+
+
+def test_tensor_and_gravity_vector():
+    "gravmag.prism tensor and gravity_vector match the individual components"
+    model = [Prism(-300, 300, -300, 300, -300, 300, {'density': 1000}),
+             Prism(400, 600, -100, 100, 50, 200, {'density': -500})]
+    # Include points aligned with the corners to test the singularities
+    x, y = gridder.regular([-600, 600, -600, 600], (25, 25))
+    for height in [-310, 310]:
+        z = height*np.ones_like(x)
+        grids = [(x, y, z), (x, z, y), (z, x, y)]
+        for xp, yp, zp in grids:
+            tensor = prism.tensor(xp, yp, zp, model, threads=2)
+            for i, f in enumerate(['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']):
+                assert_almost(tensor[i], getattr(prism, f)(xp, yp, zp, model),
+                              10, 'Field = %s' % (f))
+            vector = prism.gravity_vector(xp, yp, zp, model)
+            for i, f in enumerate(['gx', 'gy', 'gz']):
+                assert_almost(vector[i], getattr(prism, f)(xp, yp, zp, model),
+                              10, 'Field = %s' % (f))
+
+
+def test_far_field_ratio():
+    "gravmag.prism far field approximation is within the reported error"
+    inc, dec = 30, -15
+    bounds = np.array([[-100, 100, -50, 50, 200, 250]])
+    density, mag = 1000, utils.ang2vec(3, inc, dec)
+    volume = 200*100*50
+    diagonal = np.sqrt(200**2 + 100**2 + 50**2)
+    x, y = gridder.regular([-5000, 5000, -5000, 5000], (41, 41))
+    z = -100*np.ones_like(x)
+    r = np.sqrt(x**2 + y**2 + (z - 225)**2)
+    ratio = 4
+    near = r <= ratio*diagonal
+    assert near.any() and not near.all()
+    fields = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+              'gyz', 'gzz']
+    for f in fields + ['tf', 'bx', 'by', 'bz']:
+        if f in fields:
+            true = prism.gravity(f, x, y, z, bounds, density)
+            approx = prism.gravity(f, x, y, z, bounds, density, ratio=ratio)
+            power = {'potential': 1, 'gx': 2, 'gy': 2, 'gz': 2}.get(f, 3)
+            scale = prism.GRAVITY_FIELDS[f]*density*volume/r**power
+        else:
+            true = prism.magnetic(f, x, y, z, bounds, mag, inc, dec)
+            approx = prism.magnetic(f, x, y, z, bounds, mag, inc, dec,
+                                    ratio=ratio)
+            power = 3
+            scale = prism.MAGNETIC_FIELDS[f]*3*volume/r**3
+        if power == 3:
+            scale *= 2
+        np.testing.assert_array_equal(approx[near], true[near], err_msg=f)
+        error = np.abs(approx - true)[~near]
+        bound = prism.far_field_error(f, ratio)*scale[~near]
+        assert np.all(error <= bound), f
+    # The combined fields and sensitivity use the same approximation
+    model = [Prism(*b, props={'density': density}) for b in bounds]
+    tensor = prism.tensor(x, y, z, model, ratio=ratio)
+    vector = prism.gravity_vector(x, y, z, model, ratio=ratio)
+    for i, f in enumerate(['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']):
+        assert_almost(tensor[i], getattr(prism, f)(x, y, z, model,
+                                                   ratio=ratio), 10, f)
+    for i, f in enumerate(['gx', 'gy', 'gz']):
+        assert_almost(vector[i], getattr(prism, f)(x, y, z, model,
+                                                   ratio=ratio), 10, f)
+    mesh = PrismMesh((-1000, 1000, -1000, 1000, 0, 500), (2, 5, 5))
+    mesh.addprop('density', np.linspace(-500, 500, mesh.size))
+    sens = prism.sensitivity('gz', x, y, z, mesh, ratio=ratio)
+    assert_almost(sens.dot(mesh.props['density']),
+                  prism.gz(x, y, z, mesh, ratio=ratio), 10)
+    sens = prism.sensitivity('tf', x, y, z, bounds, inc, dec, ratio=ratio)
+    assert_almost(sens[:, 0],
+                  prism.magnetic('tf', x, y, z, bounds,
+                                 utils.ang2vec(1, inc, dec), inc, dec,
+                                 ratio=ratio), 10)
+    raises(ValueError, prism.far_field_error, 'gz', 0)
+    raises(ValueError, prism.far_field_error, 'blah', 2)
+    # The approximation doesn't converge for ratio <= 0.5
+    for bad in [0.1, 0.5]:
+        raises(ValueError, prism.gz, x, y, z, model, ratio=bad)
+        raises(ValueError, prism.gravity, 'gzz', x, y, z, bounds, density,
+               ratio=bad)
+        raises(ValueError, prism.tensor, x, y, z, model, ratio=bad)
+        raises(ValueError, prism.magnetic, 'tf', x, y, z, bounds, mag, inc,
+               dec, ratio=bad)
+        raises(ValueError, prism.sensitivity, 'gz', x, y, z, mesh,
+               ratio=bad)
+        raises(ValueError, prism.sensitivity, 'gz', x, y, z, mesh,
+               compress=1e-3, ratio=bad)
+
+
+def test_far_field_error_is_bound():
+    "gravmag.prism.far_field_error bounds the error in all directions"
+    inc, dec = -20, 40
+    mag = utils.ang2vec(2, inc, dec)
+    directions = np.random.RandomState(0).normal(size=(3, 2000))
+    directions /= np.sqrt(np.sum(directions**2, axis=0))
+    fields = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+              'gyz', 'gzz']
+    for dims in [(200, 100, 50), (1000, 30, 30), (500, 500, 20)]:
+        a, b, c = dims
+        bounds = np.array([[-a/2, a/2, -b/2, b/2, -c/2, c/2]])
+        volume = a*b*c
+        diagonal = np.sqrt(a**2 + b**2 + c**2)
+        for ratio in [0.6, 1, 1.5, 3, 10]:
+            # The points closest to the prism that use the approximation
+            r = 1.000001*ratio*diagonal
+            x, y, z = r*directions
+            for f in fields + ['tf', 'bx', 'by', 'bz']:
+                if f in fields:
+                    true = prism.gravity(f, x, y, z, bounds, 1000)
+                    approx = prism.gravity(f, x, y, z, bounds, 1000,
+                                           ratio=ratio)
+                    power = {'potential': 1, 'gx': 2, 'gy': 2,
+                             'gz': 2}.get(f, 3)
+                    scale = prism.GRAVITY_FIELDS[f]*1000*volume/r**power
+                else:
+                    true = prism.magnetic(f, x, y, z, bounds, mag, inc, dec)
+                    approx = prism.magnetic(f, x, y, z, bounds, mag, inc,
+                                            dec, ratio=ratio)
+                    power = 3
+                    scale = prism.MAGNETIC_FIELDS[f]*2*volume/r**3
+                if power == 3:
+                    scale *= 2
+                error = np.abs(approx - true).max()
+                bound = prism.far_field_error(f, ratio)*scale
+                assert error <= bound, (dims, ratio, f)
+    assert prism.far_field_error('gz', 0.5) == np.inf
+
+
+def test_sensitivity():
+    "gravmag.prism.sensitivity matches the effect of each prism"
+    model = [Prism(-1000, 1000, -500, 500, 0, 2000),
+             None,
+             Prism(1500, 2500, -1000, 1000, 500, 1500),
+             Prism(-3000, -2000, -2000, 2000, 100, 800)]
+    inc, dec = -30, 50
+    sinc, sdec = 20, -10
+    area = [-5000, 5000, -5000, 5000]
+    xp, yp, zp = gridder.regular(area, (15, 10), z=-10)
+    fields = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+              'gyz', 'gzz']
+    for f in fields:
+        sens = prism.sensitivity(f, xp, yp, zp, model)
+        assert sens.shape == (xp.size, len(model))
+        assert np.all(sens[:, 1] == 0)
+        for j, p in enumerate(model):
+            if p is None:
+                continue
+            true = getattr(prism, f)(xp, yp, zp, [p], dens=1)
+            assert_almost(sens[:, j], true, 10, 'Failed {}'.format(f))
+    pmag = utils.ang2vec(1, sinc, sdec)
+    for f in ['tf', 'bx', 'by', 'bz']:
+        sens = prism.sensitivity(f, xp, yp, zp, model, inc, dec, sinc, sdec)
+        for j, p in enumerate(model):
+            if p is None:
+                continue
+            if f == 'tf':
+                true = prism.tf(xp, yp, zp, [p], inc, dec, pmag=pmag)
+            else:
+                true = getattr(prism, f)(xp, yp, zp, [p], pmag=pmag)
+            assert_almost(sens[:, j], true, 10, 'Failed {}'.format(f))
+    # Single precision, preallocated output and threads
+    bounds = np.array([p.get_bounds() for p in model if p is not None])
+    true = prism.sensitivity('gzz', xp, yp, zp, bounds)
+    sens32 = prism.sensitivity('gzz', xp, yp, zp, bounds, dtype=np.float32)
+    assert sens32.dtype == np.float32
+    assert_almost(sens32, true, 2)
+    out = np.empty_like(true)
+    res = prism.sensitivity('gzz', xp, yp, zp, bounds, out=out, threads=2)
+    assert res is out
+    np.testing.assert_array_equal(out, true)
+    raises(ValueError, prism.sensitivity, 'gz', xp, yp, zp, bounds,
+           out=np.empty((3, 3)))
+    raises(ValueError, prism.sensitivity, 'blah', xp, yp, zp, bounds)
+    raises(ValueError, prism.sensitivity, 'tf', xp, yp, zp, bounds)
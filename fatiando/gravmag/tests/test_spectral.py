@@ -0,0 +1,86 @@
+from __future__ import division, absolute_import
+import pytest
+import numpy as np
+import numpy.testing as npt
+from .. import spectral, prism
+from ... import gridder, utils
+from ...mesher import PrismMesh, PrismRelief
+
+
+def test_prism_layers_vs_prism():
+    "gravmag.spectral.prism_layers gives the same result as gravmag.prism"
+    inc, dec = -30, 20
+    mesh = PrismMesh((-1000, 1000, -1500, 1500, 100, 1300), (3, 15, 10))
+    mesh.addprop('density', np.linspace(-500, 800, mesh.size))
+    mesh.addprop('magnetization',
+                 np.tile(utils.ang2vec(2, 40, -15), (mesh.size, 1)))
+    mesh.mask = [0, 13, 200, 449]
+    # The grid isn't aligned with the cells and is larger than the mesh
+    shape = (21, 26)
+    x, y, z = gridder.regular((-2050, 1950, -2600, 2400), shape, z=-50)
+    for field in ['potential', 'gx', 'gz', 'gxy', 'gzz']:
+        true = getattr(prism, field)(x, y, z, mesh)
+        npt.assert_allclose(spectral.prism_layers(field, x, y, z, shape, mesh),
+                            true, atol=1e-8*np.abs(true).max(),
+                            err_msg=field)
+    true = prism.tf(x, y, z, mesh, inc, dec)
+    npt.assert_allclose(
+        spectral.prism_layers('tf', x, y, z, shape, mesh, inc, dec),
+        true, atol=1e-8*np.abs(true).max())
+    true = prism.bz(x, y, z, mesh)
+    npt.assert_allclose(spectral.prism_layers('bz', x, y, z, shape, mesh),
+                        true, atol=1e-8*np.abs(true).max())
+
+
+def test_prism_layers_fails_spacing():
+    "gravmag.spectral.prism_layers fails if the grid spacing is wrong"
+    mesh = PrismMesh((-1000, 1000, -1500, 1500, 100, 1300), (3, 15, 10))
+    mesh.addprop('density', np.ones(mesh.size))
+    shape = (20, 20)
+    x, y, z = gridder.regular((-2000, 2000, -2000, 2000), shape, z=-50)
+    with pytest.raises(ValueError):
+        spectral.prism_layers('gz', x, y, z, shape, mesh)
+    x, y, z = gridder.regular((-2000, 2000, -3000, 3000), (21, 31), z=-50)
+    z[10] = 0
+    with pytest.raises(ValueError):
+        spectral.prism_layers('gz', x, y, z, (21, 31), mesh)
+
+
+def test_relief_gz_vs_prism():
+    "gravmag.spectral.relief_gz is close to the field of the prisms"
+    shape = (51, 51)
+    x, y = gridder.regular((-10000, 10000, -10000, 10000), shape)
+    depth = 1000 + 500*utils.gaussian2d(x, y, 3000, 2000, angle=30)
+    relief = PrismRelief(0, gridder.spacing((-10000, 10000, -10000, 10000),
+                                            shape)[::-1], (x, y, depth))
+    relief.addprop('density', -300*np.ones(x.size))
+    z = -100
+    gz = spectral.relief_gz(relief, shape, z)
+    true = prism.gz(x, y, z*np.ones_like(x), relief)
+    inside = np.abs(x) < 5000
+    inside &= np.abs(y) < 5000
+    assert np.abs(gz - true)[inside].max() < 0.02*np.abs(true).max()
+
+
+def test_oldenburg_recovers_relief():
+    "gravmag.spectral.oldenburg recovers a smooth relief from its gravity"
+    area = (-20000, 20000, -20000, 20000)
+    shape = (64, 64)
+    x, y = gridder.regular(area, shape)
+    ref, density = 2000, 400
+    depth = ref + 300*utils.gaussian2d(x, y, 4000, 3000, angle=20)
+    relief = PrismRelief(ref, gridder.spacing(area, shape)[::-1],
+                         (x, y, depth))
+    relief.addprop('density', density*np.ones(x.size))
+    z = -50
+    gz = prism.gz(x, y, z*np.ones_like(x), relief)
+    estimate = spectral.oldenburg(x, y, z, shape, gz, ref, density,
+                                  cutoff=(0.0015, 0.0025))
+    assert isinstance(estimate, PrismRelief)
+    npt.assert_allclose(estimate.x, x)
+    npt.assert_allclose(estimate.y, y)
+    inside = (np.abs(x) < 10000) & (np.abs(y) < 10000)
+    assert np.abs(estimate.z - depth)[inside].max() < 30
+    # The estimated relief fits the data
+    predicted = spectral.relief_gz(estimate, shape, z)
+    assert np.abs(predicted - gz)[inside].max() < 0.05*np.abs(gz).max()
@@ -130,3 +130,82 @@ def test_sphere_ignore_missing_prop(data, model):
         else:
             result = getattr(sphere, field)(x, y, z, model2)
         npt.assert_allclose(result, data[field], atol=1e-10, rtol=0)
+
+
+def test_sphere_many_spheres():
+    "Sphere fields of many spheres match the sum of each sphere"
+    rng = np.random.RandomState(0)
+    model = [Sphere(x, y, z, r, {'density': d,
+                                 'magnetization': utils.ang2vec(1, i, d)})
+             for x, y, z, r, d, i in zip(rng.uniform(-1000, 1000, 50),
+                                         rng.uniform(-1000, 1000, 50),
+                                         rng.uniform(200, 600, 50),
+                                         rng.uniform(10, 100, 50),
+                                         rng.uniform(-500, 500, 50),
+                                         rng.uniform(-90, 90, 50))]
+    x, y, z = gridder.regular((-1500, 1500, -1500, 1500), (20, 25), z=-10)
+    for field in FIELDS:
+        if field == 'tf':
+            true = sum(sphere.tf(x, y, z, [s], -30, 50) for s in model)
+            result = sphere.tf(x, y, z, model, -30, 50)
+        else:
+            func = getattr(sphere, field)
+            true = sum(func(x, y, z, [s]) for s in model)
+            result = func(x, y, z, model)
+        npt.assert_allclose(result, true, rtol=1e-10,
+                            atol=1e-10*np.abs(true).max(), err_msg=field)
+    # Works when the spheres are split into chunks
+    true = sphere.gz(x, y, z, model)
+    chunk_size = sphere._CHUNK_SIZE
+    try:
+        sphere._CHUNK_SIZE = 7*x.size
+        npt.assert_allclose(sphere.gz(x, y, z, model), true, rtol=1e-10,
+                            atol=1e-10*np.abs(true).max())
+    finally:
+        sphere._CHUNK_SIZE = chunk_size
+
+
+def test_sphere_tensor():
+    "sphere.tensor matches the individual gradient functions"
+    model = make_model() + [None, Sphere(0, 0, 200, 200),
+                            Sphere(300, -200, 400, 100, {'density': -20})]
+    x, y, z = gridder.regular((-1000, 1000, -1000, 1000), (10, 12), z=-1)
+    for dens in [None, 30]:
+        result = sphere.tensor(x, y, z, model, dens=dens)
+        assert len(result) == 6
+        for comp, res in zip('gxx gxy gxz gyy gyz gzz'.split(), result):
+            true = getattr(sphere, comp)(x, y, z, model, dens=dens)
+            npt.assert_allclose(res, true, rtol=1e-12, err_msg=comp)
+
+
+def test_sphere_kernel_matrices():
+    "sphere.kernel_tensor and kernel_gradient have one column per sphere"
+    model = make_model() + [Sphere(0, 0, 200, 200),
+                            Sphere(300, -200, 400, 100, {'density': -20})]
+    x, y, z = gridder.regular((-1000, 1000, -1000, 1000), (10, 12), z=-1)
+    tensor = sphere.kernel_tensor(x, y, z, model)
+    assert tensor.shape == (6, x.size, len(model))
+    for i, kernel in enumerate(KERNELS):
+        for j, s in enumerate(model):
+            npt.assert_allclose(tensor[i, :, j],
+                                getattr(sphere, kernel)(x, y, z, s),
+                                rtol=1e-12)
+    gxz, gzz = sphere.kernel_tensor(x, y, z, model, components=['xz', 'zz'])
+    npt.assert_allclose(gxz, tensor[2])
+    npt.assert_allclose(gzz, tensor[5])
+    gradient = sphere.kernel_gradient(x, y, z, model)
+    assert gradient.shape == (3, x.size, len(model))
+    for j, s in enumerate(model):
+        gz = sphere.gz(x, y, z, [s], dens=1)
+        npt.assert_allclose(gradient[2, :, j]*constants.G*constants.SI2MGAL,
+                            gz, rtol=1e-12)
+
+
+def test_sphere_kernel_matrices_fail_none():
+    "sphere.kernel_tensor and kernel_gradient don't drop None spheres"
+    model = [Sphere(0, 0, 200, 200), None, Sphere(300, -200, 400, 100)]
+    x, y, z = gridder.regular((-1000, 1000, -1000, 1000), (10, 12), z=-1)
+    with pytest.raises(ValueError):
+        sphere.kernel_tensor(x, y, z, model)
+    with pytest.raises(ValueError):
+        sphere.kernel_gradient(x, y, z, model)
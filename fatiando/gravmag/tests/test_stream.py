@@ -0,0 +1,108 @@
+from __future__ import division, absolute_import
+import os
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from .. import stream, prism, polyprism, sphere, tesseroid
+from ...mesher import Prism, PolygonalPrism, Sphere, TesseroidMesh
+from ... import gridder, utils
+
+
+def test_forward_vs_functions():
+    "gravmag.stream.forward gives the same results as calling the function"
+    props = {'density': 1000, 'magnetization': utils.ang2vec(2, 25, -10)}
+    x, y, z = gridder.scatter((-3000, 3000, -3000, 3000), 1001, z=-100,
+                              seed=0)
+    inc, dec = -30, 20
+    models = {
+        prism: [Prism(-500, 500, -1000, 1000, 100, 800, props)],
+        polyprism: [PolygonalPrism([[-500, -500], [500, -300], [0, 800]],
+                                   100, 800, props)],
+        sphere: [Sphere(200, -100, 700, 400, props)]}
+    for module, model in models.items():
+        for field in ['gz', 'gxy', 'tensor']:
+            func = getattr(module, field)
+            true = func(x, y, z, model)
+            if field == 'tensor':
+                true = np.transpose(true)
+            for chunk_size in [1, 100, 5000]:
+                res = stream.forward(func, x, y, z, model,
+                                     chunk_size=chunk_size)
+                assert_allclose(res, true, err_msg=field)
+        true = module.tf(x, y, z, model, inc, dec)
+        assert_allclose(stream.forward(module.tf, x, y, z, model,
+                                       args=(inc, dec), chunk_size=300),
+                        true)
+    true = sphere.gz(x, y, z, models[sphere], dens=-10)
+    res = stream.forward(sphere.gz, x, y, z, models[sphere],
+                         kwargs=dict(dens=-10), chunk_size=300)
+    assert_allclose(res, true)
+
+
+def test_forward_tesseroid():
+    "gravmag.stream.forward works with tesseroids"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (1, 2, 2))
+    model.addprop('density', np.array([500, 0, -200, 300], dtype='float'))
+    lon, lat, height = gridder.regular((-2, 2.5, -3, 3), (15, 21), z=150e3)
+    for field in ['gz', 'components']:
+        true = getattr(tesseroid, field)(lon, lat, height, model)
+        if field == 'components':
+            true = np.transpose(true)
+        res = stream.forward(getattr(tesseroid, field), lon, lat, height,
+                             model, chunk_size=50)
+        assert res.shape == true.shape
+        assert_allclose(res, true)
+
+
+def test_forward_memmap(tmpdir):
+    "gravmag.stream.forward reads and writes memory-mapped arrays"
+    model = [Sphere(200, -100, 700, 400, {'density': 1000})]
+    x, y = gridder.regular((-3000, 3000, -3000, 3000), (50, 60))
+    fname = os.path.join(str(tmpdir), 'points.npy')
+    np.save(fname, np.array([x, y]))
+    xmap, ymap = np.load(fname, mmap_mode='r')
+    out = np.lib.format.open_memmap(os.path.join(str(tmpdir), 'out.npy'),
+                                    mode='w+', shape=(x.size, 6))
+    res = stream.forward(sphere.tensor, xmap, ymap, -150, model, out=out,
+                         chunk_size=333)
+    assert res is out
+    true = np.transpose(sphere.tensor(x, y, -150*np.ones_like(x), model))
+    del out, res
+    assert_allclose(np.load(os.path.join(str(tmpdir), 'out.npy')), true)
+
+
+def test_iforward_iterator():
+    "gravmag.stream.iforward calculates the chunks of an iterator in order"
+    model = [Sphere(200, -100, 700, 400, {'density': 1000})]
+    x, y, z = gridder.scatter((-3000, 3000, -3000, 3000), 1000, z=-100,
+                              seed=0)
+
+    def chunks():
+        for i in range(0, x.size, 150):
+            yield x[i:i + 150], y[i:i + 150], z[i:i + 150]
+
+    for njobs in [1, 2]:
+        res = list(stream.iforward(sphere.gz, chunks(), model, njobs=njobs))
+        assert len(res) == 7
+        assert_allclose(np.concatenate(res), sphere.gz(x, y, z, model))
+    res = stream.forward(sphere.gzz, x, y, z, model, chunk_size=101,
+                         njobs=3)
+    assert_allclose(res, sphere.gzz(x, y, z, model))
+
+
+def test_forward_fails():
+    "gravmag.stream.forward fails on invalid input"
+    model = [Sphere(200, -100, 700, 400, {'density': 1000})]
+    x, y = np.zeros(10), np.zeros(10)
+    with pytest.raises(ValueError):
+        stream.forward(sphere.gz, x, y[:5], 0, model)
+    with pytest.raises(ValueError):
+        stream.forward(sphere.gz, x.reshape((2, 5)), y.reshape((2, 5)), 0,
+                       model)
+    with pytest.raises(ValueError):
+        stream.forward(sphere.gz, x, y, 0, model, out=np.empty(5))
+    with pytest.raises(ValueError):
+        stream.forward(sphere.gz, x, y, 0, model, chunk_size=0)
+    with pytest.raises(ValueError):
+        stream.forward(sphere.gz, x, y, 0, model, njobs=0)
@@ -0,0 +1,106 @@
+from __future__ import division, absolute_import
+import numpy as np
+from numpy.testing import assert_allclose
+
+from .. import talwani, basin2d
+from ...mesher import Polygon
+
+
+def _model():
+    "A few polygons with different densities"
+    return [Polygon([[3000, 0], [2200, 900], [1500, 1200], [700, 600],
+                     [0, 0]], {'density': -400}),
+            None,
+            Polygon([[5000, 100], [4500, 700], [3800, 300]], {'density': 600}),
+            Polygon([[-1000, 200], [-1500, 900], [-2000, 300]], {})]
+
+
+def test_gz_many_polygons():
+    "gravmag.talwani.gz of many polygons is the sum of each one"
+    model = _model()
+    x = np.linspace(-3000, 6000, 101)
+    z = -10*np.ones_like(x)
+    true = sum(talwani.gz(x, z, [p]) for p in model)
+    assert_allclose(talwani.gz(x, z, model), true, rtol=1e-12)
+    # Overriding the density also uses the polygons without it
+    true = sum(talwani.gz(x, z, [p], dens=100) for p in model)
+    assert_allclose(talwani.gz(x, z, model, dens=100), true, rtol=1e-12)
+    assert np.all(talwani.gz(x, z, [None]) == 0)
+    # Works with 2D arrays of points and points on the diagonal of vertices
+    x, z = np.meshgrid(np.linspace(-3000, 6000, 20),
+                       np.array([-3000., -100, -1]))
+    x[0, 0], z[0, 0] = 0, -3000
+    res = talwani.gz(x, z, model)
+    assert res.shape == x.shape
+    assert_allclose(res.ravel(), talwani.gz(x.ravel(), z.ravel(), model))
+
+
+def test_gz_points_at_depth():
+    "gravmag.talwani.gz works on points between the top and bottom of edges"
+    # The effect of a square on points at the depth of its center is zero by
+    # symmetry, both outside and inside of it
+    poly = Polygon([[-100, 400], [100, 400], [100, 600], [-100, 600]],
+                   {'density': 1000})
+    x = np.array([-2000, -300, -50, 0, 50, 300, 2000], dtype=np.float)
+    z = 500*np.ones_like(x)
+    gz = talwani.gz(x, z, [poly])
+    scale = np.abs(talwani.gz(x, 0*z, [poly])).max()
+    assert_allclose(gz, 0, atol=1e-3*scale)
+    # and antisymmetric above and below it
+    x = np.array([-300, 0, 300], dtype=np.float)
+    assert_allclose(talwani.gz(x, 450 + 0*x, [poly]),
+                    -talwani.gz(x, 550 + 0*x, [poly]), rtol=0,
+                    atol=1e-3*scale)
+
+
+def test_gz_vertex_derivatives():
+    "gravmag.talwani.gz_vertex_derivatives matches finite differences"
+    poly = _model()[0]
+    x = np.linspace(-1000, 4000, 60)
+    z = -np.linspace(20, 50, 60)
+    dx, dz = talwani.gz_vertex_derivatives(x, z, poly)
+    assert dx.shape == dz.shape == (x.size, poly.nverts)
+    delta = 0.01
+    for k in range(poly.nverts):
+        for derivative, component in [(dx, 0), (dz, 1)]:
+            up = np.array(poly.vertices, dtype=np.float)
+            down = np.array(poly.vertices, dtype=np.float)
+            up[k, component] += delta
+            down[k, component] -= delta
+            diff = (talwani.gz(x, z, [Polygon(up, poly.props)]) -
+                    talwani.gz(x, z, [Polygon(down, poly.props)]))/(2*delta)
+            assert_allclose(derivative[:, k], diff, rtol=0,
+                            atol=1e-3*np.abs(diff).max())
+    dx, dz = talwani.gz_vertex_derivatives(x, z, poly, dens=1)
+    assert_allclose(dz*poly.props['density'],
+                    talwani.gz_vertex_derivatives(x, z, poly)[1])
+
+
+def test_gz_vertex_derivatives_points_on_polygon():
+    "gravmag.talwani.gz_vertex_derivatives works on vertices and edges"
+    poly = Polygon([[0, 0], [1000, 0], [800, 500], [200, 400]],
+                   {'density': 500})
+    # On 3 vertices, the middle of the top edge and the slanted edge
+    x = np.array([0, 500, 1000, 900, 1200], dtype=np.float)
+    z = np.array([0, 0, 0, 250, 0], dtype=np.float)
+    dx, dz = talwani.gz_vertex_derivatives(x, z, poly)
+    assert np.all(np.isfinite(dx)) and np.all(np.isfinite(dz))
+    gz = talwani.gz(x, z, [poly])
+    assert np.all(np.isfinite(gz))
+    assert_allclose(gz, talwani.gz(x, z - 0.01, [poly]), rtol=0,
+                    atol=1e-4*np.abs(gz).max())
+    # Should be the same as with the points slightly above the polygon
+    dx_above, dz_above = talwani.gz_vertex_derivatives(x, z - 0.01, poly)
+    assert_allclose(dx, dx_above, rtol=0, atol=1e-5*np.abs(dx).max())
+    assert_allclose(dz, dz_above, rtol=0, atol=1e-4*np.abs(dz).max())
+    # So the basin inversions can use data on the surface of the basin
+    x = np.linspace(0, 3000, 31)
+    z = np.zeros_like(x)
+    misfit = basin2d.PolygonalBasinGravity(x, z, np.zeros_like(x), 2,
+                                           {'density': -500}, top=0)
+    assert np.all(np.isfinite(misfit.jacobian(np.array([800., 500]))))
+    assert np.all(np.isfinite(misfit.predicted(np.array([800., 500]))))
+    misfit = basin2d.Triangular(x, z, np.zeros_like(x), [(1000, 0), (2000, 0)],
+                                500)
+    assert np.all(np.isfinite(misfit.jacobian(np.array([1500., 800]))))
+    assert np.all(np.isfinite(misfit.predicted(np.array([1500., 800]))))
@@ -136,6 +136,80 @@ def test_serial_vs_parallel():
         assert_allclose(serial, parallel, err_msg="Mismatch for {}".format(f))
 
 
+def test_serial_vs_threads():
+    "gravmag.tesseroid serial and multithreaded execution give same result"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (3, 2, 1))
+    model.addprop('density', 500*np.ones(model.size))
+    lon, lat, height = gridder.regular((-1, 1.5, -2, 2), (15, 21), z=150e3)
+    for f in 'potential gx gy gz gxx gxy gxz gyy gyz gzz'.split():
+        func = getattr(tesseroid, f)
+        serial = func(lon, lat, height, model)
+        threads = func(lon, lat, height, model, parallel=True)
+        assert_allclose(serial, threads, err_msg="Mismatch for {}".format(f))
+        both = func(lon, lat, height, model, njobs=2, parallel=True)
+        assert_allclose(serial, both, err_msg="Mismatch for {}".format(f))
+
+
+def test_engine_vs_functions():
+    "gravmag.tesseroid Engine gives same result as the module functions"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (3, 2, 1))
+    model.addprop('density', 500*np.ones(model.size))
+    lon, lat, height = gridder.regular((-1, 1.5, -2, 2), (15, 21), z=150e3)
+    fields = 'potential gx gy gz gxx gxy gxz gyy gyz gzz'.split()
+    for njobs in [1, 3]:
+        with tesseroid.Engine(model, njobs=njobs) as engine:
+            for f in fields:
+                func = getattr(tesseroid, f)
+                assert_allclose(engine.calculate(f, lon, lat, height),
+                                func(lon, lat, height, model),
+                                err_msg="Mismatch for {}".format(f))
+            # Changing the densities in place should reach the workers
+            engine.density[:] = -200
+            for f in fields:
+                func = getattr(tesseroid, f)
+                assert_allclose(engine.calculate(f, lon, lat, height,
+                                                 ratio=2),
+                                func(lon, lat, height, model, dens=-200,
+                                     ratio=2),
+                                err_msg="Mismatch for {}".format(f))
+        assert engine.pool is None
+
+
+def test_sensitivity():
+    "gravmag.tesseroid.sensitivity matches the effect of each tesseroid"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (1, 2, 2))
+    model.mask[1] = True
+    density = np.array([500, 0, -200, 300], dtype='float')
+    lon, lat, height = gridder.regular((-1, 1.5, -2, 2), (15, 21), z=150e3)
+    for f in 'potential gx gy gz gxx gxy gxz gyy gyz gzz'.split():
+        func = getattr(tesseroid, f)
+        for parallel in [False, True]:
+            sens = tesseroid.sensitivity(f, lon, lat, height, model,
+                                         parallel=parallel)
+            assert sens.shape == (lon.size, len(model))
+            assert np.all(sens[:, 1] == 0)
+            for j in [0, 2, 3]:
+                true = func(lon, lat, height, [model[j]], dens=1)
+                assert_allclose(sens[:, j], true,
+                                atol=1e-10*np.abs(true).max(),
+                                err_msg="Mismatch for {} {}".format(f, j))
+        model.addprop('density', density)
+        true = func(lon, lat, height, model)
+        assert_allclose(sens.dot(density), true,
+                        atol=1e-10*np.abs(true).max(),
+                        err_msg="Mismatch for {}".format(f))
+        model.props.pop('density')
+    out = np.empty((lon.size, len(model)), dtype=np.float32)
+    sens = tesseroid.sensitivity('gz', lon, lat, height, model, out=out)
+    assert sens is out
+    assert_allclose(out, tesseroid.sensitivity('gz', lon, lat, height, model),
+                    rtol=1e-5)
+    # A list of tesseroids gives the same matrix as the mesh
+    tesseroids = [model[i] for i in range(len(model))]
+    assert_allclose(tesseroid.sensitivity('gz', lon, lat, height, tesseroids),
+                    tesseroid.sensitivity('gz', lon, lat, height, model))
+
+
 def test_fails_if_shape_mismatch():
     'gravmag.tesseroid fails if given computation points with different shapes'
     model = [Tesseroid(0, 1, 0, 1, 1000, -20000, {'density': 2670})]
@@ -201,6 +275,60 @@ def test_tesseroid_vs_spherical_shell():
             f, diff.max())
 
 
+def test_higher_order_glq_vs_spherical_shell():
+    "gravmag.tesseroid higher order GLQ with smaller ratio equal the shell"
+    density = 1000.
+    top = 1000
+    bottom = 0
+    model = TesseroidMesh((0, 360, -90, 90, top, bottom), (1, 6, 12))
+    model.addprop('density', density*np.ones(model.size))
+    h = 10000
+    lon, lat, height = gridder.regular((0, model.dims[0], 0, model.dims[1]),
+                                       (10, 10), z=h)
+    shellvalues = calc_shell_effect(h, top, bottom, density)
+    for f in ['potential', 'gz', 'gzz']:
+        ratio = 0.75*tesseroid.FIELDS[f][0]
+        errors = []
+        for glq in [tesseroid.GLQ_ORDER, (4, 4, 3)]:
+            tess = getattr(tesseroid, f)(lon, lat, height, model, ratio=ratio,
+                                         glq=glq)
+            diff = 100*np.abs(shellvalues[f] - tess)/np.abs(shellvalues[f])
+            errors.append(diff.max())
+        default, higher = errors
+        assert higher < 0.1, "diff > 0.1% for {}: {}".format(f, higher)
+        # The order matters: the default one is not enough with this ratio
+        assert default > 10*higher, \
+            "default order as good as higher for {}: {} {}".format(
+                f, default, higher)
+        if f != 'gzz':
+            assert default > 0.1, \
+                "default order reached 0.1% for {}: {}".format(f, default)
+
+
+def test_components_vs_functions():
+    "gravmag.tesseroid.components gives the same result as each function"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (3, 2, 1))
+    model.addprop('density', 500*np.ones(model.size))
+    lon, lat, height = gridder.regular((-1, 1.5, -2, 2), (15, 21), z=150e3)
+    for kwargs in [dict(), dict(parallel=True), dict(njobs=2),
+                   dict(glq=(3, 2, 4))]:
+        fields = tesseroid.components(lon, lat, height, model, **kwargs)
+        assert len(fields) == len(tesseroid.COMPONENTS)
+        for f, res in zip(tesseroid.COMPONENTS, fields):
+            func = getattr(tesseroid, f)
+            true = func(lon, lat, height, model, ratio=tesseroid.RATIO_GG,
+                        **kwargs)
+            assert_allclose(res, true, atol=1e-10*np.abs(true).max(),
+                            err_msg="Mismatch for {}".format(f))
+    with tesseroid.Engine(model) as engine:
+        fields = engine.calculate('components', lon, lat, height)
+    for f, res in zip(tesseroid.COMPONENTS, fields):
+        true = getattr(tesseroid, f)(lon, lat, height, model,
+                                     ratio=tesseroid.RATIO_GG)
+        assert_allclose(res, true, atol=1e-10*np.abs(true).max(),
+                        err_msg="Mismatch for {}".format(f))
+
+
 def test_skip_none_and_missing_properties():
     "gravmag.tesseroid ignores Nones and tesseroids without density prop"
     model = [Tesseroid(0, 1, 0, 1, 1000, -20000, {'density': 2670}),
@@ -269,22 +397,58 @@ def test_laplace_equation():
                                   % (str(tess), np.abs(trace).max()))
 
 
-def test_stack_overflow():
-    "gravmag.tesseroid raises exceptions on stack overflow"
+def test_stack_grows():
+    "gravmag.tesseroid grows the stack instead of overflowing"
     model = [Tesseroid(0, 1, 0, 1, 0, -20e4, {'density': 2600})]
     area = [0, 1, 0, 1]
     shape = [20, 20]
     lon, lat, h = gridder.regular(area, shape, z=1000)
     fields = 'potential gx gy gz gxx gxy gxz gyy gyz gzz'.split()
+    true = [getattr(tesseroid, f)(lon, lat, h, model) for f in fields]
     backup = tesseroid.STACK_SIZE
     tesseroid.STACK_SIZE = 5
-    for f in fields:
-        raises(OverflowError, getattr(tesseroid, f), lon, lat, h, model)
-    # Check if overflows on normal queue size when trying to calculated on top
-    # of the tesseroid
-    tesseroid.STACK_SIZE = 20
-    lon, lat, h = np.array([0.5]), np.array([0.5]), np.array([0])
-    for f in fields:
-        raises(OverflowError, getattr(tesseroid, f), lon, lat, h, model)
-    # Restore the module default queue size
-    tesseroid.STACK_SIZE = backup
+    try:
+        for f, res in zip(fields, true):
+            func = getattr(tesseroid, f)
+            assert_allclose(func(lon, lat, h, model), res,
+                            err_msg="Mismatch for {}".format(f))
+            assert_allclose(func(lon, lat, h, model, parallel=True), res,
+                            err_msg="Mismatch for {}".format(f))
+        # The grown stack should be kept and reused by the Engine
+        with tesseroid.Engine(model) as engine:
+            engine.calculate('gz', lon, lat, h)
+            assert engine._buffers[0].shape[0] > 5
+    finally:
+        tesseroid.STACK_SIZE = backup
+    # Calculating on top of the tesseroid used to overflow the default stack
+    lon, lat, h = np.array([0.5]), np.array([0.5]), np.array([0.])
+    with tesseroid.Engine(model) as engine:
+        for f in fields:
+            res = engine.calculate(f, lon, lat, h)
+            assert np.all(np.isfinite(res)), "Failed for {}".format(f)
+            stats = engine.stats
+            assert stats['splits'] > 0
+            assert stats['kernel_evaluations'] > stats['splits']
+            assert stats['max_depth'] > 1
+
+
+def test_engine_stats():
+    "gravmag.tesseroid Engine reports the same stats in serial and parallel"
+    model = TesseroidMesh((-1, 1.5, -2, 2, 0, -10e3), (3, 2, 1))
+    model.addprop('density', 500*np.ones(model.size))
+    lon, lat, height = gridder.regular((-1, 1.5, -2, 2), (15, 21), z=10e3)
+    stats = []
+    for njobs, parallel in [(1, False), (1, True), (2, False)]:
+        with tesseroid.Engine(model, njobs=njobs, parallel=parallel) as engine:
+            engine.calculate('gzz', lon, lat, height)
+            stats.append(engine.stats)
+    assert stats[0] == stats[1] == stats[2]
+    assert stats[0]['kernel_evaluations'] >= 8*lon.size*model.size
+    # Each integrated tesseroid evaluates the kernel once per GLQ node
+    with tesseroid.Engine(model) as engine:
+        engine.calculate('gzz', lon, lat, height, ratio=1, glq=(2, 2, 2))
+        low = engine.stats
+        engine.calculate('gzz', lon, lat, height, ratio=1, glq=(4, 4, 4))
+        high = engine.stats
+    assert low['splits'] == high['splits']
+    assert high['kernel_evaluations'] == 8*low['kernel_evaluations']
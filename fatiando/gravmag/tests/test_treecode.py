@@ -0,0 +1,153 @@
+from __future__ import division, absolute_import
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from .. import treecode, sphere
+from ...mesher import Sphere, PointGrid
+from ... import gridder, utils
+
+
+def _model():
+    "A random model of spheres with positive and negative properties"
+    rng = np.random.RandomState(0)
+    model = []
+    for i in range(300):
+        x, y = rng.uniform(-5000, 5000, size=2)
+        z = rng.uniform(500, 1500)
+        props = {'density': rng.uniform(-500, 1000),
+                 'magnetization': utils.ang2vec(rng.uniform(-1, 3),
+                                                rng.uniform(-90, 90),
+                                                rng.uniform(-180, 180))}
+        model.append(Sphere(x, y, z, rng.uniform(50, 200), props))
+    model.append(None)
+    model.append(Sphere(0, 0, 1000, 100, {}))
+    return model
+
+
+def test_gravity_vs_sphere():
+    "gravmag.treecode.gravity matches gravmag.sphere"
+    model = _model()
+    x, y, z = gridder.regular((-6000, 6000, -6000, 6000), (30, 30), z=-100)
+    for field in ['gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']:
+        if field in ['gx', 'gy']:
+            # gravmag.sphere doesn't have these components
+            true = 0
+            for s in model[:-2]:
+                dx, dy, dz = s.x - x, s.y - y, s.z - z
+                r = np.sqrt(dx**2 + dy**2 + dz**2)
+                mass = s.props['density']*4*np.pi*s.radius**3/3
+                true += mass*{'gx': dx, 'gy': dy}[field]/r**3
+            true *= treecode.GRAVITY_FIELDS[field]
+        else:
+            true = getattr(sphere, field)(x, y, z, model)
+        exact = treecode.gravity(field, x, y, z, model, theta=0)
+        assert_allclose(exact, true, rtol=1e-10, atol=1e-10*np.abs(true).max(),
+                        err_msg=field)
+        errors = []
+        for theta in [0.8, 0.4, 0.2]:
+            approx = treecode.gravity(field, x, y, z, model, theta=theta)
+            errors.append(np.abs(approx - true).max()/np.abs(true).max())
+        assert errors[0] > errors[1] > errors[2], field
+        assert errors[1] < 0.01, field
+    true = sphere.gz(x, y, z, model, dens=200)
+    assert_allclose(treecode.gravity('gz', x, y, z, model, dens=200, theta=0),
+                    true, rtol=1e-10)
+    with pytest.raises(ValueError):
+        treecode.gravity('tf', x, y, z, model)
+
+
+def test_magnetic_vs_sphere():
+    "gravmag.treecode.magnetic matches gravmag.sphere"
+    model = _model()
+    inc, dec = -30, 20
+    x, y, z = gridder.regular((-6000, 6000, -6000, 6000), (30, 30), z=-100)
+    for field in ['tf', 'bx', 'by', 'bz']:
+        if field == 'tf':
+            true = sphere.tf(x, y, z, model, inc, dec)
+        else:
+            true = getattr(sphere, field)(x, y, z, model)
+        exact = treecode.magnetic(field, x, y, z, model, inc, dec, theta=0)
+        assert_allclose(exact, true, rtol=1e-10, atol=1e-10*np.abs(true).max(),
+                        err_msg=field)
+        approx = treecode.magnetic(field, x, y, z, model, inc, dec,
+                                   theta=0.4)
+        assert np.abs(approx - true).max() < 0.01*np.abs(true).max(), field
+    pmag = utils.ang2vec(1, inc, dec)
+    assert_allclose(treecode.magnetic('bz', x, y, z, model, pmag=pmag,
+                                      theta=0),
+                    sphere.bz(x, y, z, model, pmag=pmag), rtol=1e-10)
+    with pytest.raises(ValueError):
+        treecode.magnetic('tf', x, y, z, model)
+    with pytest.raises(ValueError):
+        treecode.magnetic('gz', x, y, z, model, inc, dec)
+
+
+def test_point_grid():
+    "gravmag.treecode uses the arrays of a PointGrid"
+    grid = PointGrid((-2000, 2000, -2000, 2000), 300, (20, 20))
+    grid.addprop('density', np.linspace(-1000, 1000, grid.size))
+    spheres = [grid[i] for i in range(grid.size)]
+    x, y, z = gridder.scatter((-3000, 3000, -3000, 3000), 200, z=-10, seed=0)
+    for theta in [0, 0.5]:
+        assert_allclose(treecode.gravity('gzz', x, y, z, grid, theta=theta),
+                        treecode.gravity('gzz', x, y, z, spheres,
+                                         theta=theta))
+
+
+def test_tree_matrix():
+    "gravmag.treecode.TreeMatrix products match the dense matrix"
+    grid = PointGrid((-2000, 2000, -2000, 2000), 300, (20, 25))
+    cols = np.transpose([grid.x, grid.y, grid.z])
+    spheres = [grid[i] for i in range(grid.size)]
+    x, y, z = gridder.scatter((-3000, 3000, -3000, 3000), 300, z=-10, seed=0)
+    rows = np.transpose([x, y, z])
+    inc, dec, sinc, sdec = -30, 20, 10, -40
+    rng = np.random.RandomState(1)
+    v = rng.uniform(-1, 1, grid.size)
+    u = rng.uniform(-1, 1, x.size)
+    pmag = utils.ang2vec(1, sinc, sdec)
+    for field in ['gz', 'gxz', 'tf']:
+        if field == 'tf':
+            dense = np.transpose([sphere.tf(x, y, z, [s], inc, dec, pmag=pmag)
+                                  for s in spheres])
+        else:
+            dense = np.transpose([getattr(sphere, field)(x, y, z, [s], dens=1)
+                                  for s in spheres])
+        exact = treecode.TreeMatrix(field, rows, cols, inc=inc, dec=dec,
+                                    sinc=sinc, sdec=sdec, theta=0)
+        assert exact.shape == dense.shape
+        assert_allclose(exact.dot(v), dense.dot(v), rtol=1e-10,
+                        atol=1e-10*np.abs(dense.dot(v)).max())
+        assert_allclose(exact.T.dot(u), dense.T.dot(u), rtol=1e-10,
+                        atol=1e-10*np.abs(dense.T.dot(u)).max())
+        approx = treecode.TreeMatrix(field, rows, cols, inc=inc, dec=dec,
+                                     sinc=sinc, sdec=sdec, theta=0.3)
+        true = dense.dot(np.abs(v))
+        assert np.abs(approx.dot(np.abs(v)) - true).max() < \
+            0.01*np.abs(true).max()
+    with pytest.raises(ValueError):
+        treecode.TreeMatrix('tf', rows, cols)
+    with pytest.raises(ValueError):
+        treecode.TreeMatrix('potential', rows, cols)
+
+
+def test_no_sources():
+    "gravmag.treecode gives zeros if there are no sources"
+    x, y, z = gridder.regular((-1000, 1000, -1000, 1000), (5, 4), z=-10)
+    tree = treecode.SourceTree([], [], [])
+    assert tree.size == tree.nnodes == 0
+    assert np.all(tree.gravity('gz', x, y, z, 1000) == np.zeros_like(x))
+    for spheres in [[], [None], [None, Sphere(0, 0, 1000, 100, {})]]:
+        for field in ['gz', 'gxy']:
+            res = treecode.gravity(field, x, y, z, spheres)
+            assert res.shape == x.shape and np.all(res == 0)
+        res = treecode.magnetic('tf', x, y, z, spheres, inc=10, dec=20)
+        assert res.shape == x.shape and np.all(res == 0)
+    rows = np.transpose([x, y, z])
+    mat = treecode.TreeMatrix('gz', rows, [])
+    assert mat.shape == (x.size, 0)
+    assert np.all(mat.dot(np.zeros(0)) == np.zeros(x.size))
+    mat = treecode.TreeMatrix('gz', [], rows)
+    assert mat.shape == (0, x.size)
+    assert np.all(mat.T.dot(np.zeros(0)) == np.zeros(x.size))
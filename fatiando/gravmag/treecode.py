@@ -0,0 +1,487 @@
+r"""
+Fast forward modeling of many point sources using a tree code.
+
+Calculating the field of M point sources (spheres or the sources of an
+equivalent layer) on N points directly costs O(N M) operations. The
+Barnes-Hut tree code (Barnes and Hut, 1986) groups the sources into a binary
+tree of boxes. Seen from a computation point, a box that is far away
+(relative to its size) is replaced by the total mass (or magnetic moment) and
+the dipole moment of its sources about the center of the box. Only the nearby
+sources are added one by one. The cost is O(N log M).
+
+A box is considered far if
+
+.. math::
+
+    d > \frac{s}{\theta}
+
+where :math:`s` is the diagonal of the box, :math:`d` is the distance from
+the computation point to its center, and :math:`\theta` is the accuracy
+parameter. Smaller values of :math:`\theta` are more accurate and slower.
+``theta=0`` calculates the effect of every source directly. The error of each
+far box is proportional to :math:`\theta^2` because the first term left out of
+the approximation is the quadrupole moment. For ``theta=0.5``, the error is
+usually below 1% of the field.
+
+Available fields are ``'gx'``, ``'gy'``, ``'gz'``, the gravity gradients
+``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``, ``'gzz'``, the
+total-field anomaly ``'tf'`` and the components of the magnetic induction
+``'bx'``, ``'by'``, ``'bz'``. Use them with:
+
+* :func:`~fatiando.gravmag.treecode.gravity` and
+  :func:`~fatiando.gravmag.treecode.magnetic`: The same as the functions in
+  :mod:`fatiando.gravmag.sphere` for models made of
+  :class:`~fatiando.mesher.Sphere` (or a :class:`~fatiando.mesher.PointGrid`).
+* :class:`~fatiando.gravmag.treecode.SourceTree`: The tree of a set of point
+  sources. Build it once to calculate several fields or the fields of
+  different physical property values.
+* :class:`~fatiando.gravmag.treecode.TreeMatrix`: The sensitivity matrix of
+  point sources as a ``scipy.sparse.linalg.LinearOperator``. The products with
+  the matrix and its transpose use the tree code, so the matrix is never
+  formed. This is what the equivalent layers of
+  :mod:`fatiando.gravmag.eqlayer` use with the ``theta`` argument.
+
+The trees are built and traversed in compiled code (using numba). The
+computation points are split among all threads available to numba (set the
+``NUMBA_NUM_THREADS`` environment variable to control this).
+
+**References**
+
+Barnes, J., and P. Hut (1986), A hierarchical O(N log N) force-calculation
+algorithm, Nature, 324, 446-449, doi:10.1038/324446a0.
+
+----
+
+"""
+from __future__ import division, absolute_import
+from future.builtins import super
+
+import numpy
+import scipy.sparse.linalg
+
+from . import _treecode_numba
+from .. import utils
+from .sphere import _sphere_arrays
+from ..constants import G, SI2EOTVOS, CM, T2NT, SI2MGAL
+
+
+# The constants that convert the output of the tree code to the conventional
+# units
+GRAVITY_FIELDS = {'gx': G*SI2MGAL,
+                  'gy': G*SI2MGAL,
+                  'gz': G*SI2MGAL,
+                  'gxx': G*SI2EOTVOS,
+                  'gxy': G*SI2EOTVOS,
+                  'gxz': G*SI2EOTVOS,
+                  'gyy': G*SI2EOTVOS,
+                  'gyz': G*SI2EOTVOS,
+                  'gzz': G*SI2EOTVOS}
+MAGNETIC_FIELDS = {'tf': CM*T2NT,
+                   'bx': CM*T2NT,
+                   'by': CM*T2NT,
+                   'bz': CM*T2NT}
+
+
+def gravity(field, xp, yp, zp, spheres, dens=None, theta=0.5, leaf_size=16):
+    """
+    Calculate a gravitational field of spheres using the tree code.
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!). Output is in mGal for gx,
+        gy, and gz and in Eotvos for the gradients.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'gx'``, ``'gy'``, ``'gz'``,
+        ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``, ``'gyz'``, ``'gzz'``.
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`~fatiando.mesher.Sphere` or
+      :class:`~fatiando.mesher.PointGrid`
+        The spheres. Spheres must have the property ``'density'``. The ones
+        that are ``None`` or without a density will be ignored.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres.
+    * theta : float
+        The accuracy of the approximation (see above).
+    * leaf_size : int
+        The maximum number of spheres in the smallest boxes of the tree.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import PointGrid
+        >>> from fatiando.gravmag import sphere
+        >>> from fatiando import gridder
+        >>> grid = PointGrid((0, 1000, 0, 1000), 200, (50, 50))
+        >>> grid.addprop('density', np.linspace(-1, 1, grid.size)**2)
+        >>> xp, yp, zp = gridder.regular((0, 1000, 0, 1000), (20, 20), z=-10)
+        >>> true = sphere.gz(xp, yp, zp, [grid[i] for i in range(grid.size)])
+        >>> gz = gravity('gz', xp, yp, zp, grid, theta=0.5)
+        >>> np.allclose(gz, true, rtol=0.005)
+        True
+
+    """
+    if field not in GRAVITY_FIELDS:
+        raise ValueError("Invalid gravitational field '{}'".format(field))
+    x, y, z, volume, density = _sphere_arrays(spheres, 'density', dens)
+    tree = SourceTree(x, y, z, leaf_size=leaf_size)
+    return tree.gravity(field, xp, yp, zp, volume*density, theta=theta)
+
+
+def magnetic(field, xp, yp, zp, spheres, inc=None, dec=None, pmag=None,
+             theta=0.5, leaf_size=16):
+    """
+    Calculate a magnetic field of spheres using the tree code.
+
+    .. note:: The coordinate system of the input parameters is to be
+        x -> North, y -> East and z -> **DOWN**.
+
+    .. note:: Input units are SI. Output is in nT.
+
+    Parameters:
+
+    * field : str
+        The field to calculate. One of: ``'tf'`` (total-field anomaly),
+        ``'bx'``, ``'by'``, ``'bz'``.
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * spheres : list of :class:`~fatiando.mesher.Sphere` or
+      :class:`~fatiando.mesher.PointGrid`
+        The spheres. Spheres must have the property ``'magnetization'`` (a
+        3-component vector). The ones that are ``None`` or without a
+        magnetization will be ignored.
+    * inc, dec : floats
+        The inclination and declination of the regional field (in degrees).
+        Only used (and required) for the total-field anomaly.
+    * pmag : [mx, my, mz] or None
+        If not None, will use this magnetization vector instead of the
+        ``'magnetization'`` property of the spheres.
+    * theta : float
+        The accuracy of the approximation (see above).
+    * leaf_size : int
+        The maximum number of spheres in the smallest boxes of the tree.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if field not in MAGNETIC_FIELDS:
+        raise ValueError("Invalid magnetic field '{}'".format(field))
+    x, y, z, volume, mag = _sphere_arrays(spheres, 'magnetization', pmag)
+    tree = SourceTree(x, y, z, leaf_size=leaf_size)
+    moment = volume[:, None]*numpy.reshape(mag, (-1, 3))
+    return tree.magnetic(field, xp, yp, zp, moment, inc, dec, theta=theta)
+
+
+class SourceTree(object):
+    """
+    A tree of point sources used to calculate their fields.
+
+    The sources are split in half along the largest dimension of their
+    bounding box until there are at most *leaf_size* sources in each box.
+    The tree depends only on the positions of the sources, so it can be used
+    to calculate many fields for different masses or magnetic moments.
+
+    Parameters:
+
+    * x, y, z : 1d-arrays
+        The x, y, and z coordinates of the sources.
+    * leaf_size : int
+        The maximum number of sources in the smallest boxes of the tree.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> tree = SourceTree([0., 10, 20, 30], [0., 0, 0, 0],
+        ...                   [10., 10, 10, 10], leaf_size=1)
+        >>> tree.size, tree.nnodes
+        (4, 7)
+        >>> mass = np.ones(4)
+        >>> approx = tree.gravity('gz', [1000.], [0.], [0.], mass, theta=0.5)
+        >>> exact = tree.gravity('gz', [1000.], [0.], [0.], mass, theta=0)
+        >>> np.allclose(approx, exact, rtol=1e-3)
+        True
+
+    """
+
+    def __init__(self, x, y, z, leaf_size=16):
+        if leaf_size < 1:
+            raise ValueError(
+                "Invalid leaf_size {}. Must be >= 1.".format(leaf_size))
+        points = numpy.transpose([numpy.ravel(x), numpy.ravel(y),
+                                  numpy.ravel(z)]).astype(numpy.float64)
+        self.size = points.shape[0]
+        self.leaf_size = leaf_size
+        tree = _treecode_numba.build(points, leaf_size)
+        self.order = tree[0]
+        self._points = numpy.ascontiguousarray(points[self.order])
+        self._nodes = tree[1:]
+
+    @property
+    def nnodes(self):
+        "The number of boxes in the tree"
+        return self._nodes[0].size
+
+    def gravity(self, field, xp, yp, zp, mass, theta=0.5):
+        """
+        Calculate a gravitational field of the sources.
+
+        Parameters:
+
+        * field : str
+            The field to calculate (see
+            :func:`~fatiando.gravmag.treecode.gravity`).
+        * xp, yp, zp : arrays
+            The x, y, and z coordinates of the computation points.
+        * mass : 1d-array or float
+            The mass of each source (in kg).
+        * theta : float
+            The accuracy of the approximation.
+
+        Returns:
+
+        * res : array
+            The field calculated on xp, yp, zp
+
+        """
+        order, weights = _gravity_weights(field)
+        mass = numpy.broadcast_to(mass, (self.size,))
+        return GRAVITY_FIELDS[field]*self.evaluate(xp, yp, zp, order,
+                                                   weights, mass, theta)
+
+    def magnetic(self, field, xp, yp, zp, moment, inc=None, dec=None,
+                 theta=0.5):
+        """
+        Calculate a magnetic field of the sources (dipoles).
+
+        Parameters:
+
+        * field : str
+            The field to calculate (see
+            :func:`~fatiando.gravmag.treecode.magnetic`).
+        * xp, yp, zp : arrays
+            The x, y, and z coordinates of the computation points.
+        * moment : 2d-array or [mx, my, mz]
+            Array with shape (N, 3) with the magnetic moment of each source (in
+            A m^2). If a single vector, all sources will have this moment.
+        * inc, dec : floats
+            The inclination and declination of the regional field (in
+            degrees). Only used (and required) for the total-field anomaly.
+        * theta : float
+            The accuracy of the approximation.
+
+        Returns:
+
+        * res : array
+            The field calculated on xp, yp, zp
+
+        """
+        direction = _field_direction(field, inc, dec)
+        # Each component of the moments is a set of scalar charges
+        weights = numpy.zeros((3, 3, 3))
+        for i in range(3):
+            weights[i, :, i] = direction
+        moment = numpy.broadcast_to(moment, (self.size, 3))
+        return MAGNETIC_FIELDS[field]*self.evaluate(xp, yp, zp, 2, weights,
+                                                    moment.T, theta)
+
+    def evaluate(self, xp, yp, zp, order, weights, charges, theta=0.5):
+        """
+        Calculate a derivative of the potential of the sources (without any
+        constants).
+
+        The field is the sum of the kernel of each source times its charge. The
+        kernel of first derivatives (*order* 1) is :math:`w\\cdot d/r^3` and of
+        second derivatives (*order* 2) is :math:`\\sum_{ij} W_{ij}
+        \\partial_i\\partial_j (1/r)`, where :math:`d` is the position of the
+        source relative to the computation point. The gravity fields and the
+        magnetic fields of dipoles are particular cases.
+
+        Parameters:
+
+        * xp, yp, zp : arrays
+            The x, y, and z coordinates of the computation points.
+        * order : int
+            The order of the derivative (1 or 2).
+        * weights : 2d- or 3d-array
+            The weights :math:`w` (in the first row) or :math:`W` of the
+            kernel with shape (3, 3). Use an array with shape (K, 3, 3) to sum
+            the effect of K sets of charges with different weights.
+        * charges : 1d- or 2d-array
+            The charge of each source. An array with shape (K, N) if there are
+            K sets of weights.
+        * theta : float
+            The accuracy of the approximation.
+
+        Returns:
+
+        * res : array
+            The field calculated on xp, yp, zp
+
+        """
+        if order not in (1, 2):
+            raise ValueError("Invalid order {}. Must be 1 or 2.".format(order))
+        if theta < 0:
+            raise ValueError("Invalid theta {}. Must be >= 0.".format(theta))
+        xp, yp, zp = [numpy.ascontiguousarray(i, dtype=numpy.float64)
+                      for i in [xp, yp, zp]]
+        if xp.shape != yp.shape or xp.shape != zp.shape:
+            raise ValueError(
+                "Input arrays xp, yp, and zp must have same length!")
+        weights = numpy.asarray(weights, dtype=numpy.float64).reshape(
+            (-1, 3, 3))
+        charges = numpy.asarray(charges, dtype=numpy.float64).reshape(
+            (weights.shape[0], self.size))
+        charges = numpy.ascontiguousarray(charges[:, self.order])
+        res = numpy.zeros(xp.size)
+        if self.size == 0:
+            return res.reshape(xp.shape)
+        _treecode_numba.evaluate(xp.ravel(), yp.ravel(), zp.ravel(), order,
+                                 weights, self._points, charges,
+                                 *(self._nodes + (theta, res)))
+        return res.reshape(xp.shape)
+
+
+class TreeMatrix(scipy.sparse.linalg.LinearOperator):
+    """
+    The sensitivity matrix of point sources evaluated with the tree code.
+
+    Element ``[i, j]`` of the matrix is the field produced on the ith data
+    point by the jth source with unit density (or unit magnetization
+    intensity) and volume *volume[j]*. The matrix is never formed: products
+    with the matrix use a tree of the sources and products with its transpose
+    use a tree of the data points. Both cost O(N log N) operations and memory.
+
+    Parameters:
+
+    * field : str
+        The field (see :func:`~fatiando.gravmag.treecode.gravity` and
+        :func:`~fatiando.gravmag.treecode.magnetic`).
+    * rows : 2d-array
+        Array with shape (N, 3) with the coordinates of the data points.
+    * cols : 2d-array
+        Array with shape (M, 3) with the coordinates of the sources.
+    * volume : 1d-array or float
+        The volume of each source.
+    * inc, dec : floats
+        The inclination and declination of the regional field (in degrees).
+        Only used for the magnetic fields (required for ``'tf'``).
+    * sinc, sdec : floats
+        The inclination and declination of the magnetization of the sources.
+        Only used for the magnetic fields. If not given, will use *inc* and
+        *dec* (induced magnetization).
+    * theta : float
+        The accuracy of the approximation.
+    * leaf_size : int
+        The maximum number of points in the smallest boxes of the trees.
+
+    Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.mesher import PointGrid
+        >>> from fatiando.gravmag import sphere
+        >>> from fatiando import gridder
+        >>> grid = PointGrid((0, 1000, 0, 1000), 100, (30, 30))
+        >>> xp, yp, zp = gridder.scatter((0, 1000, 0, 1000), 500, z=-10,
+        ...                              seed=0)
+        >>> mat = TreeMatrix('gzz', np.transpose([xp, yp, zp]),
+        ...                  np.transpose([grid.x, grid.y, grid.z]))
+        >>> mat.shape
+        (500, 900)
+        >>> dense = np.transpose([sphere.gzz(xp, yp, zp, [grid[i]], dens=1)
+        ...                       for i in range(grid.size)])
+        >>> v = np.linspace(-1, 1, 900)
+        >>> u = np.linspace(0, 1, 500)
+        >>> np.allclose(mat.dot(v), dense.dot(v), rtol=0.01, atol=1e-3)
+        True
+        >>> np.allclose(mat.T.dot(u), dense.T.dot(u), rtol=0.01, atol=1e-3)
+        True
+
+    """
+
+    def __init__(self, field, rows, cols, volume=1, inc=None, dec=None,
+                 sinc=None, sdec=None, theta=0.5, leaf_size=16):
+        rows = numpy.asarray(rows, dtype=numpy.float64).reshape((-1, 3))
+        cols = numpy.asarray(cols, dtype=numpy.float64).reshape((-1, 3))
+        super().__init__(dtype=numpy.dtype(numpy.float64),
+                         shape=(rows.shape[0], cols.shape[0]))
+        if field in GRAVITY_FIELDS:
+            self.order, self.weights = _gravity_weights(field)
+            self.constant = GRAVITY_FIELDS[field]
+        elif field in MAGNETIC_FIELDS:
+            if sinc is None or sdec is None:
+                sinc, sdec = inc, dec
+            if sinc is None or sdec is None:
+                raise ValueError(
+                    "sinc and sdec (or inc and dec) are required for "
+                    "magnetic fields")
+            self.order = 2
+            self.weights = numpy.outer(_field_direction(field, inc, dec),
+                                       utils.dircos(sinc, sdec))
+            self.constant = MAGNETIC_FIELDS[field]
+        else:
+            raise ValueError("Invalid field '{}'".format(field))
+        self.field = field
+        self.theta = theta
+        self.rows = rows
+        self.cols = cols
+        self.volume = numpy.broadcast_to(numpy.asarray(volume, dtype=float),
+                                         (cols.shape[0],))
+        self.row_tree = SourceTree(*rows.T, leaf_size=leaf_size)
+        self.col_tree = SourceTree(*cols.T, leaf_size=leaf_size)
+
+    def _matvec(self, v):
+        v = numpy.ravel(v)
+        x, y, z = self.rows.T
+        res = self.col_tree.evaluate(x, y, z, self.order, self.weights,
+                                     self.volume*v, self.theta)
+        return self.constant*res
+
+    def _rmatvec(self, v):
+        # The kernel is even for order 2 and odd for order 1 when swapping the
+        # sources and computation points
+        v = numpy.ravel(v)
+        x, y, z = self.cols.T
+        res = self.row_tree.evaluate(x, y, z, self.order, self.weights, v,
+                                     self.theta)
+        return (-1)**self.order*self.constant*self.volume*res
+
+
+def _gravity_weights(field):
+    """
+    Get the order and weights of the kernel of a gravitational field.
+    """
+    if field not in GRAVITY_FIELDS:
+        raise ValueError("Invalid gravitational field '{}'".format(field))
+    weights = numpy.zeros((3, 3))
+    components = ['xyz'.index(c) for c in field[1:]]
+    if len(components) == 1:
+        weights[0, components[0]] = 1
+    else:
+        weights[components[0], components[1]] = 1
+    return len(components), weights
+
+
+def _field_direction(field, inc, dec):
+    """
+    Get the direction on which a magnetic field is projected.
+    """
+    if field not in MAGNETIC_FIELDS:
+        raise ValueError("Invalid magnetic field '{}'".format(field))
+    if field == 'tf':
+        if inc is None or dec is None:
+            raise ValueError("inc and dec are required for the total field")
+        return numpy.array(utils.dircos(inc, dec))
+    return numpy.array([float(field == c) for c in ['bx', 'by', 'bz']])
@@ -207,7 +207,7 @@ def unpad_array(a, nps):
     o = []
     for ii in range(0, a.ndim):
         o.append(slice(nps[ii][0], a.shape[ii] - nps[ii][1]))
-    b = a[o]
+    b = a[tuple(o)]
 
     return b
 
@@ -295,7 +295,8 @@ def _costaper(a, lp, rp):
     # This takes an array and applies a cosine taper to each end.
     # The array has already been deep copied above.  This is by reference only.
     a[0:lp] = a[0:lp] * _calccostaper(lp)[::-1]
-    a[-rp:] = a[-rp:] * _calccostaper(rp)
+    if rp > 0:
+        a[-rp:] = a[-rp:] * _calccostaper(rp)
     return a
 
 
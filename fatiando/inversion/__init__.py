@@ -20,6 +20,9 @@ Modules
 * :mod:`~fatiando.inversion.hyper_param`: Classes hyper parameter optimization
   (estimating the regularization parameter), like L-curve analysis and (in the
   future) cross-validation.
+* :mod:`~fatiando.inversion.hmatrix`: Compressed (hierarchical low-rank)
+  representation of dense sensitivity matrices. Can be used as the Jacobian of
+  large linear problems solved with the ``'cgls'`` method.
 * :mod:`~fatiando.inversion.optimization`: Functions for several optimization
   methods (used internally by :class:`~fatiando.inversion.misfit.Misfit`).
   In most cases you won't need to touch this.
@@ -227,6 +230,28 @@ The ``'objective'`` key holds a list of the objective function value per
 iteration of the optimization process.
 
 
+Large linear problems
+---------------------
+
+The ``'linear'`` method forms the Hessian matrix and solves a linear system,
+which takes memory proportional to the square of the number of parameters.
+For problems with many parameters, use the ``'cgls'`` method instead. It is a
+Conjugate Gradient solver that only needs products of the Jacobian (and its
+transpose) with vectors. Regularization (like ``Damping`` and ``Smoothness``)
+is applied in the same way. Use ``tol`` and ``maxit`` to stop the iterations
+early.
+
+>>> _ = solver.config('cgls', tol=10**-8)
+>>> np.allclose(solver.fit().estimate_, [2, 5])
+True
+>>> solver.stats_['method']
+'CGLS'
+
+The ``jacobian`` method of a linear ``Misfit`` can also return a
+``scipy.sparse.linalg.LinearOperator`` that computes these products without
+ever forming the matrix.
+
+
 Re-weighted least squares
 -------------------------
 
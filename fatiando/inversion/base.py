@@ -26,6 +26,13 @@ This module defines base classes that are used by the rest of the
   ``CachedMethod`` but always returns the cached value, regardless of the
   input. Effectively calculates only the first time the method is called.
   Useful for caching the Jacobian matrix in a linear problem.
+* :class:`~fatiando.inversion.base.CachedMethodMemmap`: Like
+  ``CachedMethodPermanent`` but keeps the cached matrix in a memory-mapped file
+  on disk instead of in memory. Useful for Jacobian matrices that don't fit in
+  memory.
+* :func:`~fatiando.inversion.base.stack_operators`: Stack matrices or linear
+  operators vertically without forming the stacked matrix. Used to build the
+  least-squares system of a ``MultiObjective``.
 
 ----
 
@@ -35,10 +42,15 @@ from future.utils import with_metaclass
 from future.builtins import super, object, range, isinstance, zip, map
 import hashlib
 import copy
+import os
+import tempfile
 from abc import ABCMeta, abstractmethod
 import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 
 from . import optimization
+from .. import utils
 
 
 class OperatorMixin(object):
@@ -163,8 +175,8 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         Parameters:
 
         * method : string
-            The optimization method. One of: ``'linear'``, ``'newton'``,
-            ``'levmarq'``, ``'steepest'``, ``'acor'``
+            The optimization method. One of: ``'linear'``, ``'cgls'``,
+            ``'newton'``, ``'levmarq'``, ``'steepest'``, ``'acor'``
 
         Other keyword arguments that can be passed are the ones allowed by each
         method.
@@ -179,6 +191,7 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         See the corresponding docstrings for more information:
 
         * :meth:`~fatiando.inversion.optimization.linear`
+        * :meth:`~fatiando.inversion.optimization.cgls`
         * :meth:`~fatiando.inversion.optimization.newton`
         * :meth:`~fatiando.inversion.optimization.levmarq`
         * :meth:`~fatiando.inversion.optimization.steepest`
@@ -186,8 +199,12 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
 
         """
         kwargs = copy.deepcopy(kwargs)
-        assert method in ['linear', 'newton', 'levmarq', 'steepest', 'acor'], \
+        assert method in ['linear', 'cgls', 'newton', 'levmarq', 'steepest',
+                          'acor'], \
             "Invalid optimization method '{}'".format(method)
+        if method == 'cgls':
+            assert self.islinear, \
+                "The '{}' method is only for linear problems".format(method)
         if method in ['newton', 'levmarq', 'steepest']:
             assert 'initial' in kwargs, \
                 "Missing required *initial* argument for '{}'".format(method)
@@ -225,6 +242,12 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         if self.fit_method == 'linear':
             solver = optimizer(self.hessian(None), self.gradient(None),
                                **self.fit_args)
+        elif self.fit_method == 'cgls':
+            if not hasattr(self, 'lsq_system'):
+                raise ValueError(
+                    "{} has no linear least-squares form and can't be used "
+                    "with the 'cgls' method".format(self.__class__.__name__))
+            solver = optimizer(*self.lsq_system(), **self.fit_args)
         elif self.fit_method in ['newton', 'levmarq']:
             solver = optimizer(self.hessian, self.gradient, self.value,
                                **self.fit_args)
@@ -511,6 +534,78 @@ class MultiObjective(OptimizerMixin, OperatorMixin):
         """
         return self.regul_param*sum(obj.hessian(p) for obj in self)
 
+    def lsq_system(self):
+        """
+        The matrix and vector of the least-squares form of the function.
+
+        Stacks the systems of all goal functions that make up this
+        multi-objective. Used by the ``'cgls'`` optimization method.
+
+        Returns:
+
+        * operator, vector : LinearOperator, 1d-array
+            The value of the function is ``norm(operator*p - vector)**2``
+
+        """
+        for obj in self:
+            if not hasattr(obj, 'lsq_system'):
+                raise ValueError(
+                    "{} has no linear least-squares form and can't be used "
+                    "with the 'cgls' method".format(obj.__class__.__name__))
+        systems = [obj.lsq_system() for obj in self]
+        operator = stack_operators([op for op, _ in systems])
+        vector = np.concatenate([vec for _, vec in systems])
+        scale = np.sqrt(self.regul_param)
+        return scale*operator, scale*vector
+
+
+def stack_operators(operators):
+    """
+    Stack linear operators vertically without forming their matrices.
+
+    Parameters:
+
+    * operators : list
+        The matrices, sparse matrices or ``scipy.sparse.linalg.LinearOperator``
+        to stack. All must have the same number of columns.
+
+    Returns:
+
+    * stacked : ``scipy.sparse.linalg.LinearOperator``
+        Applies all operators in ``matvec`` and sums the products of the
+        transposes in ``rmatvec``.
+
+    Examples:
+
+    >>> A = np.array([[1., 2.]])
+    >>> B = scipy.sparse.identity(2)
+    >>> C = stack_operators([A, B])
+    >>> C.shape
+    (3, 2)
+    >>> C.matvec(np.array([1., 1.]))
+    array([3., 1., 1.])
+    >>> C.rmatvec(np.array([1., 1., 2.]))
+    array([2., 4.])
+
+    """
+    operators = [scipy.sparse.linalg.aslinearoperator(op) for op in operators]
+    ncols = operators[0].shape[1]
+    assert all(op.shape[1] == ncols for op in operators), \
+        "Can't stack operators with different number of columns"
+    splits = np.cumsum([op.shape[0] for op in operators])[:-1]
+
+    def matvec(v):
+        return np.concatenate([op.matvec(v).ravel() for op in operators])
+
+    def rmatvec(v):
+        parts = np.split(np.ravel(v), splits)
+        return sum(op.rmatvec(part).ravel()
+                   for op, part in zip(operators, parts))
+
+    nrows = sum(op.shape[0] for op in operators)
+    return scipy.sparse.linalg.LinearOperator(
+        (nrows, ncols), matvec=matvec, rmatvec=rmatvec, dtype=np.float)
+
 
 class CachedMethod(object):
     """
@@ -672,3 +767,145 @@ class CachedMethodPermanent(object):
             method = getattr(self.instance.__class__, self.meth)
             self.cache = method(self.instance, p)
         return self.cache
+
+
+class CachedMethodMemmap(CachedMethodPermanent):
+    """
+    Wrap a method to cache it's output in a memory-mapped file on disk.
+
+    Like :class:`~fatiando.inversion.base.CachedMethodPermanent`, the method is
+    only run once. The returned matrix is written to a ``.npy`` file in blocks
+    of rows and the cached value is a :class:`numpy.memmap` of this file, so
+    the matrix doesn't have to be kept in memory. Products with the cached
+    matrix through :func:`~fatiando.utils.safe_dot` read it from disk a block
+    at a time.
+
+    If the method already returns a :class:`numpy.memmap` (for example, a
+    matrix filled directly into a file) or a sparse matrix, it is cached as is.
+
+    If *rows* is given, the method isn't called. The file is filled instead
+    with blocks of rows returned by ``rows(p, slice)``, so the whole matrix is
+    never in memory.
+
+    Parameters:
+
+    * instance : object
+        The instance of the object that has the method you want to cache.
+    * meth : string
+        The name of the method you want to cache.
+    * fname : string or None
+        The name of the ``.npy`` file used to store the matrix. Can be loaded
+        later with ``numpy.load(fname, mmap_mode='r')``. If None, will use a
+        temporary file that is deleted when the cached value is discarded.
+    * dtype : numpy dtype or None
+        The dtype of the stored matrix (use ``numpy.float32`` to halve the
+        disk space). If None, will use the dtype of the returned matrix
+        (float64 if *rows* is given).
+    * rows : string or None
+        The name of a method of *instance* that calculates the rows of the
+        matrix in a slice, called as ``rows(p, slice)``.
+    * shape : tuple or None
+        The shape of the matrix. Required if *rows* is given.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> class MyClass(object):
+    ...     def my_method(self, p):
+    ...         return np.ones((3, 2))*p
+    >>> obj = MyClass()
+    >>> obj.my_method = CachedMethodMemmap(obj, 'my_method')
+    >>> a = obj.my_method(np.array([1., 2.]))
+    >>> isinstance(a, np.memmap)
+    True
+    >>> a
+    memmap([[1., 2.],
+            [1., 2.],
+            [1., 2.]])
+    >>> b = obj.my_method(np.array([3., 4.]))
+    >>> a is b
+    True
+
+    Filling the file one block of rows at a time:
+
+    >>> class MyClass(object):
+    ...     def my_rows(self, p, rows):
+    ...         return np.arange(6.).reshape((3, 2))[rows]*p
+    >>> obj = MyClass()
+    >>> obj.my_method = CachedMethodMemmap(obj, 'my_method', rows='my_rows',
+    ...                                    shape=(3, 2))
+    >>> obj.my_method(np.array([1., 10.]))
+    memmap([[ 0., 10.],
+            [ 2., 30.],
+            [ 4., 50.]])
+
+    """
+
+    def __init__(self, instance, meth, fname=None, dtype=None, rows=None,
+                 shape=None):
+        super().__init__(instance, meth)
+        if rows is not None and shape is None:
+            raise ValueError("The shape of the matrix is required with rows")
+        self.fname = fname
+        self.dtype = dtype
+        self.rows = rows
+        self.shape = shape
+
+    def __call__(self, p=None):
+        if self.cache is None:
+            if self.rows is not None:
+                self.cache = self._fill(p)
+                return self.cache
+            method = getattr(self.instance.__class__, self.meth)
+            result = method(self.instance, p)
+            if (isinstance(result, np.memmap) or
+                    scipy.sparse.issparse(result)):
+                self.cache = result
+            else:
+                self.cache = self._store(np.asarray(result))
+        return self.cache
+
+    def _fill(self, p):
+        """
+        Calculate the matrix in blocks of rows directly into the file.
+        """
+        dtype = np.float64 if self.dtype is None else self.dtype
+        stored = self._open(self.shape, dtype)
+        rows = getattr(self.instance, self.rows)
+        step = max(1, utils.MEMMAP_BLOCK_SIZE//max(1, stored[:1].nbytes))
+        for i in range(0, self.shape[0], step):
+            stored[i:i + step] = rows(p, slice(i, i + step))
+        stored.flush()
+        return stored
+
+    def _store(self, matrix):
+        """
+        Write the matrix to the file in blocks of rows and memory-map it.
+        """
+        dtype = matrix.dtype if self.dtype is None else self.dtype
+        stored = self._open(matrix.shape, dtype)
+        step = max(1, utils.MEMMAP_BLOCK_SIZE//max(1, matrix[:1].nbytes))
+        for i in range(0, matrix.shape[0], step):
+            stored[i:i + step] = matrix[i:i + step]
+        stored.flush()
+        return stored
+
+    def _open(self, shape, dtype):
+        """
+        Create the memory-mapped file for a matrix.
+        """
+        if self.fname is None:
+            fd, fname = tempfile.mkstemp(suffix='.npy')
+            os.close(fd)
+        else:
+            fname = self.fname
+        stored = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype,
+                                           shape=shape)
+        if self.fname is None:
+            # The open memmap keeps the data available until it is discarded.
+            # Some operating systems don't allow removing open files.
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+        return stored
@@ -0,0 +1,338 @@
+r"""
+Compressed (hierarchical low-rank) representation of sensitivity matrices.
+
+The sensitivity (Jacobian) matrices of potential field problems are dense but
+their elements vary smoothly with the distance between the data points and
+the sources. Blocks of the matrix that relate groups of data points to groups
+of sources that are far away from them (relative to the size of the groups)
+can be approximated by low-rank matrices :math:`\bar{\bar{U}}\bar{\bar{V}}`
+to a given accuracy. Only the blocks of nearby points and sources need to be
+stored in full.
+
+* :class:`~fatiando.inversion.hmatrix.HMatrix`: A compressed matrix that
+  implements matrix-vector products with the matrix and its transpose. It is
+  a ``scipy.sparse.linalg.LinearOperator``, so it can be used as the Jacobian
+  of a linear :class:`~fatiando.inversion.misfit.Misfit` solved with the
+  ``'cgls'`` method.
+* :func:`~fatiando.inversion.hmatrix.aca`: The Adaptive Cross Approximation
+  used to compress each far-field block.
+
+The matrix is never formed in full. The compression only needs a function
+that calculates any block of it (given the indices of the rows and columns)
+and the coordinates of the data points (rows) and sources (columns). The
+points and sources are split recursively into clusters (a binary tree) along
+their largest dimension. A pair of clusters is compressed if
+
+.. math::
+
+    \min(d_{data}, d_{sources}) \le \eta\ \mathrm{dist}
+
+where :math:`d` is the diagonal of the bounding box of a cluster and
+:math:`\mathrm{dist}` is the distance between the bounding boxes.
+
+**References**
+
+Bebendorf, M. (2000), Approximation of boundary element matrices, Numerische
+Mathematik, 86(4), 565-589, doi:10.1007/PL00005410.
+
+Hackbusch, W. (1999), A sparse matrix arithmetic based on H-matrices. Part I:
+Introduction to H-matrices, Computing, 62(2), 89-108,
+doi:10.1007/s006070050015.
+
+----
+
+"""
+from __future__ import division, absolute_import
+from future.builtins import range
+
+import numpy
+import scipy.sparse.linalg
+
+
+class HMatrix(scipy.sparse.linalg.LinearOperator):
+    """
+    A matrix compressed into dense near-field and low-rank far-field blocks.
+
+    Parameters:
+
+    * block : function
+        Function ``block(rows, cols)`` that calculates the block of the matrix
+        with the given row and column indices (1d integer arrays). Must return
+        a 2d-array with shape ``(len(rows), len(cols))``.
+    * rows : 2d-array
+        Array with shape (N, 3) with the coordinates of the points related to
+        each row of the matrix (e.g., the data points).
+    * cols : 2d-array
+        Array with shape (M, 3) with the coordinates of the points related to
+        each column of the matrix (e.g., the center of each source).
+    * tol : float
+        The relative accuracy of the low-rank blocks (in the Frobenius norm).
+    * eta : float
+        Controls which blocks are compressed (see above). Smaller values
+        compress only the blocks that are farther away, which is more accurate
+        and slower.
+    * leaf_size : int
+        The maximum number of points in the smallest clusters.
+    * dtype : numpy dtype
+        The dtype of the stored blocks. Use ``numpy.float32`` to halve the
+        memory used.
+
+    Examples:
+
+    Compress the matrix of the function 1/r between two groups of points:
+
+    >>> import numpy as np
+    >>> np.random.seed(0)
+    >>> data = np.random.uniform(0, 100, size=(200, 3))
+    >>> data[:, 2] = 0
+    >>> sources = np.random.uniform(0, 100, size=(300, 3))
+    >>> sources[:, 2] = 10
+    >>> def block(i, j):
+    ...     diff = data[i][:, None, :] - sources[j][None, :, :]
+    ...     return 1/np.sqrt(np.sum(diff**2, axis=2))
+    >>> mat = HMatrix(block, data, sources, tol=1e-6)
+    >>> mat.shape
+    (200, 300)
+    >>> dense = block(np.arange(200), np.arange(300))
+    >>> v = np.random.uniform(size=300)
+    >>> np.allclose(mat.matvec(v), dense.dot(v), rtol=1e-4)
+    True
+    >>> u = np.random.uniform(size=200)
+    >>> np.allclose(mat.rmatvec(u), dense.T.dot(u), rtol=1e-4)
+    True
+    >>> np.allclose(mat.todense(), dense, rtol=1e-4)
+    True
+    >>> mat.compression < 1
+    True
+
+    The matrix must have at least one row and one column:
+
+    >>> HMatrix(block, data, sources[:0])
+    Traceback (most recent call last):
+      ...
+    ValueError: Can't build an HMatrix without rows or columns: shape (200, 0)
+
+    """
+
+    def __init__(self, block, rows, cols, tol=1e-4, eta=1., leaf_size=32,
+                 dtype=numpy.float64):
+        rows = numpy.asarray(rows, dtype=numpy.float64)
+        cols = numpy.asarray(cols, dtype=numpy.float64)
+        if rows.shape[0] == 0 or cols.shape[0] == 0:
+            raise ValueError(
+                "Can't build an HMatrix without rows or columns: "
+                "shape ({}, {})".format(rows.shape[0], cols.shape[0]))
+        super(HMatrix, self).__init__(dtype=numpy.dtype(dtype),
+                                      shape=(rows.shape[0], cols.shape[0]))
+        self.tol = tol
+        self.eta = eta
+        self.leaf_size = leaf_size
+        # Lists of (row indices, column indices, matrix) and
+        # (row indices, column indices, U, V)
+        self.dense_blocks = []
+        self.lowrank_blocks = []
+        row_tree = _cluster(rows, numpy.arange(rows.shape[0]), leaf_size)
+        col_tree = _cluster(cols, numpy.arange(cols.shape[0]), leaf_size)
+        pairs = [(row_tree, col_tree)]
+        while pairs:
+            rnode, cnode = pairs.pop()
+            if _admissible(rnode, cnode, eta):
+                lowrank = aca(block, rnode.index, cnode.index, tol)
+                if lowrank is not None:
+                    u, v = lowrank
+                    self.lowrank_blocks.append(
+                        (rnode.index, cnode.index, u.astype(self.dtype),
+                         v.astype(self.dtype)))
+                    continue
+            if not rnode.children and not cnode.children:
+                self.dense_blocks.append(
+                    (rnode.index, cnode.index,
+                     numpy.asarray(block(rnode.index, cnode.index),
+                                   dtype=self.dtype)))
+                continue
+            # Split the largest cluster (or the one that can be split)
+            split_rows = (rnode.children and
+                          (not cnode.children or
+                           rnode.diameter >= cnode.diameter))
+            if split_rows:
+                pairs.extend((child, cnode) for child in rnode.children)
+            else:
+                pairs.extend((rnode, child) for child in cnode.children)
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes used to store the compressed matrix.
+        """
+        dense = sum(b[2].nbytes for b in self.dense_blocks)
+        lowrank = sum(b[2].nbytes + b[3].nbytes for b in self.lowrank_blocks)
+        return dense + lowrank
+
+    @property
+    def compression(self):
+        """
+        The ratio between the memory used and that of the full matrix.
+        """
+        return self.nbytes/(self.shape[0]*self.shape[1]*self.dtype.itemsize)
+
+    def _matvec(self, v):
+        v = numpy.ravel(v)
+        res = numpy.zeros(self.shape[0], dtype=numpy.result_type(self.dtype,
+                                                                 v.dtype))
+        for i, j, mat in self.dense_blocks:
+            res[i] += mat.dot(v[j])
+        for i, j, u, w in self.lowrank_blocks:
+            res[i] += u.dot(w.dot(v[j]))
+        return res
+
+    def _rmatvec(self, v):
+        v = numpy.ravel(v)
+        res = numpy.zeros(self.shape[1], dtype=numpy.result_type(self.dtype,
+                                                                 v.dtype))
+        for i, j, mat in self.dense_blocks:
+            res[j] += mat.T.dot(v[i])
+        for i, j, u, w in self.lowrank_blocks:
+            res[j] += w.T.dot(u.T.dot(v[i]))
+        return res
+
+    def todense(self):
+        """
+        Assemble the full (approximated) matrix.
+
+        Returns:
+
+        * matrix : 2d-array
+            The matrix
+
+        """
+        matrix = numpy.zeros(self.shape, dtype=self.dtype)
+        for i, j, mat in self.dense_blocks:
+            matrix[numpy.ix_(i, j)] = mat
+        for i, j, u, w in self.lowrank_blocks:
+            matrix[numpy.ix_(i, j)] = u.dot(w)
+        return matrix
+
+
+def aca(block, rows, cols, tol, maxrank=None):
+    r"""
+    Low-rank approximation of a matrix block by Adaptive Cross Approximation.
+
+    Approximates the block by :math:`\bar{\bar{U}}\bar{\bar{V}}` calculating
+    only some of its rows and columns (ACA with partial pivoting, Bebendorf,
+    2000). Stops when the norm of the last rank-1 update is smaller than *tol*
+    times the (estimated) Frobenius norm of the approximation.
+
+    Parameters:
+
+    * block : function
+        Function ``block(rows, cols)`` that calculates the elements of the
+        matrix with the given row and column indices.
+    * rows, cols : 1d-arrays
+        The indices of the rows and columns of the block.
+    * tol : float
+        The relative accuracy of the approximation.
+    * maxrank : int or None
+        The maximum rank allowed. If None, will use the rank at which the
+        low-rank form uses as much memory as the full block.
+
+    Returns:
+
+    * u, v : 2d-arrays or None
+        Arrays with shapes (len(rows), k) and (k, len(cols)). None if the
+        block couldn't be approximated with rank smaller than *maxrank*.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> x = np.linspace(0, 1, 50)
+    >>> y = np.linspace(10, 11, 40)
+    >>> def block(i, j):
+    ...     return 1/np.abs(x[i][:, None] - y[j][None, :])
+    >>> u, v = aca(block, np.arange(50), np.arange(40), tol=1e-8)
+    >>> u.shape[1] < 10
+    True
+    >>> np.allclose(u.dot(v), block(np.arange(50), np.arange(40)))
+    True
+
+    """
+    nrows, ncols = len(rows), len(cols)
+    if maxrank is None:
+        maxrank = (nrows*ncols)//(nrows + ncols)
+    us, vs = [], []
+    norm2 = 0.
+    used = numpy.zeros(nrows, dtype=numpy.bool)
+    pivot = 0
+    for rank in range(maxrank):
+        used[pivot] = True
+        row = numpy.ravel(block(rows[pivot:pivot + 1], cols)).astype(
+            numpy.float64)
+        for u, v in zip(us, vs):
+            row -= u[pivot]*v
+        col_pivot = numpy.argmax(numpy.abs(row))
+        if row[col_pivot] == 0:
+            # The row is already represented. Try another one.
+            candidates = numpy.flatnonzero(~used)
+            if candidates.size == 0:
+                break
+            pivot = candidates[0]
+            continue
+        v = row/row[col_pivot]
+        u = numpy.ravel(block(rows, cols[col_pivot:col_pivot + 1])).astype(
+            numpy.float64)
+        for uk, vk in zip(us, vs):
+            u -= uk*vk[col_pivot]
+        # Update the norm of the approximation
+        unorm, vnorm = numpy.linalg.norm(u), numpy.linalg.norm(v)
+        for uk, vk in zip(us, vs):
+            norm2 += 2*u.dot(uk)*vk.dot(v)
+        norm2 += (unorm*vnorm)**2
+        us.append(u)
+        vs.append(v)
+        if unorm*vnorm <= tol*numpy.sqrt(abs(norm2)):
+            return numpy.transpose(us), numpy.array(vs)
+        aux = numpy.abs(u)
+        aux[used] = -1
+        pivot = numpy.argmax(aux)
+        if aux[pivot] < 0:
+            break
+    if len(us) == min(nrows, ncols):
+        # All rows or columns were used, so the approximation is exact
+        return numpy.transpose(us), numpy.array(vs)
+    return None
+
+
+class _Node(object):
+    """
+    A cluster of points: their indices, bounding box and sub-clusters.
+    """
+
+    def __init__(self, index, points):
+        self.index = index
+        self.lower = points.min(axis=0)
+        self.upper = points.max(axis=0)
+        self.diameter = numpy.linalg.norm(self.upper - self.lower)
+        self.children = []
+
+
+def _cluster(points, index, leaf_size):
+    """
+    Split the points recursively in two along their largest dimension.
+    """
+    node = _Node(index, points[index])
+    if len(index) > leaf_size:
+        axis = numpy.argmax(node.upper - node.lower)
+        order = numpy.argsort(points[index, axis], kind='mergesort')
+        half = len(index)//2
+        node.children = [_cluster(points, index[order[:half]], leaf_size),
+                         _cluster(points, index[order[half:]], leaf_size)]
+    return node
+
+
+def _admissible(rnode, cnode, eta):
+    """
+    Check if the clusters are far enough apart to compress their block.
+    """
+    gap = numpy.maximum(0, numpy.maximum(rnode.lower - cnode.upper,
+                                         cnode.lower - rnode.upper))
+    distance = numpy.linalg.norm(gap)
+    return min(rnode.diameter, cnode.diameter) <= eta*distance
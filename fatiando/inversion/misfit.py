@@ -20,10 +20,12 @@ import copy
 from abc import abstractmethod
 import numpy as np
 import scipy.sparse
+import scipy.sparse.linalg
 
+from .. import utils
 from ..utils import safe_dot
 from .base import (OptimizerMixin, OperatorMixin, CachedMethod,
-                   CachedMethodPermanent)
+                   CachedMethodPermanent, CachedMethodMemmap)
 
 
 class Misfit(OptimizerMixin, OperatorMixin):
@@ -57,7 +59,9 @@ class Misfit(OptimizerMixin, OperatorMixin):
     If :math:`\bar{f}` is linear, then the Jacobian will be cached in memory so
     that it is only calculated once when using the class multiple times. So
     solving the same problem with different methods or using an iterative
-    method doesn't have the penalty of recalculating the Jacobian.
+    method doesn't have the penalty of recalculating the Jacobian. Use
+    :meth:`~fatiando.inversion.misfit.Misfit.store_jacobian` to keep it in a
+    file on disk instead of in memory.
 
     .. warning::
 
@@ -147,6 +151,114 @@ class Misfit(OptimizerMixin, OperatorMixin):
         self.hessian.hard_reset()
         return self
 
+    def store_jacobian(self, fname=None, dtype=None):
+        """
+        Keep the Jacobian matrix in a memory-mapped file instead of in memory.
+
+        Use this when the Jacobian of a linear problem is too large to fit in
+        memory. The matrix returned by ``jacobian`` is written to disk in
+        blocks of rows and cached as a :class:`numpy.memmap`. The
+        ``hessian``, ``gradient`` and the ``predicted`` data (if they use
+        :func:`~fatiando.utils.safe_dot`) then read it a block at a time.
+
+        If the class implements ``jacobian_rows(self, p, rows)`` (which
+        returns the rows of the Jacobian in the slice *rows*), the file is
+        filled one block of rows at a time and the whole matrix is never in
+        memory.
+
+        Only available for linear problems.
+
+        Parameters:
+
+        * fname : string or None
+            The name of the ``.npy`` file used to store the Jacobian. If None,
+            will use a temporary file.
+        * dtype : numpy dtype or None
+            The dtype of the stored matrix (use ``numpy.float32`` to halve the
+            disk space). If None, will use the dtype of the Jacobian.
+
+        Returns:
+
+        * self
+
+        Examples:
+
+        >>> import numpy as np
+        >>> class Linear(Misfit):
+        ...     def __init__(self, data, A):
+        ...         super(Linear, self).__init__(data, A.shape[1], True)
+        ...         self.A = A
+        ...     def predicted(self, p):
+        ...         return safe_dot(self.jacobian(p), p)
+        ...     def jacobian(self, p):
+        ...         return self.A
+        >>> A = np.array([[1., 2.], [3., 4.], [5., 6.]])
+        >>> solver = Linear(A.dot([2., 3.]), A).store_jacobian()
+        >>> isinstance(solver.jacobian(None), np.memmap)
+        True
+        >>> solver.fit().estimate_
+        array([2., 3.])
+
+        """
+        if not self.islinear:
+            raise ValueError(
+                "Can only store the Jacobian of linear problems on disk.")
+        if hasattr(self, 'jacobian_rows'):
+            self.jacobian = CachedMethodMemmap(
+                self, 'jacobian', fname, dtype, rows='jacobian_rows',
+                shape=(self.ndata, self.nparams))
+        else:
+            self.jacobian = CachedMethodMemmap(self, 'jacobian', fname, dtype)
+        self.hessian = CachedMethodPermanent(self, 'hessian')
+        return self
+
+    def lsq_system(self):
+        r"""
+        The matrix and vector of the least-squares form of the misfit.
+
+        For a linear problem, the misfit can be written as
+
+        .. math::
+
+            \phi = \|\bar{\bar{W}}^{1/2}\bar{\bar{J}}\bar{p} -
+            \bar{\bar{W}}^{1/2}\bar{d}^o\|^2
+
+        This is used by the matrix-free ``'cgls'`` optimization method, which
+        only needs products of the Jacobian (and its transpose) with vectors.
+        The Hessian matrix is never formed. The ``jacobian`` method can return
+        a ``scipy.sparse.linalg.LinearOperator`` instead of a matrix to avoid
+        forming the Jacobian as well.
+
+        Only available for linear problems with diagonal (or no) weights.
+
+        Returns:
+
+        * operator, vector : LinearOperator, 1d-array
+            The value of the misfit is ``norm(operator*p - vector)**2``
+
+        """
+        if not self.islinear:
+            raise ValueError(
+                "The least-squares system is only defined for linear problems")
+        jacobian = self.jacobian(None)
+        if not isinstance(jacobian, scipy.sparse.linalg.LinearOperator):
+            matrix = jacobian
+            jacobian = scipy.sparse.linalg.LinearOperator(
+                matrix.shape, matvec=lambda v: safe_dot(matrix, v),
+                rmatvec=lambda v: safe_dot(matrix.T, v), dtype=matrix.dtype)
+        data = self.data
+        if self.weights is not None:
+            diagonal = _weights_diagonal(self.weights)
+            if diagonal is None:
+                raise ValueError(
+                    "The least-squares system requires diagonal weights")
+            sqrt_weights = np.sqrt(diagonal)
+            jacobian = scipy.sparse.linalg.aslinearoperator(
+                scipy.sparse.diags(sqrt_weights, 0))*jacobian
+            data = sqrt_weights*data
+        scale = np.sqrt(self.regul_param)
+        return scale*jacobian, scale*data
+
     def residuals(self, p=None):
         """
         Calculate the residuals vector (observed - predicted data).
@@ -248,8 +360,14 @@ class Misfit(OptimizerMixin, OperatorMixin):
 
         """
         jacobian = self.jacobian(p)
+        if isinstance(jacobian, scipy.sparse.linalg.LinearOperator):
+            raise ValueError(
+                "Can't form the Hessian of a matrix-free Jacobian. " +
+                "Use the 'cgls' optimization method.")
         if self.weights is None:
             hessian = safe_dot(jacobian.T, jacobian)
+        elif isinstance(jacobian, np.memmap):
+            hessian = _weighted_gram(jacobian, self.weights)
         else:
             hessian = safe_dot(jacobian.T, self.weights*jacobian)
         hessian *= 2*self.regul_param
@@ -292,3 +410,36 @@ class Misfit(OptimizerMixin, OperatorMixin):
             grad = np.array(grad).ravel()
         grad *= -2*self.regul_param
         return grad
+
+
+def _weights_diagonal(weights):
+    """
+    Get the diagonal of the weight matrix if it is diagonal (None otherwise).
+
+    Weights passed as 1d-arrays to ``set_weights`` are stored as diagonal
+    sparse matrices.
+    """
+    is_diagonal = (scipy.sparse.isspmatrix_dia(weights) and
+                   np.all(weights.offsets == 0))
+    if is_diagonal:
+        return weights.diagonal()
+    return None
+
+
+def _weighted_gram(jacobian, weights):
+    """
+    Calculate J^T W J for a Jacobian J stored in a memory-mapped file.
+
+    If the weight matrix W is diagonal, reads the rows of J from disk only
+    once. Otherwise, the product W J is calculated in memory.
+    """
+    diagonal = _weights_diagonal(weights)
+    if diagonal is None:
+        return safe_dot(jacobian.T, safe_dot(weights, jacobian))
+    step = max(1, utils.MEMMAP_BLOCK_SIZE//max(1, jacobian[:1].nbytes))
+    hessian = 0
+    for i in range(0, jacobian.shape[0], step):
+        block = np.asarray(jacobian[i:i + step])
+        hessian = hessian + safe_dot(
+            block.T, diagonal[i:i + step].reshape((-1, 1))*block)
+    return hessian
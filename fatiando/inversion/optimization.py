@@ -18,6 +18,8 @@ loop, like so::
 **Gradient descent**
 
 * :func:`~fatiando.inversion.optimization.linear`: Solver for a linear problem
+* :func:`~fatiando.inversion.optimization.cgls`: Matrix-free Conjugate
+  Gradient Least Squares solver for a linear problem
 * :func:`~fatiando.inversion.optimization.newton`: Newton's method
 * :func:`~fatiando.inversion.optimization.levmarq`: Levemberg-Marquardt
   algorithm
@@ -30,6 +32,9 @@ loop, like so::
 
 **References**
 
+Aster, R. C., B. Borchers, and C. H. Thurber (2013), Parameter Estimation and
+Inverse Problems, 2nd ed., Academic Press.
+
 Socha, K., and M. Dorigo (2008), Ant colony optimization for continuous
 domains, European Journal of Operational Research, 185(3), 1155-1173,
 doi:10.1016/j.ejor.2006.06.046.
@@ -44,6 +49,7 @@ import copy
 import warnings
 import numpy
 import scipy.sparse
+import scipy.sparse.linalg
 
 from ..utils import safe_solve, safe_diagonal, safe_dot
 
@@ -95,6 +101,119 @@ def linear(hessian, gradient, precondition=True):
     yield 0, p, dict(method="Linear solver")
 
 
+def cgls(operator, data, initial=None, maxit=1000, tol=10**-5):
+    r"""
+    Solve a linear least-squares problem with the CGLS method.
+
+    Minimizes the objective function
+
+    .. math::
+
+        \phi(\bar{p}) = \|\bar{\bar{A}}\bar{p} - \bar{d}\|^2
+
+    using the Conjugate Gradient Least Squares method (e.g., Aster et al.,
+    2013). This is the Conjugate Gradient method applied to the normal
+    equations :math:`\bar{\bar{A}}^T\bar{\bar{A}}\bar{p} =
+    \bar{\bar{A}}^T\bar{d}` without ever forming
+    :math:`\bar{\bar{A}}^T\bar{\bar{A}}`. Each iteration needs only a
+    product with :math:`\bar{\bar{A}}` and one with its transpose, so the
+    memory used is proportional to the number of data plus the number of
+    parameters.
+
+    Regularization is included by stacking rows on :math:`\bar{\bar{A}}` and
+    :math:`\bar{d}` (see the ``lsq_system`` method of the
+    :class:`~fatiando.inversion.misfit.Misfit` and
+    :mod:`~fatiando.inversion.regularization` classes).
+
+    Parameters:
+
+    * operator : 2d-array, sparse matrix or LinearOperator
+        The matrix :math:`\bar{\bar{A}}`. Can be a
+        ``scipy.sparse.linalg.LinearOperator`` that implements only the
+        ``matvec`` and ``rmatvec`` products.
+    * data : 1d-array
+        The vector :math:`\bar{d}`.
+    * initial : 1d-array or None
+        The initial estimate. If None, will start from a vector of zeros.
+    * maxit : int
+        The maximum number of iterations allowed.
+    * tol : float
+        The convergence criterion. Stops when the norm of the gradient
+        :math:`\bar{\bar{A}}^T(\bar{d} - \bar{\bar{A}}\bar{p})` is smaller
+        than *tol* times its initial value. Larger values stop earlier (which
+        also regularizes the solution).
+
+    Yields:
+
+    * i, estimate, stats:
+        * i : int
+            The current iteration number
+        * estimate : 1d-array
+            The current estimated parameter vector
+        * stats : dict
+            Statistics about the optimization so far. Keys:
+
+            * method : str
+                The name of the optimization method
+            * iterations : int
+                The total number of iterations so far
+            * objective : list
+                Value of the objective function per iteration. First value
+                corresponds to the inital estimate
+
+    Examples:
+
+    >>> A = numpy.array([[1., 0], [0, 2], [1, 1]])
+    >>> d = safe_dot(A, [1., 2.])
+    >>> for i, p, stats in cgls(A, d):
+    ...     pass
+    >>> numpy.allclose(p, [1, 2])
+    True
+    >>> stats['iterations']
+    2
+
+    """
+    operator = scipy.sparse.linalg.aslinearoperator(operator)
+    stats = dict(method="CGLS",
+                 iterations=0,
+                 objective=[])
+    if initial is None:
+        p = numpy.zeros(operator.shape[1], dtype=numpy.float)
+        residuals = numpy.array(data, dtype=numpy.float)
+    else:
+        p = numpy.array(initial, dtype=numpy.float)
+        residuals = data - operator.matvec(p)
+    stats['objective'].append(numpy.linalg.norm(residuals)**2)
+    grad = operator.rmatvec(residuals)
+    gamma = numpy.linalg.norm(grad)**2
+    gamma0 = gamma
+    direction = grad
+    for iteration in range(maxit):
+        if gamma <= gamma0*tol**2 or gamma == 0:
+            break
+        aux = operator.matvec(direction)
+        alpha = gamma/numpy.linalg.norm(aux)**2
+        p = p + alpha*direction
+        residuals = residuals - alpha*aux
+        grad = operator.rmatvec(residuals)
+        newgamma = numpy.linalg.norm(grad)**2
+        direction = grad + (newgamma/gamma)*direction
+        gamma = newgamma
+        stats['objective'].append(numpy.linalg.norm(residuals)**2)
+        stats['iterations'] += 1
+        yield iteration, p, copy.deepcopy(stats)
+    else:
+        if gamma > gamma0*tol**2:
+            warnings.warn(
+                'Exited because maximum iterations reached. ' +
+                'Might not have achieved convergence. ' +
+                'Try inscreasing the maximum number of iterations allowed.',
+                RuntimeWarning)
+    if stats['iterations'] == 0:
+        # Already at the minimum
+        yield 0, p, copy.deepcopy(stats)
+
+
 def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
            precondition=True):
     r"""
@@ -40,6 +40,7 @@ import copy
 
 import numpy
 import scipy.sparse
+import scipy.sparse.linalg
 
 from .base import OperatorMixin, CachedMethod, CachedMethodPermanent
 from ..utils import safe_dot
@@ -192,6 +193,23 @@ class Damping(Regularization):
         """
         return self.regul_param*numpy.linalg.norm(p)**2
 
+    def lsq_system(self):
+        """
+        The matrix and vector of the least-squares form of the function.
+
+        Used by the matrix-free ``'cgls'`` optimization method.
+
+        Returns:
+
+        * operator, vector : LinearOperator, 1d-array
+            The value of the function is ``norm(operator*p - vector)**2``
+
+        """
+        operator = scipy.sparse.linalg.aslinearoperator(
+            scipy.sparse.identity(self.nparams))
+        vector = numpy.zeros(self.nparams)
+        return numpy.sqrt(self.regul_param)*operator, vector
+
 
 class Smoothness(Regularization):
     r"""
@@ -323,6 +341,23 @@ class Smoothness(Regularization):
         # Need to divide by 2 because the hessian is 2*R.T*R
         return self.regul_param*safe_dot(p.T, safe_dot(self.hessian(p), p))/2
 
+    def lsq_system(self):
+        """
+        The matrix and vector of the least-squares form of the function.
+
+        Used by the matrix-free ``'cgls'`` optimization method. The matrix is
+        the finite difference matrix, so the Hessian is never formed.
+
+        Returns:
+
+        * operator, vector : LinearOperator, 1d-array
+            The value of the function is ``norm(operator*p - vector)**2``
+
+        """
+        operator = scipy.sparse.linalg.aslinearoperator(self.fdmat)
+        vector = numpy.zeros(self.fdmat.shape[0])
+        return numpy.sqrt(self.regul_param)*operator, vector
+
 
 class Smoothness1D(Smoothness):
     """
@@ -6,3 +6,5 @@ from __future__ import absolute_import
 from .geometry import Polygon, Square, Prism, Tesseroid, Sphere
 from .geometry import PolygonalPrism
 from .mesh import SquareMesh, PointGrid, PrismRelief, PrismMesh, TesseroidMesh
+from .mesh import OctreePrismMesh
+from .mesh import load_mesh, load_ubc
@@ -5,6 +5,8 @@ Meshes behave like lists/arrays of geometric objects (they are iterables).
 """
 from __future__ import division, absolute_import
 from future.builtins import range, object, super
+import zipfile
+import struct
 import numpy as np
 import scipy.special
 import scipy.interpolate
@@ -280,6 +282,9 @@ class PointGrid(object):
         self.i += 1
         return sphere
 
+    # Python 3 iterator protocol
+    __next__ = next
+
     def addprop(self, prop, values):
         """
         Add physical property values to the points in the grid.
@@ -383,6 +388,26 @@ class PointGrid(object):
                 subs.append(PointGrid(area, zs, (mx, my), props))
         return subs
 
+    def save(self, fname, compress=False):
+        """
+        Save the grid to a binary ``.npz`` file.
+
+        The file holds the geometry of the grid and all physical properties.
+        Load it back with :func:`~fatiando.mesher.load_mesh`.
+
+        Parameters:
+
+        * fname : str or file
+            The file name or an open file. A ``.npz`` extension is appended to
+            file names that don't have one.
+        * compress : True or False
+            If True, will compress the arrays. Compressed properties can't be
+            memory-mapped when loading the file.
+
+        """
+        arrays = dict(area=self.area, z=self.z, shape=self.shape)
+        _save_npz(fname, self, arrays, compress)
+
     def copy(self):
         """ Return a deep copy of the current instance."""
         return cp.deepcopy(self)
@@ -464,6 +489,9 @@ class PrismRelief(object):
         self.i += 1
         return prism
 
+    # Python 3 iterator protocol
+    __next__ = next
+
     def addprop(self, prop, values):
         """
         Add physical property values to the prisms.
@@ -487,6 +515,29 @@ class PrismRelief(object):
             return v
         self.props[prop] = [correct(v, i) for i, v in enumerate(values)]
 
+    def save(self, fname, compress=False):
+        """
+        Save the relief to a binary ``.npz`` file.
+
+        The file holds the geometry of the relief and all physical properties
+        (with the sign corrections applied by
+        :meth:`~fatiando.mesher.PrismRelief.addprop`).
+        Load it back with :func:`~fatiando.mesher.load_mesh`.
+
+        Parameters:
+
+        * fname : str or file
+            The file name or an open file. A ``.npz`` extension is appended to
+            file names that don't have one.
+        * compress : True or False
+            If True, will compress the arrays. Compressed properties can't be
+            memory-mapped when loading the file.
+
+        """
+        arrays = dict(ref=self.ref, dims=(self.dy, self.dx), x=self.x,
+                      y=self.y, z=self.z)
+        _save_npz(fname, self, arrays, compress)
+
     def copy(self):
         """ Return a deep copy of the current instance."""
         return cp.deepcopy(self)
@@ -603,24 +654,127 @@ class PrismMesh(object):
             self.props = {}
         else:
             self.props = props
-        # The index of the current prism in an iteration. Needed when mesh is
-        # used as an iterator
-        self.i = 0
-        # List of masked prisms. Will return None if trying to access them
-        self.mask = []
+        # Boolean array with the masked prisms. Will return None if trying to
+        # access them
+        self._mask = np.zeros(size, dtype=np.bool)
+        # The boundaries of the cells are only calculated when needed
+        self._cell_bounds = None
         # Wether or not to change heights to z coordinate
         self.zdown = True
 
     def __len__(self):
         return self.size
 
+    @property
+    def mask(self):
+        """
+        Boolean array that is True for the masked cells of the mesh.
+
+        Accessing a masked cell returns None. Can be set to a boolean array or
+        to a list with the indices of the masked cells.
+
+        Examples:
+
+            >>> mesh = PrismMesh((0, 1, 0, 2, 0, 3), (1, 2, 2))
+            >>> mesh.mask = [1, 3]
+            >>> print(mesh.mask)
+            [False  True False  True]
+            >>> mesh.mask[0] = True
+            >>> print(mesh[0])
+            None
+
+        """
+        return self._mask
+
+    @mask.setter
+    def mask(self, value):
+        value = np.asarray(value)
+        if value.dtype == np.bool:
+            if value.size != self.size:
+                raise ValueError(
+                    "Invalid mask with size {}. Should be {}.".format(
+                        value.size, self.size))
+            self._mask = value.ravel().copy()
+        else:
+            self._mask = np.zeros(self.size, dtype=np.bool)
+            self._mask[value.astype(np.int)] = True
+
+    @property
+    def cell_bounds(self):
+        """
+        The boundaries of all cells of the mesh as an (N, 6) array.
+
+        Each row has the boundaries ``[x1, x2, y1, y2, z1, z2]`` of a cell, in
+        the same order as the cells of the mesh (including the masked ones).
+        For a :class:`~fatiando.mesher.TesseroidMesh`, these are ``[w, e, s,
+        n, top, bottom]``. The array is calculated only once.
+
+        Examples:
+
+            >>> mesh = PrismMesh((0, 1, 0, 2, 0, 3), (1, 2, 2))
+            >>> for cell in mesh.cell_bounds:
+            ...     print(cell.tolist())
+            [0.0, 0.5, 0.0, 1.0, 0.0, 3.0]
+            [0.5, 1.0, 0.0, 1.0, 0.0, 3.0]
+            [0.0, 0.5, 1.0, 2.0, 0.0, 3.0]
+            [0.5, 1.0, 1.0, 2.0, 0.0, 3.0]
+            >>> print(mesh.x1.tolist())
+            [0.0, 0.5, 0.0, 0.5]
+
+        """
+        if self._cell_bounds is None:
+            nz, ny, nx = self.shape
+            dx, dy, dz = self.dims
+            cells = np.empty((nz, ny, nx, 6), dtype=np.float)
+            x = self.bounds[0] + dx*np.arange(nx)
+            y = self.bounds[2] + dy*np.arange(ny)
+            z = self.bounds[4] + dz*np.arange(nz)
+            cells[..., 0] = x
+            cells[..., 1] = x + dx
+            cells[..., 2] = y[:, np.newaxis]
+            cells[..., 3] = y[:, np.newaxis] + dy
+            cells[..., 4] = z[:, np.newaxis, np.newaxis]
+            cells[..., 5] = z[:, np.newaxis, np.newaxis] + dz
+            self._cell_bounds = cells.reshape((self.size, 6))
+        return self._cell_bounds
+
+    @property
+    def x1(self):
+        "The x1 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 0]
+
+    @property
+    def x2(self):
+        "The x2 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 1]
+
+    @property
+    def y1(self):
+        "The y1 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 2]
+
+    @property
+    def y2(self):
+        "The y2 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 3]
+
+    @property
+    def z1(self):
+        "The z1 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 4]
+
+    @property
+    def z2(self):
+        "The z2 boundary of all cells (a view of the ``cell_bounds``)"
+        return self.cell_bounds[:, 5]
+
     def __getitem__(self, index):
         if index >= self.size or index < -self.size:
             raise IndexError('mesh index out of range')
         # To walk backwards in the list
         if index < 0:
             index = self.size + index
-        if index in self.mask:
+        if self._mask[index]:
             return None
         nz, ny, nx = self.shape
         k = index//(nx*ny)
@@ -636,15 +790,17 @@ class PrismMesh(object):
         return self.celltype(x1, x2, y1, y2, z1, z2, props=props)
 
     def __iter__(self):
-        self.i = 0
-        return self
-
-    def next(self):
-        if self.i >= self.size:
-            raise StopIteration
-        prism = self.__getitem__(self.i)
-        self.i += 1
-        return prism
+        # Use the precomputed boundaries instead of calculating the indices of
+        # each cell like __getitem__
+        cells = self.cell_bounds
+        mask = self._mask
+        props = self.props
+        for index in range(self.size):
+            if mask[index]:
+                yield None
+                continue
+            cellprops = dict([p, props[p][index]] for p in props)
+            yield self.celltype(*cells[index], props=cellprops)
 
     def addprop(self, prop, values):
         """
@@ -672,7 +828,12 @@ class PrismMesh(object):
         topography).
         Also mask prisms outside of the topography grid provided.
         The topography height information does not need to be on a regular
-        grid, it will be interpolated.
+        grid, it will be interpolated. If the topography is given on the
+        centers of the cells of the mesh (in the same order as the cells in a
+        layer), the interpolation is skipped.
+
+        The mask is calculated for all layers at once by comparing the depth
+        of the center of each cell with the topography.
 
         Parameters:
 
@@ -683,48 +844,50 @@ class PrismMesh(object):
         * below : boolean
             Will mask prisms below the input surface if set to *True*.
 
+        Examples:
+
+            >>> mesh = PrismMesh((0, 2, 0, 2, 0, 2), (2, 1, 2))
+            >>> x, y = [0.5, 1.5], [1, 1]
+            >>> mesh.carvetopo(x, y, [-0.2, -1.2])
+            >>> print(mesh.mask)
+            [False  True False False]
+
         """
         nz, ny, nx = self.shape
         x1, x2, y1, y2, z1, z2 = self.bounds
         dx, dy, dz = self.dims
         # The coordinates of the centers of the cells
-        xc = np.arange(x1, x2, dx) + 0.5 * dx
-        # Sometimes arange returns more due to rounding
-        if len(xc) > nx:
-            xc = xc[:-1]
-        yc = np.arange(y1, y2, dy) + 0.5 * dy
-        if len(yc) > ny:
-            yc = yc[:-1]
-        zc = np.arange(z1, z2, dz) + 0.5 * dz
-        if len(zc) > nz:
-            zc = zc[:-1]
-        XC, YC = np.meshgrid(xc, yc)
-        topo = scipy.interpolate.griddata((x, y), height, (XC, YC),
-                                          method='cubic').ravel()
+        xc = x1 + dx*(np.arange(nx) + 0.5)
+        yc = y1 + dy*(np.arange(ny) + 0.5)
+        zc = z1 + dz*(np.arange(nz) + 0.5)
+        XC, YC = [i.ravel() for i in np.meshgrid(xc, yc)]
+        x, y = np.ravel(x), np.ravel(y)
+        height = np.ravel(height)
+        if (x.size == XC.size and np.allclose(x, XC) and
+                np.allclose(y, YC)):
+            topo = np.array(height, dtype=np.float)
+        else:
+            topo = scipy.interpolate.griddata((x, y), height, (XC, YC),
+                                              method='cubic')
         if self.zdown:
             # -1 if to transform height into z coordinate
             topo = -1 * topo
-        # griddata returns a masked array. If the interpolated point is out of
-        # of the data range, mask will be True. Use this to remove all cells
-        # below a masked topo point (ie, one with no height information)
+        # Remove all cells below a topo point with no height information (out
+        # of the data range of the interpolation).
         if np.ma.isMA(topo):
-            topo_mask = topo.mask
+            topo_mask = np.ma.getmaskarray(topo) | np.isnan(topo.filled(0))
+            topo = topo.filled(0)
         else:
-            topo_mask = [False for i in range(len(topo))]
-        c = 0
-        for cellz in zc:
-            for h, masked in zip(topo, topo_mask):
-                if below:
-                    if (masked or
-                            (cellz > h and self.zdown) or
-                            (cellz < h and not self.zdown)):
-                        self.mask.append(c)
-                else:
-                    if (masked or
-                            (cellz < h and self.zdown) or
-                            (cellz > h and not self.zdown)):
-                        self.mask.append(c)
-                c += 1
+            topo_mask = np.isnan(topo)
+            topo = np.where(topo_mask, 0, topo)
+        # One row per layer and one column per cell in a layer
+        cellz = zc[:, np.newaxis]
+        if below == self.zdown:
+            carved = cellz > topo
+        else:
+            carved = cellz < topo
+        carved |= topo_mask
+        self._mask |= carved.ravel()
 
     def get_xs(self):
         """
@@ -886,10 +1049,48 @@ class PrismMesh(object):
             meshfile.close()
         values = np.fromiter(self.props[prop], dtype=np.float)
         # Replace the masked cells with a dummy value
-        values[self.mask] = -10000000
+        values[self._mask] = -10000000
         reordered = np.ravel(np.reshape(values, self.shape), order='F')
         np.savetxt(propfile, reordered, fmt='%.4f')
 
+    def save(self, fname, compress=False):
+        """
+        Save the mesh to a binary ``.npz`` file.
+
+        The file holds the geometry of the mesh, the mask, and all physical
+        properties. This is much faster than
+        :meth:`~fatiando.mesher.PrismMesh.dump` and doesn't lose precision.
+        Load it back with :func:`~fatiando.mesher.load_mesh`.
+
+        Parameters:
+
+        * fname : str or file
+            The file name or an open file. A ``.npz`` extension is appended to
+            file names that don't have one.
+        * compress : True or False
+            If True, will compress the arrays. Compressed properties can't be
+            memory-mapped when loading the file.
+
+        Examples:
+
+            >>> from io import BytesIO
+            >>> mesh = PrismMesh((0, 10, 0, 20, 0, 5), (1, 2, 2))
+            >>> mesh.addprop('density', [1, 2, 3, 4])
+            >>> mesh.mask = [2]
+            >>> fname = BytesIO()
+            >>> mesh.save(fname)
+            >>> loaded = load_mesh(BytesIO(fname.getvalue()))
+            >>> for p in loaded:
+            ...     print(p)
+            x1:0 | x2:5 | y1:0 | y2:10 | z1:0 | z2:5 | density:1
+            x1:5 | x2:10 | y1:0 | y2:10 | z1:0 | z2:5 | density:2
+            None
+            x1:5 | x2:10 | y1:10 | y2:20 | z1:0 | z2:5 | density:4
+
+        """
+        arrays = dict(bounds=self.bounds, shape=self.shape, mask=self._mask)
+        _save_npz(fname, self, arrays, compress)
+
     def copy(self):
         """ Return a deep copy of the current instance."""
         return cp.deepcopy(self)
@@ -1005,3 +1206,582 @@ class TesseroidMesh(PrismMesh):
         super().__init__(bounds, shape, props)
         self.zdown = False
         self.dump = None
+
+
+class OctreePrismMesh(PrismMesh):
+    """
+    A 3D mesh of right rectangular prisms that can be refined locally.
+
+    The mesh starts as a regular :class:`~fatiando.mesher.PrismMesh` with
+    *shape*. Each cell can then be split into 8 equal prisms (the cell's
+    *children*) using :meth:`~fatiando.mesher.OctreePrismMesh.refine`, up to
+    *maxlevel* times. This allows small cells where resolution is needed
+    (e.g., near the surface) and large cells everywhere else.
+
+    When a cell is refined, its children take its place in the list of cells
+    (ordered x first, then y, then z) and inherit its physical properties and
+    mask. Cells are identified by their *level* (the number of times they
+    were split) and their (i, j, k) index on the regular grid of that level
+    (see :meth:`~fatiando.mesher.OctreePrismMesh.ijk`).
+
+    Like :class:`~fatiando.mesher.PrismMesh`, this class can be used as a list
+    of prisms, so it can be passed to the functions in
+    :mod:`fatiando.gravmag.prism` and to
+    :mod:`fatiando.gravmag.harvester`. The methods of
+    :class:`~fatiando.mesher.PrismMesh` that assume a regular mesh (like
+    ``get_xs`` and ``get_layer``) are not available.
+
+    Parameters:
+
+    * bounds : list = [xmin, xmax, ymin, ymax, zmin, zmax]
+        Boundaries of the mesh.
+    * shape : tuple = (nz, ny, nx)
+        Number of prisms in the x, y, and z directions before any refinement.
+    * maxlevel : int
+        The maximum number of times a cell can be refined.
+    * props :  dict
+        Physical properties of each prism in the mesh.
+        Each key should be the name of a physical property. The corresponding
+        value should be a list with the values of that particular property on
+        each prism of the mesh.
+
+    Examples:
+
+        >>> mesh = OctreePrismMesh((0, 2, 0, 1, 0, 1), (1, 1, 2), maxlevel=1)
+        >>> mesh.addprop('density', [2, 5])
+        >>> len(mesh)
+        2
+        >>> mesh.refine([0])
+        >>> len(mesh)
+        9
+        >>> for p in mesh:
+        ...     print(p)
+        x1:0 | x2:0.5 | y1:0 | y2:0.5 | z1:0 | z2:0.5 | density:2
+        x1:0.5 | x2:1 | y1:0 | y2:0.5 | z1:0 | z2:0.5 | density:2
+        x1:0 | x2:0.5 | y1:0.5 | y2:1 | z1:0 | z2:0.5 | density:2
+        x1:0.5 | x2:1 | y1:0.5 | y2:1 | z1:0 | z2:0.5 | density:2
+        x1:0 | x2:0.5 | y1:0 | y2:0.5 | z1:0.5 | z2:1 | density:2
+        x1:0.5 | x2:1 | y1:0 | y2:0.5 | z1:0.5 | z2:1 | density:2
+        x1:0 | x2:0.5 | y1:0.5 | y2:1 | z1:0.5 | z2:1 | density:2
+        x1:0.5 | x2:1 | y1:0.5 | y2:1 | z1:0.5 | z2:1 | density:2
+        x1:1 | x2:2 | y1:0 | y2:1 | z1:0 | z2:1 | density:5
+        >>> mesh.ijk(3)
+        (1, 1, 0, 1)
+        >>> mesh.ijk(8)
+        (1, 0, 0, 0)
+        >>> print(mesh.neighbors(8)['south'])
+        [1, 3, 5, 7]
+        >>> print(mesh.neighbors(1)['north'])
+        [8]
+        >>> print(mesh.neighbors(1)['below'])
+        [5]
+
+    Cells can't be refined more than *maxlevel* times:
+
+        >>> mesh.refine([0])
+        Traceback (most recent call last):
+            ...
+        ValueError: Can't refine cells past the maximum level 1.
+
+    """
+
+    def __init__(self, bounds, shape, maxlevel=3, props=None):
+        super().__init__(bounds, shape, props)
+        self.maxlevel = int(maxlevel)
+        k, j, i = [a.ravel() for a in np.indices(self.shape)]
+        self._ijk = np.transpose([i, j, k])
+        self._level = np.zeros(self.size, dtype=np.int)
+        # Maps (level, i, j, k) to the index of the cell. Only built when
+        # searching for neighbors.
+        self._lookup = None
+        self.dump = None
+        self.get_xs = None
+        self.get_ys = None
+        self.get_zs = None
+        self.get_layer = None
+        self.layers = None
+
+    @property
+    def level(self):
+        "The refinement level of each cell."
+        return self._level
+
+    @property
+    def cell_bounds(self):
+        """
+        The boundaries of all cells of the mesh as an (N, 6) array.
+
+        Each row has the boundaries ``[x1, x2, y1, y2, z1, z2]`` of a cell, in
+        the same order as the cells of the mesh (including the masked ones).
+        The array is recalculated only after the mesh is refined.
+        """
+        if self._cell_bounds is None:
+            dims = np.array(self.dims)
+            origin = np.array(self.bounds[::2], dtype=np.float)
+            sizes = dims*0.5**self._level[:, np.newaxis]
+            cells = np.empty((self.size, 6), dtype=np.float)
+            cells[:, ::2] = origin + self._ijk*sizes
+            cells[:, 1::2] = cells[:, ::2] + sizes
+            self._cell_bounds = cells
+        return self._cell_bounds
+
+    def __getitem__(self, index):
+        if index >= self.size or index < -self.size:
+            raise IndexError('mesh index out of range')
+        # To walk backwards in the list
+        if index < 0:
+            index = self.size + index
+        if self._mask[index]:
+            return None
+        props = dict([p, self.props[p][index]] for p in self.props)
+        return self.celltype(*self.cell_bounds[index], props=props)
+
+    def ijk(self, index):
+        """
+        The (i, j, k) index and the refinement level of a cell.
+
+        i, j, and k are the indices of the cell in the x, y, and z directions
+        on a regular mesh with the cells of its level. A cell with level
+        ``l`` spans ``i/2**l`` to ``(i + 1)/2**l`` in units of the
+        unrefined cells.
+
+        Parameters:
+
+        * index : int
+            The index of the cell in the mesh.
+
+        Returns:
+
+        * [i, j, k, level] : tuple of ints
+
+        """
+        i, j, k = self._ijk[index].tolist()
+        return i, j, k, int(self._level[index])
+
+    def refine(self, indexes):
+        """
+        Split cells of the mesh into 8 equal prisms.
+
+        The children take the place of the refined cell in the mesh and
+        inherit its physical properties and mask.
+
+        Parameters:
+
+        * indexes : list of ints or boolean array
+            The indices of the cells that will be refined.
+
+        """
+        indexes = np.asarray(indexes)
+        if indexes.dtype == np.bool:
+            indexes = np.nonzero(indexes)[0]
+        indexes = indexes.astype(np.int)
+        if np.any(self._level[indexes] >= self.maxlevel):
+            raise ValueError(
+                "Can't refine cells past the maximum level {}.".format(
+                    self.maxlevel))
+        split = np.zeros(self.size, dtype=np.bool)
+        split[indexes] = True
+        counts = np.where(split, 8, 1)
+        parent = np.repeat(np.arange(self.size), counts)
+        # The index of each child in its parent (0 if not split)
+        child = np.arange(parent.size) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        offsets = np.transpose([child % 2, (child//2) % 2, child//4])
+        factor = np.where(split, 2, 1)[parent]
+        self._ijk = self._ijk[parent]*factor[:, np.newaxis] + offsets
+        self._level = self._level[parent] + split[parent]
+        self._mask = self._mask[parent]
+        for prop in self.props:
+            self.props[prop] = np.asarray(self.props[prop])[parent]
+        self.size = parent.size
+        self._cell_bounds = None
+        self._lookup = None
+
+    def refine_depth(self, z, level):
+        """
+        Refine the cells with top above *z* until they reach *level*.
+
+        Use this to have small cells near the surface and large cells at
+        depth.
+
+        Parameters:
+
+        * z : float
+            Cells with a top shallower than *z* (z is positive downward) will
+            be refined.
+        * level : int
+            The level to which the cells will be refined. Can't be larger than
+            *maxlevel*.
+
+        Examples:
+
+            >>> mesh = OctreePrismMesh((0, 4, 0, 4, 0, 4), (1, 1, 1))
+            >>> mesh.refine_depth(1, 2)
+            >>> len(mesh)
+            36
+            >>> print(np.bincount(mesh.level).tolist())
+            [0, 4, 32]
+
+        """
+        if level > self.maxlevel:
+            raise ValueError(
+                "Can't refine cells past the maximum level {}.".format(
+                    self.maxlevel))
+        while True:
+            refine = (self.z1 < z) & (self._level < level)
+            if not np.any(refine):
+                break
+            self.refine(refine)
+
+    def find(self, point):
+        """
+        Find the index of the cell that has *point* inside it.
+
+        Parameters:
+
+        * point : list = [x, y, z]
+            The coordinates of the point.
+
+        Returns:
+
+        * index : int or None
+            The index of the cell or None if the point is outside the mesh.
+
+        """
+        x, y, z = point
+        cells = self.cell_bounds
+        inside = ((x >= cells[:, 0]) & (x <= cells[:, 1]) &
+                  (y >= cells[:, 2]) & (y <= cells[:, 3]) &
+                  (z >= cells[:, 4]) & (z <= cells[:, 5]))
+        indexes = np.nonzero(inside)[0]
+        if indexes.size == 0:
+            return None
+        return int(indexes[0])
+
+    def neighbors(self, index):
+        """
+        Find the cells that share a face with a cell.
+
+        A cell can have one neighbor (of the same size or larger) or several
+        smaller neighbors through each face. Masked cells are included.
+
+        Parameters:
+
+        * index : int
+            The index of the cell in the mesh.
+
+        Returns:
+
+        * neighbors : dict
+            The indices of the neighbors through each face. Keys are
+            ``'above'``, ``'below'`` (-z and +z), ``'south'``, ``'north'`` (-x
+            and +x), ``'west'``, and ``'east'`` (-y and +y).
+
+        """
+        directions = [('south', 0, -1), ('north', 0, 1), ('west', 1, -1),
+                      ('east', 1, 1), ('above', 2, -1), ('below', 2, 1)]
+        return dict((name, self._face_neighbors(index, axis, step))
+                    for name, axis, step in directions)
+
+    def _face_neighbors(self, index, axis, step):
+        """
+        The indices of the neighbors of a cell through the face in the
+        direction *step* (-1 or 1) of *axis* (0 for x, 1 for y, 2 for z).
+        """
+        if self._lookup is None:
+            keys = zip(self._level.tolist(), *self._ijk.T.tolist())
+            self._lookup = dict(zip(keys, range(self.size)))
+        lookup = self._lookup
+        i, j, k, level = self.ijk(index)
+        ijk = [i, j, k]
+        ijk[axis] += step
+        if ijk[axis] < 0 or ijk[axis] >= self.shape[2 - axis]*2**level:
+            return []
+        # The neighbor has the same size or is larger
+        for up in range(level + 1):
+            key = (level - up,) + tuple(c >> up for c in ijk)
+            if key in lookup:
+                return [lookup[key]]
+        # The neighbor is refined. Look for the children touching the face.
+        side = 0 if step > 0 else 1
+        found = []
+        stack = [(level, ijk)]
+        while stack:
+            level, ijk = stack.pop()
+            key = (level,) + tuple(ijk)
+            if key in lookup:
+                found.append(lookup[key])
+                continue
+            if level >= self.maxlevel:
+                continue
+            for a in range(2):
+                for b in range(2):
+                    offsets = [a, b]
+                    offsets.insert(axis, side)
+                    stack.append((level + 1, [2*c + o for c, o in
+                                              zip(ijk, offsets)]))
+        return sorted(found)
+
+    def carvetopo(self, x, y, height, below=False):
+        """
+        Mask (remove) prisms from the mesh that are above the topography.
+
+        The topography is interpolated on the horizontal position of the
+        center of each cell. Also mask prisms outside of the topography grid
+        provided.
+
+        Parameters:
+
+        * x, y : lists
+            x and y coordinates of the grid points
+        * height : list or array
+            Array with the height of the topography
+        * below : boolean
+            Will mask prisms below the input surface if set to *True*.
+
+        """
+        cells = self.cell_bounds
+        xc = 0.5*(cells[:, 0] + cells[:, 1])
+        yc = 0.5*(cells[:, 2] + cells[:, 3])
+        zc = 0.5*(cells[:, 4] + cells[:, 5])
+        topo = scipy.interpolate.griddata(
+            (np.ravel(x), np.ravel(y)), np.ravel(height), (xc, yc),
+            method='cubic')
+        # -1 to transform height into z coordinate
+        topo = -1*topo
+        topo_mask = np.isnan(topo)
+        topo = np.where(topo_mask, 0, topo)
+        if below:
+            carved = zc > topo
+        else:
+            carved = zc < topo
+        self._mask |= carved | topo_mask
+
+    def save(self, fname, compress=False):
+        """
+        Save the mesh to a binary ``.npz`` file.
+
+        The file holds the geometry and refinement of the mesh, the mask, and
+        all physical properties.
+        Load it back with :func:`~fatiando.mesher.load_mesh`.
+
+        Parameters:
+
+        * fname : str or file
+            The file name or an open file. A ``.npz`` extension is appended to
+            file names that don't have one.
+        * compress : True or False
+            If True, will compress the arrays. Compressed properties can't be
+            memory-mapped when loading the file.
+
+        """
+        arrays = dict(bounds=self.bounds, shape=self.shape, mask=self._mask,
+                      maxlevel=self.maxlevel, level=self._level, ijk=self._ijk)
+        _save_npz(fname, self, arrays, compress)
+
+
+def load_mesh(fname, mmap_mode=None):
+    """
+    Load a mesh saved to a binary ``.npz`` file by the ``save`` method.
+
+    Works for :class:`~fatiando.mesher.PrismMesh`,
+    :class:`~fatiando.mesher.OctreePrismMesh`,
+    :class:`~fatiando.mesher.TesseroidMesh`,
+    :class:`~fatiando.mesher.PointGrid`, and
+    :class:`~fatiando.mesher.PrismRelief`. The returned object has the same
+    class as the one that was saved.
+
+    Parameters:
+
+    * fname : str or file
+        The file name or an open file.
+    * mmap_mode : None, 'r', 'r+', or 'c'
+        If not None, the physical properties are memory-mapped from the file
+        instead of read into memory (see :class:`numpy.memmap` for the meaning
+        of each mode). Only the parts of the properties that are accessed are
+        read from disk. Requires a file name and an uncompressed file.
+        Properties that can't be memory-mapped are read normally.
+
+    Returns:
+
+    * mesh
+        The loaded mesh.
+
+    """
+    data = np.load(fname)
+    try:
+        meshtype = str(data['meshtype'])
+        arrays = dict((name, data[name]) for name in data.files
+                      if not name.startswith('prop_'))
+        props = {}
+        for name in data.files:
+            if not name.startswith('prop_'):
+                continue
+            values = None
+            if mmap_mode is not None:
+                values = _npz_memmap(fname, name, mmap_mode)
+            if values is None:
+                values = data[name]
+                if values.ndim == 0:
+                    values = values[()]
+            props[name[len('prop_'):]] = values
+    finally:
+        data.close()
+    if meshtype == 'OctreePrismMesh':
+        mesh = OctreePrismMesh(arrays['bounds'].tolist(),
+                               tuple(int(i) for i in arrays['shape']),
+                               int(arrays['maxlevel']))
+        mesh._ijk = arrays['ijk']
+        mesh._level = arrays['level']
+        mesh.size = mesh._level.size
+        mesh.props = props
+        mesh.mask = arrays['mask']
+    elif meshtype in ['PrismMesh', 'TesseroidMesh']:
+        cls = PrismMesh if meshtype == 'PrismMesh' else TesseroidMesh
+        mesh = cls(arrays['bounds'].tolist(),
+                   tuple(int(i) for i in arrays['shape']), props)
+        mesh.mask = arrays['mask']
+    elif meshtype == 'PointGrid':
+        mesh = PointGrid(arrays['area'].tolist(), arrays['z'],
+                         tuple(int(i) for i in arrays['shape']), props)
+    elif meshtype == 'PrismRelief':
+        mesh = PrismRelief(float(arrays['ref']), arrays['dims'].tolist(),
+                           [arrays['x'], arrays['y'], arrays['z']])
+        mesh.props = props
+    else:
+        raise ValueError("Unknown mesh type '{}' in file.".format(meshtype))
+    return mesh
+
+
+def load_ubc(meshfile, propfile=None, prop='density'):
+    """
+    Read a mesh in the format used by the UBC-GIF program MeshTools3D.
+
+    This is the inverse of :meth:`~fatiando.mesher.PrismMesh.dump`. Cells of
+    the model with the dummy value -10000000 are masked.
+
+    .. note:: Only regular meshes (all cells with the same size in each
+        direction) are supported.
+
+    Parameters:
+
+    * meshfile : str or file
+        The UBC-GIF mesh file. Can be a file name or an open file.
+    * propfile : None or str or file
+        The UBC-GIF model file with the physical property values. Can be a file
+        name or an open file. If None, the mesh will have no properties.
+    * prop : str
+        The name given to the physical property read from *propfile*.
+
+    Returns:
+
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The mesh with the physical property (if *propfile* was given).
+
+    Examples:
+
+        >>> from io import StringIO
+        >>> meshfile = StringIO(u"2 2 1\\n0 0 0\\n2*10\\n5 5\\n1*5")
+        >>> densfile = StringIO(u"1\\n3\\n-10000000\\n4")
+        >>> mesh = load_ubc(meshfile, densfile, 'density')
+        >>> for p in mesh:
+        ...     print(p)
+        x1:0 | x2:5 | y1:0 | y2:10 | z1:0 | z2:5 | density:1
+        None
+        x1:0 | x2:5 | y1:10 | y2:20 | z1:0 | z2:5 | density:3
+        x1:5 | x2:10 | y1:10 | y2:20 | z1:0 | z2:5 | density:4
+
+    """
+    isstr = False
+    if isinstance(meshfile, str):
+        isstr = True
+        meshfile = open(meshfile)
+    try:
+        tokens = meshfile.read().split()
+    finally:
+        if isstr:
+            meshfile.close()
+    ny, nx, nz = [int(i) for i in tokens[:3]]
+    y1, x1, z1 = [float(i) for i in tokens[3:6]]
+    # The origin is the elevation of the top of the mesh. Subtract from 0 to
+    # avoid getting -0 for a mesh starting at sea level.
+    z1 = 0. - z1
+    widths = []
+    for token in tokens[6:]:
+        if '*' in token:
+            count, width = token.split('*')
+            widths.extend(int(count)*[float(width)])
+        else:
+            widths.append(float(token))
+    if len(widths) != nx + ny + nz:
+        raise ValueError(
+            "Expected {} cell widths in the mesh file but got {}.".format(
+                nx + ny + nz, len(widths)))
+    dims = []
+    for width in [widths[:ny], widths[ny:ny + nx], widths[ny + nx:]]:
+        if not np.allclose(width, width[0]):
+            raise ValueError("Only meshes with regular cells are supported.")
+        dims.append(width[0])
+    dy, dx, dz = dims
+    bounds = [x1, x1 + nx*dx, y1, y1 + ny*dy, z1, z1 + nz*dz]
+    mesh = PrismMesh(bounds, (nz, ny, nx))
+    if propfile is not None:
+        values = np.loadtxt(propfile, dtype=np.float, ndmin=1)
+        if values.size != mesh.size:
+            raise ValueError(
+                "Expected {} values in the model file but got {}.".format(
+                    mesh.size, values.size))
+        # UBC-GIF orders the cells z first, then y, then x
+        values = np.ravel(np.reshape(values, mesh.shape, order='F'))
+        mesh.mask = values == -10000000
+        mesh.addprop(prop, values)
+    return mesh
+
+
+def _save_npz(fname, mesh, arrays, compress):
+    """
+    Save the geometry arrays and the properties of a mesh to an npz file.
+
+    The class name is stored under ``meshtype`` and each property under
+    ``prop_<name>``.
+    """
+    arrays['meshtype'] = type(mesh).__name__
+    for prop in mesh.props:
+        arrays['prop_' + prop] = np.asarray(mesh.props[prop])
+    if compress:
+        np.savez_compressed(fname, **arrays)
+    else:
+        np.savez(fname, **arrays)
+
+
+def _npz_memmap(fname, name, mode):
+    """
+    Memory-map an array stored uncompressed in an npz file.
+
+    Returns None if the array can't be memory-mapped (compressed, object
+    dtype, scalar, or *fname* is not a file name).
+    """
+    if not isinstance(fname, str):
+        return None
+    with zipfile.ZipFile(fname) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(fname, 'rb') as arrayfile:
+        # The data start after the local file header of the zip member, which
+        # has a fixed size of 30 bytes plus the file name and extra field
+        arrayfile.seek(info.header_offset + 26)
+        namelen, extralen = struct.unpack('<HH', arrayfile.read(4))
+        arrayfile.seek(info.header_offset + 30 + namelen + extralen)
+        version = np.lib.format.read_magic(arrayfile)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(arrayfile)
+        else:
+            header = np.lib.format.read_array_header_2_0(arrayfile)
+        shape, fortran_order, dtype = header
+        offset = arrayfile.tell()
+    if dtype.hasobject or len(shape) == 0:
+        return None
+    order = 'F' if fortran_order else 'C'
+    return np.memmap(fname, dtype=dtype, mode=mode, shape=shape,
+                     order=order, offset=offset)
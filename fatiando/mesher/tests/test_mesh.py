@@ -7,6 +7,7 @@ from pytest import raises
 
 from ... import gridder
 from ..mesh import PrismMesh, Prism, SquareMesh, PointGrid, TesseroidMesh
+from ..mesh import PrismRelief, OctreePrismMesh, load_mesh, load_ubc
 
 
 def test_pointgrid():
@@ -160,6 +161,38 @@ def test_prism_mesh_copy():
     assert np.array_equal(p1.props['density'], p2.props['density'])
 
 
+def test_prism_mesh_arrays():
+    "PrismMesh cell_bounds and iteration match the indexing of the mesh"
+    for cls, bounds in [(PrismMesh, (-10, 20, 5, 13, 0, 7)),
+                        (TesseroidMesh, (-10, 20, 5, 13, 0, -7000))]:
+        mesh = cls(bounds, (3, 4, 5))
+        mesh.addprop('density', np.arange(mesh.size))
+        mesh.mask = [2, 15, 40]
+        assert mesh.cell_bounds.shape == (mesh.size, 6)
+        cells = list(mesh)
+        assert len(cells) == mesh.size
+        for i, cell in enumerate(cells):
+            if i in [2, 15, 40]:
+                assert mesh.mask[i]
+                assert cell is None
+                assert mesh[i] is None
+                continue
+            assert not mesh.mask[i]
+            npt.assert_allclose(cell.get_bounds(), mesh[i].get_bounds())
+            npt.assert_allclose(cell.get_bounds(), mesh.cell_bounds[i])
+            assert cell.props['density'] == i
+        for j, name in enumerate(['x1', 'x2', 'y1', 'y2', 'z1', 'z2']):
+            npt.assert_allclose(getattr(mesh, name), mesh.cell_bounds[:, j])
+    mesh = PrismMesh((0, 1, 0, 2, 0, 3), (1, 2, 2))
+    mask = np.array([True, False, False, True])
+    mesh.mask = mask
+    npt.assert_equal(mesh.mask, mask)
+    mesh.mask = []
+    assert not np.any(mesh.mask)
+    with raises(ValueError):
+        mesh.mask = [True, False]
+
+
 def test_carvetopo():
     bounds = (0, 1, 0, 1, 0, 2)
     shape = (2, 1, 1)
@@ -221,3 +254,167 @@ def test_tesseroid_mesh_copy():
     orig.addprop('density', 3300 + np.zeros(orig.size))
     cp = orig.copy()
     assert np.array_equal(orig.props['density'], cp.props['density'])
+
+
+def test_carvetopo_gridded():
+    "carvetopo with topography on the cell centers matches the interpolation"
+    bounds = (0, 1000, 0, 2000, -200, 800)
+    shape = (10, 20, 10)
+    xc = np.linspace(50, 950, shape[2])
+    yc = np.linspace(50, 1950, shape[1])
+    x, y = [i.ravel() for i in np.meshgrid(xc, yc)]
+    height = 100 + 300*np.sin(x/300)*np.cos(y/500)
+    # Topography on a denser grid that contains the mesh
+    xs, ys = gridder.regular((-100, 1100, -100, 2100), (101, 51))
+    hs = 100 + 300*np.sin(xs/300)*np.cos(ys/500)
+    for below in [False, True]:
+        gridded = PrismMesh(bounds, shape)
+        gridded.carvetopo(x, y, height, below=below)
+        interp = PrismMesh(bounds, shape)
+        interp.carvetopo(xs, ys, hs, below=below)
+        assert np.any(gridded.mask) and not np.all(gridded.mask)
+        # Only cells very close to the surface can differ
+        assert np.mean(gridded.mask != interp.mask) < 0.01
+        # Compare with the definition
+        zc = np.linspace(-150, 750, shape[0])
+        for k, z in enumerate(zc):
+            layer = gridded.mask.reshape(shape)[k].ravel()
+            if below:
+                npt.assert_equal(layer, z > -height)
+            else:
+                npt.assert_equal(layer, z < -height)
+
+
+def test_carvetopo_outside_topography():
+    "carvetopo masks the cells outside of the topography data"
+    mesh = PrismMesh((0, 4, 0, 4, 0, 2), (1, 2, 2))
+    topox = [0, 0, 2, 2]
+    topoy = [0, 2, 0, 2]
+    mesh.carvetopo(topox, topoy, [10, 10, 10, 10])
+    npt.assert_equal(mesh.mask, [False, True, True, True])
+
+
+def test_save_load_meshes(tmpdir):
+    "Meshes are the same after saving and loading from npz files"
+    for cls, bounds in [(PrismMesh, (-10, 20, 5, 13, 0, 7)),
+                        (TesseroidMesh, (-10, 20, 5, 13, 0, -7000))]:
+        mesh = cls(bounds, (3, 4, 5))
+        mesh.addprop('density', np.arange(mesh.size, dtype=np.float))
+        mesh.addprop('magnetization', np.ones((mesh.size, 3)))
+        mesh.mask = [2, 15, 40]
+        fname = str(tmpdir.join('mesh.npz'))
+        for compress in [False, True]:
+            mesh.save(fname, compress=compress)
+            for mmap_mode in [None, 'r']:
+                loaded = load_mesh(fname, mmap_mode=mmap_mode)
+                assert type(loaded) is cls
+                assert loaded.shape == mesh.shape
+                npt.assert_allclose(loaded.bounds, mesh.bounds)
+                npt.assert_equal(loaded.mask, mesh.mask)
+                npt.assert_allclose(loaded.cell_bounds, mesh.cell_bounds)
+                for prop in mesh.props:
+                    npt.assert_allclose(loaded.props[prop], mesh.props[prop])
+                memmapped = isinstance(loaded.props['density'], np.memmap)
+                assert memmapped == (mmap_mode is not None and not compress)
+
+
+def test_save_load_grid_relief(tmpdir):
+    "PointGrid and PrismRelief are the same after saving and loading"
+    grid = PointGrid([0, 10, 2, 6], np.linspace(100, 200, 6), (2, 3))
+    grid.addprop('density', [1, 2, 3, 4, 5, 6])
+    fname = str(tmpdir.join('grid.npz'))
+    grid.save(fname)
+    loaded = load_mesh(fname)
+    assert type(loaded) is PointGrid
+    assert loaded.shape == grid.shape
+    for attr in ['x', 'y', 'z']:
+        npt.assert_allclose(getattr(loaded, attr), getattr(grid, attr))
+    npt.assert_equal(loaded.props['density'], grid.props['density'])
+    x, y = gridder.regular((0, 10, 0, 20), (3, 2))
+    relief = PrismRelief(0, (10, 5), [x, y, [-1, 2, -3, 4, -5, 6]])
+    relief.addprop('density', np.arange(6))
+    fname = str(tmpdir.join('relief.npz'))
+    relief.save(fname)
+    loaded = load_mesh(fname)
+    assert type(loaded) is PrismRelief
+    assert len(loaded) == len(relief)
+    for p1, p2 in zip(loaded, relief):
+        npt.assert_allclose(p1.get_bounds(), p2.get_bounds())
+        assert p1.props['density'] == p2.props['density']
+
+
+def test_dump_load_ubc(tmpdir):
+    "Loading a UBC mesh gives the mesh that was dumped"
+    mesh = PrismMesh((-10, 20, 5, 13, 100, 700), (3, 4, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=np.float))
+    mesh.mask = [2, 15, 40]
+    meshfile = str(tmpdir.join('mesh.msh'))
+    densfile = str(tmpdir.join('density.den'))
+    mesh.dump(meshfile, densfile, 'density')
+    loaded = load_ubc(meshfile, densfile, 'density')
+    assert loaded.shape == mesh.shape
+    npt.assert_allclose(loaded.bounds, mesh.bounds)
+    npt.assert_equal(loaded.mask, mesh.mask)
+    keep = ~mesh.mask
+    npt.assert_allclose(loaded.props['density'][keep],
+                        mesh.props['density'][keep])
+    geometry = load_ubc(meshfile)
+    assert geometry.props == {}
+    assert not np.any(geometry.mask)
+
+
+def test_octree_mesh():
+    "OctreePrismMesh cells fill the mesh and neighbors are consistent"
+    bounds = (-10, 20, 5, 13, 0, 7)
+    shape = (3, 4, 5)
+    mesh = OctreePrismMesh(bounds, shape, maxlevel=2)
+    regular = PrismMesh(bounds, shape)
+    npt.assert_allclose(mesh.cell_bounds, regular.cell_bounds)
+    mesh.addprop('density', np.arange(mesh.size, dtype=np.float))
+    nz, ny, nx = shape
+    dx, dy, dz = regular.dims
+    mesh.refine([0, 7, 33])
+    mesh.refine_depth(1, 2)
+    assert len(mesh) == mesh.size == len(list(mesh))
+    cells = mesh.cell_bounds
+    volume = np.prod(cells[:, 1::2] - cells[:, ::2], axis=1).sum()
+    npt.assert_allclose(volume, 30*8*7)
+    for index, cell in enumerate(mesh):
+        npt.assert_allclose(cell.get_bounds(), cells[index])
+        center = [0.5*(cells[index, 2*i] + cells[index, 2*i + 1])
+                  for i in range(3)]
+        assert mesh.find(center) == index
+        # Children inherit the density (the index) of the unrefined cell
+        i = int((center[0] - bounds[0])//dx)
+        j = int((center[1] - bounds[2])//dy)
+        k = int((center[2] - bounds[4])//dz)
+        assert cell.props['density'] == i + j*nx + k*nx*ny
+    opposite = {'above': 'below', 'below': 'above', 'north': 'south',
+                'south': 'north', 'east': 'west', 'west': 'east'}
+    for index in range(mesh.size):
+        neighbors = mesh.neighbors(index)
+        for direction in neighbors:
+            for n in neighbors[direction]:
+                assert index in mesh.neighbors(n)[opposite[direction]]
+    assert mesh.find((100, 0, 0)) is None
+    with raises(ValueError):
+        mesh.refine_depth(1, 3)
+
+
+def test_save_load_octree(tmpdir):
+    "OctreePrismMesh is the same after saving and loading"
+    mesh = OctreePrismMesh((-10, 20, 5, 13, 0, 7), (3, 4, 5), maxlevel=2)
+    mesh.refine_depth(2, 2)
+    mesh.addprop('density', np.arange(mesh.size, dtype=np.float))
+    mesh.mask = [2, 15, 40]
+    fname = str(tmpdir.join('octree.npz'))
+    mesh.save(fname)
+    loaded = load_mesh(fname)
+    assert type(loaded) is OctreePrismMesh
+    assert loaded.size == mesh.size
+    assert loaded.maxlevel == mesh.maxlevel
+    npt.assert_equal(loaded.level, mesh.level)
+    npt.assert_equal(loaded.mask, mesh.mask)
+    npt.assert_allclose(loaded.cell_bounds, mesh.cell_bounds)
+    npt.assert_allclose(loaded.props['density'], mesh.props['density'])
+    assert loaded.neighbors(10) == mesh.neighbors(10)
@@ -0,0 +1,41 @@
+from __future__ import absolute_import, division
+import os
+import numpy
+from numpy.testing import assert_allclose
+from fatiando import utils
+
+
+def _memmap(tmpdir, name, array):
+    "Save an array to a .npy file and open it as a memmap"
+    fname = os.path.join(str(tmpdir), name)
+    numpy.save(fname, array)
+    return numpy.load(fname, mmap_mode='r')
+
+
+def test_safe_dot_memmap(tmpdir):
+    "utils.safe_dot of memmaps in blocks matches numpy.dot"
+    rng = numpy.random.RandomState(0)
+    matrix = rng.uniform(size=(300, 40))
+    vector = rng.uniform(size=300)
+    jac = _memmap(tmpdir, 'jac.npy', matrix)
+    backup = utils.MEMMAP_BLOCK_SIZE
+    try:
+        utils.MEMMAP_BLOCK_SIZE = 1000
+        assert_allclose(utils.safe_dot(jac, matrix[0]), matrix.dot(matrix[0]))
+        assert_allclose(utils.safe_dot(jac.T, vector), matrix.T.dot(vector))
+        assert_allclose(utils.safe_dot(jac.T, jac), matrix.T.dot(matrix))
+    finally:
+        utils.MEMMAP_BLOCK_SIZE = backup
+
+
+def test_safe_dot_empty_memmap(tmpdir):
+    "utils.safe_dot works with empty memmaps"
+    for shape in [(0, 10), (10, 0)]:
+        jac = _memmap(tmpdir, 'empty.npy', numpy.zeros(shape))
+        vector = numpy.ones(shape[1])
+        res = utils.safe_dot(jac, vector)
+        assert res.shape == (shape[0],)
+        assert_allclose(res, 0)
+        res = utils.safe_dot(jac.T, jac)
+        assert res.shape == (shape[1], shape[1])
+        assert_allclose(res, 0)
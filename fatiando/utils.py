@@ -12,6 +12,10 @@ import scipy.misc
 
 from . import constants, gridder
 
+# How many bytes of a matrix stored in a memory-mapped file (numpy.memmap) are
+# read into memory at a time by safe_dot
+MEMMAP_BLOCK_SIZE = 2**26
+
 
 def safe_inverse(matrix):
     """
@@ -79,6 +83,15 @@ def safe_dot(a, b):
     If *a* and *b* are dense, will use :func:`numpy.dot`. If either is sparse
     (from :mod:`scipy.sparse`) will use the multiplication operator (i.e., \*).
 
+    If *a* is a ``scipy.sparse.linalg.LinearOperator`` (like a compressed
+    :class:`~fatiando.inversion.hmatrix.HMatrix`), will use its ``dot`` method.
+
+    If either is a :class:`numpy.memmap` (a matrix stored in a file on disk),
+    the product is calculated in blocks of at most ``MEMMAP_BLOCK_SIZE`` bytes
+    of the memory-mapped matrix. The blocks follow the order of the matrix in
+    the file, so ``safe_dot(jac.T, jac)`` and ``safe_dot(jac.T, vector)`` read
+    the rows of ``jac`` only once.
+
     Parameters:
 
     * a, b : array or matrix
@@ -89,13 +102,67 @@ def safe_dot(a, b):
     * prod : array or matrix
         The dot product of *a* and *b*
 
-    """
+    Examples:
+
+    >>> import tempfile
+    >>> a = numpy.memmap(tempfile.TemporaryFile(), dtype='float64',
+    ...                  shape=(3, 2))
+    >>> a[:] = [[1, 2], [3, 4], [5, 6]]
+    >>> safe_dot(a.T, a)
+    array([[35., 44.],
+           [44., 56.]])
+    >>> safe_dot(a, numpy.array([1, 1]))
+    array([ 3.,  7., 11.])
+
+    """
+    if isinstance(a, scipy.sparse.linalg.LinearOperator):
+        return a.dot(b)
+    if isinstance(a, numpy.memmap) or isinstance(b, numpy.memmap):
+        return _blockwise_dot(a, b)
     if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
         return a * b
     else:
         return numpy.dot(a, b)
 
 
+def _blockwise_dot(a, b):
+    """
+    Dot product reading the memory-mapped matrix (a or b) in blocks.
+
+    If the rows of *a* are contiguous in the file, the result is calculated
+    for blocks of rows of *a*. Otherwise, the partial products of blocks of the
+    inner dimension are summed.
+    """
+    def _load(block):
+        # Views of a memmap are also memmaps and would recurse into here
+        if isinstance(block, numpy.memmap):
+            return numpy.asarray(block)
+        return block
+    if scipy.sparse.issparse(a):
+        a = a.tocsr()
+    if scipy.sparse.issparse(b):
+        b = b.tocsr()
+    mmap = b if isinstance(b, numpy.memmap) else a
+    if mmap.size == 0:
+        # Nothing to read in blocks and the block sizes would divide by zero
+        return safe_dot(_load(a), _load(b))
+    if isinstance(a, numpy.memmap) and a.flags.c_contiguous and a.ndim == 2:
+        step = max(1, MEMMAP_BLOCK_SIZE//(a.shape[1]*a.itemsize))
+        blocks = [safe_dot(_load(a[i:i + step]), b)
+                  for i in range(0, a.shape[0], step)]
+        return numpy.concatenate(blocks)
+    size = b.shape[0]
+    step = max(1, MEMMAP_BLOCK_SIZE*size//(mmap.size*mmap.itemsize))
+    result = 0
+    for i in range(0, size, step):
+        if a.ndim == 2:
+            block = a[:, i:i + step]
+        else:
+            block = a[i:i + step]
+        result = result + safe_dot(_load(block), _load(b[i:i + step]))
+    return result
+
+
 def safe_diagonal(matrix):
     """
     Get the diagonal of a matrix using the appropriate method.
@@ -74,6 +74,7 @@ ext_parts = [
     ['fatiando', 'seismic', '_ttime2d'],
     ['fatiando', 'seismic', '_wavefd'],
     ['fatiando', 'gravmag', '_prism'],
+    ['fatiando', 'gravmag', '_polyprism'],
 ]
 extensions = [('.'.join(parts), os.path.join(*parts) + ext)
               for parts in ext_parts]
@@ -81,8 +82,23 @@ libs = []
 if os.name == 'posix':
     libs.append('m')
 ext_args = dict(libraries=libs, include_dirs=[numpy.get_include()])
-EXT_MODULES = [Extension(name, [path], **ext_args)
-               for name, path in extensions]
+# Modules that use OpenMP (through Cython's prange) to run in parallel.
+# Set the environment variable FATIANDO_NO_OPENMP to build them serial (e.g.,
+# if your compiler doesn't support OpenMP).
+openmp_modules = ['fatiando.gravmag._prism', 'fatiando.gravmag._polyprism']
+if 'FATIANDO_NO_OPENMP' in os.environ:
+    openmp_args = dict()
+elif os.name == 'nt':
+    openmp_args = dict(extra_compile_args=['/openmp'])
+else:
+    openmp_args = dict(extra_compile_args=['-fopenmp'],
+                       extra_link_args=['-fopenmp'])
+EXT_MODULES = []
+for name, path in extensions:
+    args = dict(ext_args)
+    if name in openmp_modules:
+        args.update(openmp_args)
+    EXT_MODULES.append(Extension(name, [path], **args))
 # Cythonize the .pyx modules if --cython is used
 if use_cython:
     sys.argv.remove('--cython')